@@ -1,12 +1,81 @@
 # this function is used to authenticate websocket connection from client to API Gateway
 # the web socket connection is used for requesting streaming sessions
+# it runs as the REQUEST authorizer of the $connect route: the client passes a signed, expiring token in the tokenId
+# query string parameter, which is verified locally with keys cached per container (see sessionToken.py), and an IAM
+# policy is returned so that API Gateway rejects invalid clients before any route integration runs. Clients built
+# before signed tokens still send the static LegacyTokenId, which is accepted until LegacyTokenUntil (epoch seconds,
+# empty for no end) while they are migrated; unset LegacyTokenId to turn it off. When the function is still wired as
+# the $connect integration it answers with a status code as before
+import hmac
 import json
+import logging
+import os
+import time
+
+import sessionLanes
+import sessionToken
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+LEGACY_TOKEN_ID = os.environ.get("LegacyTokenId", "")
+LEGACY_TOKEN_UNTIL = float(os.environ.get("LegacyTokenUntil") or "inf")
+LEGACY_SUBJECT = 'legacy'
+
+
+def policy(principal_id, effect, resource, context=None):
+    response = {
+        'principalId': principal_id,
+        'policyDocument': {
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Action': 'execute-api:Invoke',
+                'Effect': effect,
+                'Resource': resource
+            }]
+        }
+    }
+    if context:
+        response['context'] = context
+    return response
+
+
+def legacy_claims(token, now=None):
+    """Returns claims for the static token of not yet migrated clients, or None outside the migration window."""
+    now = time.time() if now is None else now
+    if not LEGACY_TOKEN_ID or not token or now >= LEGACY_TOKEN_UNTIL:
+        return None
+    if not hmac.compare_digest(token.encode('utf-8'), LEGACY_TOKEN_ID.encode('utf-8')):
+        return None
+    logger.info("Accepted legacy web socket token")
+    return {'sub': LEGACY_SUBJECT, 'exp': int(min(now + 3600, LEGACY_TOKEN_UNTIL))}
+
+
+def verify(token):
+    return sessionToken.verify(token) or legacy_claims(token)
+
 
 def lambda_handler(event, context):
-    
-    print(event)
-    
-    if("abcd" == event["queryStringParameters"]["tokenId"]):
+    token = (event.get("queryStringParameters") or {}).get("tokenId", "")
+
+    if event.get("type") == "REQUEST":
+        claims = verify(token)
+        try:
+            exp = int(claims["exp"]) if claims is not None else None
+        except (TypeError, ValueError, OverflowError):
+            exp = None
+        if exp is None:
+            logger.info(f"Rejected web socket connection {event.get('requestContext', {}).get('connectionId')}")
+            return policy('anonymous', 'Deny', event["methodArn"])
+        # the claims are handed to the routes as requestContext.authorizer, a signed priority lane included
+        context = {'sub': str(claims.get("sub", "")), 'exp': exp}
+        if claims.get(sessionLanes.PRIORITY_FIELD) is not None:
+            context[sessionLanes.PRIORITY_FIELD] = str(claims[sessionLanes.PRIORITY_FIELD])
+        return policy(str(claims.get("sub", "")), 'Allow', event["methodArn"], context)
+
+    # $connect integration: a connection that already passed the authorizer needs no second check
+    authorized = event.get("requestContext", {}).get("authorizer") or verify(token)
+    if authorized:
         return {
             'statusCode': 200,
             'body': json.dumps('Web socket connection  valid !')
@@ -15,5 +84,4 @@ def lambda_handler(event, context):
         return {
             'statusCode': 401,
             'body': json.dumps('Web socket connection  invalid !')
-        } 
-    
+        }
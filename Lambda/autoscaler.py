@@ -0,0 +1,159 @@
+# this function keeps a pool of warm Signalling servers ahead of demand. It runs on a schedule, reads the depth of
+# the session queues of all priority lanes, the current pool from EC2 and the MatchMaker, and the recent arrival rate
+# from the queues' CloudWatch metrics, and lets scalingPolicy decide how many instances to launch or release within
+# concurrencyLimit. Launches go through the createInstances function. Released servers are first reserved at the
+# MatchMaker so that no user is sent to them, then stopped, which lets the existing terminate rule free their slot and
+# either park them in the warm pool (warmPool.py) or tear them down
+import json
+import os
+import logging
+import datetime
+
+from botocore.exceptions import ClientError
+
+import matchmakerClient
+import runtime
+import scalingPolicy
+import sessionLanes
+import slotAllocator
+import slotProvisioner
+import tracing
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+WARM_SPARES = int(os.environ.get("WarmSpares", "1"))
+BOOT_MINUTES = float(os.environ.get("BootMinutes", "8"))
+HISTORY_MINUTES = int(os.environ.get("HistoryMinutes", "30"))
+SCALE_IN_BUFFER = int(os.environ.get("ScaleInBuffer", "1"))
+
+
+def queue_depth(lanes):
+    # waiting requests over every priority lane, the per lane depths are published as lanes metrics on the way
+    return sum(visible for visible, _ in sessionLanes.depths(lanes).values())
+
+
+def arrival_history(queue_names, minutes=HISTORY_MINUTES):
+    # messages sent to the queues per minute, oldest first. Minutes without a datapoint count as no arrivals
+    now = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0)
+    start = now - datetime.timedelta(minutes=minutes)
+    per_minute = {}
+    for queue_name in queue_names:
+        response = runtime.client('cloudwatch').get_metric_statistics(
+            Namespace='AWS/SQS',
+            MetricName='NumberOfMessagesSent',
+            Dimensions=[{'Name': 'QueueName', 'Value': queue_name}],
+            StartTime=start,
+            EndTime=now,
+            Period=60,
+            Statistics=['Sum']
+        )
+        for point in response['Datapoints']:
+            minute = point['Timestamp'].replace(second=0, microsecond=0)
+            per_minute[minute] = per_minute.get(minute, 0.0) + point['Sum']
+    return [per_minute.get(start + datetime.timedelta(minutes=i), 0.0) for i in range(minutes)]
+
+
+def signalling_pool():
+    # (pending or running instances, instances not registered with a target group slot yet)
+    pool_size = 0
+    booting = 0
+    paginator = runtime.client('ec2').get_paginator('describe_instances')
+    for page in paginator.paginate(Filters=[
+            {'Name': 'tag:type', 'Values': ['signalling']},
+            {'Name': 'instance-state-name', 'Values': ['pending', 'running']}]):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                pool_size += 1
+                if not any(tag['Key'] == slotAllocator.SLOT_TAG for tag in instance.get('Tags', [])):
+                    booting += 1
+    return pool_size, booting
+
+
+def emit_lease_metrics(leases):
+    # the MatchMaker's reservation lease counters, AbandonedServerSeconds is the server time lost to users who were
+    # handed a server and never connected to it
+    if not leases:
+        return
+    counts = {name[0].upper() + name[1:]: leases.get(name, 0) for name in
+              ('granted', 'confirmed', 'released', 'expired', 'late', 'mismatched', 'active', 'abandonedServerSeconds')}
+    counts['AbandonedLeasePercent'] = round(100.0 * leases.get('expired', 0) / leases['granted'], 2) \
+        if leases.get('granted') else 0.0
+    tracing.emit_counts('leases', counts,
+                        units={'AbandonedServerSeconds': 'Seconds', 'AbandonedLeasePercent': 'Percent'})
+
+
+def lambda_handler(event, context):
+    logger.info("=== START: Autoscaler Lambda ===")
+    event = event or {}
+    dry_run = bool(event.get("dryRun", False))
+
+    lanes = sessionLanes.lanes()
+    matchmaker = matchmakerClient.get_client(os.environ["MatchMakerURL"])
+    headers = {"clientsecret": runtime.get_parameter('HealthCoach-ClientSecret')}
+
+    stats = matchmaker.request('GET', headers, path=f"{matchmaker.base_path}/signallingservers/stats")
+    if stats.status != 200:
+        # without the idle count every decision would be a guess, wait for the next run
+        logger.error(f"Could not read pool stats from MatchMaker, skipping this run: {stats}")
+        return {'statusCode': 503, 'body': json.dumps('MatchMaker pool stats unavailable')}
+    idle = stats.json().get('idle', 0)
+    emit_lease_metrics(stats.json().get('leases'))
+
+    depth = queue_depth(lanes)
+    pool_size, booting = signalling_pool()
+    try:
+        history = arrival_history([lane.queue_name for lane in lanes])
+    except ClientError as err:
+        # without the history the policy still covers the queue and the warm spares, only the forecast is missing
+        logger.error(f"Could not read the arrival history, scaling without a forecast: {err}")
+        history = []
+
+    policy = scalingPolicy.WarmPoolPolicy(
+        warm_spares=WARM_SPARES,
+        max_instances=int(runtime.get_parameter('HealthCoach-ConcurrencyLimit')),
+        boot_minutes=BOOT_MINUTES,
+        scale_in_buffer=SCALE_IN_BUFFER
+    )
+    decision = policy.decide(depth, pool_size, idle, booting, history)
+    logger.info(f"Queue depth {depth}, pool {pool_size} ({booting} booting, {idle} idle): {decision}")
+
+    # booting instances and the ones about to be launched each need a free target group slot, surplus slots created
+    # for an earlier peak are retired
+    table = runtime.resource('dynamodb').Table(os.environ.get('DynamoDBName', 'instanceMapping'))
+    slots = slotProvisioner.ensure(table, policy.max_instances, wanted_free=booting + decision.launch, dry_run=dry_run)
+
+    released = []
+    if not dry_run and decision.launch:
+        lambdaFunc = runtime.client('lambda')
+        lambdaArnCreateInstances = runtime.get_function_arn('HealthCoach-createInstances', 'CreateInstancesArn')
+        # the decision already accounts for booting instances, so createInstances launches exactly this many
+        lambdaFunc.invoke(
+            FunctionName=lambdaArnCreateInstances,
+            InvocationType='Event',
+            Payload=json.dumps({"startAllServers": False, "count": decision.launch})
+        )
+        logger.info(f"Requested {decision.launch} new signalling instances")
+
+    if not dry_run and decision.release:
+        # reserving the idle servers keeps the MatchMaker from handing them out while they shut down
+        reservations = matchmaker.reserve(decision.release, headers=headers) or []
+        released = [r.instance_id for r in reservations if r.status == 200 and r.instance_id]
+        if released:
+            runtime.client('ec2').stop_instances(InstanceIds=released)
+        logger.info(f"Stopping idle signalling instances: {released}")
+
+    logger.info("=== END: Autoscaler Lambda ===")
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'decision': decision.to_dict(),
+            'queueDepth': depth,
+            'poolSize': pool_size,
+            'booting': booting,
+            'idle': idle,
+            'released': released,
+            'slots': slots,
+            'dryRun': dry_run
+        })
+    }
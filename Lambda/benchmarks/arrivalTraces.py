@@ -0,0 +1,55 @@
+# session arrival traces shared by the load test and the capacity simulator. A trace is a list of dicts sorted by
+# 'at', the arrival time in seconds from the start of the run, optionally with 'sessionSeconds' for that user
+import json
+import random
+
+# share of the daily traffic per hour of the day, a working-day curve peaking late morning and mid afternoon
+WORKDAY_PROFILE = [0, 0, 0, 0, 0, 0, 1, 2, 5, 8, 10, 10, 8, 9, 10, 9, 7, 5, 3, 2, 1, 1, 0, 0]
+
+
+def poisson_trace(rate_per_minute, duration_seconds, seed=None, start=0.0):
+    rng = random.Random(seed)
+    arrivals = []
+    at = start + rng.expovariate(rate_per_minute / 60.0)
+    while at < start + duration_seconds:
+        arrivals.append({'at': at})
+        at += rng.expovariate(rate_per_minute / 60.0)
+    return arrivals
+
+
+def burst_trace(count, at=0.0, spread=0.0, seed=None):
+    rng = random.Random(seed)
+    return sorted(({'at': at + rng.uniform(0, spread)} for _ in range(count)), key=lambda a: a['at'])
+
+
+def diurnal_trace(sessions_per_day, seed=None, profile=WORKDAY_PROFILE, days=1):
+    # Poisson arrivals whose rate follows the hourly profile, scaled to sessions_per_day on average
+    rng = random.Random(seed)
+    total = float(sum(profile))
+    arrivals = []
+    for day in range(days):
+        for hour, weight in enumerate(profile):
+            if not weight:
+                continue
+            per_minute = sessions_per_day * weight / total / 60.0
+            arrivals += poisson_trace(per_minute, 3600, seed=rng.random(), start=(day * 24 + hour) * 3600.0)
+    return arrivals
+
+
+def replay_trace(path):
+    with open(path) as f:
+        arrivals = [json.loads(line) for line in f if line.strip()]
+    return sorted(arrivals, key=lambda a: a['at'])
+
+
+def exponential_lengths(mean_seconds, seed=None):
+    # session lengths for arrivals without their own sessionSeconds, at least a minute
+    rng = random.Random(seed)
+    return lambda: max(60.0, rng.expovariate(1.0 / mean_seconds)) if mean_seconds > 0 else 0.0
+
+
+def time_of_day(value):
+    # "HH:MM" -> seconds after midnight
+    hours, minutes = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60
+
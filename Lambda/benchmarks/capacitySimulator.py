@@ -0,0 +1,474 @@
+# this tool is a discrete-event model of the Signalling server fleet, used to weigh a change to concurrencyLimit, the
+# 10:00 / 18:15 schedules or the 20 minute self-stop before it is deployed. It replays a day (or several) of session
+# arrivals in well under a second and reports wait-time percentiles, abandoned requests, capacity rejections, instance
+# hours split into booting/busy/idle and their cost. Scaling and teardown are plug-in policies: CurrentPolicy models
+# what createInstances, terminateInstance, the poller and the instance user data do today and is the baseline the
+# alternatives are compared with. Examples:
+#   python capacitySimulator.py --sessions-per-day 300
+#   python capacitySimulator.py --policy current --policy idle-stop --policy warm-pool --concurrency-limit 20
+#   python capacitySimulator.py --trace arrivals.jsonl --policy current --self-stop-minutes 40 --json
+#   python capacitySimulator.py --policy mypolicies:NightShiftPolicy
+# A custom policy subclasses CapacityPolicy; its constructor arguments are filled from the matching command line options
+import argparse
+import heapq
+import importlib
+import inspect
+import itertools
+import json
+import os
+import sys
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import arrivalTraces
+import scalingPolicy
+import tracing
+
+BOOTING = 'booting'
+READY = 'ready'
+STOPPED = 'stopped'
+
+# EC2 bills per second with a one minute minimum
+MINIMUM_BILLED_SECONDS = 60
+
+
+class Instance:
+    def __init__(self, instance_id, launched_at, source):
+        self.instance_id = instance_id
+        self.launched_at = launched_at
+        self.source = source
+        self.ready_at = None
+        self.stopped_at = None
+        self.state = BOOTING
+        # False when registerInstances found no free target group slot, such an instance never serves a session
+        self.has_slot = False
+        self.user = None
+        self.idle_since = None
+        self.busy_seconds = 0.0
+
+    @property
+    def idle(self):
+        return self.state == READY and self.has_slot and self.user is None
+
+
+class User:
+    def __init__(self, arrived_at, session_seconds):
+        self.arrived_at = arrived_at
+        self.session_seconds = session_seconds
+        self.started_at = None
+        self.abandoned = False
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# policies
+# ---------------------------------------------------------------------------------------------------------------------
+
+class CapacityPolicy:
+    """Base class of the scaling and teardown plug-ins.
+
+    poll_seconds is how often queued users are matched with idle servers, 0 matches them as soon as something
+    changes (SQS event source). The hooks may call sim.launch, sim.stop, sim.at and sim.every.
+    """
+    name = 'none'
+    poll_seconds = 0
+
+    def start(self, sim):
+        pass
+
+    def on_poll(self, sim, waiting):
+        # called after matching with the number of users still waiting
+        pass
+
+    def on_ready(self, sim, instance):
+        pass
+
+    def on_idle(self, sim, instance):
+        pass
+
+
+def _days(sim):
+    return range(int(sim.horizon // 86400) + (1 if sim.horizon % 86400 else 0))
+
+
+def stop_all(sim):
+    # the scheduled terminateInstance run with {"stopAllServers": true}
+    for instance in sim.active():
+        sim.stop(instance, 'stopAllServers')
+
+
+class CurrentPolicy(CapacityPolicy):
+    # the deployed behaviour: the scheduled poller every 5 minutes asks createInstances for the waiting users net of
+    # booting instances, the 10:00 rule invokes createInstances with {"startAllServers": false} (one instance), the
+    # 18:15 rule terminates every server and each instance stops itself a fixed time after its server started
+    name = 'current'
+
+    def __init__(self, concurrency_limit=10, poll_minutes=5.0, start_at='10:00', start_count=1, stop_at='18:15',
+                 self_stop_minutes=20.0):
+        self.concurrency_limit = concurrency_limit
+        self.poll_seconds = poll_minutes * 60
+        self.start_at = start_at
+        self.start_count = start_count
+        self.stop_at = stop_at
+        self.self_stop_seconds = self_stop_minutes * 60 if self_stop_minutes else None
+
+    def start(self, sim):
+        for day in _days(sim):
+            if self.start_at:
+                sim.at(day * 86400 + arrivalTraces.time_of_day(self.start_at), self.create_instances, sim, self.start_count)
+            if self.stop_at:
+                sim.at(day * 86400 + arrivalTraces.time_of_day(self.stop_at), stop_all, sim)
+
+    def create_instances(self, sim, count, subtract_booting=False):
+        # mirrors createInstances: refused at capacity, otherwise capped at the room left under the limit
+        active = len(sim.active())
+        if active >= self.concurrency_limit:
+            sim.capacity_rejections += 1
+            return 0
+        launch = count - len(sim.booting()) if subtract_booting else count
+        launch = min(launch, self.concurrency_limit - active)
+        return sim.launch(launch, 'createInstances') if launch > 0 else 0
+
+    def on_poll(self, sim, waiting):
+        if waiting:
+            self.create_instances(sim, waiting, subtract_booting=True)
+
+    def on_ready(self, sim, instance):
+        if self.self_stop_seconds:
+            sim.at(sim.now + self.self_stop_seconds, sim.stop, instance, 'selfStop')
+
+
+class IdleStopPolicy(CurrentPolicy):
+    # the current scale-out with the SQS event source matching users immediately, and an instance that stops only
+    # after its server has been idle for idle_minutes instead of at a fixed time
+    name = 'idle-stop'
+
+    def __init__(self, concurrency_limit=10, start_at='10:00', start_count=1, stop_at='18:15', idle_minutes=10.0):
+        super().__init__(concurrency_limit, 0, start_at, start_count, stop_at, None)
+        self.idle_seconds = idle_minutes * 60
+
+    def on_idle(self, sim, instance):
+        idle_since = instance.idle_since
+        sim.at(sim.now + self.idle_seconds, self._stop_if_still_idle, sim, instance, idle_since)
+
+    def _stop_if_still_idle(self, sim, instance, idle_since):
+        if instance.idle and instance.idle_since == idle_since:
+            sim.stop(instance, 'idleStop')
+
+
+class WarmPoolPolicy(CapacityPolicy):
+    # the autoscaler function: every minute scalingPolicy.WarmPoolPolicy sizes the pool from the queue depth and the
+    # forecast arrival rate, idle servers above the target are stopped, users are matched immediately
+    name = 'warm-pool'
+
+    def __init__(self, concurrency_limit=10, warm_spares=1, boot_minutes=8.0, stop_at=None, history_minutes=30):
+        self.policy = scalingPolicy.WarmPoolPolicy(warm_spares=warm_spares, max_instances=concurrency_limit,
+                                                   boot_minutes=boot_minutes)
+        self.stop_at = stop_at
+        self.history_minutes = history_minutes
+
+    def start(self, sim):
+        sim.every(60, self.evaluate, sim)
+        if self.stop_at:
+            for day in _days(sim):
+                sim.at(day * 86400 + arrivalTraces.time_of_day(self.stop_at), stop_all, sim)
+
+    def evaluate(self, sim):
+        decision = self.policy.decide(len(sim.waiting), len(sim.active()), len(sim.idle()), len(sim.booting()),
+                                      sim.arrival_history(self.history_minutes))
+        if decision.launch:
+            sim.launch(decision.launch, 'autoscaler')
+        for instance in sim.idle()[:decision.release]:
+            sim.stop(instance, 'autoscaler')
+
+
+POLICIES = {policy.name: policy for policy in (CurrentPolicy, IdleStopPolicy, WarmPoolPolicy)}
+
+
+def load_policy(name):
+    # a built-in policy name or module:Class for a plug-in on the Python path
+    if name in POLICIES:
+        return POLICIES[name]
+    module_name, _, class_name = name.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# simulator
+# ---------------------------------------------------------------------------------------------------------------------
+
+class CapacitySimulator:
+    def __init__(self, arrivals, policy, slots=10, boot_seconds=480.0, session_seconds=600.0, patience_seconds=900.0,
+                 price_per_hour=1.0, horizon=None, seed=1):
+        self.arrivals = arrivals
+        self.policy = policy
+        self.slots = slots
+        self.boot_seconds = boot_seconds
+        self.patience_seconds = patience_seconds
+        self.price_per_hour = price_per_hour
+        last = arrivals[-1]['at'] if arrivals else 0.0
+        self.horizon = horizon or 86400.0 * max(1, int(last // 86400) + 1)
+        self.session_length = arrivalTraces.exponential_lengths(session_seconds, seed)
+
+        self.now = 0.0
+        self.events = []
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self.instances = []
+        self.users = []
+        self.waiting = deque()
+        self.free_slots = slots
+        self.capacity_rejections = 0
+        self.interrupted = 0
+        self.stop_reasons = {}
+        self._dispatch_pending = False
+
+    # --- API for policies --------------------------------------------------------------------------------------------
+
+    def at(self, when, callback, *args):
+        heapq.heappush(self.events, (when, next(self._seq), callback, args))
+
+    def every(self, interval, callback, *args):
+        def tick():
+            callback(*args)
+            self.at(self.now + interval, tick)
+        self.at(self.now, tick)
+
+    def active(self):
+        return [i for i in self.instances if i.state != STOPPED]
+
+    def booting(self):
+        return [i for i in self.instances if i.state == BOOTING]
+
+    def idle(self):
+        return [i for i in self.instances if i.idle]
+
+    def arrival_history(self, minutes):
+        # arrivals per minute over the last `minutes` minutes, oldest first
+        end = int(self.now // 60)
+        counts = [0.0] * minutes
+        for user in reversed(self.users):
+            minute = int(user.arrived_at // 60)
+            if minute < end - minutes:
+                break
+            if end - minutes <= minute < end:
+                counts[minute - end + minutes] += 1
+        return counts
+
+    def launch(self, count, source):
+        for _ in range(count):
+            instance = Instance(f"i-{next(self._ids):05d}", self.now, source)
+            self.instances.append(instance)
+            self.at(self.now + self.boot_seconds, self._boot, instance)
+        return count
+
+    def stop(self, instance, reason):
+        if instance.state == STOPPED:
+            return
+        if instance.user is not None:
+            # the user's session is cut short when its server goes away
+            self.interrupted += 1
+            instance.busy_seconds += self.now - instance.user.started_at
+            instance.user = None
+        instance.state = STOPPED
+        instance.stopped_at = self.now
+        if instance.has_slot:
+            self.free_slots += 1
+        self.stop_reasons[reason] = self.stop_reasons.get(reason, 0) + 1
+
+    # --- model -------------------------------------------------------------------------------------------------------
+
+    def _boot(self, instance):
+        if instance.state != BOOTING:
+            return
+        instance.state = READY
+        instance.ready_at = self.now
+        # registerInstances claims a target group slot, without one the server is never reachable
+        if self.free_slots > 0:
+            self.free_slots -= 1
+            instance.has_slot = True
+            instance.idle_since = self.now
+        self.policy.on_ready(self, instance)
+        if instance.idle:
+            self.policy.on_idle(self, instance)
+        self._changed()
+
+    def _arrive(self, arrival):
+        user = User(self.now, arrival.get('sessionSeconds') or self.session_length())
+        self.users.append(user)
+        self.waiting.append(user)
+        if self.patience_seconds:
+            self.at(self.now + self.patience_seconds, self._abandon, user)
+        self._changed()
+
+    def _abandon(self, user):
+        if user.started_at is None and not user.abandoned:
+            user.abandoned = True
+            self.waiting.remove(user)
+
+    def _end_session(self, instance, user):
+        if instance.user is not user:
+            return
+        instance.busy_seconds += self.now - user.started_at
+        instance.user = None
+        instance.idle_since = self.now
+        self.policy.on_idle(self, instance)
+        self._changed()
+
+    def _changed(self):
+        # with immediate matching every change is followed by one match round at the same timestamp
+        if not self.policy.poll_seconds and not self._dispatch_pending:
+            self._dispatch_pending = True
+            self.at(self.now, self._poll)
+
+    def _poll(self):
+        self._dispatch_pending = False
+        idle = self.idle()
+        while self.waiting and idle:
+            user = self.waiting.popleft()
+            instance = idle.pop(0)
+            user.started_at = self.now
+            instance.user = user
+            self.at(self.now + user.session_seconds, self._end_session, instance, user)
+        self.policy.on_poll(self, len(self.waiting))
+
+    def run(self):
+        for arrival in self.arrivals:
+            self.at(arrival['at'], self._arrive, arrival)
+        self.policy.start(self)
+        if self.policy.poll_seconds:
+            self.every(self.policy.poll_seconds, self._poll)
+        while self.events and self.events[0][0] <= self.horizon:
+            self.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+        self.now = self.horizon
+        return self.report()
+
+    # --- report ------------------------------------------------------------------------------------------------------
+
+    def report(self):
+        waits = sorted((u.started_at - u.arrived_at) / 60.0 for u in self.users if u.started_at is not None)
+        booting_hours = busy_hours = idle_hours = billed_hours = 0.0
+        for instance in self.instances:
+            end = instance.stopped_at if instance.stopped_at is not None else self.horizon
+            busy = instance.busy_seconds
+            if instance.user is not None:
+                busy += end - instance.user.started_at
+            ready_at = instance.ready_at if instance.ready_at is not None else end
+            booting_hours += (ready_at - instance.launched_at) / 3600.0
+            busy_hours += busy / 3600.0
+            # a running server without a slot cannot take sessions either, its time counts as idle
+            idle_hours += max(0.0, end - ready_at - busy) / 3600.0
+            billed_hours += max(end - instance.launched_at, MINIMUM_BILLED_SECONDS) / 3600.0
+        return {
+            'policy': self.policy.name,
+            'arrivals': len(self.users),
+            'served': len(waits),
+            'abandoned': sum(1 for u in self.users if u.abandoned),
+            'stillWaiting': len(self.waiting),
+            'waitMinutes': {
+                'p50': round(tracing.percentile(waits, 50), 2),
+                'p95': round(tracing.percentile(waits, 95), 2),
+                'p99': round(tracing.percentile(waits, 99), 2),
+                'max': round(waits[-1], 2) if waits else 0.0,
+            },
+            'interruptedSessions': self.interrupted,
+            'capacityRejections': self.capacity_rejections,
+            'launches': len(self.instances),
+            'withoutSlot': sum(1 for i in self.instances if i.ready_at is not None and not i.has_slot),
+            'peakInstances': self._peak_instances(),
+            'instanceHours': round(billed_hours, 2),
+            'bootingHours': round(booting_hours, 2),
+            'busyHours': round(busy_hours, 2),
+            'idleHours': round(idle_hours, 2),
+            'utilisation': round(busy_hours / billed_hours, 3) if billed_hours else 0.0,
+            'cost': round(billed_hours * self.price_per_hour, 2),
+            'stops': dict(sorted(self.stop_reasons.items())),
+        }
+
+    def _peak_instances(self):
+        changes = []
+        for instance in self.instances:
+            changes.append((instance.launched_at, 1))
+            changes.append((instance.stopped_at if instance.stopped_at is not None else self.horizon, -1))
+        peak = current = 0
+        for _, delta in sorted(changes):
+            current += delta
+            peak = max(peak, current)
+        return peak
+
+
+COLUMNS = [
+    ('served', 'served'), ('abandoned', 'abandoned'), ('stillWaiting', 'waiting'), ('p50', 'wait p50'),
+    ('p95', 'wait p95'), ('p99', 'wait p99'), ('interruptedSessions', 'cut'), ('capacityRejections', 'at cap'),
+    ('launches', 'launches'), ('peakInstances', 'peak'), ('instanceHours', 'inst h'), ('idleHours', 'idle h'),
+    ('utilisation', 'util'), ('cost', 'cost'),
+]
+
+
+def format_reports(reports):
+    width = max(len(r['policy']) for r in reports) + 2
+    rows = [f"{'policy':<{width}}" + "".join(f"{title:>10}" for _, title in COLUMNS)]
+    for report in reports:
+        values = dict(report, **report['waitMinutes'])
+        rows.append(f"{report['policy']:<{width}}" + "".join(f"{values[key]:>10}" for key, _ in COLUMNS))
+    rows.append("wait times in minutes, cut = sessions interrupted by a stopping instance, at cap = createInstances "
+                "calls refused at concurrencyLimit")
+    return "\n".join(rows)
+
+
+def build_policy(policy_class, args):
+    # fills the policy's constructor arguments from the options with the same name
+    parameters = inspect.signature(policy_class).parameters
+    options = {name: getattr(args, name) for name in parameters if getattr(args, name, None) is not None}
+    return policy_class(**options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Discrete-event simulation of Signalling server capacity policies")
+    parser.add_argument('--policy', action='append', help="current, idle-stop, warm-pool or module:Class, repeatable")
+    parser.add_argument('--trace', help="JSONL arrival trace, otherwise a working-day profile is generated")
+    parser.add_argument('--sessions-per-day', type=float, default=200.0)
+    parser.add_argument('--days', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--slots', type=int, help="target group slots, defaults to the concurrency limit")
+    parser.add_argument('--boot-minutes', type=float, default=8.0)
+    parser.add_argument('--session-minutes', type=float, default=10.0, help="mean session length")
+    parser.add_argument('--patience-minutes', type=float, default=15.0, help="users give up after this, 0 never")
+    parser.add_argument('--price-per-hour', type=float, default=1.0, help="price of one instance hour")
+    parser.add_argument('--json', action='store_true')
+    # policy options, passed to every policy that takes them
+    parser.add_argument('--concurrency-limit', type=int, default=10)
+    parser.add_argument('--poll-minutes', type=float)
+    parser.add_argument('--start-at', help="HH:MM of the daily createInstances run")
+    parser.add_argument('--start-count', type=int)
+    parser.add_argument('--stop-at', help="HH:MM of the daily stopAllServers run")
+    parser.add_argument('--self-stop-minutes', type=float)
+    parser.add_argument('--idle-minutes', type=float)
+    parser.add_argument('--warm-spares', type=int)
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        arrivals = arrivalTraces.replay_trace(args.trace)
+    else:
+        arrivals = arrivalTraces.diurnal_trace(args.sessions_per_day, seed=args.seed, days=args.days)
+
+    reports = []
+    for name in args.policy or ['current']:
+        simulator = CapacitySimulator(
+            arrivals, build_policy(load_policy(name), args),
+            slots=args.slots or args.concurrency_limit,
+            boot_seconds=args.boot_minutes * 60,
+            session_seconds=args.session_minutes * 60,
+            patience_seconds=args.patience_minutes * 60,
+            price_per_hour=args.price_per_hour,
+            horizon=86400.0 * args.days if not args.trace else None,
+            seed=args.seed
+        )
+        reports.append(simulator.run())
+    print(json.dumps(reports, indent=2) if args.json else format_reports(reports))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
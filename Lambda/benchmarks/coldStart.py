@@ -0,0 +1,109 @@
+# this tool measures the cold start of every handler in the consolidated Lambda package the way Lambda pays it: a fresh
+# interpreter imports index.py for a function name, dispatch imports that handler's module and creates its hot clients.
+# Each handler is started --repeat times in its own process and the medians of the import time, the client init time,
+# the whole process and the number of modules loaded are reported. Creating a client needs no network or credentials,
+# only a region. Save a run and compare later runs with it to catch a cold start regression, e.g. a new module-level
+# import:
+#   python coldStart.py --save coldstart.json
+#   python coldStart.py --baseline coldstart.json --max-regression-pct 25
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LAMBDA_DIR)
+
+import dispatch
+
+# what the handlers read from their environment, with placeholder values
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'SQSName': 'sessions.fifo',
+    'ApiGatewayUrl': 'https://websocket.local/production',
+    'MatchMakerURL': 'http://matchmaker.local:90/signallingserver',
+    'DynamoDBName': 'instanceMapping',
+}
+
+# runs in the fresh interpreter, dispatch prints the coldStart EMF record while index is imported
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+before = len(sys.modules)
+import index
+print(json.dumps({'coldStartTotalMs': (time.perf_counter() - started) * 1000, 'modules': len(sys.modules) - before}))
+"""
+
+# milliseconds a handler may get slower before the relative limit applies, below that it is measurement noise
+NOISE_MS = 5.0
+
+
+def measure(handler, repeat=5):
+    env = dict(os.environ, **ENVIRONMENT, AWS_LAMBDA_FUNCTION_NAME=handler, PYTHONDONTWRITEBYTECODE='1')
+    env.pop('HandlerName', None)
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', CHILD], cwd=LAMBDA_DIR, env=env, capture_output=True,
+                                text=True, check=True).stdout
+        process_ms = (time.perf_counter() - started) * 1000
+        run = {'processMs': process_ms}
+        for line in output.splitlines():
+            record = json.loads(line[line.find('{'):]) if '{' in line else {}
+            if record.get('Group') == 'coldStart':
+                run.update(importMs=record['ImportMs'], initMs=record['InitMs'])
+            elif 'coldStartTotalMs' in record:
+                run.update(totalMs=record['coldStartTotalMs'], modules=record['modules'])
+        runs.append(run)
+    return {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+
+
+def compare(results, baseline, max_regression_pct):
+    """Returns the handlers whose total cold start regressed beyond the limit."""
+    regressions = []
+    for handler, result in results.items():
+        before = baseline.get(handler)
+        if before is None:
+            continue
+        limit = before['totalMs'] * (1 + max_regression_pct / 100.0) + NOISE_MS
+        if result['totalMs'] > limit:
+            regressions.append(f"{handler}: {result['totalMs']} ms, baseline {before['totalMs']} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold start of each Lambda handler")
+    parser.add_argument('handlers', nargs='*', help="defaults to every handler dispatch knows")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON file of an earlier run to compare with")
+    parser.add_argument('--max-regression-pct', type=float, default=25.0)
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {handler: measure(handler, args.repeat) for handler in args.handlers or sorted(dispatch.HANDLERS)}
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'handler':<22}{'import ms':>11}{'init ms':>10}{'total ms':>10}{'process ms':>12}{'modules':>9}")
+        for handler, r in results.items():
+            print(f"{handler:<22}{r['importMs']:>11.1f}{r['initMs']:>10.1f}{r['totalMs']:>10.1f}"
+                  f"{r['processMs']:>12.1f}{r['modules']:>9.0f}")
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression_pct)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
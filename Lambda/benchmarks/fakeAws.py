@@ -0,0 +1,776 @@
+# in-process stand-ins for the AWS services used by the Lambda handlers: SQS FIFO, DynamoDB, EC2, ELBv2, SSM, Lambda,
+# API Gateway management and CloudWatch. They keep just enough state to run the real handlers offline and count every
+# API call, so a load test can report AWS calls per session. Time comes from a virtual clock advanced by the driver.
+# install() swaps them in behind runtime.client / runtime.resource
+import copy
+import itertools
+import json
+import re
+import threading
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+DEFAULT_KEYS = {'launchLock': 'LockName', 'connectionTombstones': 'ConnectionId'}
+SCAN_PAGE_SIZE = 100
+DESCRIBE_PAGE_SIZE = 50
+
+_MISSING = object()
+
+
+class Clock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# DynamoDB expressions: boto3 condition objects and the small string expressions used with the low-level client
+# ---------------------------------------------------------------------------------------------------------------------
+
+def evaluate(condition, item, values=None):
+    if condition is None:
+        return True
+    if isinstance(condition, str):
+        return _evaluate_string(condition, item, values or {})
+    kind = type(condition).__name__
+    operands = condition._values
+    if kind == 'And':
+        return evaluate(operands[0], item) and evaluate(operands[1], item)
+    if kind == 'Or':
+        return evaluate(operands[0], item) or evaluate(operands[1], item)
+    if kind == 'Not':
+        return not evaluate(operands[0], item)
+    if kind == 'AttributeExists':
+        return operands[0].name in item
+    if kind == 'AttributeNotExists':
+        return operands[0].name not in item
+    current = item.get(operands[0].name, _MISSING)
+    if kind == 'NotEquals':
+        return current is _MISSING or current != operands[1]
+    if current is _MISSING:
+        return False
+    if kind == 'Equals':
+        return current == operands[1]
+    if kind == 'LessThan':
+        return current < operands[1]
+    if kind == 'LessThanEquals':
+        return current <= operands[1]
+    if kind == 'GreaterThan':
+        return current > operands[1]
+    if kind == 'GreaterThanEquals':
+        return current >= operands[1]
+    if kind == 'In':
+        return current in operands[1]
+    if kind == 'BeginsWith':
+        return str(current).startswith(operands[1])
+    raise NotImplementedError(f"Condition {kind} is not supported by the fake DynamoDB")
+
+
+def _evaluate_string(expression, item, values):
+    for clause in re.split(r'\s+AND\s+', expression, flags=re.IGNORECASE):
+        match = re.fullmatch(r'\s*attribute_not_exists\((\w+)\)\s*', clause)
+        if match:
+            if match.group(1) in item:
+                return False
+            continue
+        match = re.fullmatch(r'\s*(\w+)\s*(=|<>|<)\s*(:\w+)\s*', clause)
+        if not match:
+            raise NotImplementedError(f"Expression {expression} is not supported by the fake DynamoDB")
+        name, operator, placeholder = match.groups()
+        current = item.get(name, _MISSING)
+        expected = values[placeholder]
+        if operator == '=' and current != expected:
+            return False
+        if operator == '<>' and current == expected:
+            return False
+        if operator == '<' and (current is _MISSING or not current < expected):
+            return False
+    return True
+
+
+def apply_update(item, expression, values):
+    # supports "SET a = :x, b = :y", "SET a = a + :n" and "REMOVE c" clauses in any order
+    for keyword, body in re.findall(r'(SET|REMOVE|set|remove)\s+(.*?)(?=\s+(?:SET|REMOVE|set|remove)\s+|$)', expression):
+        if keyword.upper() == 'SET':
+            for assignment in body.split(','):
+                name, value = [part.strip() for part in assignment.split('=', 1)]
+                increment = re.fullmatch(r'(\w+)\s*\+\s*(:\w+)', value)
+                if increment:
+                    item[name] = item.get(increment.group(1), 0) + values[increment.group(2)]
+                else:
+                    item[name] = values[value]
+        else:
+            for name in body.split(','):
+                item.pop(name.strip(), None)
+
+
+class _TransactionCanceled(ClientError):
+    pass
+
+
+class _ConditionalCheckFailed(ClientError):
+    pass
+
+
+class FakeTableClient:
+    # the low-level client reached through table.meta.client
+    class exceptions:
+        TransactionCanceledException = _TransactionCanceled
+        ConditionalCheckFailedException = _ConditionalCheckFailed
+
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+
+    def transact_write_items(self, TransactItems):
+        self.dynamodb.aws.count('dynamodb', 'TransactWriteItems')
+        with self.dynamodb.aws.lock:
+            for entry in TransactItems:
+                update = entry['Update']
+                table = self.dynamodb.Table(update['TableName'])
+                item = table.items.get(table.key_of(update['Key']), {})
+                if not evaluate(update.get('ConditionExpression'), item, update.get('ExpressionAttributeValues')):
+                    raise _TransactionCanceled({'Error': {'Code': 'TransactionCanceledException'}}, 'TransactWriteItems')
+            for entry in TransactItems:
+                update = entry['Update']
+                table = self.dynamodb.Table(update['TableName'])
+                key = table.key_of(update['Key'])
+                item = table.items.setdefault(key, dict(update['Key']))
+                apply_update(item, update['UpdateExpression'], update.get('ExpressionAttributeValues', {}))
+
+
+class _Meta:
+    def __init__(self, client):
+        self.client = client
+
+
+class FakeBatchWriter:
+    def __init__(self, table):
+        self.table = table
+        self.pending = 0
+
+    def _flush_if_full(self):
+        self.pending += 1
+        if self.pending == 25:
+            self.table.aws.count('dynamodb', 'BatchWriteItem')
+            self.pending = 0
+
+    def put_item(self, Item):
+        with self.table.aws.lock:
+            self.table.items[self.table.key_of(Item)] = copy.deepcopy(Item)
+        self._flush_if_full()
+
+    def delete_item(self, Key):
+        with self.table.aws.lock:
+            self.table.items.pop(self.table.key_of(Key), None)
+        self._flush_if_full()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.pending:
+            self.table.aws.count('dynamodb', 'BatchWriteItem')
+        return False
+
+
+class FakeTable:
+    def __init__(self, aws, dynamodb, name, key_name):
+        self.aws = aws
+        self.name = name
+        self.key_name = key_name
+        self.items = {}
+        # index name -> (partition key, sort key)
+        self.indexes = {'FreeSlotIndex': ('FreeSlot', 'TargetGroup')}
+        self.meta = _Meta(FakeTableClient(dynamodb))
+
+    def key_of(self, item):
+        return item[self.key_name]
+
+    def _page(self, items, params):
+        items = sorted(items, key=lambda i: str(i.get(self.key_name)))
+        start = params.get('ExclusiveStartKey')
+        if start:
+            items = [i for i in items if str(i.get(self.key_name)) > str(start[self.key_name])]
+        return items
+
+    def scan(self, FilterExpression=None, ProjectionExpression=None, Select=None, ExclusiveStartKey=None, **kwargs):
+        self.aws.count('dynamodb', 'Scan')
+        with self.aws.lock:
+            page = self._page(self.items.values(), {'ExclusiveStartKey': ExclusiveStartKey})
+            evaluated = page[:SCAN_PAGE_SIZE]
+            matched = [copy.deepcopy(i) for i in evaluated if evaluate(FilterExpression, i)]
+        response = {'Count': len(matched), 'ScannedCount': len(evaluated)}
+        if Select != 'COUNT':
+            response['Items'] = matched
+        if len(page) > SCAN_PAGE_SIZE:
+            response['LastEvaluatedKey'] = {self.key_name: evaluated[-1][self.key_name]}
+        return response
+
+    def query(self, KeyConditionExpression, IndexName=None, Limit=None, Select=None, ExclusiveStartKey=None, **kwargs):
+        self.aws.count('dynamodb', 'Query')
+        partition, sort = self.indexes[IndexName] if IndexName else (self.key_name, None)
+        with self.aws.lock:
+            candidates = [i for i in self.items.values() if partition in i and evaluate(KeyConditionExpression, i)]
+            candidates = self._page(candidates, {'ExclusiveStartKey': ExclusiveStartKey})
+            page = candidates[:Limit] if Limit else candidates
+            page = [copy.deepcopy(i) for i in page]
+        response = {'Count': len(page)}
+        if Select != 'COUNT':
+            response['Items'] = page
+        if Limit and len(candidates) > Limit:
+            response['LastEvaluatedKey'] = {self.key_name: page[-1][self.key_name]}
+        return response
+
+    def get_item(self, Key, ConsistentRead=False, **kwargs):
+        self.aws.count('dynamodb', 'GetItem')
+        with self.aws.lock:
+            item = self.items.get(self.key_of(Key))
+            return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        self.aws.count('dynamodb', 'PutItem')
+        with self.aws.lock:
+            existing = self.items.get(self.key_of(Item), {})
+            if not evaluate(ConditionExpression, existing, ExpressionAttributeValues):
+                raise _ConditionalCheckFailed({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+            self.items[self.key_of(Item)] = copy.deepcopy(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, ConditionExpression=None,
+                    ReturnValues=None, **kwargs):
+        self.aws.count('dynamodb', 'UpdateItem')
+        with self.aws.lock:
+            key = self.key_of(Key)
+            existing = self.items.get(key, {})
+            if not evaluate(ConditionExpression, existing, ExpressionAttributeValues):
+                raise _ConditionalCheckFailed({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+            item = self.items.setdefault(key, dict(Key))
+            apply_update(item, UpdateExpression, ExpressionAttributeValues or {})
+            return {'Attributes': copy.deepcopy(item)} if ReturnValues else {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        self.aws.count('dynamodb', 'DeleteItem')
+        with self.aws.lock:
+            existing = self.items.get(self.key_of(Key), {})
+            if not evaluate(ConditionExpression, existing, ExpressionAttributeValues):
+                raise _ConditionalCheckFailed({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'DeleteItem')
+            self.items.pop(self.key_of(Key), None)
+        return {}
+
+    def batch_writer(self, **kwargs):
+        return FakeBatchWriter(self)
+
+
+class FakeDynamoDB:
+    def __init__(self, aws):
+        self.aws = aws
+        self.tables = {}
+        self.meta = _Meta(FakeTableClient(self))
+
+    def Table(self, name):
+        with self.aws.lock:
+            if name not in self.tables:
+                self.tables[name] = FakeTable(self.aws, self, name, DEFAULT_KEYS.get(name, 'TargetGroup'))
+            return self.tables[name]
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self.aws.count('dynamodb', 'BatchGetItem')
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            with self.aws.lock:
+                items = [table.items.get(table.key_of(key)) for key in request['Keys']]
+                responses[name] = [copy.deepcopy(item) for item in items if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# SQS FIFO
+# ---------------------------------------------------------------------------------------------------------------------
+
+class FakeMessage:
+    def __init__(self, queue, message_id, body, group_id):
+        self.queue = queue
+        self.message_id = message_id
+        self.body = body
+        self.group_id = group_id
+        self.sent_at = queue.aws.clock.now
+        self.visible_at = queue.aws.clock.now
+        self.receive_count = 0
+
+    @property
+    def receipt_handle(self):
+        return self.message_id
+
+    def delete(self):
+        self.queue.aws.count('sqs', 'DeleteMessage')
+        self.queue.remove(self.message_id)
+        return {}
+
+
+class FakeQueue:
+    def __init__(self, aws, name, visibility_timeout=30, dedup_window=300):
+        self.aws = aws
+        self.name = name
+        self.url = f"https://sqs.local/000000000000/{name}"
+        self.visibility_timeout = visibility_timeout
+        self.dedup_window = dedup_window
+        self.messages = []
+        self.dedup = {}
+        self.duplicates_dropped = 0
+        self.attributes = {}
+        self._ids = itertools.count(1)
+
+    def send_message(self, MessageBody, MessageGroupId=None, MessageDeduplicationId=None, **kwargs):
+        self.aws.count('sqs', 'SendMessage')
+        return self._enqueue(MessageBody, MessageGroupId, MessageDeduplicationId)
+
+    def _enqueue(self, body, group_id, dedup_id):
+        now = self.aws.clock.now
+        with self.aws.lock:
+            if dedup_id is not None:
+                seen = self.dedup.get(dedup_id)
+                if seen is not None and now - seen[1] < self.dedup_window:
+                    # FIFO deduplication silently accepts the duplicate and drops it
+                    self.duplicates_dropped += 1
+                    return {'MessageId': seen[0]}
+            message = FakeMessage(self, f"m-{next(self._ids)}", body, group_id)
+            if dedup_id is not None:
+                self.dedup[dedup_id] = (message.message_id, now)
+            self.messages.append(message)
+            return {'MessageId': message.message_id}
+
+    def receive(self, count):
+        now = self.aws.clock.now
+        with self.aws.lock:
+            # a FIFO queue does not hand out a message while an earlier one of the same group is in flight
+            blocked = {m.group_id for m in self.messages if m.visible_at > now}
+            received = []
+            for message in self.messages:
+                if len(received) == count:
+                    break
+                if message.visible_at <= now and message.group_id not in blocked:
+                    message.visible_at = now + self.visibility_timeout
+                    message.receive_count += 1
+                    received.append(message)
+                    blocked.add(message.group_id)
+            return received
+
+    def receive_messages(self, MaxNumberOfMessages=1, WaitTimeSeconds=0, **kwargs):
+        self.aws.count('sqs', 'ReceiveMessage')
+        return self.receive(MaxNumberOfMessages)
+
+    def remove(self, message_id):
+        with self.aws.lock:
+            self.messages = [m for m in self.messages if m.message_id != message_id]
+
+    def make_visible(self, message_id):
+        with self.aws.lock:
+            for message in self.messages:
+                if message.message_id == message_id:
+                    message.visible_at = self.aws.clock.now
+
+    def counts(self):
+        now = self.aws.clock.now
+        with self.aws.lock:
+            visible = sum(1 for m in self.messages if m.visible_at <= now)
+            return visible, len(self.messages) - visible
+
+    def load(self):
+        self.aws.count('sqs', 'GetQueueAttributes')
+        visible, in_flight = self.counts()
+        self.attributes = {'ApproximateNumberOfMessages': str(visible),
+                           'ApproximateNumberOfMessagesNotVisible': str(in_flight)}
+
+
+class FakeSQSResource:
+    def __init__(self, aws):
+        self.aws = aws
+
+    def get_queue_by_name(self, QueueName):
+        self.aws.count('sqs', 'GetQueueUrl')
+        return self.aws.queue(QueueName)
+
+    def Queue(self, url):
+        return self.aws.queue(url.rsplit('/', 1)[-1])
+
+
+class FakeSQSClient:
+    def __init__(self, aws):
+        self.aws = aws
+
+    def get_queue_url(self, QueueName):
+        self.aws.count('sqs', 'GetQueueUrl')
+        return {'QueueUrl': self.aws.queue(QueueName).url}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None):
+        self.aws.count('sqs', 'GetQueueAttributes')
+        visible, in_flight = self.aws.queue(QueueUrl.rsplit('/', 1)[-1]).counts()
+        return {'Attributes': {'ApproximateNumberOfMessages': str(visible),
+                               'ApproximateNumberOfMessagesNotVisible': str(in_flight)}}
+
+    def send_message(self, QueueUrl, MessageBody, MessageGroupId=None, MessageDeduplicationId=None, **kwargs):
+        self.aws.count('sqs', 'SendMessage')
+        return self.aws.queue(QueueUrl.rsplit('/', 1)[-1])._enqueue(MessageBody, MessageGroupId, MessageDeduplicationId)
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, **kwargs):
+        self.aws.count('sqs', 'ReceiveMessage')
+        messages = self.aws.queue(QueueUrl.rsplit('/', 1)[-1]).receive(MaxNumberOfMessages)
+        return {'Messages': [{'MessageId': m.message_id, 'ReceiptHandle': m.receipt_handle, 'Body': m.body}
+                             for m in messages]}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.aws.count('sqs', 'DeleteMessage')
+        self.aws.queue(QueueUrl.rsplit('/', 1)[-1]).remove(ReceiptHandle)
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.aws.count('sqs', 'DeleteMessageBatch')
+        queue = self.aws.queue(QueueUrl.rsplit('/', 1)[-1])
+        for entry in Entries:
+            queue.remove(entry['ReceiptHandle'])
+        return {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# EC2, ELBv2, SSM, Lambda, API Gateway management, CloudWatch
+# ---------------------------------------------------------------------------------------------------------------------
+
+class _Paginator:
+    def __init__(self, method, result_key, page_size):
+        self.method = method
+        self.result_key = result_key
+        self.page_size = page_size
+
+    def paginate(self, **kwargs):
+        items = self.method(_paginated=True, **kwargs)[self.result_key]
+        for start in range(0, max(len(items), 1), self.page_size):
+            yield {self.result_key: items[start:start + self.page_size]}
+
+
+class FakeEC2:
+    def __init__(self, aws):
+        self.aws = aws
+        self.instances = {}
+        self.reservations = []
+        self._ids = itertools.count(1)
+        # tags the launch template adds to every instance it starts
+        self.launch_template_tags = {'type': 'signalling', 'Application': 'HealthCoach'}
+        # optional hook(params) -> error code, used to inject capacity errors
+        self.launch_error = None
+
+    def _matches(self, instance, filters, instance_ids):
+        if instance_ids and instance['InstanceId'] not in instance_ids:
+            return False
+        tags = {t['Key']: t['Value'] for t in instance['Tags']}
+        for f in filters or []:
+            if f['Name'] == 'instance-state-name':
+                if instance['State']['Name'] not in f['Values']:
+                    return False
+            elif f['Name'].startswith('tag:'):
+                if tags.get(f['Name'][4:]) not in f['Values']:
+                    return False
+            elif f['Name'] == 'subnet-id':
+                if instance.get('SubnetId') not in f['Values']:
+                    return False
+        return True
+
+    def describe_instances(self, Filters=None, InstanceIds=None, _paginated=False, **kwargs):
+        self.aws.count('ec2', 'DescribeInstances')
+        with self.aws.lock:
+            reservations = []
+            for reservation_id, ids in self.reservations:
+                instances = [copy.deepcopy(self.instances[i]) for i in ids
+                             if self._matches(self.instances[i], Filters, InstanceIds)]
+                if instances:
+                    reservations.append({'ReservationId': reservation_id, 'Instances': instances})
+        return {'Reservations': reservations}
+
+    def get_paginator(self, operation):
+        assert operation == 'describe_instances'
+        return _Paginator(self.describe_instances, 'Reservations', DESCRIBE_PAGE_SIZE)
+
+    def run_instances(self, MinCount=1, MaxCount=1, TagSpecifications=None, SubnetId=None, **kwargs):
+        self.aws.count('ec2', 'RunInstances')
+        if self.launch_error:
+            code = self.launch_error(dict(kwargs, MinCount=MinCount, MaxCount=MaxCount, SubnetId=SubnetId))
+            if code:
+                raise client_error(code, 'RunInstances')
+        tags = dict(self.launch_template_tags)
+        for spec in TagSpecifications or []:
+            tags.update({t['Key']: t['Value'] for t in spec['Tags']})
+        created = []
+        with self.aws.lock:
+            reservation_id = f"r-{len(self.reservations) + 1:08d}"
+            for _ in range(MaxCount):
+                instance_id = f"i-{next(self._ids):08d}"
+                self.instances[instance_id] = {
+                    'InstanceId': instance_id,
+                    'State': {'Name': 'pending'},
+                    'SubnetId': SubnetId,
+                    'LaunchedAt': self.aws.clock.now,
+                    'Tags': [{'Key': k, 'Value': v} for k, v in tags.items()]
+                }
+                created.append(instance_id)
+            self.reservations.append((reservation_id, created))
+            instances = [copy.deepcopy(self.instances[i]) for i in created]
+        self.aws.notify('launched', created)
+        return {'ReservationId': reservation_id, 'Instances': instances}
+
+    def create_tags(self, Resources, Tags):
+        self.aws.count('ec2', 'CreateTags')
+        with self.aws.lock:
+            for instance_id in Resources:
+                tags = {t['Key']: t['Value'] for t in self.instances[instance_id]['Tags']}
+                tags.update({t['Key']: t['Value'] for t in Tags})
+                self.instances[instance_id]['Tags'] = [{'Key': k, 'Value': v} for k, v in tags.items()]
+        return {}
+
+    def delete_tags(self, Resources, Tags):
+        self.aws.count('ec2', 'DeleteTags')
+        with self.aws.lock:
+            for instance_id in Resources:
+                keys = {t['Key'] for t in Tags}
+                self.instances[instance_id]['Tags'] = [t for t in self.instances[instance_id]['Tags']
+                                                       if t['Key'] not in keys]
+        return {}
+
+    def set_state(self, instance_ids, state):
+        with self.aws.lock:
+            for instance_id in instance_ids:
+                if instance_id in self.instances:
+                    self.instances[instance_id]['State'] = {'Name': state}
+
+    def terminate_instances(self, InstanceIds):
+        self.aws.count('ec2', 'TerminateInstances')
+        self.set_state(InstanceIds, 'terminated')
+        self.aws.notify('terminated', list(InstanceIds))
+        return {'TerminatingInstances': [{'InstanceId': i} for i in InstanceIds]}
+
+    def stop_instances(self, InstanceIds, **kwargs):
+        self.aws.count('ec2', 'StopInstances')
+        self.set_state(InstanceIds, 'stopped')
+        self.aws.notify('stopped', list(InstanceIds))
+        return {'StoppingInstances': [{'InstanceId': i} for i in InstanceIds]}
+
+    def start_instances(self, InstanceIds, **kwargs):
+        self.aws.count('ec2', 'StartInstances')
+        self.set_state(InstanceIds, 'pending')
+        with self.aws.lock:
+            for instance_id in InstanceIds:
+                self.instances[instance_id]['LaunchedAt'] = self.aws.clock.now
+        self.aws.notify('started', list(InstanceIds))
+        return {'StartingInstances': [{'InstanceId': i} for i in InstanceIds]}
+
+
+class FakeELBv2:
+    def __init__(self, aws):
+        self.aws = aws
+        self.targets = {}
+        # the Signalling ALB with one listener, query string rules and target groups created at runtime
+        self.load_balancer = {'LoadBalancerArn': 'arn:aws:elasticloadbalancing:local:000000000000:loadbalancer/app/signalling/1',
+                              'LoadBalancerName': 'signalling', 'VpcId': 'vpc-local'}
+        self.listener = {'ListenerArn': 'arn:aws:elasticloadbalancing:local:000000000000:listener/app/signalling/1/80',
+                         'Port': 80}
+        self.target_groups = {}
+        self.rules = {}
+        self._ids = itertools.count(1)
+
+    def describe_load_balancers(self, Names=None, **kwargs):
+        self.aws.count('elbv2', 'DescribeLoadBalancers')
+        return {'LoadBalancers': [self.load_balancer]}
+
+    def describe_listeners(self, LoadBalancerArn, **kwargs):
+        self.aws.count('elbv2', 'DescribeListeners')
+        return {'Listeners': [self.listener]}
+
+    def describe_rules(self, ListenerArn, **kwargs):
+        self.aws.count('elbv2', 'DescribeRules')
+        with self.aws.lock:
+            return {'Rules': [copy.deepcopy(rule) for rule in self.rules.values()]}
+
+    def create_target_group(self, Name, **kwargs):
+        self.aws.count('elbv2', 'CreateTargetGroup')
+        with self.aws.lock:
+            arn = f"arn:aws:elasticloadbalancing:local:000000000000:targetgroup/{Name}/{next(self._ids)}"
+            self.target_groups[arn] = {'TargetGroupArn': arn, 'TargetGroupName': Name}
+            return {'TargetGroups': [dict(self.target_groups[arn])]}
+
+    def create_rule(self, ListenerArn, Priority, Conditions, Actions, **kwargs):
+        self.aws.count('elbv2', 'CreateRule')
+        with self.aws.lock:
+            if any(rule['Priority'] == str(Priority) for rule in self.rules.values()):
+                raise client_error('PriorityInUse', 'CreateRule')
+            arn = f"{ListenerArn.replace(':listener/', ':listener-rule/')}/{next(self._ids)}"
+            self.rules[arn] = {'RuleArn': arn, 'Priority': str(Priority), 'Conditions': Conditions, 'Actions': Actions}
+            return {'Rules': [copy.deepcopy(self.rules[arn])]}
+
+    def delete_rule(self, RuleArn):
+        self.aws.count('elbv2', 'DeleteRule')
+        with self.aws.lock:
+            if self.rules.pop(RuleArn, None) is None:
+                raise client_error('RuleNotFound', 'DeleteRule')
+        return {}
+
+    def delete_target_group(self, TargetGroupArn):
+        self.aws.count('elbv2', 'DeleteTargetGroup')
+        with self.aws.lock:
+            if any(action.get('TargetGroupArn') == TargetGroupArn
+                   for rule in self.rules.values() for action in rule['Actions']):
+                raise client_error('ResourceInUse', 'DeleteTargetGroup')
+            self.target_groups.pop(TargetGroupArn, None)
+        return {}
+
+    def register_targets(self, TargetGroupArn, Targets):
+        self.aws.count('elbv2', 'RegisterTargets')
+        with self.aws.lock:
+            self.targets.setdefault(TargetGroupArn, set()).update(t['Id'] for t in Targets)
+        return {}
+
+    def deregister_targets(self, TargetGroupArn, Targets):
+        self.aws.count('elbv2', 'DeregisterTargets')
+        with self.aws.lock:
+            self.targets.get(TargetGroupArn, set()).difference_update(t['Id'] for t in Targets)
+        return {}
+
+
+class FakeSSM:
+    def __init__(self, aws):
+        self.aws = aws
+        self.parameters = {}
+
+    def get_parameter(self, Name, WithDecryption=False):
+        self.aws.count('ssm', 'GetParameter')
+        if Name not in self.parameters:
+            raise client_error('ParameterNotFound', 'GetParameter')
+        return {'Parameter': {'Name': Name, 'Value': self.parameters[Name]}}
+
+
+class FakeLambda:
+    def __init__(self, aws):
+        self.aws = aws
+        # function name or ARN -> handler(event, context)
+        self.functions = {}
+        # asynchronous invocations, run by the driver via run_pending()
+        self.pending = []
+
+    def get_function(self, FunctionName):
+        self.aws.count('lambda', 'GetFunction')
+        return {'Configuration': {'FunctionArn': f"arn:aws:lambda:local:000000000000:function:{FunctionName}"}}
+
+    def invoke(self, FunctionName, InvocationType='RequestResponse', Payload='{}'):
+        self.aws.count('lambda', 'Invoke')
+        name = FunctionName.rsplit(':', 1)[-1]
+        event = json.loads(Payload)
+        if InvocationType == 'Event':
+            with self.aws.lock:
+                self.pending.append((name, event))
+            return {'StatusCode': 202}
+        result = self.functions[name](event, None)
+        return {'StatusCode': 200, 'Payload': json.dumps(result)}
+
+    def run_pending(self):
+        while True:
+            with self.aws.lock:
+                if not self.pending:
+                    return
+                name, event = self.pending.pop(0)
+            if name in self.functions:
+                self.functions[name](event, None)
+
+
+class _GoneException(ClientError):
+    pass
+
+
+class FakeApiGateway:
+    class exceptions:
+        GoneException = _GoneException
+
+    def __init__(self, aws):
+        self.aws = aws
+        self.closed = set()
+        # connection id -> list of posted messages
+        self.posted = {}
+
+    def post_to_connection(self, ConnectionId, Data):
+        self.aws.count('apigatewaymanagementapi', 'PostToConnection')
+        if ConnectionId in self.closed:
+            raise _GoneException({'Error': {'Code': 'GoneException'}}, 'PostToConnection')
+        data = json.loads(Data)
+        with self.aws.lock:
+            self.posted.setdefault(ConnectionId, []).append(data)
+        self.aws.notify('posted', (ConnectionId, data))
+        return {}
+
+
+class FakeCloudWatch:
+    def __init__(self, aws):
+        self.aws = aws
+
+    def get_metric_statistics(self, **kwargs):
+        self.aws.count('cloudwatch', 'GetMetricStatistics')
+        return {'Datapoints': []}
+
+    def put_metric_data(self, **kwargs):
+        self.aws.count('cloudwatch', 'PutMetricData')
+        return {}
+
+
+class FakeAws:
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.listeners = []
+        self.queues = {}
+        self.dynamodb = FakeDynamoDB(self)
+        self.ec2 = FakeEC2(self)
+        self.elbv2 = FakeELBv2(self)
+        self.ssm = FakeSSM(self)
+        self.lambda_ = FakeLambda(self)
+        self.apigateway = FakeApiGateway(self)
+        self.cloudwatch = FakeCloudWatch(self)
+        self.sqs = FakeSQSClient(self)
+
+    def count(self, service, operation):
+        with self.lock:
+            self.calls[f"{service}.{operation}"] += 1
+
+    def notify(self, event, data):
+        for listener in self.listeners:
+            listener(event, data)
+
+    def queue(self, name):
+        with self.lock:
+            if name not in self.queues:
+                self.queues[name] = FakeQueue(self, name)
+            return self.queues[name]
+
+    def client(self, service_name, **kwargs):
+        return {
+            'ec2': self.ec2,
+            'elbv2': self.elbv2,
+            'ssm': self.ssm,
+            'lambda': self.lambda_,
+            'apigatewaymanagementapi': self.apigateway,
+            'cloudwatch': self.cloudwatch,
+            'sqs': self.sqs,
+            'dynamodb': self.dynamodb.meta.client,
+        }[service_name]
+
+    def resource(self, service_name, **kwargs):
+        return {'dynamodb': self.dynamodb, 'sqs': FakeSQSResource(self)}[service_name]
+
+    def install(self, runtime):
+        # routes every client the handlers create through the stand-ins and drops anything cached from before
+        runtime.client = self.client
+        runtime.resource = self.resource
+        runtime.invalidate()
@@ -0,0 +1,251 @@
+# in-process stand-in for the MatchMaker REST API (Matchmaker/matchmaker.js): GET /signallingserver and the bulk
+# /signallingservers/reserve, /release and /stats endpoints, served over real HTTP so the poller's pooled client is
+# exercised as in production. Signalling servers connect and disconnect through the methods the load test driver calls
+# where cirrus.js would send connect/streamerConnected/clientConnected/clientDisconnected messages. Reservation
+# leases expire on the driver's virtual clock, query strings are read from the fake instanceMapping table
+import json
+import secrets
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds a handed-out server waits for its user, LeaseSeconds in the MatchMaker config
+LEASE_SECONDS = 60
+LEASE_COUNTERS = ('granted', 'confirmed', 'released', 'expired', 'late', 'mismatched', 'abandonedServerSeconds')
+
+
+def with_lease(query_string, lease_id):
+    # as withLease() in matchmaker.js, the browser passes the lease on to Cirrus in the signalling server URL. The
+    # stored query string has no leading "?" (session=02), so the lease is joined with "&"
+    separator = '&' if query_string and query_string[-1] not in '?&' else ''
+    return f"{query_string}{separator}lease={lease_id}"
+
+
+def split_lease(url):
+    # (signalling server URL or query string without the lease parameter, lease ID or None)
+    base, mark, query = url.rpartition('?')
+    params = urllib.parse.parse_qsl(query, keep_blank_values=True)
+    lease = next((value for key, value in params if key == 'lease'), None)
+    if lease is None:
+        return url, None
+    query = urllib.parse.urlencode([(key, value) for key, value in params if key != 'lease'])
+    return f"{base}{mark}{query}" if query else base, lease
+
+
+class FakeMatchmaker:
+    def __init__(self, aws, secret, table_name='instanceMapping', lease_seconds=LEASE_SECONDS):
+        self.aws = aws
+        self.secret = secret
+        self.table_name = table_name
+        self.lease_seconds = lease_seconds
+        self.servers = {}
+        self.query_strings = {}
+        self.leases = dict.fromkeys(LEASE_COUNTERS, 0)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self._httpd = None
+
+    # --- cirrus.js side ----------------------------------------------------------------------------------------------
+
+    def server_ready(self, instance_id):
+        with self.lock:
+            self.servers.setdefault(instance_id, {'instanceID': instance_id, 'clients': 0, 'leaseID': None,
+                                                  'leaseExpiresAt': 0.0})
+            self.servers[instance_id]['ready'] = True
+
+    def server_gone(self, instance_id):
+        # an instance restarted from the warm pool comes back in another slot, its query string is read again
+        with self.lock:
+            self.servers.pop(instance_id, None)
+            self.query_strings.pop(instance_id, None)
+
+    def client_connected(self, instance_id, lease_id=None):
+        # confirms the lease like poolState.clientConnected(), returns False when the server is gone
+        with self.lock:
+            server = self.servers.get(instance_id)
+            if not server:
+                return False
+            now = self.aws.clock.now
+            if server['leaseID']:
+                expired = server['leaseExpiresAt'] < now
+                if expired:
+                    self._count_expired()
+                if lease_id and lease_id != server['leaseID']:
+                    self.leases['mismatched'] += 1
+                else:
+                    self.leases['late' if expired else 'confirmed'] += 1
+            elif lease_id:
+                self.leases['late'] += 1
+            server['leaseID'] = None
+            server['clients'] += 1
+            return True
+
+    def client_disconnected(self, instance_id):
+        with self.lock:
+            server = self.servers.get(instance_id)
+            if server and server['clients'] > 0:
+                server['clients'] -= 1
+
+    # --- pool logic, mirrors modules/poolState.js --------------------------------------------------------------------
+
+    def _count_expired(self):
+        self.leases['expired'] += 1
+        self.leases['abandonedServerSeconds'] += self.lease_seconds
+
+    def _available(self, count):
+        now = self.aws.clock.now
+        handed_out = []
+        for server in self.servers.values():
+            if len(handed_out) == count:
+                break
+            if server['clients'] or not server['ready']:
+                continue
+            if server['leaseID']:
+                if server['leaseExpiresAt'] >= now:
+                    continue
+                # the previous lease ran out without its user
+                self._count_expired()
+            server['leaseID'] = secrets.token_hex(8)
+            server['leaseExpiresAt'] = now + self.lease_seconds
+            self.leases['granted'] += 1
+            handed_out.append(dict(server))
+        return handed_out
+
+    def _release(self, instance_ids, lease_ids=None):
+        now = self.aws.clock.now
+        released = 0
+        for i, instance_id in enumerate(instance_ids):
+            server = self.servers.get(instance_id)
+            lease_id = lease_ids[i] if lease_ids and i < len(lease_ids) else None
+            if server and not server['clients'] and server['leaseID'] and server['leaseExpiresAt'] >= now \
+                    and (not lease_id or lease_id == server['leaseID']):
+                server['leaseID'] = None
+                released += 1
+        self.leases['released'] += released
+        return released
+
+    def _query_strings(self, instance_ids):
+        # served from the instanceID -> QueryString cache, the mapping table is scanned only on a miss like
+        # getQueryStrings() (the periodic background reload is not counted)
+        if any(instance_id not in self.query_strings for instance_id in instance_ids):
+            self.aws.count('matchmaker', 'dynamodb.Scan')
+            table = self.aws.dynamodb.Table(self.table_name)
+            with self.aws.lock:
+                self.query_strings = {item['InstanceID']: item['QueryString'] for item in table.items.values()
+                                      if item.get('InstanceID')}
+        return {instance_id: self.query_strings[instance_id] for instance_id in instance_ids
+                if instance_id in self.query_strings}
+
+    def lease_stats(self):
+        now = self.aws.clock.now
+        with self.lock:
+            stats = dict(self.leases)
+            stats['active'] = 0
+            for server in self.servers.values():
+                if server['leaseID'] and server['leaseExpiresAt'] >= now:
+                    stats['active'] += 1
+                elif server['leaseID']:
+                    stats['expired'] += 1
+                    stats['abandonedServerSeconds'] += self.lease_seconds
+        return stats
+
+    def stats(self):
+        now = self.aws.clock.now
+        stats = {'total': 0, 'ready': 0, 'busy': 0, 'reserved': 0, 'idle': 0}
+        with self.lock:
+            for server in self.servers.values():
+                stats['total'] += 1
+                if server['ready']:
+                    stats['ready'] += 1
+                if server['clients']:
+                    stats['busy'] += 1
+                elif server['ready']:
+                    leased = server['leaseID'] and server['leaseExpiresAt'] >= now
+                    stats['reserved' if leased else 'idle'] += 1
+        stats['leases'] = self.lease_stats()
+        return stats
+
+    def handle(self, method, path, headers, body):
+        """Returns (status, payload) for one request, payload is a dict or a plain text message."""
+        parts = urllib.parse.urlsplit(path)
+        self.requests += 1
+        self.aws.count('matchmaker', f"{method} {parts.path}")
+        if headers.get('clientsecret') != self.secret:
+            return 401, 'Unauthorized'
+        if method == 'GET' and parts.path == '/signallingserver':
+            with self.lock:
+                servers = self._available(1)
+            if not servers:
+                return 400, 'No signalling servers available'
+            server = servers[0]
+            query_string = self._query_strings([server['instanceID']]).get(server['instanceID'])
+            if query_string is None:
+                with self.lock:
+                    self._release([server['instanceID']], [server['leaseID']])
+                return 400, 'No signalling servers available'
+            return 200, {'signallingServer': with_lease(query_string, server['leaseID']),
+                         'instanceID': server['instanceID'], 'leaseID': server['leaseID'],
+                         'leaseExpiresAt': server['leaseExpiresAt']}
+        if method == 'POST' and parts.path == '/signallingservers/reserve':
+            count = max(1, min(int(urllib.parse.parse_qs(parts.query).get('count', ['1'])[0]), 100))
+            with self.lock:
+                servers = self._available(count)
+            query_strings = self._query_strings([s['instanceID'] for s in servers])
+            reserved = []
+            with self.lock:
+                for server in servers:
+                    if server['instanceID'] in query_strings:
+                        reserved.append({'instanceID': server['instanceID'],
+                                         'signallingServer': with_lease(query_strings[server['instanceID']],
+                                                                       server['leaseID']),
+                                         'leaseID': server['leaseID'],
+                                         'leaseExpiresAt': server['leaseExpiresAt']})
+                    else:
+                        self._release([server['instanceID']], [server['leaseID']])
+            return 200, {'signallingServers': reserved}
+        if method == 'POST' and parts.path == '/signallingservers/release':
+            request = json.loads(body or '{}')
+            with self.lock:
+                return 200, {'released': self._release(request.get('instanceIDs', []), request.get('leaseIDs'))}
+        if method == 'GET' and parts.path == '/signallingservers/stats':
+            return 200, self.stats()
+        return 404, 'Not Found'
+
+    # --- HTTP server -------------------------------------------------------------------------------------------------
+
+    def start(self, host='127.0.0.1', port=0):
+        matchmaker = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body leave in one segment, otherwise Nagle and delayed ACKs add 40 ms to every request
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def _serve(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, payload = matchmaker.handle(self.command, self.path, {k.lower(): v for k, v in self.headers.items()},
+                                                    body.decode('utf-8'))
+                data = json.dumps(payload).encode('utf-8') if isinstance(payload, dict) else payload.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json' if isinstance(payload, dict) else 'text/plain')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _serve
+            do_POST = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._httpd.server_address[1]}/signallingserver"
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
@@ -0,0 +1,548 @@
+# this tool replays session arrival traces against the real handlers (requestSession, poller, createInstances,
+# registerInstances, sendSessionDetails, terminateInstance) running in process on top of fakeAws and fakeMatchmaker.
+# Time is virtual: instance boot, sessions and the 20 minute self-stop play out in simulated seconds, so an hour of
+# traffic runs in seconds and a change to the allocation path can be compared before and after without an AWS account.
+# The report gives session throughput, time-to-session percentiles, how many requests were lost and the AWS API calls
+# per delivered session. Examples:
+#   python loadtest.py poisson --rate 30 --duration 900
+#   python loadtest.py burst --count 40 --spread 5 --warm 10
+#   python loadtest.py replay arrivals.jsonl --mode scheduled --json
+#   python loadtest.py poisson --rate 40 --mode scheduled --priority-lanes clinician:clinician.fifo:6,free:sessions.fifo:1
+#       --lane-mix clinician=0.2
+# A JSONL trace holds one arrival per line, e.g. {"at": 12.5} or {"at": 12.5, "sessionSeconds": 300, "priority":
+# "clinician"}, where at is in seconds from the start of the run. With priority lanes the report breaks the time to
+# session down per lane. With --disconnect a share of the users closes the page when no server arrived within
+# --patience seconds, the $disconnect route runs disconnectClient and the report counts the requests the poller
+# cancelled and the reservations and launches that saved; --no-tombstones closes the connections without it. --max-p95 and --max-calls-per-session make the run exit with 1 when exceeded
+import argparse
+import contextlib
+import heapq
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import arrivalTraces
+import fakeAws
+import fakeMatchmaker
+import runtime
+import sessionLanes
+import tracing
+
+CLIENT_SECRET = 'loadtest-secret'
+EPOCH_MS = 1767225600000
+
+ENVIRONMENT = {
+    'SQSName': 'sessions.fifo',
+    'clientSecret': CLIENT_SECRET,
+    'ApiGatewayUrl': 'https://websocket.local/production',
+    'DynamoDBName': 'instanceMapping',
+    'CreateInstancesArn': 'arn:aws:lambda:local:000000000000:function:HealthCoach-createInstances',
+    'SubnetIdPublicA': 'subnet-a',
+    'SubnetIdPublicB': 'subnet-b',
+    'LaunchTemplateName': 'HealthCoach-Production-UESignaling-LT',
+    'ALBName': 'signalling',
+}
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# driver
+# ---------------------------------------------------------------------------------------------------------------------
+
+class LoadTest:
+    def __init__(self, arrivals, mode='sqs', slots=10, concurrency_limit=10, warm=0, boot_seconds=480.0,
+                 ready_seconds=30.0, connect_seconds=5.0, session_seconds=600.0, lifetime_seconds=1200.0,
+                 poll_interval=1.0, schedule_seconds=60.0, batch_size=10, max_batches=5, settle_seconds=None,
+                 abandon=0.0, lease_seconds=fakeMatchmaker.LEASE_SECONDS, seed=1, warm_pool=0, restart_seconds=120.0,
+                 unavailable_subnets=(), priority_lanes=None, lane_mix=None, disconnect=0.0, patience_seconds=120.0,
+                 tombstones=True, verbose=False):
+        self.arrivals = arrivals
+        self.mode = mode
+        self.slots = slots
+        self.concurrency_limit = concurrency_limit
+        self.warm = warm
+        self.boot_seconds = boot_seconds
+        # WarmPoolSize of createInstances/terminateInstance, and the boot time of a parked instance that is started
+        self.warm_pool = warm_pool
+        self.restart_seconds = restart_seconds
+        # subnets where every launch fails with InsufficientInstanceCapacity
+        self.unavailable_subnets = set(unavailable_subnets)
+        # PriorityLanes of requestSession and the poller, and {lane: share of the arrivals} for arrivals without one
+        self.priority_lanes = priority_lanes
+        self.lane_mix = lane_mix or {}
+        # share of the users who close the page when no server arrived within patience_seconds, and whether the
+        # $disconnect route records it
+        self.disconnect = disconnect
+        self.patience_seconds = patience_seconds
+        self.tombstones = tombstones
+        self.ready_seconds = ready_seconds
+        self.connect_seconds = connect_seconds
+        self.session_seconds = session_seconds
+        self.lifetime_seconds = lifetime_seconds
+        # the SQS event source mapping polls continuously, the scheduled poller runs once per schedule_seconds
+        self.poll_interval = poll_interval if mode == 'sqs' else schedule_seconds
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.settle_seconds = boot_seconds + ready_seconds + 300 if settle_seconds is None else settle_seconds
+        # share of the users who are handed a server and never connect to it, their leases expire
+        self.abandon = abandon
+        self.rng = random.Random(seed)
+        self.lane_rng = random.Random(seed)
+        self.disconnect_rng = random.Random(seed)
+        self.verbose = verbose
+
+        self.aws = fakeAws.FakeAws()
+        self.matchmaker = fakeMatchmaker.FakeMatchmaker(self.aws, CLIENT_SECRET, lease_seconds=lease_seconds)
+        self.events = []
+        self._seq = itertools.count()
+        self.requests = {}
+        self.delivered = {}
+        self.outcomes = Counter()
+        self.handler_seconds = Counter()
+        self.handler_calls = Counter()
+        self.trace_lines = []
+        self.launched = 0
+        self.warm_starts = 0
+        self.peak_instances = 0
+        self.running = set()
+
+    # --- setup -------------------------------------------------------------------------------------------------------
+
+    def _setup(self):
+        os.environ.update(ENVIRONMENT)
+        if self.priority_lanes:
+            os.environ['PriorityLanes'] = self.priority_lanes
+        else:
+            os.environ.pop('PriorityLanes', None)
+        self.lanes = sessionLanes.lanes()
+        sessionLanes.clock = lambda: self.aws.clock.now
+        os.environ['MatchMakerURL'] = self.matchmaker.start()
+        self.aws.install(runtime)
+        # handlers are imported after the environment is in place, some read it at import time
+        import createInstances
+        import disconnectClient
+        import poller
+        import registerInstances
+        import requestSession
+        import sendSessionDetails
+        import terminateInstance
+        import warmPool
+        warmPool.POOL_SIZE = self.warm_pool
+        self.handlers = {
+            'requestSession': requestSession.lambda_handler,
+            'poller': poller.lambda_handler,
+            'createInstances': createInstances.lambda_handler,
+            'disconnectClient': disconnectClient.lambda_handler,
+            'registerInstances': registerInstances.lambda_handler,
+            'sendSessionDetails': sendSessionDetails.lambda_handler,
+            'terminateInstance': terminateInstance.lambda_handler,
+        }
+        self.aws.lambda_.functions['HealthCoach-createInstances'] = lambda event, context: self._call('createInstances', event)
+        self.aws.listeners.append(self._on_aws_event)
+        if self.unavailable_subnets:
+            self.aws.ec2.launch_error = lambda params: 'InsufficientInstanceCapacity' \
+                if params.get('SubnetId') in self.unavailable_subnets else None
+
+        self.aws.ssm.parameters.update({
+            'HealthCoach-ClientSecret': CLIENT_SECRET,
+            'HealthCoach-ConcurrencyLimit': str(self.concurrency_limit),
+            'concurrencyLimit': str(self.concurrency_limit),
+            'HealthCoach-MatchmakerIP': '127.0.0.1',
+        })
+        table = self.aws.dynamodb.Table('instanceMapping')
+        for i in range(1, self.slots + 1):
+            # the slots uploadToDDB writes for the listener rules, QueryString without the leading "?"
+            table.items[f"TG{i:02d}"] = {
+                'TargetGroup': f"TG{i:02d}",
+                'ARN': f"arn:aws:elasticloadbalancing:local:000000000000:targetgroup/SignallingTargetGroup{i:02d}",
+                'QueryString': f"session={i:02d}",
+                'InstanceID': '',
+                'FreeSlot': 'free',
+            }
+
+        for arrival in self.arrivals:
+            if 'priority' not in arrival and self.lane_mix:
+                arrival = dict(arrival, priority=self._pick_lane())
+            self._schedule(arrival['at'], 'arrival', arrival)
+        if self.warm:
+            self._call('createInstances', {'count': self.warm})
+            # warm instances are up before the first user arrives
+            self.events = [(0.0, seq, kind, (data[0], 0.0)) if kind == 'boot' else (at, seq, kind, data)
+                           for at, seq, kind, data in self.events]
+            heapq.heapify(self.events)
+            self.aws.calls.clear()
+            self.launched = 0
+
+    def _pick_lane(self):
+        # arrivals that fall outside the mix carry no priority and end up in the last lane
+        draw = self.lane_rng.random()
+        for lane, share in self.lane_mix.items():
+            if draw < share:
+                return lane
+            draw -= share
+        return None
+
+    def _schedule(self, at, kind, data):
+        heapq.heappush(self.events, (at, next(self._seq), kind, data))
+
+    def _call(self, name, event):
+        # runs one handler invocation with its log output captured, EMF records are kept for the stage report
+        buffer = io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if self.verbose else buffer):
+            result = self.handlers[name](event, None)
+        self.handler_seconds[name] += time.perf_counter() - started
+        self.handler_calls[name] += 1
+        if isinstance(result, dict) and 'statusCode' in result:
+            self.outcomes[f"{name}.{result['statusCode']}"] += 1
+        self.trace_lines.extend(buffer.getvalue().splitlines())
+        return result
+
+    # --- reactions to calls the handlers make ------------------------------------------------------------------------
+
+    def _on_aws_event(self, event, data):
+        now = self.aws.clock.now
+        if event in ('launched', 'started'):
+            if event == 'launched':
+                self.launched += len(data)
+            else:
+                self.warm_starts += len(data)
+            self.running.update(data)
+            self.peak_instances = max(self.peak_instances, len(self.running))
+            boot_seconds = self.boot_seconds if event == 'launched' else self.restart_seconds
+            for instance_id in data:
+                self._schedule(now + boot_seconds, 'boot', (instance_id, self.ready_seconds))
+        elif event in ('stopped', 'terminated'):
+            for instance_id in data:
+                self.matchmaker.server_gone(instance_id)
+                self.running.discard(instance_id)
+            if event == 'stopped':
+                # the EventBridge rule on the stopped state triggers terminateInstance
+                for instance_id in data:
+                    self._schedule(now, 'stoppedEvent', instance_id)
+        elif event == 'posted':
+            connection_id, message = data
+            if 'signallingServer' in message and connection_id not in self.delivered:
+                self.delivered[connection_id] = now
+                self._schedule(now + self.connect_seconds, 'connect', (connection_id, message['signallingServer']))
+
+    def _instance_for(self, query_string):
+        table = self.aws.dynamodb.Table('instanceMapping')
+        for item in table.items.values():
+            if item.get('QueryString') == query_string and item.get('InstanceID'):
+                return item['InstanceID']
+        return None
+
+    # --- simulated world ---------------------------------------------------------------------------------------------
+
+    def _arrival(self, arrival):
+        # the arrival's own time, not the tick it is processed in, is the request time API Gateway would report
+        now = arrival['at']
+        index = len(self.requests)
+        connection_id = arrival.get('connectionId', f"conn-{index:06d}")
+        request_id = arrival.get('requestId', f"req-{index:06d}")
+        self.requests[connection_id] = dict(arrival, at=now)
+        body = {'action': 'requestSession', 'bearer': CLIENT_SECRET}
+        event = {
+            'requestContext': {
+                'requestId': request_id,
+                'connectionId': connection_id,
+                'requestTimeEpoch': EPOCH_MS + int(now * 1000),
+            },
+            'body': json.dumps(body)
+        }
+        if arrival.get('priority'):
+            # the lane comes from the signed session token, as authorizeClient passes its claims on
+            event['requestContext']['authorizer'] = {sessionLanes.PRIORITY_FIELD: arrival['priority']}
+        self._call('requestSession', event)
+        if self.disconnect and self.disconnect_rng.random() < self.disconnect:
+            self._schedule(now + self.patience_seconds, 'disconnect', connection_id)
+
+    def _disconnect(self, connection_id):
+        # the user gives up waiting and closes the page, API Gateway runs the $disconnect route
+        if connection_id in self.delivered:
+            return
+        self.aws.apigateway.closed.add(connection_id)
+        self.outcomes['cancelled'] += 1
+        if self.tombstones:
+            self._call('disconnectClient', {'requestContext': {
+                'connectionId': connection_id, 'eventType': 'DISCONNECT', 'disconnectStatusCode': 1001,
+                'disconnectReason': 'Going away'}})
+
+    def _boot(self, instance_id, ready_seconds):
+        if instance_id not in self.running:
+            return
+        self.aws.ec2.set_state([instance_id], 'running')
+        # the EventBridge rule on the running state triggers registerInstances
+        self._call('registerInstances', {'detail': {'instance-id': instance_id, 'state': 'running'}})
+        self._schedule(self.aws.clock.now + ready_seconds, 'ready', instance_id)
+        self._schedule(self.aws.clock.now + self.lifetime_seconds, 'selfStop', instance_id)
+
+    def _connect(self, connection_id, signalling_server):
+        if self.abandon and self.rng.random() < self.abandon:
+            self.outcomes['abandoned'] += 1
+            return
+        query_string, lease_id = fakeMatchmaker.split_lease(signalling_server)
+        instance_id = self._instance_for(query_string)
+        if instance_id and self.matchmaker.client_connected(instance_id, lease_id):
+            session_seconds = self.requests[connection_id].get('sessionSeconds', self.session_seconds)
+            self._schedule(self.aws.clock.now + session_seconds, 'sessionEnd', instance_id)
+        else:
+            self.outcomes['connectFailed'] += 1
+
+    def _poll(self):
+        if self.mode == 'scheduled':
+            self._call('poller', {'source': 'aws.events'})
+        else:
+            # the event source mapping of each lane hands batches to concurrent poller invocations
+            for lane in self.lanes:
+                queue = self.aws.queue(lane.queue_name)
+                for _ in range(self.max_batches):
+                    messages = queue.receive(self.batch_size)
+                    if not messages:
+                        break
+                    self.aws.count('sqs', 'ReceiveMessage')
+                    records = [{'messageId': m.message_id, 'body': m.body} for m in messages]
+                    response = self._call('poller', {'Records': records})
+                    failed = {f['itemIdentifier'] for f in response.get('batchItemFailures', [])}
+                    done = [m for m in messages if m.message_id not in failed]
+                    if done:
+                        self.aws.count('sqs', 'DeleteMessageBatch')
+                        for message in done:
+                            queue.remove(message.message_id)
+        self.aws.lambda_.run_pending()
+
+    def run(self):
+        self._setup()
+        horizon = (self.arrivals[-1]['at'] if self.arrivals else 0.0) + self.settle_seconds
+        next_poll = 0.0
+        wall_started = time.perf_counter()
+        try:
+            while self.aws.clock.now <= horizon:
+                while self.events and self.events[0][0] <= self.aws.clock.now:
+                    _, _, kind, data = heapq.heappop(self.events)
+                    if kind == 'arrival':
+                        self._arrival(data)
+                    elif kind == 'boot':
+                        self._boot(*data)
+                    elif kind == 'ready':
+                        if data in self.running:
+                            self.matchmaker.server_ready(data)
+                    elif kind == 'disconnect':
+                        self._disconnect(data)
+                    elif kind == 'connect':
+                        self._connect(*data)
+                    elif kind == 'sessionEnd':
+                        self.matchmaker.client_disconnected(data)
+                    elif kind == 'selfStop':
+                        if data in self.running:
+                            self.aws.ec2.set_state([data], 'stopped')
+                            self.aws.notify('stopped', [data])
+                    elif kind == 'stoppedEvent':
+                        self._call('terminateInstance', {'detail': {'instance-id': data, 'state': 'stopped'}})
+                if self.aws.clock.now >= next_poll:
+                    self._poll()
+                    next_poll = self.aws.clock.now + self.poll_interval
+                if len(self.delivered) + self.outcomes['cancelled'] == len(self.arrivals) and self.aws.clock.now >= horizon - self.settle_seconds:
+                    break
+                self.aws.clock.advance(1.0)
+        finally:
+            self.matchmaker.stop()
+        return self.report(time.perf_counter() - wall_started)
+
+    # --- report ------------------------------------------------------------------------------------------------------
+
+    def counts(self, group):
+        # totals of the emit_counts records of a group, e.g. the poller's cancellations
+        totals = Counter()
+        for record in (json.loads(line[line.find('{'):]) for line in self.trace_lines if f'"Group": "{group}"' in line):
+            for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']:
+                totals[metric['Name']] += record[metric['Name']]
+        return dict(totals)
+
+    def report(self, wall_seconds):
+        waits = sorted(self.delivered[c] - r['at'] for c, r in self.requests.items() if c in self.delivered)
+        delivered = len(waits)
+        calls = dict(sorted(self.aws.calls.items()))
+        aws_calls = sum(n for op, n in calls.items() if not op.startswith('matchmaker.'))
+        virtual_seconds = max(self.aws.clock.now, 1.0)
+        stages = tracing.aggregate(self.trace_lines)
+        lanes = {}
+        if len(self.lanes) > 1:
+            for lane in self.lanes:
+                requests = {c: r for c, r in self.requests.items()
+                            if sessionLanes.lane_for(None, {sessionLanes.PRIORITY_FIELD: r.get('priority')},
+                                                    configured=self.lanes) is lane}
+                lane_waits = sorted(self.delivered[c] - r['at'] for c, r in requests.items() if c in self.delivered)
+                lanes[lane.name] = {
+                    'arrivals': len(requests),
+                    'delivered': len(lane_waits),
+                    'p50': tracing.percentile(lane_waits, 50),
+                    'p95': tracing.percentile(lane_waits, 95),
+                    'p99': tracing.percentile(lane_waits, 99),
+                    'max': lane_waits[-1] if lane_waits else 0.0,
+                }
+        return {
+            'mode': self.mode,
+            'arrivals': len(self.arrivals),
+            'accepted': self.outcomes.get('requestSession.200', 0),
+            'delivered': delivered,
+            'undelivered': len(self.arrivals) - delivered,
+            'duplicatesDropped': sum(self.aws.queue(lane.queue_name).duplicates_dropped for lane in self.lanes),
+            'connectFailed': self.outcomes.get('connectFailed', 0),
+            'abandoned': self.outcomes.get('abandoned', 0),
+            'closedWhileQueued': self.outcomes.get('cancelled', 0),
+            'cancellations': self.counts('cancellations'),
+            'virtualSeconds': round(virtual_seconds, 1),
+            'wallSeconds': round(wall_seconds, 3),
+            'sessionsPerMinute': round(delivered * 60.0 / virtual_seconds, 2),
+            'timeToSession': {
+                'p50': tracing.percentile(waits, 50),
+                'p95': tracing.percentile(waits, 95),
+                'p99': tracing.percentile(waits, 99),
+                'max': max(waits) if waits else 0.0,
+            },
+            'lanes': lanes,
+            'instancesLaunched': self.launched,
+            'slots': len(self.aws.dynamodb.Table('instanceMapping').items),
+            'slotsCreated': self.aws.calls.get('elbv2.CreateRule', 0),
+            'slotsRetired': self.aws.calls.get('elbv2.DeleteRule', 0),
+            'warmStarts': self.warm_starts,
+            'peakInstances': self.peak_instances,
+            'awsCalls': aws_calls,
+            'awsCallsPerSession': round(aws_calls / delivered, 2) if delivered else None,
+            'calls': calls,
+            'handlerCalls': dict(self.handler_calls),
+            'handlerStatus': {k: v for k, v in sorted(self.outcomes.items()) if '.' in k},
+            'handlerMillis': {name: round(seconds * 1000, 1) for name, seconds in self.handler_seconds.items()},
+            # wall-clock durations of the in-process stages, from the handlers' own EMF records
+            'stages': {stage: stages[stage] for stage in ('ingest', 'matchmaker', 'push', 'launch') if stage in stages},
+            'leases': self.matchmaker.lease_stats(),
+        }
+
+
+def format_report(report):
+    t = report['timeToSession']
+    lines = [
+        f"mode {report['mode']}: {report['arrivals']} arrivals, {report['accepted']} accepted, "
+        f"{report['delivered']} delivered, {report['undelivered']} undelivered "
+        f"({report['duplicatesDropped']} dropped as FIFO duplicates, {report['connectFailed']} failed to connect, "
+        f"{report['closedWhileQueued']} closed while queued)",
+        f"simulated {report['virtualSeconds']} s in {report['wallSeconds']} s, {report['sessionsPerMinute']} sessions/min",
+        f"time to session (s): p50 {t['p50']:.1f}  p95 {t['p95']:.1f}  p99 {t['p99']:.1f}  max {t['max']:.1f}",
+        f"instances launched {report['instancesLaunched']}, started from the warm pool {report['warmStarts']}, "
+        f"peak {report['peakInstances']}",
+        f"target group slots {report['slots']} at the end, {report['slotsCreated']} created, "
+        f"{report['slotsRetired']} retired",
+        f"AWS calls {report['awsCalls']}, per delivered session {report['awsCallsPerSession']}",
+        "leases: " + ", ".join(f"{name} {value:g}" for name, value in report['leases'].items()),
+    ]
+    if report['cancellations']:
+        c = report['cancellations']
+        lines.append(f"dropped requests of closed connections: {c.get('Cancelled', 0)} by tombstone, "
+                     f"{c.get('ClosedOnPush', 0)} on the keep-alive push, saved {c.get('PushesSaved', 0)} pushes, "
+                     f"{c.get('ReservationsSaved', 0)} reservations and {c.get('LaunchesSaved', 0)} launches")
+    for name, lane in report['lanes'].items():
+        lines.append(f"lane {name}: {lane['arrivals']} arrivals, {lane['delivered']} delivered, time to session (s): "
+                     f"p50 {lane['p50']:.1f}  p95 {lane['p95']:.1f}  p99 {lane['p99']:.1f}  max {lane['max']:.1f}")
+    lines += [
+        "",
+        f"{'call':<44}{'count':>8}",
+    ]
+    lines += [f"{op:<44}{count:>8}" for op, count in report['calls'].items()]
+    if report['stages']:
+        lines += ["", tracing.format_report(report['stages'])]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    # the run options are accepted after the trace name, e.g. loadtest.py burst --count 40 --warm 10
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument('--seed', type=int, default=1)
+    options.add_argument('--mode', choices=['sqs', 'scheduled'], default='sqs')
+    options.add_argument('--slots', type=int, default=10,
+                         help="target group slots in instanceMapping at the start, more are provisioned on demand")
+    options.add_argument('--concurrency-limit', type=int, default=10)
+    options.add_argument('--warm', type=int, default=0, help="instances ready before the first arrival")
+    options.add_argument('--boot-seconds', type=float, default=480.0)
+    options.add_argument('--warm-pool', type=int, default=0, help="WarmPoolSize, stopped instances kept for restart")
+    options.add_argument('--unavailable-subnet', action='append', default=[],
+                         help="subnet where launches fail with InsufficientInstanceCapacity, e.g. subnet-a")
+    options.add_argument('--restart-seconds', type=float, default=120.0,
+                         help="boot time of an instance started from the warm pool")
+    options.add_argument('--ready-seconds', type=float, default=30.0, help="from registration to streamer connected")
+    options.add_argument('--session-seconds', type=float, default=600.0)
+    options.add_argument('--lifetime-seconds', type=float, default=1200.0, help="self-stop from the user data")
+    options.add_argument('--abandon', type=float, default=0.0,
+                         help="share of users who never connect to the server they were given")
+    options.add_argument('--lease-seconds', type=float, default=fakeMatchmaker.LEASE_SECONDS,
+                         help="LeaseSeconds of the MatchMaker")
+    options.add_argument('--priority-lanes', help="PriorityLanes, e.g. clinician:clinician.fifo:6,free:sessions.fifo:1")
+    options.add_argument('--lane-mix', default='',
+                         help="share of the arrivals per lane, e.g. clinician=0.2, the rest go to the last lane")
+    options.add_argument('--disconnect', type=float, default=0.0,
+                         help="share of users who close the page when no server arrived within --patience seconds")
+    options.add_argument('--patience', type=float, default=120.0)
+    options.add_argument('--no-tombstones', action='store_true',
+                         help="close the connections without running the $disconnect route, to compare")
+    options.add_argument('--json', action='store_true', help="print the report as JSON")
+    options.add_argument('--verbose', action='store_true', help="show handler logs")
+    options.add_argument('--max-p95', type=float, help="fail when the p95 time to session exceeds this many seconds")
+    options.add_argument('--max-calls-per-session', type=float, help="fail when AWS calls per session exceed this")
+
+    parser = argparse.ArgumentParser(description="Offline load test of the session allocation pipeline")
+    traces = parser.add_subparsers(dest='trace', required=True)
+    poisson = traces.add_parser('poisson', parents=[options], help="Poisson arrivals")
+    poisson.add_argument('--rate', type=float, default=20.0, help="arrivals per minute")
+    poisson.add_argument('--duration', type=float, default=600.0, help="seconds of arrivals")
+    burst = traces.add_parser('burst', parents=[options], help="a burst of simultaneous arrivals")
+    burst.add_argument('--count', type=int, default=50)
+    burst.add_argument('--at', type=float, default=0.0)
+    burst.add_argument('--spread', type=float, default=0.0, help="seconds the burst is spread over")
+    replay = traces.add_parser('replay', parents=[options], help="replay a JSONL arrival trace")
+    replay.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    if args.trace == 'poisson':
+        arrivals = arrivalTraces.poisson_trace(args.rate, args.duration, args.seed)
+    elif args.trace == 'burst':
+        arrivals = arrivalTraces.burst_trace(args.count, args.at, args.spread, args.seed)
+    else:
+        arrivals = arrivalTraces.replay_trace(args.path)
+
+    report = LoadTest(
+        arrivals, mode=args.mode, slots=args.slots, concurrency_limit=args.concurrency_limit, warm=args.warm,
+        boot_seconds=args.boot_seconds, warm_pool=args.warm_pool, restart_seconds=args.restart_seconds,
+        unavailable_subnets=args.unavailable_subnet, priority_lanes=args.priority_lanes,
+        lane_mix={lane: float(share) for lane, share in
+                  (entry.split('=') for entry in args.lane_mix.split(',') if entry.strip())},
+        ready_seconds=args.ready_seconds, session_seconds=args.session_seconds,
+        lifetime_seconds=args.lifetime_seconds, abandon=args.abandon, lease_seconds=args.lease_seconds,
+        disconnect=args.disconnect, patience_seconds=args.patience, tombstones=not args.no_tombstones,
+        seed=args.seed, verbose=args.verbose
+    ).run()
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+    failed = False
+    if args.max_p95 is not None and report['timeToSession']['p95'] > args.max_p95:
+        print(f"p95 time to session {report['timeToSession']['p95']:.1f} s exceeds {args.max_p95} s", file=sys.stderr)
+        failed = True
+    calls_per_session = report['awsCallsPerSession']
+    if args.max_calls_per_session is not None and (calls_per_session is None or calls_per_session > args.max_calls_per_session):
+        print(f"{calls_per_session} AWS calls per session exceeds {args.max_calls_per_session}", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# this module keeps a tombstone for every web socket connection a browser closed, so that a request still waiting in
+# a session queue can be cancelled. disconnectClient writes the tombstone when API Gateway runs the $disconnect route,
+# and the poller looks up a whole batch with one BatchGetItem before it sends keep-alives or reserves servers: the
+# request of a closed connection is dropped without a MatchMaker reservation, a push or a scale-out. Tombstones expire
+# through the table's TTL once no message for the connection can be left in a queue. A lookup that fails cancels
+# nothing, the poller then finds the closed connections with the keep-alive push as before
+import os
+import time
+import logging
+
+from botocore.exceptions import ClientError
+
+import runtime
+
+logger = logging.getLogger()
+
+TOMBSTONE_TABLE = os.environ.get("TombstoneTableName", "connectionTombstones")
+# the default message retention of the session queues, 4 days
+TTL_SECONDS = int(os.environ.get("TombstoneTtlSeconds", "345600"))
+# BatchGetItem reads at most 100 keys per call
+BATCH_GET_LIMIT = 100
+MAX_ATTEMPTS = 3
+
+
+def record(connection_id, reason=None):
+    """Writes the tombstone of a closed connection."""
+    item = {'ConnectionId': connection_id, 'ExpiresAt': int(time.time()) + TTL_SECONDS}
+    if reason:
+        item['Reason'] = reason
+    runtime.resource('dynamodb').Table(TOMBSTONE_TABLE).put_item(Item=item)
+
+
+def cancelled(connection_ids):
+    """Returns the set of connection_ids that have a tombstone, empty when the lookup fails."""
+    keys = sorted({connection_id for connection_id in connection_ids if connection_id})
+    if not keys:
+        return set()
+    dynamodb = runtime.resource('dynamodb')
+    found = set()
+    try:
+        for i in range(0, len(keys), BATCH_GET_LIMIT):
+            request = {TOMBSTONE_TABLE: {'Keys': [{'ConnectionId': key} for key in keys[i:i + BATCH_GET_LIMIT]],
+                                         'ProjectionExpression': 'ConnectionId'}}
+            for attempt in range(MAX_ATTEMPTS):
+                response = dynamodb.batch_get_item(RequestItems=request)
+                found.update(item['ConnectionId'] for item in response.get('Responses', {}).get(TOMBSTONE_TABLE, []))
+                request = response.get('UnprocessedKeys') or {}
+                if not request:
+                    break
+                # throttled keys are retried after a short backoff, the ones left over count as not cancelled
+                time.sleep(0.05 * 2 ** attempt)
+            if request:
+                logger.warning(f"{len(request[TOMBSTONE_TABLE]['Keys'])} tombstone lookups were not processed")
+    except ClientError as err:
+        logger.error(f"Could not look up connection tombstones: {err}")
+    return found
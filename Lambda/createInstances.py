@@ -1,9 +1,30 @@
 import json
-import boto3
 import os
-import random
 import base64
-from boto3.dynamodb.conditions import Attr
+import time
+
+import launchLock
+import placement
+import runtime
+import slotAllocator
+import slotProvisioner
+import tracing
+import warmPool
+
+def _launched(warm_ids, launched_ids):
+    # WarmStarts against ColdLaunches is the share of the demand the warm pool served
+    if warmPool.enabled():
+        tracing.emit_counts('warmPool', {'WarmStarts': len(warm_ids), 'ColdLaunches': len(launched_ids)})
+    instance_ids = warm_ids + launched_ids
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': '✅ New HealthCoach instances created successfully',
+            'InstanceId': instance_ids[0],
+            'InstanceIds': instance_ids,
+            'WarmStarts': len(warm_ids)
+        })
+    }
 
 def lambda_handler(event, context):
     print("=== 🚀 HealthCoach CreateInstances Lambda STARTED ===")
@@ -11,18 +32,17 @@ def lambda_handler(event, context):
 
     try:
         # === Step 1: Get configuration ===
-        ssm = boto3.client('ssm')
-        print("🔹 Fetching concurrency limit and matchmaker IP from SSM...")
+        print("🔹 Fetching concurrency limit and matchmaker IP from SSM (cached per container)...")
 
-        concurrency_limit = int(ssm.get_parameter(Name='HealthCoach-ConcurrencyLimit')['Parameter']['Value'])
-        matchmaker_ip = ssm.get_parameter(Name='HealthCoach-MatchmakerIP')['Parameter']['Value']
+        concurrency_limit = int(runtime.get_parameter('HealthCoach-ConcurrencyLimit'))
+        matchmaker_ip = runtime.get_parameter('HealthCoach-MatchmakerIP')
 
         print(f"✅ Concurrency Limit: {concurrency_limit}")
         print(f"✅ Matchmaker IP: {matchmaker_ip}")
 
         # === Step 2: Setup EC2 and DynamoDB ===
-        ec2 = boto3.client('ec2')
-        dynamodb = boto3.resource('dynamodb')
+        ec2 = runtime.client('ec2')
+        dynamodb = runtime.resource('dynamodb')
         table_name = os.environ.get('DynamoDBName', 'HealthCoach-Production-SessionMapping')
         table = dynamodb.Table(table_name)
         print(f"✅ Using DynamoDB table: {table_name}")
@@ -33,10 +53,23 @@ def lambda_handler(event, context):
         print(f"✅ Available subnets: {all_subnets}")
 
         # === Step 4: Build user data ===
+        # persist runs the script on every start, so that instances restarted from the warm pool sync and start too.
+        # The build is synced from the chunked manifest published by infra/buildManifest.py, which only downloads what
+        # changed; without a published manifest the whole deployment folder is synced as before
+        bucket = os.environ.get('S3BucketName', 'healthcoach-deployment')
+        build_prefix = os.environ.get('BuildPrefix', 'HealthCoach-Build')
         user_data_script = f"""<powershell>
 Write-Host "Starting HealthCoach signalling instance..."
 Write-Host "Matchmaker IP: {matchmaker_ip}"
-aws s3 sync s3://{os.environ.get('S3BucketName', 'healthcoach-deployment')}/HealthCoach-Deployment/ C:\\ --delete
+$buildStore = "s3://{bucket}/{build_prefix}"
+aws s3 cp "$buildStore/syncBuild.ps1" C:\\syncBuild.ps1 --only-show-errors
+if ($LASTEXITCODE -eq 0) {{
+    powershell -ExecutionPolicy Bypass -File C:\\syncBuild.ps1 -Store $buildStore -Destination C:\\
+}}
+if ($LASTEXITCODE -ne 0) {{
+    Write-Host "No incremental build sync, syncing the whole deployment..."
+    aws s3 sync s3://{bucket}/HealthCoach-Deployment/ C:\\ --delete
+}}
 if (Test-Path "C:\\start-healthcoach.bat") {{
     Write-Host "Starting HealthCoach service..."
     (Get-Content "C:\\start-healthcoach.bat") -replace '%MATCHMAKER_IP%', '{matchmaker_ip}' | Set-Content "C:\\start-healthcoach.bat"
@@ -45,103 +78,135 @@ if (Test-Path "C:\\start-healthcoach.bat") {{
     Write-Host "ERROR: start-healthcoach.bat not found!"
 }}
 Write-Host "Setup complete."
-</powershell>"""
+</powershell>
+<persist>true</persist>"""
 
         user_data_encoded = base64.b64encode(user_data_script.encode('utf-8')).decode('utf-8')
         print("✅ UserData encoded successfully")
 
         # === Step 5: Launch Template setup ===
+        # the template comes first, the fallback instance types and templates are tried when EC2 has no capacity
         launch_template_value = os.environ.get('LaunchTemplateName', 'HealthCoach-Production-UESignaling-LT')
-        launch_template_key = 'LaunchTemplateId' if launch_template_value.startswith('lt-') else 'LaunchTemplateName'
-        print(f"✅ LaunchTemplate key={launch_template_key}, value={launch_template_value}")
+        launch_options = placement.launch_options(launch_template_value)
+        print(f"✅ Launch options in order: {[label for label, _ in launch_options]}")
 
         # === Step 6: Scheduled startAllServers mode ===
         if "startAllServers" in event and event["startAllServers"]:
             print("🕒 Scheduled mode: launching multiple instances...")
-            response = ec2.run_instances(
-                LaunchTemplate={launch_template_key: launch_template_value, 'Version': '$Latest'},
-                MinCount=int(concurrency_limit),
-                MaxCount=int(concurrency_limit),
-                UserData=user_data_encoded,
-                SubnetId=random.choice(all_subnets)
-            )
-            print(f"✅ Created {concurrency_limit} instances.")
+            instance_ids = placement.launch(ec2, int(concurrency_limit), all_subnets,
+                                            {'UserData': user_data_encoded}, options=launch_options)
+            print(f"✅ Created {len(instance_ids)} instances.")
             return {'statusCode': 200, 'body': json.dumps('All instances created successfully')}
 
-        # === Step 7: Check EC2 active instances ===
-        print("🔍 Checking currently running or pending instances...")
-        running_instances = ec2.describe_instances(
-            Filters=[
+        # === Step 7: Serialize scale-out planners ===
+        # count is how many instances the caller wants. With subtractBooting the caller asks for free capacity,
+        # e.g. the poller's number of waiting users, and instances that are still booting already cover part of it
+        requested_count = int(event.get("count", 1))
+        subtract_booting = bool(event.get("subtractBooting", False))
+        lock = launchLock.LaunchLock()
+        if not lock.acquire():
+            print("⏳ Another scale-out is in progress, skipping this request.")
+            return {
+                'statusCode': 409,
+                'body': json.dumps("Scale-out already in progress")
+            }
+
+        try:
+            # === Step 8: Check EC2 active instances ===
+            print("🔍 Checking currently running or pending instances...")
+            current_instance_count = 0
+            booting_count = 0
+            # running or pending instances per subnet, placement prefers the emptier ones
+            spread = {}
+            paginator = ec2.get_paginator('describe_instances')
+            for page in paginator.paginate(Filters=[
                 {'Name': 'tag:Application', 'Values': ['HealthCoach']},
                 {'Name': 'instance-state-name', 'Values': ['running', 'pending']}
-            ]
-        )
-
-        current_instance_count = sum(len(r['Instances']) for r in running_instances['Reservations'])
-        print(f"✅ Active HealthCoach instances: {current_instance_count}/{concurrency_limit}")
-
-        if current_instance_count >= concurrency_limit:
-            print("⚠️ Instance pool at full capacity! Skipping creation.")
-            return {
-                'statusCode': 400,
-                'body': json.dumps("Instance pool at capacity! Could not create new instance")
+            ]):
+                for reservation in page['Reservations']:
+                    for instance in reservation['Instances']:
+                        current_instance_count += 1
+                        spread[instance.get('SubnetId')] = spread.get(instance.get('SubnetId'), 0) + 1
+                        if not any(tag['Key'] == slotAllocator.SLOT_TAG for tag in instance.get('Tags', [])):
+                            booting_count += 1
+            print(f"✅ Active HealthCoach instances: {current_instance_count}/{concurrency_limit}, booting: {booting_count}")
+
+            launch_count = requested_count - booting_count if subtract_booting else requested_count
+            launch_count = min(launch_count, concurrency_limit - current_instance_count)
+
+            if current_instance_count >= concurrency_limit:
+                print("⚠️ Instance pool at full capacity! Skipping creation.")
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps("Instance pool at capacity! Could not create new instance")
+                }
+
+            if launch_count <= 0:
+                print(f"✅ {booting_count} instances already booting cover the {requested_count} requested.")
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps({'message': 'Booting instances cover the request', 'InstanceIds': []})
+                }
+
+            # === Step 9: DynamoDB check ===
+            # the slot itself is claimed atomically by registerInstances once the instance is running. Booting,
+            # restarted and new instances claim one each; missing slots are provisioned before any instance is
+            # started, and no more instances are started than can be registered
+            needed_slots = booting_count + launch_count
+            print("🔍 Checking DynamoDB FreeSlotIndex for available slots...")
+            available_slots = slotAllocator.count_free_slots(table, limit=needed_slots)
+            print(f"✅ DynamoDB available slots (up to {needed_slots}): {available_slots}")
+            if available_slots < needed_slots:
+                provisioned = slotProvisioner.ensure(table, concurrency_limit, wanted_free=needed_slots)
+                print(f"🧩 Slot provisioning: {provisioned}")
+                if provisioned:
+                    available_slots = provisioned['free']
+                launch_count = min(launch_count, available_slots - booting_count)
+                if launch_count <= 0:
+                    print("⚠️ No target group slot for another instance, skipping the launch.")
+                    return {
+                        'statusCode': 400,
+                        'body': json.dumps("No free target group slots! Could not create new instance")
+                    }
+
+            # === Step 10: Restart parked instances from the warm pool ===
+            warm_ids = warmPool.take(ec2, launch_count)
+            launch_count -= len(warm_ids)
+            print(f"♻️ Started {len(warm_ids)} instances from the warm pool, {launch_count} left to launch")
+
+            instance_ids = []
+            if launch_count <= 0:
+                return _launched(warm_ids, instance_ids)
+
+            # === Step 11: Launch new EC2 instances, falling back to other subnets and launch options ===
+            print(f"🧭 Launching {launch_count} new instances, current spread: {spread}")
+
+            # placement adds the launch template, the subnet and MinCount 1, which lets EC2 start as many as it has
+            # capacity for; the rest is tried in the next subnet or with the next launch option
+            launch_params = {
+                'UserData': user_data_encoded,
+                'TagSpecifications': [{
+                    'ResourceType': 'instance',
+                    'Tags': [
+                        {'Key': 'Name', 'Value': 'HealthCoach-UESignaling-Auto'},
+                        {'Key': 'Type', 'Value': 'signalling'},
+                        {'Key': 'Application', 'Value': 'HealthCoach'},
+                        {'Key': 'CreatedBy', 'Value': 'Lambda-AutoScale'},
+                        {'Key': warmPool.CREATED_TAG, 'Value': str(int(time.time()))}
+                    ]
+                }]
             }
 
-        # === Step 8: DynamoDB check ===
-        print("🔍 Checking DynamoDB for available slots...")
-        response = table.scan(FilterExpression=Attr('InstanceID').eq(''))
-        available_slots = len(response['Items'])
-        print(f"✅ DynamoDB available slots: {available_slots}")
-
-        # === Step 9: Launch new EC2 instance ===
-        subnet_to_use = random.choice(all_subnets) if all_subnets else None
-        print(f"🧭 Launching new instance in subnet: {subnet_to_use}")
-
-        launch_params = {
-            'LaunchTemplate': {
-                launch_template_key: launch_template_value,
-                'Version': '$Latest'
-            },
-            'MinCount': 1,
-            'MaxCount': 1,
-            'UserData': user_data_encoded,
-            'TagSpecifications': [{
-                'ResourceType': 'instance',
-                'Tags': [
-                    {'Key': 'Name', 'Value': 'HealthCoach-UESignaling-Auto'},
-                    {'Key': 'Type', 'Value': 'signalling'},
-                    {'Key': 'Application', 'Value': 'HealthCoach'},
-                    {'Key': 'CreatedBy', 'Value': 'Lambda-AutoScale'}
-                ]
-            }]
-        }
+            print(f"🚀 Launching instances with params: {json.dumps(launch_params)}")
+            with tracing.stage_timer("launch", event.get("correlationIds", []), Count=launch_count):
+                instance_ids = placement.launch(ec2, launch_count, all_subnets, launch_params, spread=spread,
+                                                options=launch_options)
+            print(f"✅ EC2 Instances created: {instance_ids}")
+        finally:
+            lock.release()
 
-        if subnet_to_use:
-            launch_params['SubnetId'] = subnet_to_use
-
-        print(f"🚀 Launching instance with params: {json.dumps(launch_params)}")
-        ec2_response = ec2.run_instances(**launch_params)
-        instance_id = ec2_response['Instances'][0]['InstanceId']
-        print(f"✅ EC2 Instance created: {instance_id}")
-
-        # === Step 10: Update DynamoDB if slot exists ===
-        if available_slots > 0:
-            item_key = response['Items'][0].get('id') or response['Items'][0].get('TargetGroup')
-            print(f"📝 Updating DynamoDB slot with InstanceID={instance_id} for key={item_key}")
-            table.update_item(
-                Key={'TargetGroup': item_key},
-                UpdateExpression="SET InstanceID = :iid",
-                ExpressionAttributeValues={':iid': instance_id}
-            )
-
-        # === Step 11: Success response ===
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': '✅ New HealthCoach instance created successfully',
-                'InstanceId': instance_id
-            })
-        }
+        # === Step 12: Success response ===
+        return _launched(warm_ids, instance_ids)
 
     except Exception as e:
         print(f"❌ ERROR: {str(e)}", flush=True)
@@ -0,0 +1,37 @@
+# this function runs on the $disconnect route of the web socket API, when a browser closes its connection or API
+# Gateway drops it. It records a tombstone for the connection (see connectionTombstones.py) so that the poller drops a
+# session request that is still queued for it instead of reserving a signalling server or launching an instance.
+# A connection that already got its session leaves a tombstone as well, it is never looked up again and expires
+import json
+import logging
+
+import connectionTombstones
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def lambda_handler(event, context):
+    request_context = event.get("requestContext", {})
+    connection_id = request_context.get("connectionId")
+    if not connection_id:
+        return {
+            'statusCode': 400,
+            'body': json.dumps('No connection id in the disconnect event')
+        }
+
+    try:
+        connectionTombstones.record(connection_id, request_context.get("disconnectReason"))
+    except Exception as e:
+        # API Gateway ignores the response of $disconnect, the queued request is then dropped by the keep-alive push
+        logger.error(f"Could not record the tombstone of connection {connection_id}: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps('Could not record the disconnect')
+        }
+
+    logger.info(f"Connection {connection_id} closed, queued requests for it are cancelled")
+    return {
+        'statusCode': 200,
+        'body': json.dumps('Disconnected')
+    }
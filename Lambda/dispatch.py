@@ -0,0 +1,87 @@
+# this module is the single entry point of the consolidated Lambda package. Every function of the stack deploys the
+# same zip of this folder with the handler index.lambda_handler (index.py re-exports this module); the function name,
+# or the HandlerName environment variable, picks the handler module that serves it, and only that module is imported.
+# The clients a handler uses on every invocation are created while the container initialises, where Lambda runs at
+# full CPU and outside the billed first request, while rarely used ones (elbv2, apigatewaymanagementapi) are created on
+# first use by runtime.client. Import and init time are published as coldStart metrics per Handler, and
+# benchmarks/coldStart.py measures the same numbers locally
+import os
+import time
+import logging
+import importlib
+
+import runtime
+import tracing
+
+logger = logging.getLogger()
+
+# handler name -> module, the names are the stack's function names
+HANDLERS = {name: name for name in (
+    'authorizeClient', 'autoscaler', 'createInstances', 'disconnectClient', 'keepConnectionAlive', 'poller',
+    'registerInstances', 'requestSession', 'sendSessionDetails', 'terminateInstance', 'uploadToDDB')}
+
+# (kind, service[, environment variable with the endpoint URL]) of the clients each handler needs on every invocation
+HOT_CLIENTS = {
+    'authorizeClient': [] if os.environ.get('TokenSigningKey') else [('client', 'ssm')],
+    'autoscaler': [('client', 'ssm'), ('client', 'sqs'), ('client', 'ec2'), ('client', 'cloudwatch'),
+                   ('resource', 'dynamodb')],
+    'createInstances': [('client', 'ssm'), ('client', 'ec2'), ('resource', 'dynamodb')],
+    'disconnectClient': [('resource', 'dynamodb')],
+    'keepConnectionAlive': [('client', 'apigatewaymanagementapi', 'ApiGatewayUrl')],
+    'poller': [('resource', 'sqs'), ('client', 'sqs'), ('client', 'ssm'), ('resource', 'dynamodb')],
+    'registerInstances': [('client', 'ssm'), ('client', 'ec2'), ('resource', 'dynamodb')],
+    'requestSession': [('resource', 'sqs'), ('client', 'sqs')],
+    'sendSessionDetails': [('client', 'apigatewaymanagementapi', 'ApiGatewayUrl')],
+    'terminateInstance': [('client', 'ec2'), ('resource', 'dynamodb')],
+}
+
+_loaded = {}
+
+
+def handler_name(event=None):
+    # an internal invoke can name its handler, e.g. {"handler": "createInstances", ...}
+    if isinstance(event, dict) and event.get('handler') in HANDLERS:
+        return event['handler']
+    name = os.environ.get('HandlerName') or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', '')
+    if name not in HANDLERS:
+        # e.g. HealthCoach-createInstances
+        name = name.rsplit('-', 1)[-1]
+    if name not in HANDLERS:
+        raise ValueError(f"No handler for function {name!r}, set HandlerName to one of {sorted(HANDLERS)}")
+    return name
+
+
+def prewarm(name):
+    for kind, service, *endpoint in HOT_CLIENTS.get(name, ()):
+        if endpoint and not os.environ.get(endpoint[0]):
+            continue
+        # keyed like sessionPush.management_client(), so the handler finds the same cached client
+        kwargs = {'endpoint_url': os.environ[endpoint[0]]} if endpoint else {}
+        (runtime.resource if kind == 'resource' else runtime.client)(service, **kwargs)
+
+
+def load(name):
+    """Imports the handler module and creates its hot clients once per container, returns its lambda_handler."""
+    if name not in _loaded:
+        started = time.perf_counter()
+        module = importlib.import_module(HANDLERS[name])
+        imported = time.perf_counter()
+        prewarm(name)
+        _loaded[name] = module.lambda_handler
+        tracing.emit_counts('coldStart', {
+            'ImportMs': round((imported - started) * 1000, 3),
+            'InitMs': round((time.perf_counter() - imported) * 1000, 3)
+        }, units={'ImportMs': 'Milliseconds', 'InitMs': 'Milliseconds'}, dimensions=('Handler',), Handler=name)
+    return _loaded[name]
+
+
+def lambda_handler(event, context):
+    return load(handler_name(event))(event, context)
+
+
+# the handler of this function is loaded during the init phase, not on the first request
+if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+    try:
+        load(handler_name())
+    except ValueError as err:
+        logger.warning(str(err))
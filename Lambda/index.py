@@ -0,0 +1,3 @@
+# entry point of the consolidated Lambda package, the functions of the stack keep the handler index.lambda_handler
+# and dispatch picks the handler module from the function name
+from dispatch import lambda_handler  # noqa: F401
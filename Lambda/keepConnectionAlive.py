@@ -1,9 +1,11 @@
 # this function is used to keep the web socket connection between browser and API gateway alive, till a session is available
-import boto3
+# it is a thin wrapper around sessionPush, which the poller also uses directly
 import json
-import os
 import logging
 
+import sessionPush
+import tracing
+
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -13,13 +15,20 @@ def lambda_handler(event, context):
   
   
   print(event)
-  inputParams = {
-                "status"   : 'waiting for session!'
-            }
-  apigateway=boto3.client('apigatewaymanagementapi' ,endpoint_url=os.environ["ApiGatewayUrl"])
-  apigateway.post_to_connection(ConnectionId=event["connectionId"], Data=json.dumps(inputParams))
-           
-  logger.info("Sent server details to frontend ! ")
+  with tracing.stage_timer("push", tracing.correlation_id(event)):
+    status = sessionPush.push(event["connectionId"], sessionPush.WAITING_MESSAGE)
+  if status == sessionPush.GONE:
+    return {
+      'statusCode': 410,
+      'body': json.dumps('Client connection is gone')
+    }
+  if status != sessionPush.SENT:
+    return {
+      'statusCode': 500,
+      'body': json.dumps('Could not send keep alive message to frontend')
+    }
+
+  logger.info("Sent keep alive message to frontend ! ")
   return {
     'statusCode': 200,
     'body': json.dumps('Completed sending server details to backend')    
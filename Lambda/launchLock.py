@@ -0,0 +1,60 @@
+# this module provides a short-lived lock in DynamoDB so that concurrent scale-out planners (poller, autoscaler,
+# createInstances invocations) cannot check capacity and launch at the same time. The lock is a lease: it expires on
+# its own after a few seconds, so a crashed holder never blocks scaling for long
+import os
+import time
+import uuid
+import logging
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import runtime
+
+logger = logging.getLogger()
+
+LOCK_TABLE = os.environ.get("LockTableName", "launchLock")
+LEASE_SECONDS = int(os.environ.get("LaunchLockLeaseSeconds", "60"))
+
+
+class LaunchLock:
+    def __init__(self, name='scale-out', lease_seconds=LEASE_SECONDS):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.owner = str(uuid.uuid4())
+        self.table = runtime.resource('dynamodb').Table(LOCK_TABLE)
+        self.held = False
+
+    def acquire(self):
+        now = int(time.time())
+        try:
+            self.table.put_item(
+                Item={'LockName': self.name, 'Owner': self.owner, 'ExpiresAt': now + self.lease_seconds},
+                # ExpiresAt is also the table's TTL attribute, expired leases are removed eventually
+                ConditionExpression=Attr('LockName').not_exists() | Attr('ExpiresAt').lt(now)
+            )
+        except ClientError as err:
+            if err.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            logger.info(f"Lock {self.name} is held by another planner")
+            return False
+        self.held = True
+        return True
+
+    def release(self):
+        if not self.held:
+            return
+        try:
+            self.table.delete_item(Key={'LockName': self.name}, ConditionExpression=Attr('Owner').eq(self.owner))
+        except ClientError as err:
+            if err.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            logger.warning(f"Lock {self.name} expired before it was released")
+        self.held = False
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
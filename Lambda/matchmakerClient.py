@@ -0,0 +1,201 @@
+# this module is used by the poller to talk to the MatchMaker REST API. Requests for a batch of queued sessions are
+# sent in parallel, bounded by a concurrency limit, over a pool of persistent keep-alive connections that is kept per
+# container. Every request reports its own status and latency, so a timeout or error only affects that request.
+# When the MatchMaker supports it, a whole batch is matched in one round trip with the bulk reservation API
+# (POST /signallingservers/reserve and /signallingservers/release)
+import http.client
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+MATCHMAKER_CONCURRENCY = int(os.environ.get("MatchMakerConcurrency", "5"))
+MATCHMAKER_TIMEOUT_SECONDS = float(os.environ.get("MatchMakerTimeoutSeconds", "10"))
+
+# pooled connections are only reused for requests that must not be retried when they have been idle for less than
+# this, below the 5 s keep-alive timeout of the MatchMaker's Node.js HTTP server
+MATCHMAKER_IDLE_REUSE_SECONDS = float(os.environ.get("MatchMakerIdleReuseSeconds", "4"))
+
+# errors raised when a pooled connection was closed by the server while idle. A request that is safe to repeat is
+# retried once on a new connection. Allocations are not: the first attempt may have reached the MatchMaker and leased
+# servers, a retry would lease a second set and the first leases would only end when they expire
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError, http.client.BadStatusLine)
+RETRYABLE_METHODS = ('GET', 'HEAD')
+
+
+class MatchmakerResult:
+    # outcome of a single MatchMaker request. status is None when no HTTP response was received (timeout, refused ...)
+    def __init__(self, status=None, body=None, latency_ms=0.0, error=None, instance_id=None, lease_id=None):
+        self.status = status
+        self.body = body
+        self.latency_ms = latency_ms
+        self.error = error
+        # set for servers handed out by the bulk reservation API, needed to release them again
+        self.instance_id = instance_id
+        self.lease_id = lease_id
+
+    def json(self):
+        return json.loads(self.body.decode("utf-8"))
+
+    def __repr__(self):
+        return f"MatchmakerResult(status={self.status}, latency_ms={self.latency_ms:.1f}, error={self.error})"
+
+
+class MatchmakerClient:
+    def __init__(self, url, concurrency=MATCHMAKER_CONCURRENCY, timeout=MATCHMAKER_TIMEOUT_SECONDS):
+        parts = urllib.parse.urlsplit(url)
+        self.scheme = parts.scheme or 'http'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        # the bulk API lives next to the single server endpoint, e.g. /signallingserver -> /signallingservers/reserve
+        self.base_path = (parts.path or '/').rsplit('/', 1)[0]
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        # (connection, idle since) of the idle connections, at most `concurrency` are ever open at the same time
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        with self._lock:
+            self._created += 1
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self, max_idle_seconds=None):
+        # returns (connection, reused). With max_idle_seconds, idle connections the server may have closed are dropped
+        while True:
+            try:
+                connection, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_connection(), False
+            if max_idle_seconds is None or time.monotonic() - idle_since < max_idle_seconds:
+                return connection, True
+            connection.close()
+
+    def _release(self, connection):
+        if self._idle.qsize() < self.concurrency:
+            self._idle.put((connection, time.monotonic()))
+        else:
+            connection.close()
+
+    @property
+    def connections_created(self):
+        return self._created
+
+    def _send(self, connection, method, path, headers, body):
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        # the body has to be read completely before the connection can be reused
+        body = response.read()
+        if response.will_close:
+            connection.close()
+        return response.status, body
+
+    def request(self, method='GET', headers=None, path=None, body=None, retry=None):
+        # retry: whether the request may be sent again after a stale pooled connection, by default only for
+        # RETRYABLE_METHODS. Requests that are not retried only reuse recently idle connections
+        retry = method in RETRYABLE_METHODS if retry is None else retry
+        path = path or self.path
+        headers = dict(headers or {})
+        headers.setdefault("Connection", "keep-alive")
+        if body is not None:
+            body = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        started = time.monotonic()
+        connection, reused = self._acquire(None if retry else MATCHMAKER_IDLE_REUSE_SECONDS)
+        try:
+            try:
+                status, response_body = self._send(connection, method, path, headers, body)
+            except _STALE_CONNECTION_ERRORS:
+                if not reused or not retry:
+                    raise
+                connection.close()
+                connection = self._new_connection()
+                status, response_body = self._send(connection, method, path, headers, body)
+            self._release(connection)
+            return MatchmakerResult(status, response_body, (time.monotonic() - started) * 1000)
+        except Exception as e:
+            connection.close()
+            return MatchmakerResult(None, None, (time.monotonic() - started) * 1000, f"{type(e).__name__}: {e}")
+
+    def request_many(self, count, method='GET', headers=None):
+        # sends `count` identical requests with at most `concurrency` in flight and returns the results in order. Each
+        # GET /signallingserver leases a server, so they are not retried either
+        if count <= 0:
+            return []
+        workers = min(self.concurrency, count)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda _: self.request(method, headers, retry=False), range(count)))
+        latencies = sorted(r.latency_ms for r in results)
+        logger.info(f"MatchMaker batch of {count}: p50={latencies[len(latencies) // 2]:.1f}ms "
+                    f"max={latencies[-1]:.1f}ms errors={sum(1 for r in results if r.error)}")
+        return results
+
+    def reserve(self, count, headers=None):
+        """Reserves up to `count` signalling servers in one request and returns one MatchmakerResult per slot.
+
+        Reserved slots get status 200 and the same body as GET /signallingserver, the others status 400 like a
+        MatchMaker without free servers. Returns None when the MatchMaker does not support bulk reservation.
+        """
+        if count <= 0:
+            return []
+        result = self.request('POST', headers, path=f"{self.base_path}/signallingservers/reserve?count={count}")
+        logger.info(f"MatchMaker bulk reservation of {count}: {result}")
+        if result.status in (404, 405):
+            return None
+        if result.status != 200:
+            return [MatchmakerResult(result.status, result.body, result.latency_ms, result.error) for _ in range(count)]
+
+        results = []
+        try:
+            for server in json.loads(result.body.decode("utf-8")).get("signallingServers", [])[:count]:
+                body = json.dumps({"signallingServer": server["signallingServer"]}).encode("utf-8")
+                results.append(MatchmakerResult(200, body, result.latency_ms, instance_id=server.get("instanceID"),
+                                                lease_id=server.get("leaseID")))
+        except (ValueError, AttributeError, KeyError, TypeError) as e:
+            # an unreadable answer fails every request of the batch like a timeout, the leases it may hold expire
+            error = f"Malformed reservation response, {type(e).__name__}: {e}"
+            logger.warning(error)
+            return [MatchmakerResult(None, None, result.latency_ms, error) for _ in range(count)]
+        while len(results) < count:
+            results.append(MatchmakerResult(400, b'No signalling servers available', result.latency_ms))
+        return results
+
+    def release(self, instance_ids, headers=None, lease_ids=None):
+        # returns reserved but unused servers to the MatchMaker pool. With lease_ids, parallel to instance_ids, only
+        # those leases end, so a server that was leased again in the meantime is not taken from its new user
+        pairs = [(instance_id, (lease_ids or [None] * len(instance_ids))[i])
+                 for i, instance_id in enumerate(instance_ids) if instance_id]
+        if not pairs:
+            return None
+        body = {"instanceIDs": [instance_id for instance_id, _ in pairs]}
+        if any(lease_id for _, lease_id in pairs):
+            body["leaseIDs"] = [lease_id or '' for _, lease_id in pairs]
+        # ending the same leases twice is harmless, so a release is retried like a GET
+        result = self.request('POST', headers, path=f"{self.base_path}/signallingservers/release", body=body,
+                              retry=True)
+        if result.status != 200:
+            logger.warning(f"Could not release reserved servers {body['instanceIDs']}: {result}")
+        return result
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url):
+    # one client, and so one connection pool, per MatchMaker URL and container
+    with _clients_lock:
+        if url not in _clients:
+            _clients[url] = MatchmakerClient(url)
+        return _clients[url]
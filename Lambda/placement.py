@@ -0,0 +1,140 @@
+# this module decides where new Signalling instances are launched. Subnets are ranked by their recent launch outcomes
+# (a subnet that just ran out of capacity is tried last until CapacityBackoffSeconds have passed) and then by how many
+# instances each already runs, so the pool stays spread over the AZs. Launch options are tried in order: the launch
+# template as it is, the same template with each of FallbackInstanceTypes, then each of FallbackLaunchTemplates. A
+# capacity error moves on to the next subnet, then to the next option, within the same invocation, until the requested
+# count is launched. A vCPU or instance quota error moves on to the next option without counting against the subnet. Outcomes are remembered per container, and every attempt is published as a placement metric per
+# subnet with its latency
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+from botocore.exceptions import ClientError
+
+import tracing
+
+logger = logging.getLogger()
+
+# errors that only say this subnet/instance type combination cannot be served right now
+CAPACITY_ERRORS = {
+    'InsufficientInstanceCapacity',
+    'InsufficientHostCapacity',
+    'InsufficientReservedInstanceCapacity',
+    'InsufficientCapacity',
+    'Unsupported',
+}
+# account or Region quotas: no subnet helps, the subnet is not marked and the next launch option is tried, as another
+# instance type may count against another vCPU quota
+QUOTA_ERRORS = {
+    'VcpuLimitExceeded',
+    'InstanceLimitExceeded',
+}
+BACKOFF_SECONDS = float(os.environ.get("CapacityBackoffSeconds", "300"))
+HISTORY_LENGTH = 20
+
+_history = {}
+_lock = threading.Lock()
+
+
+def _split(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+def template_spec(value):
+    return {'LaunchTemplateId' if value.startswith('lt-') else 'LaunchTemplateName': value, 'Version': '$Latest'}
+
+
+def launch_options(template, fallback_types=None, fallback_templates=None):
+    """Ordered [(label, run_instances overrides)] from the launch template and its fallbacks."""
+    fallback_types = _split(os.environ.get("FallbackInstanceTypes")) if fallback_types is None else fallback_types
+    fallback_templates = _split(os.environ.get("FallbackLaunchTemplates")) \
+        if fallback_templates is None else fallback_templates
+    options = [(template, {'LaunchTemplate': template_spec(template)})]
+    options += [(f"{template}/{instance_type}", {'LaunchTemplate': template_spec(template), 'InstanceType': instance_type})
+                for instance_type in fallback_types]
+    options += [(fallback, {'LaunchTemplate': template_spec(fallback)}) for fallback in fallback_templates]
+    return options
+
+
+def record(subnet, launched, now=None):
+    with _lock:
+        _history.setdefault(subnet, deque(maxlen=HISTORY_LENGTH)).append((now or time.time(), launched))
+
+
+def backing_off(subnet, now=None):
+    # the last launch in this subnet failed for capacity and that was less than BACKOFF_SECONDS ago
+    with _lock:
+        outcomes = _history.get(subnet)
+        if not outcomes:
+            return False
+        at, launched = outcomes[-1]
+    return not launched and (now or time.time()) - at < BACKOFF_SECONDS
+
+
+def success_rate(subnet):
+    with _lock:
+        outcomes = list(_history.get(subnet, ()))
+    return sum(1 for _, launched in outcomes if launched) / len(outcomes) if outcomes else 1.0
+
+
+def rank(subnets, spread=None, now=None):
+    """Subnets in the order they should be tried, spread is {subnet: running or pending instances}."""
+    spread = spread or {}
+    shuffled = list(subnets)
+    # ties are broken at random so that concurrent callers do not all start with the same subnet
+    random.shuffle(shuffled)
+    return sorted(shuffled, key=lambda subnet: (backing_off(subnet, now), -success_rate(subnet), spread.get(subnet, 0)))
+
+
+def _error_code(err):
+    return err.response.get('Error', {}).get('Code')
+
+
+def launch(ec2, count, subnets, params, spread=None, options=None):
+    """Launches up to count instances with run_instances(**params) plus the placement, returns their IDs.
+
+    Raises the last capacity error when not a single instance could be launched.
+    """
+    options = options or launch_options(os.environ.get('LaunchTemplateName', 'HealthCoach-Production-UESignaling-LT'))
+    ranked = rank(subnets, spread) or [None]
+    instance_ids = []
+    last_error = None
+    for label, overrides in options:
+        for subnet in ranked:
+            remaining = count - len(instance_ids)
+            if remaining <= 0:
+                return instance_ids
+            request = dict(params, **overrides, MinCount=1, MaxCount=remaining)
+            if subnet:
+                request['SubnetId'] = subnet
+            started = time.monotonic()
+            try:
+                response = ec2.run_instances(**request)
+            except ClientError as err:
+                if _error_code(err) in QUOTA_ERRORS:
+                    last_error = err
+                    logger.warning(f"Quota reached for {label}: {_error_code(err)}")
+                    tracing.emit_counts('placement', {'QuotaFailures': 1}, Option=label, Error=_error_code(err))
+                    break
+                if _error_code(err) not in CAPACITY_ERRORS:
+                    raise
+                last_error = err
+                record(subnet, False)
+                logger.warning(f"No capacity for {label} in {subnet}: {_error_code(err)}")
+                tracing.emit_counts('placement', {'LaunchFailures': 1}, dimensions=('Subnet',),
+                                    Subnet=subnet or 'default', Option=label, Error=_error_code(err))
+                continue
+            launched = [instance['InstanceId'] for instance in response['Instances']]
+            instance_ids += launched
+            record(subnet, True)
+            logger.info(f"Launched {len(launched)} of {remaining} with {label} in {subnet}")
+            tracing.emit_counts('placement', {'Launched': len(launched),
+                                              'LaunchLatency': round((time.monotonic() - started) * 1000, 3)},
+                                units={'LaunchLatency': 'Milliseconds'}, dimensions=('Subnet',),
+                                Subnet=subnet or 'default', Option=label)
+    if not instance_ids and last_error is not None:
+        raise last_error
+    return instance_ids
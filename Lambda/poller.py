@@ -1,150 +1,300 @@
 # This function polls the SQS queue for new session requests and checks
 # if a Signalling instance is available to service the request or needs to be created.
-# It should be triggered on a schedule (e.g., every minute via CloudWatch Event).
+# It has two entry points which share the same per-message allocation logic:
+# - lambda_handler is triggered on a schedule (e.g., every minute via CloudWatch Event) and keeps long-polling
+#   and draining the queue until the invocation gets close to its deadline
+# - sqs_handler is wired to the queue as an event source and reports the messages that could not be
+#   allocated through batchItemFailures so only those are retried. lambda_handler forwards SQS events to it
+# With PriorityLanes the requests wait in one queue per lane. The scheduled drain picks the lane of every batch with
+# sessionLanes' weighted shares and starvation bound; with event source mappings each lane queue needs its own
+# mapping, and their MaximumConcurrency sets the share of each lane. Queue wait and end-to-end time are published per
+# Lane as well
+# Requests of browsers that closed their connection while queued are dropped before anything is spent on them: the
+# $disconnect route leaves a tombstone per connection (connectionTombstones.py), which is looked up for the whole batch
+# at once, the keep-alive push still catches the connections that closed without a tombstone. The requests dropped
+# either way, and the pushes, reservations and launches that saved, are published as cancellations metrics
 
-import boto3
 import json
 import os
 import logging
-import urllib.request
-import urllib.error
+import time
+
+import connectionTombstones
+import matchmakerClient
+import runtime
+import sessionLanes
+import sessionPush
+import tracing
 
 # Configure logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def lambda_handler(event, context):
-    logger.info("=== START: Poller Lambda ===")
-    logger.info(f"Incoming event: {json.dumps(event)}")
+# outcomes of allocate_session for a single request
+ALLOCATED = 'allocated'      # a signalling server was found and the details sent to the client
+DISCARDED = 'discarded'      # the request cannot be served and should be removed from the queue
+RETRY = 'retry'              # no server available right now, the message should stay in the queue
+FAILED = 'failed'            # the MatchMaker call or the hand-off failed, the message should stay in the queue
 
-    # Initialize boto3 Lambda client
-    lambdaFunc = boto3.client('lambda')
-    logger.info("Initialized boto3 Lambda client")
+# the scheduled poller stops draining when less than this is left before the Lambda timeout
+SAFETY_MARGIN_MILLIS = int(os.environ.get("PollerSafetyMarginMillis", "10000"))
+# upper bound for one scheduled drain so that consecutive schedule runs do not overlap
+MAX_DRAIN_SECONDS = int(os.environ.get("PollerMaxDrainSeconds", "240"))
+LONG_POLL_SECONDS = 20
 
-    # Retrieve ARNs for dependent Lambdas
-    logger.info("Fetching ARNs for dependent Lambdas...")
 
-    response = lambdaFunc.get_function(FunctionName='HealthCoach-sendSessionDetails')
-    lambdaArnSendSessionDetails = response['Configuration']['FunctionArn']
-    logger.info(f"sendSessionDetails ARN: {lambdaArnSendSessionDetails}")
+def allocate_batch(payloads):
+    """Asks the MatchMaker for a signalling server for each queued request and returns one outcome per payload.
 
-    response = lambdaFunc.get_function(FunctionName='HealthCoach-createInstances')
-    lambdaArnCreateInstances = response['Configuration']['FunctionArn']
-    logger.info(f"createInstances ARN: {lambdaArnCreateInstances}")
+    The whole batch is reserved with a single bulk MatchMaker request when the MatchMaker supports it, otherwise the
+    per-session requests run in parallel over pooled connections. A timeout or error only fails its own request.
+    Browsers are notified directly over their web socket, a request whose connection was closed, as recorded by
+    the $disconnect route or found by the keep-alive push, is dropped without using a server.
+    """
+    matchmakersecret = runtime.get_parameter('HealthCoach-ClientSecret')
+    matchmaker = matchmakerClient.get_client(os.environ["MatchMakerURL"])
+    outcomes = [None] * len(payloads)
+    for payload in payloads:
+        tracing.since("queueWait", tracing.correlation_id(payload), payload.get("enqueuedAt"), dimensions=('Lane',),
+                      Lane=payload.get("lane", sessionLanes.DEFAULT_LANE))
 
-    response = lambdaFunc.get_function(FunctionName='HealthCoach-keepConnectionAlive')
-    lambdaArnKeepAlive = response['Configuration']['FunctionArn']
-    logger.info(f"keepConnectionAlive ARN: {lambdaArnKeepAlive}")
+    # Step 1: Drop the requests of connections the browser closed while queued, they need no push and no server
+    cancelled = connectionTombstones.cancelled([payload.get("connectionId") for payload in payloads])
+    pending = []
+    for i, payload in enumerate(payloads):
+        if payload.get("connectionId") in cancelled:
+            logger.info(f"Connection {payload.get('connectionId')} was closed while queued, cancelling the request")
+            outcomes[i] = DISCARDED
+        else:
+            pending.append(i)
 
-    # Retrieve MatchMaker client secret from SSM
-    ssm = boto3.client('ssm')
-    logger.info("Fetching MatchMaker client secret from SSM...")
-    parameter = ssm.get_parameter(Name='HealthCoach-ClientSecret')
-    matchmakersecret = parameter['Parameter']['Value']
-    logger.info("Successfully retrieved MatchMaker client secret")
+    # Step 2: Send a keep-alive signal to the frontend, closed connections need no server
+    statuses = sessionPush.push_many([(payloads[i].get("connectionId"), sessionPush.WAITING_MESSAGE) for i in pending])
+    live = []
+    for i, status in zip(pending, statuses):
+        if status == sessionPush.GONE:
+            logger.info(f"Connection {payloads[i].get('connectionId')} closed while waiting, dropping the request")
+            outcomes[i] = DISCARDED
+        else:
+            live.append(i)
 
-    # Connect to SQS
-    sqs = boto3.resource('sqs')
-    queue_name = os.environ["SQSName"]
-    logger.info(f"Connecting to SQS queue: {queue_name}")
-    queue = sqs.get_queue_by_name(QueueName=queue_name)
-    logger.info(f"Connected to SQS queue URL: {queue.url}")
+    # Step 3: Reserve Signalling servers for the whole batch in one MatchMaker round trip. MatchMakers without
+    # the bulk API get one GET request per queued session instead
+    headers = {"clientsecret": matchmakersecret}
+    results = matchmaker.reserve(len(live), headers=headers)
+    if results is None:
+        logger.info(f"Sending {len(live)} GET requests to MatchMaker at {os.environ['MatchMakerURL']}")
+        results = matchmaker.request_many(len(live), headers=headers)
 
-    # Receive messages
-    messages = queue.receive_messages(MaxNumberOfMessages=10, WaitTimeSeconds=2)
-    logger.info(f"Received {len(messages)} messages from SQS")
+    allocated = []
+    for i, result in zip(live, results):
+        payload = payloads[i]
+        connection_id = payload.get("connectionId", "Unknown")
+        logger.info(f"MatchMaker response for connection {connection_id}: {result}")
+        tracing.emit("matchmaker", tracing.correlation_id(payload), result.latency_ms, Status=result.status)
 
-    for message in messages:
-        logger.info(f"Processing message body: {message.body}")
+        if result.status == 200:
+            try:
+                JSON_object = result.json()
+                # Merge MatchMaker data into the original payload
+                payload.update(JSON_object)
+                # the per-session GET names the leased server in its body, the bulk reservation on the result
+                result.instance_id = result.instance_id or JSON_object.get("instanceID")
+                result.lease_id = result.lease_id or JSON_object.get("leaseID")
+                allocated.append((i, result))
+            except Exception as e:
+                logger.error(f"Invalid MatchMaker response for connection {connection_id}: {str(e)}")
+                outcomes[i] = FAILED
 
-        try:
-            payload = json.loads(message.body)
-        except Exception as e:
-            logger.error(f"Failed to parse message body: {str(e)}")
+        elif result.status == 400:
+            logger.info("No signalling servers available, the request waits for the next poll")
+            # Message not deleted here, will be retried on the next poll. The caller requests one
+            # scale-out for all the requests that found no server
+            outcomes[i] = RETRY
+
+        elif result.status is None or result.status >= 400:
+            if result.status == 401:
+                # the secret may have been rotated, fetch it again on the next invocation
+                runtime.invalidate(('ssm', 'HealthCoach-ClientSecret'))
+            logger.error(f"MatchMaker request failed for connection {connection_id}: {result.status} {result.error}")
+            outcomes[i] = FAILED
+
+        else:
+            logger.warning(f"Unexpected MatchMaker status code: {result.status}")
+            outcomes[i] = DISCARDED
+
+    # Step 4: Send the session details to the browsers
+    with tracing.stage_timer("push", [tracing.correlation_id(payloads[i]) for i, _ in allocated]):
+        statuses = sessionPush.push_many([
+            (payloads[i]["connectionId"], {"signallingServer": payloads[i]["signallingServer"]}) for i, _ in allocated])
+    unused_reservations = []
+    for (i, result), status in zip(allocated, statuses):
+        if status == sessionPush.SENT:
+            outcomes[i] = ALLOCATED
+            tracing.since("endToEnd", tracing.correlation_id(payloads[i]), payloads[i].get("requestedAt"),
+                          dimensions=('Lane',), Lane=payloads[i].get("lane", sessionLanes.DEFAULT_LANE))
             continue
+        # the browser never got its server, end its lease so the server goes back to the pool
+        unused_reservations.append((result.instance_id, result.lease_id))
+        outcomes[i] = DISCARDED if status == sessionPush.GONE else FAILED
 
-        # Step 1: Send a keep-alive signal to the frontend
-        logger.info("Invoking keepConnectionAlive Lambda...")
-        lambdaFunc.invoke(
-            FunctionName=lambdaArnKeepAlive,
-            InvocationType='Event',
-            Payload=json.dumps(payload)
-        )
-        logger.info("keepConnectionAlive invoked successfully")
+    unreleasable = [lease_id for instance_id, lease_id in unused_reservations if not instance_id]
+    if unreleasable:
+        # an older MatchMaker does not name the server behind a GET /signallingserver lease
+        logger.warning(f"Cannot release {len(unreleasable)} unused leases without an instance ID, they end when "
+                       f"they expire: {unreleasable}")
+    unused_reservations = [(instance_id, lease_id) for instance_id, lease_id in unused_reservations if instance_id]
+    if unused_reservations:
+        logger.info(f"Returning unused reservations to MatchMaker: {unused_reservations}")
+        matchmaker.release([instance_id for instance_id, _ in unused_reservations], headers=headers,
+                           lease_ids=[lease_id for _, lease_id in unused_reservations])
 
-        # Step 2: Log connection details
-        connection_id = payload.get("connectionId", "Unknown")
-        matchmaker_url = os.environ["MatchMakerURL"]
-        logger.info(f"Connection ID: {connection_id}")
-        logger.info(f"MatchMaker URL: {matchmaker_url}")
-        logger.info(f"Client Secret: {matchmakersecret}")
+    tombstoned = len(payloads) - len(pending)
+    closed = tombstoned + len(pending) - len(live)
+    if closed:
+        # a dropped request would have taken a server while the pool had enough. Once the pool ran out it would have
+        # waited for a launch itself or taken the server of a request that then waits for one
+        launches_saved = closed if RETRY in outcomes else 0
+        tracing.emit_counts('cancellations', {
+            'Cancelled': tombstoned, 'ClosedOnPush': closed - tombstoned, 'PushesSaved': tombstoned,
+            'ReservationsSaved': closed - launches_saved, 'LaunchesSaved': launches_saved})
 
-        # Step 3: Check with MatchMaker for available Signalling servers
-        try:
-            logger.info("Sending GET request to MatchMaker...")
+    return outcomes
 
-            request = urllib.request.Request(
-                url=matchmaker_url,
-                headers={"clientsecret": matchmakersecret},
-                method='GET'
-            )
 
-            logger.info(f"Request prepared: URL={request.full_url}, Headers={request.header_items()}")
+def request_scale_out(deficit, correlation_ids=()):
+    # one createInstances invocation per poll covers every request that found no server. createInstances nets out
+    # the instances that are still booting and serializes concurrent planners with a lock
+    if deficit <= 0:
+        return
+    logger.info(f"{deficit} requests without a signalling server — invoking createInstances Lambda once")
+    runtime.client('lambda').invoke(
+        FunctionName=runtime.get_function_arn('HealthCoach-createInstances', 'CreateInstancesArn'),
+        InvocationType='Event',
+        Payload=json.dumps({"startAllServers": False, "count": deficit, "subtractBooting": True,
+                            "correlationIds": list(correlation_ids)})
+    )
 
-            response = urllib.request.urlopen(request, timeout=10)
-            logger.info(f"MatchMaker response status: {response.status}")
 
-            if response.status == 200:
-                responsePayload = response.read()
-                JSON_object = json.loads(responsePayload.decode("utf-8"))
-                logger.info(f"MatchMaker response JSON: {json.dumps(JSON_object)}")
+def allocate_session(payload):
+    """Allocates a signalling server for a single queued request, see allocate_batch."""
+    return allocate_batch([payload])[0]
 
-                # Merge MatchMaker data into the original payload
-                payload.update(JSON_object)
 
-                # Step 4: Invoke sendSessionDetails Lambda
-                logger.info("Invoking sendSessionDetails Lambda...")
-                lambdaFunc.invoke(
-                    FunctionName=lambdaArnSendSessionDetails,
-                    InvocationType='Event',
-                    Payload=json.dumps(payload)
-                )
-                logger.info("sendSessionDetails Lambda invoked successfully")
+def _remaining_millis(context, started):
+    # remaining time of this invocation, capped by MAX_DRAIN_SECONDS. context is None when run outside Lambda
+    drain_left = MAX_DRAIN_SECONDS * 1000 - (time.monotonic() - started) * 1000
+    if context is None:
+        return drain_left
+    return min(context.get_remaining_time_in_millis(), drain_left)
 
-                # Delete the processed message
-                delete_response = message.delete()
-                logger.info(f"Deleted message from SQS after successful processing. Response: {delete_response}")
 
-            else:
-                logger.warning(f"Unexpected MatchMaker status code: {response.status}")
-                delete_response = message.delete()
-                logger.info(f"Deleted message from SQS after unexpected status. Response: {delete_response}")
-
-        except urllib.error.HTTPError as err:
-            logger.error(f"HTTPError while contacting MatchMaker: {err.code} - {err.reason}")
-            if err.code == 400:
-                logger.info("No signalling servers available — invoking createInstances Lambda")
-
-                inputParams = {"startAllServers": False}
-                lambdaFunc.invoke(
-                    FunctionName=lambdaArnCreateInstances,
-                    InvocationType='Event',
-                    Payload=json.dumps(inputParams)
-                )
-                logger.info("createInstances Lambda invoked to start new server instance")
-                # Message not deleted here, will be retried next poll
-
-            else:
-                logger.error(f"Unhandled HTTP error: {err}")
-                raise err
+def lambda_handler(event, context):
+    if "Records" in event:
+        return sqs_handler(event, context)
+
+    logger.info("=== START: Poller Lambda ===")
+    logger.info(f"Incoming event: {json.dumps(event)}")
+    started = time.monotonic()
+
+    # Connect to SQS, one queue per priority lane. The queue URLs are resolved once per container
+    sqs = runtime.resource('sqs')
+    lanes = sessionLanes.lanes()
+    scheduler = sessionLanes.scheduler(lanes)
+    # the waiting messages per lane tell the scheduler which lanes are starving, a single lane never is
+    backlog = {name: visible for name, (visible, _) in sessionLanes.depths(lanes).items()} if len(lanes) > 1 else {}
+    logger.info(f"Draining lanes {lanes}, backlog {backlog}")
+
+    processed = 0
+    # lanes that may still have messages, a lane that returns none is left out for the rest of this drain
+    candidates = list(lanes)
+    # keep draining until the queues are empty, the pool is out of servers or the deadline gets close
+    while True:
+        remaining = _remaining_millis(context, started) - SAFETY_MARGIN_MILLIS
+        if remaining <= 0:
+            logger.info("Approaching the invocation deadline, stopping the drain")
+            break
+        lane = scheduler.next_lane(candidates, backlog)
+        if lane is None:
+            break
+        # only the last lane that may have messages is long polled, the others are checked without waiting
+        wait_seconds = int(min(LONG_POLL_SECONDS, remaining // 1000)) if len(candidates) == 1 else 0
+
+        queue = sqs.Queue(sessionLanes.queue_url(lane))
+        messages = queue.receive_messages(MaxNumberOfMessages=10, WaitTimeSeconds=wait_seconds)
+        logger.info(f"Received {len(messages)} messages from lane {lane.name}")
+        if not messages:
+            scheduler.skip(lane, candidates)
+            candidates.remove(lane)
+            continue
+        backlog[lane.name] = max(0, backlog.get(lane.name, 0) - len(messages))
+
+        batch = []
+        for message in messages:
+            logger.info(f"Processing message body: {message.body}")
 
+            try:
+                batch.append((message, json.loads(message.body)))
+            except Exception as e:
+                logger.error(f"Failed to parse message body: {str(e)}")
+
+        try:
+            outcomes = allocate_batch([payload for _, payload in batch])
         except Exception as e:
-            logger.error(f"General exception during MatchMaker communication: {str(e)}")
-            raise e
+            # as in sqs_handler, the batch stays in the queue and is received again after its visibility timeout
+            logger.error(f"Allocation failed for a batch of lane {lane.name}, leaving it in the queue: {str(e)}")
+            continue
+        scheduler.granted(lane, outcomes.count(ALLOCATED))
+        processed += len(batch)
+        out_of_capacity = RETRY in outcomes
+        for (message, _), outcome in zip(batch, outcomes):
+            if outcome in (ALLOCATED, DISCARDED):
+                delete_response = message.delete()
+                logger.info(f"Deleted message from SQS ({outcome}). Response: {delete_response}")
+
+        if out_of_capacity:
+            # the remaining messages cannot be served either, leave them for the next poll and scale out once
+            # for every request still waiting in any lane
+            logger.info("No signalling servers available, stopping the drain until capacity is added")
+            queued = sum(visible for visible, _ in sessionLanes.depths(lanes).values())
+            waiting = [tracing.correlation_id(payload) for (_, payload), outcome in zip(batch, outcomes) if outcome == RETRY]
+            request_scale_out(len(waiting) + queued, waiting)
+            break
 
-    logger.info("=== END: Poller Lambda completed successfully ===")
+    logger.info(f"=== END: Poller Lambda completed successfully, processed {processed} messages ===")
 
     return {
         'statusCode': 200,
         'body': json.dumps('Completed scanning for incoming requests')
     }
+
+
+def sqs_handler(event, context):
+    # messages that are not listed in batchItemFailures are deleted by the event source mapping,
+    # this requires FunctionResponseTypes: ReportBatchItemFailures on the mapping
+    records = event.get("Records", [])
+    logger.info(f"=== START: Poller Lambda (SQS batch of {len(records)}) ===")
+
+    batch = []
+    for record in records:
+        logger.info(f"Processing message {record['messageId']} body: {record['body']}")
+
+        try:
+            batch.append((record["messageId"], json.loads(record["body"])))
+        except Exception as e:
+            logger.error(f"Failed to parse message body, dropping it: {str(e)}")
+
+    try:
+        outcomes = allocate_batch([payload for _, payload in batch])
+    except Exception as e:
+        logger.error(f"Allocation failed for the whole batch: {str(e)}")
+        outcomes = [FAILED] * len(batch)
+
+    request_scale_out(outcomes.count(RETRY),
+                      [tracing.correlation_id(payload) for (_, payload), outcome in zip(batch, outcomes) if outcome == RETRY])
+
+    failures = [{"itemIdentifier": message_id}
+                for (message_id, _), outcome in zip(batch, outcomes) if outcome in (RETRY, FAILED)]
+
+    logger.info(f"=== END: Poller Lambda, {len(failures)} of {len(records)} messages returned to the queue ===")
+    return {"batchItemFailures": failures}
@@ -1,17 +1,54 @@
-import boto3
+# this function is invoked by the web socket API when a browser asks for a session. It validates the bearer and puts
+# the request on the sessions FIFO queue. The queue runs in high-throughput mode (deduplication per message group and
+# a throughput limit per message group), so every browser connection is its own message group and the deduplication
+# ID is derived from the connection and API Gateway request IDs, which never collide between two users. When the
+# backlog is above MaxQueueDepth the request is rejected right away with a retry-after hint instead of queueing it.
+# With PriorityLanes each lane is a queue of its own (see sessionLanes.py) and the backlog cap applies per lane, so a
+# flood of low priority requests does not turn away high priority ones
+import hashlib
 import json
 import os
 import traceback
 
+import runtime
+import sessionLanes
+import tracing
+
+# 0 disables admission control
+MAX_QUEUE_DEPTH = int(os.environ.get("MaxQueueDepth", "500"))
+RETRY_AFTER_SECONDS = int(os.environ.get("RetryAfterSeconds", "30"))
+# the queue depth is read at most once per this many seconds and container
+QUEUE_DEPTH_TTL_SECONDS = float(os.environ.get("QueueDepthCacheSeconds", "5"))
+
+
+def deduplication_id(connection_id, request_id):
+    # SQS accepts at most 128 characters, longer combinations are hashed
+    dedup_id = f"{connection_id}:{request_id}"
+    return dedup_id if len(dedup_id) <= 128 else hashlib.sha256(dedup_id.encode('utf-8')).hexdigest()
+
+
+def queue_backlog(queue_url):
+    # visible plus in-flight messages, shared by all requests of this container for QUEUE_DEPTH_TTL_SECONDS
+    def load():
+        attributes = runtime.client('sqs').get_queue_attributes(
+            QueueUrl=queue_url,
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+        )['Attributes']
+        return int(attributes.get('ApproximateNumberOfMessages', 0)) + \
+            int(attributes.get('ApproximateNumberOfMessagesNotVisible', 0))
+    return runtime.cached(('sqs-backlog', queue_url), load, ttl=QUEUE_DEPTH_TTL_SECONDS)
+
+
 def lambda_handler(event, context):
     print("===== 🚀 START: requestSession Lambda =====")
+    started_ms = tracing.now_ms()
 
     try:
         # Step 1: Log the raw event (trimmed for safety)
         print(f"📩 Incoming event: {json.dumps(event)[:1000]}")
 
         # Step 2: Setup SQS client
-        sqs = boto3.resource("sqs")
+        sqs = runtime.resource("sqs")
         sqs_name = os.environ.get("SQSName", "")
         client_secret = os.environ.get("clientSecret", "")
 
@@ -26,22 +63,17 @@ def lambda_handler(event, context):
                 "body": json.dumps("Server configuration error: missing environment variables.")
             }
 
-        # Step 4: Connect to SQS
-        print("🔗 Connecting to SQS queue...")
-        queue = sqs.get_queue_by_name(QueueName=sqs_name)
-        print("✅ Connected to SQS successfully!")
-
-        # Step 5: Extract event details
+        # Step 4: Extract event details
         messageReqId = event["requestContext"]["requestId"]
         messageConnId = event["requestContext"]["connectionId"]
         messageReqBody = event["body"]
-        uniqueId = str(event["requestContext"]["requestTimeEpoch"])
+        uniqueId = deduplication_id(messageConnId, messageReqId)
 
         print(f"🆔 Request ID: {messageReqId}")
         print(f"🔌 Connection ID: {messageConnId}")
-        print(f"⏱️ Unique ID (epoch): {uniqueId}")
+        print(f"⏱️ Deduplication ID: {uniqueId}")
 
-        # Step 6: Parse and validate request body
+        # Step 5: Parse and validate request body
         try:
             parsed_body = json.loads(messageReqBody)
             secretParam = parsed_body.get("bearer", "")
@@ -54,25 +86,54 @@ def lambda_handler(event, context):
 
         print(f"🔑 Bearer received: {secretParam}")
 
-        # Step 7: Validate bearer
+        # Step 6: Validate bearer
         if secretParam == client_secret:
             print("✅ Bearer validated successfully!")
             
+            # the token claims passed on by the authorizer cap the priority lane, the body can only lower it
+            lane = sessionLanes.lane_for(parsed_body, event["requestContext"].get("authorizer"))
+            print(f"🛣️ Priority lane: {lane.name} ({lane.queue_name})")
+
+            # the API Gateway requestId is the correlation ID carried through the rest of the pipeline
             payload = {
                 "requestId": messageReqId,
+                "correlationId": messageReqId,
                 "connectionId": messageConnId,
+                "requestedAt": event["requestContext"]["requestTimeEpoch"],
+                "enqueuedAt": tracing.now_ms(),
+                "lane": lane.name,
                 "body": parsed_body
             }
             payload_str = json.dumps(payload)
 
-            # Step 8: Send message to SQS
-            print(f"📤 Sending message to SQS queue: {sqs_name}")
+            # Step 7: Connect to the lane's queue, the queue URL is resolved once per container
+            queue_url = sessionLanes.queue_url(lane)
+            queue = sqs.Queue(queue_url)
+
+            # Step 8: Admission control, a full backlog is rejected fast instead of growing without limit
+            if MAX_QUEUE_DEPTH:
+                backlog = queue_backlog(queue_url)
+                if backlog >= MAX_QUEUE_DEPTH:
+                    print(f"🚦 Queue backlog {backlog} of lane {lane.name} reached the cap of {MAX_QUEUE_DEPTH}, "
+                          f"rejecting the request")
+                    tracing.since("ingest", messageReqId, started_ms, Admitted=False, Lane=lane.name)
+                    return {
+                        "statusCode": 429,
+                        "headers": {"Retry-After": str(RETRY_AFTER_SECONDS)},
+                        "body": json.dumps({"message": "Too many session requests, please retry later",
+                                            "retryAfter": RETRY_AFTER_SECONDS})
+                    }
+
+            # Step 9: Send message to SQS. Each connection is its own message group so the high-throughput FIFO
+            # queue can spread the requests over its partitions
+            print(f"📤 Sending message to SQS queue: {lane.queue_name}")
             queue.send_message(
                 MessageBody=payload_str,
-                MessageGroupId=messageReqId,
+                MessageGroupId=messageConnId,
                 MessageDeduplicationId=uniqueId
             )
             print("✅ Message successfully sent to SQS!")
+            tracing.since("ingest", messageReqId, started_ms, Lane=lane.name)
             print(f"📦 Payload sent: {payload_str}")
 
             return {
@@ -0,0 +1,87 @@
+# this module is shared by all the Lambda functions in this folder and keeps state that should survive across warm
+# invocations of the same container. boto3 clients are created once per container, and SSM parameters and the ARNs
+# of dependent Lambda functions are cached with a TTL so that a busy poller does not hit the control plane (and SSM
+# throttling limits) on every invocation. It has to be packaged next to the handler that imports it. boto3 itself is
+# imported with the first client, so a handler that needs none (the authorizer with a local key) never pays for it;
+# dispatch creates the clients a handler always needs during init.
+import os
+import time
+import threading
+import logging
+
+logger = logging.getLogger()
+
+# how long a cached SSM parameter or resolved ARN is trusted before it is fetched again
+CACHE_TTL_SECONDS = float(os.environ.get("CacheTTLSeconds", "300"))
+
+_clients = {}
+_resources = {}
+_cache = {}
+_lock = threading.Lock()
+
+
+def _cache_key(service_name, kwargs):
+    return (service_name, tuple(sorted(kwargs.items())))
+
+
+def client(service_name, **kwargs):
+    # boto3 clients are thread safe, so a single instance per service/endpoint is shared by the whole container
+    key = _cache_key(service_name, kwargs)
+    with _lock:
+        if key not in _clients:
+            import boto3
+            _clients[key] = boto3.client(service_name, **kwargs)
+        return _clients[key]
+
+
+def resource(service_name, **kwargs):
+    # boto3 resources are not thread safe, callers that fan out to worker threads should use client() instead
+    key = _cache_key(service_name, kwargs)
+    with _lock:
+        if key not in _resources:
+            import boto3
+            _resources[key] = boto3.resource(service_name, **kwargs)
+        return _resources[key]
+
+
+def cached(key, loader, ttl=None):
+    # returns the cached value for key, calling loader() when it is missing or older than ttl seconds
+    ttl = CACHE_TTL_SECONDS if ttl is None else ttl
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and now - entry[1] < ttl:
+            return entry[0]
+    value = loader()
+    with _lock:
+        _cache[key] = (value, time.monotonic())
+    return value
+
+
+def invalidate(key=None):
+    # drops a single cached entry, or everything when no key is given. Call it after a value is known to be stale,
+    # e.g. when the matchmaker rejects the client secret after a rotation
+    with _lock:
+        if key is None:
+            _cache.clear()
+        else:
+            _cache.pop(key, None)
+
+
+def get_parameter(name, ttl=None, decrypt=False):
+    def load():
+        logger.info(f"Fetching SSM parameter {name}")
+        return client('ssm').get_parameter(Name=name, WithDecryption=decrypt)['Parameter']['Value']
+    return cached(('ssm', name), load, ttl)
+
+
+def get_function_arn(function_name, env_var=None, ttl=None):
+    # the ARN is taken from the environment when the stack provides it, otherwise it is resolved once with
+    # lambda.get_function and cached
+    if env_var and os.environ.get(env_var):
+        return os.environ[env_var]
+
+    def load():
+        logger.info(f"Resolving ARN for Lambda {function_name}")
+        return client('lambda').get_function(FunctionName=function_name)['Configuration']['FunctionArn']
+    return cached(('arn', function_name), load, ttl)
@@ -0,0 +1,81 @@
+# this module holds the decision logic of the warm-pool autoscaler. It has no AWS dependencies so that it can be
+# exercised with synthetic demand traces. Given the queue depth, the current pool and the recent arrival rate it
+# decides how many signalling instances to launch or release so that a number of warm spares is ready before the
+# demand arrives, instead of starting one instance per request that found no server
+import math
+
+
+class ScalingDecision:
+    def __init__(self, launch=0, release=0, wanted_free=0, forecast_rate=0.0, reason=''):
+        self.launch = launch
+        self.release = release
+        # free servers (idle or booting) the policy wants to have
+        self.wanted_free = wanted_free
+        # forecast arrivals per minute
+        self.forecast_rate = forecast_rate
+        self.reason = reason
+
+    def to_dict(self):
+        return {
+            'launch': self.launch,
+            'release': self.release,
+            'wantedFree': self.wanted_free,
+            'forecastRate': round(self.forecast_rate, 3),
+            'reason': self.reason
+        }
+
+    def __repr__(self):
+        return f"ScalingDecision({self.to_dict()})"
+
+
+class WarmPoolPolicy:
+    def __init__(self, warm_spares=1, max_instances=10, boot_minutes=8.0, smoothing=0.3, scale_in_buffer=1):
+        # idle servers kept on top of the forecast demand
+        self.warm_spares = warm_spares
+        # never grow the pool beyond this, the concurrencyLimit
+        self.max_instances = max_instances
+        # time from run_instances until a server is ready, arrivals in this window must be covered by the pool
+        self.boot_minutes = boot_minutes
+        # weight of the newest minute in the exponentially weighted arrival rate
+        self.smoothing = smoothing
+        # extra idle servers tolerated before releasing, avoids flapping around the target
+        self.scale_in_buffer = scale_in_buffer
+
+    def forecast_rate(self, arrivals_per_minute):
+        """Exponentially weighted arrival rate per minute, arrivals_per_minute is ordered oldest first."""
+        rate = None
+        for arrivals in arrivals_per_minute:
+            rate = arrivals if rate is None else self.smoothing * arrivals + (1 - self.smoothing) * rate
+        if rate is None:
+            return 0.0
+        # do not forecast below the most recent minute when demand is ramping up
+        return float(max(rate, arrivals_per_minute[-1]))
+
+    def decide(self, queue_depth, pool_size, idle, booting, arrivals_per_minute):
+        """Returns the ScalingDecision for one evaluation.
+
+        queue_depth: requests waiting in the session queue
+        pool_size: signalling instances that are pending or running
+        idle: ready servers without a client
+        booting: instances that are not registered with a target group yet
+        arrivals_per_minute: recent session requests per minute, oldest first
+        """
+        rate = self.forecast_rate(arrivals_per_minute)
+        expected = math.ceil(rate * self.boot_minutes)
+        wanted_free = queue_depth + expected + self.warm_spares
+        available = idle + booting
+        headroom = max(0, self.max_instances - pool_size)
+
+        if wanted_free > available:
+            launch = min(wanted_free - available, headroom)
+            reason = f"{available} free for {wanted_free} wanted"
+            if launch < wanted_free - available:
+                reason += f", capped by limit {self.max_instances}"
+            return ScalingDecision(launch=launch, wanted_free=wanted_free, forecast_rate=rate, reason=reason)
+
+        excess = idle - wanted_free - self.scale_in_buffer
+        if queue_depth == 0 and excess > 0:
+            return ScalingDecision(release=excess, wanted_free=wanted_free, forecast_rate=rate,
+                                   reason=f"{idle} idle for {wanted_free} wanted")
+
+        return ScalingDecision(wanted_free=wanted_free, forecast_rate=rate, reason='pool matches demand')
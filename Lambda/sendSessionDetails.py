@@ -1,11 +1,13 @@
 # this function is used to send session details back to browser when a signalling server is available to process it
 # the response includes the query string for the signalling server and it uses the websocket connection id to interface
 # back with the client
-import boto3
+# it is a thin wrapper around sessionPush, which the poller also uses directly
 import json
-import os
 import logging
 
+import sessionPush
+import tracing
+
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -15,12 +17,19 @@ def lambda_handler(event, context):
   
   
   print(event)
-  inputParams = {
-                "signallingServer"   : event["signallingServer"]
-            }
-  apigateway=boto3.client('apigatewaymanagementapi' ,endpoint_url=os.environ["ApiGatewayUrl"])
-  apigateway.post_to_connection(ConnectionId=event["connectionId"], Data=json.dumps(inputParams))
-           
+  with tracing.stage_timer("push", tracing.correlation_id(event)):
+    status = sessionPush.push(event["connectionId"], {"signallingServer": event["signallingServer"]})
+  if status == sessionPush.GONE:
+    return {
+      'statusCode': 410,
+      'body': json.dumps('Client connection is gone')
+    }
+  if status != sessionPush.SENT:
+    return {
+      'statusCode': 500,
+      'body': json.dumps('Could not send server details to frontend')
+    }
+
   logger.info("Sent server details to frontend ! ")
   return {
     'statusCode': 200,
@@ -0,0 +1,151 @@
+# this module splits the session requests into priority lanes and decides which lane the poller serves next. Each lane
+# is its own FIFO queue, PriorityLanes lists them as name:queue:weight, highest priority first, e.g.
+#   clinician:sessions-clinician.fifo:6,paid:sessions-paid.fifo:3,free:sessions.fifo:1
+# requestSession puts a request in the lane named by the PriorityField of the session token claims the authorizer
+# passed on. The claim is the highest lane the client may use, the PriorityField of the request body can only pick a
+# lower one, so a client cannot talk itself into a better lane. Requests without a known claim go to the last lane.
+# Without PriorityLanes there is a single lane on SQSName and nothing changes.
+# The poller shares the servers between the lanes by weight: the next batch comes from the lane that was granted the
+# fewest servers for its weight, so with the weights above clinicians get 6 of every 10 servers while they have a
+# backlog and the free lane still gets 1. A lane with waiting messages that other lanes have passed over for
+# StarvationSeconds is served next whatever the weights say, which bounds the wait of the lower lanes when the higher
+# ones are overloaded. Depth and in-flight messages are published per Lane as lanes metrics
+import os
+import time
+import logging
+
+import runtime
+import tracing
+
+logger = logging.getLogger()
+
+PRIORITY_FIELD = os.environ.get("PriorityField", "priority")
+STARVATION_SECONDS = float(os.environ.get("StarvationSeconds", "120"))
+DEFAULT_LANE = 'standard'
+# the time source of the starvation bound, the load test replaces it with its virtual clock
+clock = time.time
+
+
+class Lane:
+    def __init__(self, name, queue_name, weight=1):
+        self.name = name
+        self.queue_name = queue_name
+        self.weight = weight
+
+    def __repr__(self):
+        return f"Lane({self.name}, {self.queue_name}, weight={self.weight})"
+
+
+def lanes(value=None):
+    """The configured lanes, highest priority first."""
+    value = os.environ.get("PriorityLanes", "") if value is None else value
+    configured = []
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        name, queue_name, *weight = [part.strip() for part in entry.split(':')]
+        configured.append(Lane(name, queue_name, max(1, int(weight[0])) if weight else 1))
+    return configured or [Lane(DEFAULT_LANE, os.environ.get("SQSName", ""))]
+
+
+def lane_for(body, claims=None, configured=None):
+    # the signed claim sets the highest lane allowed, without one that is the lowest lane. The body may ask for a
+    # lower lane than that, never for a higher one
+    configured = configured or lanes()
+    by_name = {lane.name: lane for lane in configured}
+
+    def named(source):
+        value = source.get(PRIORITY_FIELD) if isinstance(source, dict) else None
+        return by_name.get(str(value)) if value is not None else None
+
+    allowed = named(claims) or configured[-1]
+    asked = named(body)
+    if asked is not None and configured.index(asked) > configured.index(allowed):
+        return asked
+    return allowed
+
+
+def queue_url(lane):
+    # resolved once per container
+    sqs = runtime.client('sqs')
+    return runtime.cached(('sqs', lane.queue_name), lambda: sqs.get_queue_url(QueueName=lane.queue_name)['QueueUrl'])
+
+
+def depths(configured=None):
+    """{lane name: (visible, in flight)} with one GetQueueAttributes per lane, published as lanes metrics."""
+    sqs = runtime.client('sqs')
+    result = {}
+    for lane in configured or lanes():
+        attributes = sqs.get_queue_attributes(
+            QueueUrl=queue_url(lane),
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+        )['Attributes']
+        result[lane.name] = (int(attributes.get('ApproximateNumberOfMessages', 0)),
+                             int(attributes.get('ApproximateNumberOfMessagesNotVisible', 0)))
+        tracing.emit_counts('lanes', {'QueueDepth': result[lane.name][0], 'InFlight': result[lane.name][1]},
+                            dimensions=('Lane',), Lane=lane.name)
+    return result
+
+
+class LaneScheduler:
+    def __init__(self, configured, starvation_seconds=None, now=None):
+        self.lanes = configured
+        self.starvation_seconds = STARVATION_SECONDS if starvation_seconds is None else starvation_seconds
+        # servers granted to each lane divided by its weight, the lane with the least is served next
+        self.virtual = {lane.name: 0.0 for lane in configured}
+        # a lane that was never granted a server counts from the creation of the scheduler
+        self.created = clock() if now is None else now
+        self.last_granted = {}
+        self.last_grant = None
+
+    def passed_over(self, lane):
+        # how long other lanes have been granted servers since this one last was. Time in which no lane got a
+        # server, e.g. while the pool is scaling out, does not count
+        if self.last_grant is None:
+            return 0.0
+        return max(0.0, self.last_grant - self.last_granted.get(lane.name, self.created))
+
+    def next_lane(self, candidates, backlog=None):
+        """Picks the lane to receive from among candidates, backlog is {lane name: visible messages}.
+
+        Returns None when there is no candidate.
+        """
+        if not candidates:
+            return None
+        backlog = backlog or {}
+        starving = [lane for lane in candidates
+                    if backlog.get(lane.name) and self.passed_over(lane) >= self.starvation_seconds]
+        if starving:
+            chosen = max(starving, key=self.passed_over)
+            logger.info(f"Lane {chosen.name} was passed over for {self.passed_over(chosen):.0f} s, serving it first")
+            return chosen
+        # ties go to the higher priority lane, the one listed first
+        order = {lane.name: i for i, lane in enumerate(self.lanes)}
+        return min(candidates, key=lambda lane: (self.virtual[lane.name], order.get(lane.name, 0)))
+
+    def skip(self, lane, candidates):
+        # the lane turned out to be empty. It does not bank the share it did not use, otherwise a lane that was idle
+        # for a while would take every server once its requests arrive
+        others = [self.virtual[candidate.name] for candidate in candidates if candidate is not lane]
+        if others:
+            self.virtual[lane.name] = max(self.virtual[lane.name], min(others))
+
+    def granted(self, lane, count, now=None):
+        """Charges the lane for count servers its requests were granted."""
+        self.virtual[lane.name] += count / float(lane.weight)
+        if count:
+            now = clock() if now is None else now
+            self.last_granted[lane.name] = now
+            self.last_grant = now
+
+
+_schedulers = {}
+
+
+def scheduler(configured=None):
+    """The LaneScheduler of this container for the configured lanes, its shares carry over between invocations."""
+    configured = configured or lanes()
+    key = tuple((lane.name, lane.queue_name, lane.weight) for lane in configured)
+    if key not in _schedulers:
+        _schedulers[key] = LaneScheduler(configured)
+    return _schedulers[key]
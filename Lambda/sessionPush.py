@@ -0,0 +1,47 @@
+# this module sends messages to browsers over their API Gateway web socket connection. The management API client is
+# cached per container and a batch of messages is posted concurrently. It is used directly by the poller and by the
+# keepConnectionAlive and sendSessionDetails functions. A connection the browser already closed (GoneException) is
+# reported as GONE so the caller can drop the request and release anything reserved for it
+import json
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import runtime
+
+logger = logging.getLogger()
+
+SENT = 'sent'
+GONE = 'gone'
+ERROR = 'error'
+
+PUSH_CONCURRENCY = int(os.environ.get("PushConcurrency", "10"))
+
+WAITING_MESSAGE = {"status": 'waiting for session!'}
+
+
+def management_client(endpoint_url=None):
+    return runtime.client('apigatewaymanagementapi', endpoint_url=endpoint_url or os.environ["ApiGatewayUrl"])
+
+
+def push(connection_id, data, endpoint_url=None):
+    """Posts data (a dict) to one connection and returns SENT, GONE or ERROR."""
+    client = management_client(endpoint_url)
+    try:
+        client.post_to_connection(ConnectionId=connection_id, Data=json.dumps(data))
+        return SENT
+    except client.exceptions.GoneException:
+        logger.info(f"Connection {connection_id} is gone")
+        return GONE
+    except Exception as e:
+        logger.error(f"Failed to post to connection {connection_id}: {str(e)}")
+        return ERROR
+
+
+def push_many(messages, endpoint_url=None):
+    """Posts [(connection_id, data), ...] concurrently and returns the statuses in the same order."""
+    if not messages:
+        return []
+    workers = min(PUSH_CONCURRENCY, len(messages))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda message: push(message[0], message[1], endpoint_url), messages))
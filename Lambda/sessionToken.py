@@ -0,0 +1,131 @@
+# this module signs and verifies the tokens browsers present when they open the session web socket. A token is a
+# compact JWT signed with HMAC-SHA256 that carries the user (sub) and an expiry (exp). The signing keys come from the
+# SSM parameter named by TokenKeyParameter and are cached per container, so verifying a token is local CPU work only.
+# The parameter holds either one secret or a JSON object {"kid": "secret", ...}; with several keys a new one can be
+# added, used for signing and the old one removed later without invalidating tokens in flight. Mint a token with:
+#   python sessionToken.py --subject alice --ttl 3600 [--kid 2024-06] [--claim priority=priority]
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import math
+import os
+import time
+
+import runtime
+
+logger = logging.getLogger()
+
+KEY_PARAMETER = os.environ.get("TokenKeyParameter", "HealthCoach-TokenSigningKey")
+KEY_CACHE_SECONDS = float(os.environ.get("TokenKeyCacheSeconds", "900"))
+# checked only when set
+ISSUER = os.environ.get("TokenIssuer", "")
+AUDIENCE = os.environ.get("TokenAudience", "")
+LEEWAY_SECONDS = int(os.environ.get("TokenLeewaySeconds", "30"))
+# tokens are short, anything longer is rejected before it is decoded
+MAX_TOKEN_LENGTH = 4096
+DEFAULT_KID = 'default'
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def signing_keys():
+    """Returns {kid: key bytes}, loaded from SSM at most once per KEY_CACHE_SECONDS and container."""
+    def load():
+        # TokenSigningKey is for local runs, deployed functions read the parameter
+        raw = os.environ.get("TokenSigningKey") or runtime.client('ssm').get_parameter(
+            Name=KEY_PARAMETER, WithDecryption=True)['Parameter']['Value']
+        try:
+            keys = json.loads(raw)
+        except ValueError:
+            keys = None
+        if not isinstance(keys, dict):
+            keys = {DEFAULT_KID: raw}
+        return {kid: key.encode('utf-8') for kid, key in keys.items()}
+    return runtime.cached(('token-keys', KEY_PARAMETER), load, ttl=KEY_CACHE_SECONDS)
+
+
+def sign(claims, kid=None, keys=None):
+    keys = keys or signing_keys()
+    kid = kid or sorted(keys)[-1]
+    header = {"alg": "HS256", "typ": "JWT", "kid": kid}
+    signing_input = f"{_b64encode(json.dumps(header, separators=(',', ':')).encode('utf-8'))}." \
+                    f"{_b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))}"
+    signature = hmac.new(keys[kid], signing_input.encode('ascii'), hashlib.sha256).digest()
+    return f"{signing_input}.{_b64encode(signature)}"
+
+
+def verify(token, now=None, keys=None):
+    """Returns the token's claims, or None when it is malformed, badly signed, expired or not yet valid."""
+    if not token or len(token) > MAX_TOKEN_LENGTH or not token.isascii() or token.count('.') != 2:
+        return None
+    encoded_header, encoded_claims, encoded_signature = token.split('.')
+    try:
+        header = json.loads(_b64decode(encoded_header))
+        signature = _b64decode(encoded_signature)
+    except ValueError:
+        return None
+    # the algorithm is fixed, a token cannot downgrade itself to "none"
+    if not isinstance(header, dict) or header.get("alg") != "HS256":
+        return None
+    if not isinstance(header.get("kid", DEFAULT_KID), str):
+        return None
+    key = (keys or signing_keys()).get(header.get("kid", DEFAULT_KID))
+    if key is None:
+        logger.info(f"Token signed with unknown key {header.get('kid')}")
+        return None
+    expected = hmac.new(key, f"{encoded_header}.{encoded_claims}".encode('ascii'), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    try:
+        claims = json.loads(_b64decode(encoded_claims))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict):
+        return None
+
+    now = time.time() if now is None else now
+    # exp is mandatory, a token without one would never expire
+    # bool is an int and NaN/Infinity parse as floats, none of them is a usable expiry
+    exp = claims.get("exp")
+    if isinstance(exp, bool) or not isinstance(exp, (int, float)) or not math.isfinite(exp) or \
+            now > exp + LEEWAY_SECONDS:
+        return None
+    if isinstance(claims.get("nbf"), (int, float)) and now + LEEWAY_SECONDS < claims["nbf"]:
+        return None
+    if ISSUER and claims.get("iss") != ISSUER:
+        return None
+    if AUDIENCE:
+        audience = claims.get("aud")
+        if AUDIENCE != audience and not (isinstance(audience, list) and AUDIENCE in audience):
+            return None
+    return claims
+
+
+def issue(subject, ttl_seconds=3600, kid=None, keys=None, **extra_claims):
+    now = int(time.time())
+    claims = {"sub": subject, "iat": now, "exp": now + int(ttl_seconds)}
+    if ISSUER:
+        claims["iss"] = ISSUER
+    if AUDIENCE:
+        claims["aud"] = AUDIENCE
+    claims.update(extra_claims)
+    return sign(claims, kid, keys)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mint a session web socket token")
+    parser.add_argument('--subject', required=True)
+    parser.add_argument('--ttl', type=int, default=3600, help="seconds until the token expires")
+    parser.add_argument('--kid', help="signing key ID, defaults to the last one in sort order")
+    parser.add_argument('--claim', action='append', default=[], help="extra claim, e.g. priority=priority")
+    args = parser.parse_args()
+    print(issue(args.subject, args.ttl, args.kid, **dict(claim.split('=', 1) for claim in args.claim)))
@@ -0,0 +1,125 @@
+# this module hands out the target group slots kept in the instanceMapping table. Free slots carry a FreeSlot
+# attribute which is the partition key of the sparse FreeSlotIndex, so finding a free slot is a small index query
+# instead of a full table scan. A slot is claimed with a conditional update, so two instances booting at the same
+# time can never be written into the same slot, and the loser simply retries with another candidate
+import os
+import random
+import time
+import logging
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+FREE_SLOT_INDEX = os.environ.get("FreeSlotIndexName", "FreeSlotIndex")
+FREE_MARKER = 'free'
+# tag put on a signalling instance with the TargetGroup key of the slot it holds
+SLOT_TAG = 'TargetGroup'
+
+CLAIM_ATTEMPTS = 5
+CANDIDATES_PER_ATTEMPT = 5
+
+
+def free_slots(table, limit=CANDIDATES_PER_ATTEMPT):
+    # the index is eventually consistent, a returned slot may already be taken and has to be claimed conditionally
+    response = table.query(
+        IndexName=FREE_SLOT_INDEX,
+        KeyConditionExpression=Key('FreeSlot').eq(FREE_MARKER),
+        Limit=limit
+    )
+    return response['Items']
+
+
+def count_free_slots(table, limit=None):
+    params = {
+        'IndexName': FREE_SLOT_INDEX,
+        'KeyConditionExpression': Key('FreeSlot').eq(FREE_MARKER),
+        'Select': 'COUNT'
+    }
+    if limit:
+        params['Limit'] = limit
+    count = 0
+    while True:
+        response = table.query(**params)
+        count += response['Count']
+        if (limit and count >= limit) or 'LastEvaluatedKey' not in response:
+            return count
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _is_conditional_failure(err):
+    return err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def claim_slot(table, instance_id, attempts=CLAIM_ATTEMPTS):
+    """Writes instance_id into a free slot and returns the claimed item, or None when no slot is free."""
+    for attempt in range(attempts):
+        candidates = free_slots(table)
+        if not candidates:
+            logger.info("No free target group slots")
+            return None
+        # spread concurrent claimers over the candidates to keep contention low
+        random.shuffle(candidates)
+        for candidate in candidates:
+            try:
+                response = table.update_item(
+                    Key={'TargetGroup': candidate['TargetGroup']},
+                    UpdateExpression="SET InstanceID = :iid REMOVE FreeSlot",
+                    ConditionExpression=Attr('FreeSlot').eq(FREE_MARKER) & Attr('InstanceID').eq(''),
+                    ExpressionAttributeValues={':iid': instance_id},
+                    ReturnValues='ALL_NEW'
+                )
+                logger.info(f"Claimed slot {candidate['TargetGroup']} for {instance_id}")
+                return response['Attributes']
+            except ClientError as err:
+                if not _is_conditional_failure(err):
+                    raise
+                logger.info(f"Slot {candidate['TargetGroup']} was claimed concurrently, trying the next one")
+        # every candidate was taken, back off with jitter before reading the index again
+        time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+    logger.warning(f"Could not claim a slot for {instance_id} after {attempts} attempts")
+    return None
+
+
+def get_slot(table, target_group, instance_id=None):
+    # keyed read of a slot, optionally only when it is held by instance_id
+    item = table.get_item(Key={'TargetGroup': target_group}, ConsistentRead=True).get('Item')
+    if item is None or (instance_id is not None and item.get('InstanceID') != instance_id):
+        return None
+    return item
+
+
+def release_slot(table, target_group, instance_id=None):
+    """Marks the slot free again. With instance_id, only releases it while that instance still holds it."""
+    params = {
+        'Key': {'TargetGroup': target_group},
+        'UpdateExpression': "SET InstanceID = :empty, FreeSlot = :free",
+        'ExpressionAttributeValues': {':empty': '', ':free': FREE_MARKER}
+    }
+    if instance_id is not None:
+        params['ConditionExpression'] = Attr('InstanceID').eq(instance_id)
+    try:
+        table.update_item(**params)
+        logger.info(f"Released slot {target_group}")
+        return True
+    except ClientError as err:
+        if not _is_conditional_failure(err):
+            raise
+        logger.info(f"Slot {target_group} is no longer held by {instance_id}, nothing to release")
+        return False
+
+
+def backfill_free_index(table):
+    # marks free slots written before the index existed, returns how many were updated
+    params = {'FilterExpression': Attr('InstanceID').eq('') & Attr('FreeSlot').not_exists(),
+              'ProjectionExpression': 'TargetGroup'}
+    updated = 0
+    while True:
+        response = table.scan(**params)
+        for item in response['Items']:
+            release_slot(table, item['TargetGroup'], instance_id='')
+            updated += 1
+        if 'LastEvaluatedKey' not in response:
+            return updated
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
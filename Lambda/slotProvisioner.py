@@ -0,0 +1,245 @@
+# this module grows and shrinks the set of target group slots so that capacity can follow concurrencyLimit without a
+# stack update. A slot is a target group of the Signalling ALB, the query string rule (session=NN) that forwards to it
+# and its item in instanceMapping. The stack creates the first ones; ensure() creates more when fewer than MinFreeSlots
+# (or the free slots a caller is about to use) are free, up to concurrencyLimit slots and MaxSlots, the ALB's rule
+# quota. It retires free slots it created itself when more than MinFreeSlots + SlotRetireSurplus are free or there are
+# more slots than concurrencyLimit. The stack's own slots are never retired. New slots are written to the table with
+# one batch write. Retired ones are taken out of the FreeSlotIndex first, in one conditional transaction, so that no
+# instance can claim them while their rule and target group are deleted. Concurrent callers are serialized with a
+# launchLock lease
+import os
+import re
+import logging
+
+from botocore.exceptions import ClientError
+
+import launchLock
+import runtime
+import slotAllocator
+import tracing
+
+logger = logging.getLogger()
+
+MIN_FREE_SLOTS = int(os.environ.get("MinFreeSlots", "1"))
+RETIRE_SURPLUS = int(os.environ.get("SlotRetireSurplus", "2"))
+# application load balancers allow 100 rules per listener, the default action is one of them
+MAX_SLOTS = int(os.environ.get("MaxSlots", "99"))
+NAME_PREFIX = os.environ.get("SlotTargetGroupPrefix", "SignallingTargetGroup")
+QUERY_KEY = 'session'
+# marks the slots this module created, on the target group, the rule and the table item
+MANAGED_BY = 'slotProvisioner'
+TRANSACTION_CHUNK = 100
+
+# session=02 -> 2
+_QUERY_NUMBER = re.compile(rf"^{QUERY_KEY}=(\d+)$")
+
+
+def paged(call, result_key, **params):
+    # elbv2 describe_* calls page with Marker/NextMarker
+    while True:
+        response = call(**params)
+        yield from response.get(result_key, [])
+        if not response.get('NextMarker'):
+            return
+        params['Marker'] = response['NextMarker']
+
+
+def plan(total, free, concurrency_limit, wanted_free=0, min_free=None, surplus=None, max_slots=None):
+    """Returns (slots to create, free slots to retire) for total slots of which free are free."""
+    min_free = MIN_FREE_SLOTS if min_free is None else min_free
+    surplus = RETIRE_SURPLUS if surplus is None else surplus
+    max_slots = MAX_SLOTS if max_slots is None else max_slots
+    wanted_free = max(min_free, wanted_free)
+    # an instance never needs more than one slot, so there is no point in more slots than instances
+    cap = min(concurrency_limit, max_slots)
+    create = max(0, min(wanted_free - free, cap - total))
+    if create:
+        return create, 0
+    retire = max(0, free - (wanted_free + surplus), total - cap)
+    return 0, min(retire, free)
+
+
+def listener(elbv2, alb_name):
+    """(listener ARN, VPC ID) of the Signalling ALB, resolved once per container."""
+    def load():
+        balancer = elbv2.describe_load_balancers(Names=[alb_name])['LoadBalancers'][0]
+        listeners = list(paged(elbv2.describe_listeners, 'Listeners', LoadBalancerArn=balancer['LoadBalancerArn']))
+        chosen = next((item for item in listeners if item.get('Port') == 80), listeners[0])
+        return chosen['ListenerArn'], balancer['VpcId']
+    return runtime.cached(('signalling-listener', alb_name), load)
+
+
+def _free(item):
+    return item.get('FreeSlot') == slotAllocator.FREE_MARKER and not item.get('InstanceID')
+
+
+def _number(item):
+    match = _QUERY_NUMBER.match(item.get('QueryString', ''))
+    return int(match.group(1)) if match else None
+
+
+def create_slots(table, elbv2, alb_name, count, current):
+    """Creates count target groups and query string rules and writes their slots in one batch, returns the items."""
+    listener_arn, vpc_id = listener(elbv2, alb_name)
+    rules = list(paged(elbv2.describe_rules, 'Rules', ListenerArn=listener_arn))
+    used_priorities = {int(rule['Priority']) for rule in rules if str(rule.get('Priority', '')).isdigit()}
+    used_numbers = {_number(item) for item in current.values()}
+    for rule in rules:
+        for condition in rule.get('Conditions', []):
+            for value in condition.get('QueryStringConfig', {}).get('Values', []):
+                if value.get('Key') == QUERY_KEY and value.get('Value', '').isdigit():
+                    used_numbers.add(int(value['Value']))
+    # number 01 is the default target group of the listener, it has no rule and no slot
+    used_numbers.add(1)
+    tags = [{'Key': 'ManagedBy', 'Value': MANAGED_BY}]
+
+    items = []
+    number, priority = 1, 0
+    for _ in range(count):
+        while number in used_numbers:
+            number += 1
+        priority += 1
+        while priority in used_priorities:
+            priority += 1
+        value = f"{number:02d}"
+        try:
+            target_group = elbv2.create_target_group(
+                Name=f"{NAME_PREFIX}{value}", Protocol='HTTP', Port=80, VpcId=vpc_id, TargetType='instance', Tags=tags
+            )['TargetGroups'][0]
+            rule = elbv2.create_rule(
+                ListenerArn=listener_arn,
+                Priority=priority,
+                Conditions=[{'Field': 'query-string', 'QueryStringConfig': {'Values': [{'Key': QUERY_KEY, 'Value': value}]}}],
+                Actions=[{'Type': 'forward', 'TargetGroupArn': target_group['TargetGroupArn']}],
+                Tags=tags
+            )['Rules'][0]
+        except ClientError as err:
+            # e.g. a target group or rule quota, the slots created so far are still written
+            logger.error(f"Could not create slot {value}: {err}")
+            break
+        used_numbers.add(number)
+        used_priorities.add(priority)
+        # the same TargetGroup key and QueryString uploadToDDB derives from the rule
+        items.append({
+            'TargetGroup': f"TG{value}",
+            'ARN': target_group['TargetGroupArn'],
+            'QueryString': f"{QUERY_KEY}={value}",
+            'InstanceID': '',
+            'FreeSlot': slotAllocator.FREE_MARKER,
+            'RuleArn': rule['RuleArn'],
+            'ManagedBy': MANAGED_BY
+        })
+
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+    return items
+
+
+def _withdraw(table, items):
+    # takes the slots out of the FreeSlotIndex while they are still free, returns the ones that were withdrawn. A
+    # chunk whose transaction is cancelled because a slot was claimed meanwhile falls back to single updates
+    client = table.meta.client
+    update = {
+        'UpdateExpression': "REMOVE FreeSlot",
+        'ConditionExpression': "FreeSlot = :free AND InstanceID = :empty",
+        'ExpressionAttributeValues': {':free': slotAllocator.FREE_MARKER, ':empty': ''}
+    }
+    withdrawn = []
+    for i in range(0, len(items), TRANSACTION_CHUNK):
+        chunk = items[i:i + TRANSACTION_CHUNK]
+        try:
+            client.transact_write_items(TransactItems=[
+                {'Update': dict(update, TableName=table.name, Key={'TargetGroup': item['TargetGroup']})} for item in chunk])
+            withdrawn += chunk
+        except client.exceptions.TransactionCanceledException:
+            logger.info(f"Transaction cancelled, withdrawing {len(chunk)} slots one by one")
+            for item in chunk:
+                try:
+                    table.update_item(Key={'TargetGroup': item['TargetGroup']}, **update)
+                    withdrawn.append(item)
+                except ClientError as err:
+                    if err.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                        raise
+    return withdrawn
+
+
+def retire_slots(table, elbv2, count, current):
+    """Deletes up to count free slots created by this module, newest first, returns the retired items."""
+    candidates = sorted((item for item in current.values() if item.get('ManagedBy') == MANAGED_BY and _free(item)),
+                        key=lambda item: _number(item) or 0, reverse=True)[:count]
+    retired = []
+    for item in _withdraw(table, candidates):
+        try:
+            # the rule goes first, a target group cannot be deleted while a rule forwards to it
+            elbv2.delete_rule(RuleArn=item['RuleArn'])
+            elbv2.delete_target_group(TargetGroupArn=item['ARN'])
+        except ClientError as err:
+            # the item stays out of the index and is picked up by the next run that finds it
+            logger.error(f"Could not delete slot {item['TargetGroup']}: {err}")
+            continue
+        retired.append(item)
+    with table.batch_writer() as batch:
+        for item in retired:
+            batch.delete_item(Key={'TargetGroup': item['TargetGroup']})
+    return retired
+
+
+def current_slots(table):
+    # one paginated read of the whole mapping table
+    items = {}
+    params = {}
+    while True:
+        response = table.scan(**params)
+        for item in response['Items']:
+            items[item['TargetGroup']] = item
+        if 'LastEvaluatedKey' not in response:
+            return items
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def ensure(table, concurrency_limit, wanted_free=0, dry_run=False):
+    """Provisions or retires slots so that at least max(MinFreeSlots, wanted_free) are free.
+
+    wanted_free counts the slots about to be claimed: instances that are booting or being launched. Returns
+    {'slots', 'free', 'created', 'retired'}, or None when ALBName is not set or another caller holds the lock.
+    """
+    alb_name = os.environ.get("ALBName")
+    if not alb_name:
+        return None
+    lock = launchLock.LaunchLock('slot-provisioner')
+    if not dry_run and not lock.acquire():
+        return None
+    try:
+        current = current_slots(table)
+        # withdrawn slots whose deletion failed are neither free nor usable, their deletion is retried below
+        stale = [item for item in current.values() if item.get('ManagedBy') == MANAGED_BY and
+                 not item.get('InstanceID') and 'FreeSlot' not in item]
+        total = len(current) - len(stale)
+        free = sum(1 for item in current.values() if _free(item))
+        create, retire = plan(total, free, concurrency_limit, wanted_free)
+        logger.info(f"Slots {total}, free {free}, wanted free {wanted_free}: create {create}, retire {retire}")
+        if dry_run:
+            return {'slots': total, 'free': free, 'created': create, 'retired': retire}
+
+        elbv2 = runtime.client('elbv2')
+        created = len(create_slots(table, elbv2, alb_name, create, current)) if create else 0
+        retired = len(retire_slots(table, elbv2, retire, current)) if retire else 0
+        for item in stale:
+            # the rule or target group may already be gone from the earlier attempt
+            for call, params in ((elbv2.delete_rule, {'RuleArn': item['RuleArn']}),
+                                 (elbv2.delete_target_group, {'TargetGroupArn': item['ARN']})):
+                try:
+                    call(**params)
+                except ClientError as err:
+                    if err.response.get('Error', {}).get('Code') not in ('RuleNotFound', 'TargetGroupNotFound'):
+                        raise
+            table.delete_item(Key={'TargetGroup': item['TargetGroup']})
+
+        report = {'slots': total + created - retired, 'free': free + created - retired,
+                  'created': created, 'retired': retired}
+        tracing.emit_counts('slots', {'Slots': report['slots'], 'FreeSlots': report['free'],
+                                      'SlotsCreated': created, 'SlotsRetired': retired})
+        return report
+    finally:
+        lock.release()
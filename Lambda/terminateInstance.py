@@ -2,65 +2,163 @@
 # to stop the instance after a predefined period like 20 minutes. Once instance moved to stopped state, an Event bridge rule
 # triggers this function to terminate the stopped instance
 # a varriation of the Event Bridge rule also triggers ths function on schedule, passing the paramater stopAllServers=true in event
-# causing all Signalling servers to be terminated at the same time
+# causing all Signalling servers to be terminated at the same time. The bulk teardown pages through all instances and
+# mappings, terminates/deregisters in parallel chunks and then clears the mappings with transactional writes. A slot
+# is only returned to the pool once its instance left the target group or was terminated, so a new instance never
+# shares a target group with the old one
+# with a warm pool configured (WarmPoolSize, see warmPool.py) a stopped instance is parked instead of terminated while
+# the pool has room for it, so that createInstances can start it again. The bulk teardown still terminates everything
 
-import boto3
 import json
 import os
-import json
+from concurrent.futures import ThreadPoolExecutor
+
 from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import runtime
+import slotAllocator
+import warmPool
+
+# DynamoDB transactions take at most 100 items
+TRANSACTION_CHUNK = 100
+TERMINATE_CHUNK = int(os.environ.get("TerminateChunkSize", "50"))
+TEARDOWN_WORKERS = int(os.environ.get("TeardownWorkers", "8"))
+
+
+def chunks(items, size):
+  for i in range(0, len(items), size):
+    yield items[i:i + size]
+
+
+def list_signalling_instances(ec2):
+  # every signalling instance that is not already terminated, across all pages and all instances of a reservation
+  instanceIds = []
+  paginator = ec2.get_paginator('describe_instances')
+  for page in paginator.paginate(Filters=[
+      {'Name': 'tag:type', 'Values': ['signalling']},
+      {'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}]):
+    for reservation in page['Reservations']:
+      for instance in reservation['Instances']:
+        instanceIds.append(instance['InstanceId'])
+  return instanceIds
+
+
+def load_instance_mapping(table):
+  # all slots that hold an instance, keyed by instance id
+  instanceMapping = {}
+  params = {'FilterExpression': Attr('InstanceID').ne('')}
+  while True:
+    response = table.scan(**params)
+    for item in response['Items']:
+      instanceMapping[item['InstanceID']] = item
+    if 'LastEvaluatedKey' not in response:
+      return instanceMapping
+    params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def clear_mappings(table, items):
+  # each chunk is released in one transaction, conditional on the slot still being held by the same instance. If a
+  # slot changed hands in the meantime the transaction is cancelled and that chunk falls back to single releases
+  client = table.meta.client
+  for chunk in chunks(items, TRANSACTION_CHUNK):
+    try:
+      client.transact_write_items(TransactItems=[{
+        'Update': {
+          'TableName': table.name,
+          'Key': {'TargetGroup': item['TargetGroup']},
+          'UpdateExpression': "SET InstanceID = :empty, FreeSlot = :free",
+          'ConditionExpression': "InstanceID = :iid",
+          'ExpressionAttributeValues': {':empty': '', ':free': slotAllocator.FREE_MARKER, ':iid': item['InstanceID']}
+        }
+      } for item in chunk])
+    except client.exceptions.TransactionCanceledException:
+      print(f'Transaction cancelled, releasing {len(chunk)} slots one by one')
+      for item in chunk:
+        slotAllocator.release_slot(table, item['TargetGroup'], item['InstanceID'])
+
+
+def deregister_and_terminate(ec2, elbClient, instanceIds, instanceMapping, terminate=True):
+  # deregistration from the slot target groups and termination run in parallel chunks. Returns the instance ids that
+  # could not be deregistered; a terminated instance leaves its target group anyway, so they do not stop the teardown
+  def deregister(item):
+    if not item.get('ARN'):
+      return None
+    try:
+      elbClient.deregister_targets(TargetGroupArn=item['ARN'], Targets=[{'Id': item['InstanceID']}])
+    except ClientError as err:
+      print(f"Could not deregister {item['InstanceID']} from {item['ARN']}: {err}")
+      return item['InstanceID']
+    return None
+
+  def terminate_chunk(chunk):
+    ec2.terminate_instances(InstanceIds=chunk)
+    print(f'Terminated {len(chunk)} signalling instances')
+
+  mapped = [instanceMapping[i] for i in instanceIds if i in instanceMapping]
+  with ThreadPoolExecutor(max_workers=TEARDOWN_WORKERS) as executor:
+    deregistrations = [executor.submit(deregister, item) for item in mapped]
+    terminations = [executor.submit(terminate_chunk, chunk) for chunk in chunks(instanceIds, TERMINATE_CHUNK)] \
+      if terminate else []
+    for future in terminations:
+      # surfaces the first termination error after every chunk had its chance to run
+      future.result()
+    return [instanceId for instanceId in (future.result() for future in deregistrations) if instanceId]
+
+
+def find_slot(table, instance):
+  # keyed lookup through the slot tag written by registerInstances, with a scan only for untagged instances
+  tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+  if slotAllocator.SLOT_TAG in tags:
+    return slotAllocator.get_slot(table, tags[slotAllocator.SLOT_TAG], instance['InstanceId'])
+  params = {'FilterExpression': Attr('InstanceID').eq(instance['InstanceId'])}
+  while True:
+    response = table.scan(**params)
+    if response['Items']:
+      return response['Items'][0]
+    if 'LastEvaluatedKey' not in response:
+      return None
+    params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
 
 def lambda_handler(event, context):
-  
-  # get all TG to instance mapping from dynamoDB to remove mapping later during termination
-  dynamodb = boto3.resource('dynamodb')
+
+  dynamodb = runtime.resource('dynamodb')
   table = dynamodb.Table('instanceMapping')
-  response = table.scan(FilterExpression=Attr('InstanceID').ne(''))
-  instanceMapping={}
-  for item in response['Items']:
-      instanceMapping[item['InstanceID']]=item['TargetGroup']
-  print(json.dumps(instanceMapping))
-  
+  ec2 = runtime.client('ec2')
+  elbClient = runtime.client('elbv2')
+
   if("stopAllServers" in event):
         if(event["stopAllServers"]):
-          ec2 = boto3.client('ec2')
-          allInstances=[]
-          response = ec2.describe_instances(Filters=[{'Name': 'tag:type', 'Values': ['signalling']}])
-          for reservation in response['Reservations']:
-            instanceID=reservation['Instances'][0]['InstanceId']
-            print('Found instance id '+instanceID)
-            allInstances.append(instanceID)
-            # remove instance mapping from dynamoDb table
-            table.update_item(
-              Key={
-                'TargetGroup': instanceMapping[instanceID],
-                },
-                UpdateExpression="set InstanceID = :i",
-                ExpressionAttributeValues={
-                    ':i': ''
-                    }
-            )
-          print('will terminate all signalling instances ')
-          ec2.terminate_instances(InstanceIds=allInstances)
+          # get all TG to instance mapping from dynamoDB to remove mapping during termination
+          instanceMapping = load_instance_mapping(table)
+          allInstances = list_signalling_instances(ec2)
+          print(f'Found {len(allInstances)} signalling instances, {len(instanceMapping)} mapped slots')
+          if allInstances:
+            print('will terminate all signalling instances ')
+            deregister_and_terminate(ec2, elbClient, allInstances, instanceMapping)
+            # remove instance mapping from dynamoDb table once the instances are gone
+            clear_mappings(table, [instanceMapping[i] for i in allInstances if i in instanceMapping])
   else:
           instanceId=event["detail"]["instance-id"]
-          ec2 = boto3.client('ec2')
           # describe instance based on instance id
           response = ec2.describe_instances(InstanceIds=[instanceId],Filters=[{'Name': 'tag:type', 'Values': ['signalling']}])
           if(len(response['Reservations'])==1):
-            print('will terminate instance '+instanceId)
-            # remove instance mapping from dynamoDb table
-            table.update_item(
-            Key={
-                'TargetGroup': instanceMapping[instanceId],
-                },
-                UpdateExpression="set InstanceID = :i",
-                ExpressionAttributeValues={
-                    ':i': ''
-                    }
-            )
-            ec2.terminate_instances(InstanceIds=[instanceId])
+            instance = response['Reservations'][0]['Instances'][0]
+            slot = find_slot(table, instance)
+            instanceMapping = {instanceId: slot} if slot is not None else {}
+            # the instance is deregistered before it is parked, a warm start must not find it in its old target group.
+            # One that is still registered is terminated instead
+            failed = deregister_and_terminate(ec2, elbClient, [instanceId], instanceMapping, terminate=False)
+            if not failed and warmPool.park(ec2, instance):
+              print('parked instance '+instanceId+' in the warm pool')
+            else:
+              print('will terminate instance '+instanceId)
+              ec2.terminate_instances(InstanceIds=[instanceId])
+            # remove instance mapping from dynamoDb table and return the slot to the free pool
+            if slot is not None:
+              slotAllocator.release_slot(table, slot['TargetGroup'], instanceId)
   return {
     'statusCode': 200,
-    'body': json.dumps('Instance was terminated successfully !')    
+    'body': json.dumps('Instance was terminated successfully !')
   }
@@ -0,0 +1,90 @@
+# shared fixtures of the Lambda tests. The handlers run against the in-process AWS stand-ins of benchmarks/fakeAws.py
+# and the HTTP MatchMaker of benchmarks/fakeMatchmaker.py, the same ones the load test uses. boto3.client and
+# boto3.resource are routed to the stand-ins, so runtime.py's own per-container caching is what the tests exercise.
+# Run from the repository root with: python -m pytest Lambda/tests
+import os
+import sys
+from collections import Counter
+
+import pytest
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LAMBDA_DIR)
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'benchmarks'))
+
+import fakeAws
+import fakeMatchmaker
+import runtime
+
+CLIENT_SECRET = 'test-secret'
+
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'SQSName': 'sessions.fifo',
+    'ApiGatewayUrl': 'https://websocket.local/production',
+    'DynamoDBName': 'instanceMapping',
+    'CreateInstancesArn': 'arn:aws:lambda:local:000000000000:function:HealthCoach-createInstances',
+}
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """A fresh FakeAws behind boto3, aws.created counts the clients and resources runtime creates per service."""
+    import boto3
+
+    fake = fakeAws.FakeAws()
+    fake.created = Counter()
+
+    def client(service_name, **kwargs):
+        fake.created[f"client.{service_name}"] += 1
+        return fake.client(service_name, **kwargs)
+
+    def resource(service_name, **kwargs):
+        fake.created[f"resource.{service_name}"] += 1
+        return fake.resource(service_name, **kwargs)
+
+    monkeypatch.setattr(boto3, 'client', client)
+    monkeypatch.setattr(boto3, 'resource', resource)
+    monkeypatch.setattr(runtime, '_clients', {})
+    monkeypatch.setattr(runtime, '_resources', {})
+    monkeypatch.setattr(runtime, '_cache', {})
+    for name, value in ENVIRONMENT.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv('PriorityLanes', raising=False)
+    return fake
+
+
+@pytest.fixture
+def matchmaker(aws, monkeypatch):
+    """A FakeMatchmaker served over HTTP with MatchMakerURL and the client secret parameter pointing at it."""
+    fake = fakeMatchmaker.FakeMatchmaker(aws, CLIENT_SECRET)
+    monkeypatch.setenv('MatchMakerURL', fake.start())
+    aws.ssm.parameters['HealthCoach-ClientSecret'] = CLIENT_SECRET
+    yield fake
+    fake.stop()
+
+
+def add_servers(aws, matchmaker, count):
+    """Registers count ready signalling servers, each in its own instanceMapping slot, returns their instance IDs."""
+    table = aws.dynamodb.Table('instanceMapping')
+    instance_ids = []
+    for i in range(2, count + 2):
+        instance_id = f"i-{i:04d}"
+        table.items[f"TG{i:02d}"] = {'TargetGroup': f"TG{i:02d}", 'ARN': f"arn:tg/TG{i:02d}",
+                                     'QueryString': f"session={i:02d}", 'InstanceID': instance_id}
+        matchmaker.server_ready(instance_id)
+        instance_ids.append(instance_id)
+    return instance_ids
+
+
+def enqueue(aws, count, start=0, queue_name='sessions.fifo'):
+    """Queues count session requests the way requestSession does, returns their connection IDs."""
+    import json
+    queue = aws.queue(queue_name)
+    connection_ids = []
+    for i in range(start, start + count):
+        connection_id = f"conn-{i:04d}"
+        queue.send_message(MessageBody=json.dumps({'connectionId': connection_id, 'requestId': f"req-{i:04d}"}),
+                           MessageGroupId=connection_id, MessageDeduplicationId=f"req-{i:04d}")
+        connection_ids.append(connection_id)
+    return connection_ids
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+import authorizeClient
+import sessionToken
+
+METHOD_ARN = 'arn:aws:execute-api:eu-west-1:123456789012:api-id/production/$connect'
+
+
+@pytest.fixture(autouse=True)
+def signing_key(monkeypatch):
+    monkeypatch.setenv('TokenSigningKey', 'secret')
+    monkeypatch.setattr(authorizeClient, 'LEGACY_TOKEN_ID', 'abcd')
+    monkeypatch.setattr(authorizeClient, 'LEGACY_TOKEN_UNTIL', float('inf'))
+
+
+def authorize(token):
+    response = authorizeClient.lambda_handler(
+        {'type': 'REQUEST', 'methodArn': METHOD_ARN, 'queryStringParameters': {'tokenId': token}}, None)
+    return response['policyDocument']['Statement'][0]['Effect'], response
+
+
+def test_signed_token_is_allowed_with_its_claims(aws):
+    effect, response = authorize(sessionToken.issue('alice', priority='priority'))
+
+    assert effect == 'Allow'
+    assert response['principalId'] == 'alice'
+    assert response['policyDocument']['Statement'][0]['Resource'] == METHOD_ARN
+    assert response['context']['priority'] == 'priority'
+
+
+def test_invalid_token_is_denied(aws):
+    assert authorize('not-a-token')[0] == 'Deny'
+    assert authorize(sessionToken.issue('alice', ttl_seconds=-3600))[0] == 'Deny'
+
+
+def test_legacy_token_is_allowed_during_the_migration_window(aws, monkeypatch):
+    effect, response = authorize('abcd')
+
+    assert effect == 'Allow' and response['principalId'] == authorizeClient.LEGACY_SUBJECT
+
+    monkeypatch.setattr(authorizeClient, 'LEGACY_TOKEN_UNTIL', time.time() - 1)
+    assert authorize('abcd')[0] == 'Deny'
+    monkeypatch.setattr(authorizeClient, 'LEGACY_TOKEN_UNTIL', float('inf'))
+    monkeypatch.setattr(authorizeClient, 'LEGACY_TOKEN_ID', '')
+    assert authorize('abcd')[0] == 'Deny'
+    assert authorize('')[0] == 'Deny'
+
+
+def test_connect_integration_answers_with_a_status_code(aws):
+    response = authorizeClient.lambda_handler({'queryStringParameters': {'tokenId': 'abcd'}}, None)
+
+    assert response['statusCode'] == 200
+    assert authorizeClient.lambda_handler({'queryStringParameters': {'tokenId': 'x'}}, None)['statusCode'] == 401
+
+
+def test_key_id_list_is_denied_not_raised(aws):
+    header = sessionToken._b64encode(b'{"alg":"HS256","kid":["a","b"]}')
+    _, claims, signature = sessionToken.issue('alice').split('.')
+
+    assert authorize(f"{header}.{claims}.{signature}")[0] == 'Deny'
+
+
+def test_unusable_expiry_is_denied_not_raised(aws, monkeypatch):
+    # whatever verify lets through, an expiry that is no integer ends in a Deny
+    for exp in (float('inf'), float('nan'), 'soon'):
+        monkeypatch.setattr(authorizeClient, 'verify', lambda token, exp=exp: {'sub': 'alice', 'exp': exp})
+        assert authorize('token')[0] == 'Deny'
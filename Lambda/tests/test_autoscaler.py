@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+import autoscaler
+import fakeAws
+from conftest import enqueue
+
+
+@pytest.fixture
+def config(aws, matchmaker, monkeypatch):
+    aws.ssm.parameters['HealthCoach-ConcurrencyLimit'] = '10'
+    monkeypatch.delenv('ALBName', raising=False)
+
+
+def scale(event):
+    response = autoscaler.lambda_handler(event, None)
+    assert response['statusCode'] == 200, response
+    return json.loads(response['body'])
+
+
+def test_metric_read_failure_scales_without_a_forecast(aws, config, monkeypatch, caplog):
+    def access_denied(**kwargs):
+        raise fakeAws.client_error('AccessDenied', 'GetMetricStatistics')
+
+    monkeypatch.setattr(aws.cloudwatch, 'get_metric_statistics', access_denied)
+    enqueue(aws, 2)
+
+    body = scale({'dryRun': True})
+
+    # 2 waiting and 1 warm spare, no idle server
+    assert body['decision']['launch'] == 3 and body['decision']['forecastRate'] == 0.0
+    assert 'Could not read the arrival history' in caplog.text
+
+
+def test_launch_is_requested_from_create_instances(aws, config):
+    enqueue(aws, 1)
+
+    body = scale({})
+
+    assert body['decision']['launch'] == 2
+    assert aws.calls['lambda.Invoke'] == 1
@@ -0,0 +1,139 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'infra'))
+
+import buildManifest
+
+CHUNK = 4
+
+
+class RecordingStore(buildManifest.LocalStore):
+    def __init__(self, path):
+        super().__init__(path)
+        self.puts = []
+
+    def put(self, name, data):
+        self.puts.append(name)
+        super().put(name, data)
+
+
+def write(root, files):
+    for relative, data in files.items():
+        path = os.path.join(root, *relative.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def build(tmp_path, name, files):
+    root = str(tmp_path / name)
+    os.makedirs(root, exist_ok=True)
+    write(root, files)
+    return root
+
+
+def test_files_are_cut_into_fixed_size_chunks_with_a_short_last_one(tmp_path):
+    root = build(tmp_path, 'build', {'a.bin': b'aaaabbbbcc', 'empty.bin': b''})
+
+    sha256, chunks = buildManifest.hash_file(os.path.join(root, 'a.bin'), CHUNK)
+
+    assert len(chunks) == 3
+    assert chunks[2] == buildManifest.hashlib.sha256(b'cc').hexdigest()
+    assert sha256 == buildManifest.hashlib.sha256(b'aaaabbbbcc').hexdigest()
+    assert buildManifest.hash_file(os.path.join(root, 'empty.bin'), CHUNK)[1] == []
+    locations = buildManifest.chunk_locations(buildManifest.build_manifest(root, CHUNK), root)
+    assert locations[chunks[2]] == (os.path.join(root, 'a.bin'), 8, 2)
+
+
+def test_manifest_version_depends_only_on_content(tmp_path):
+    first = build(tmp_path, 'first', {'a.bin': b'aaaabbbb', 'sub/b.bin': b'cc'})
+    second = build(tmp_path, 'second', {'a.bin': b'aaaabbbb', 'sub/b.bin': b'cc',
+                                        buildManifest.STATE_DIR + '/state.json': b'{}'})
+    third = build(tmp_path, 'third', {'a.bin': b'aaaabbbb', 'sub/b.bin': b'cd'})
+
+    manifest = buildManifest.build_manifest(first, CHUNK)
+
+    assert [entry['path'] for entry in manifest['files']] == ['a.bin', 'sub/b.bin']
+    assert buildManifest.build_manifest(second, CHUNK)['version'] == manifest['version']
+    assert buildManifest.build_manifest(third, CHUNK)['version'] != manifest['version']
+    assert buildManifest.build_manifest(first, 2 * CHUNK)['version'] != manifest['version']
+
+
+def test_diff_downloads_only_the_new_chunks_of_changed_files(tmp_path):
+    old = buildManifest.build_manifest(
+        build(tmp_path, 'old', {'a.bin': b'aaaabbbbcc', 'b.bin': b'dddd', 'gone.bin': b'eeee'}), CHUNK)
+    new = buildManifest.build_manifest(
+        build(tmp_path, 'new', {'a.bin': b'aaaaxxxxcc', 'b.bin': b'dddd', 'c.bin': b'bbbb'}), CHUNK)
+
+    assert buildManifest.diff(old, new) == {
+        'files': 3,
+        'changedFiles': 2,
+        'removedFiles': 1,
+        'buildBytes': 18,
+        # a.bin only lacks xxxx, c.bin is made of a chunk the old a.bin already had
+        'downloadChunks': 1,
+        'downloadBytes': 4
+    }
+
+
+def test_diff_with_another_chunk_size_downloads_every_changed_file(tmp_path):
+    old = buildManifest.build_manifest(build(tmp_path, 'old', {'a.bin': b'aaaabbbb', 'b.bin': b'cccc'}), 2 * CHUNK)
+    new = buildManifest.build_manifest(build(tmp_path, 'new', {'a.bin': b'aaaabbbx', 'b.bin': b'cccc'}), CHUNK)
+
+    result = buildManifest.diff(old, new)
+
+    assert result['changedFiles'] == 1
+    assert (result['downloadChunks'], result['downloadBytes']) == (2, 8)
+
+
+def test_publish_uploads_each_missing_chunk_once_and_latest_last(tmp_path):
+    root = build(tmp_path, 'build', {'a.bin': b'aaaaaaaabb', 'b.bin': b'aaaa'})
+    store = RecordingStore(str(tmp_path / 'store'))
+
+    result = buildManifest.publish(root, store, CHUNK, workers=2, sync_script=None)
+
+    assert (result['files'], result['chunks'], result['uploadedChunks'], result['uploadedBytes']) == (2, 2, 2, 6)
+    assert store.list('chunks') == {buildManifest.hashlib.sha256(data).hexdigest() for data in (b'aaaa', b'bb')}
+    assert store.puts[-1] == 'latest.json'
+    latest = json.loads(store.get('latest.json'))
+    assert latest == {'version': result['version'], 'manifest': f"manifests/{result['version']}.json"}
+    assert json.loads(store.get(latest['manifest']))['files'][0]['path'] == 'a.bin'
+
+
+def test_publishing_again_skips_the_chunks_the_store_has(tmp_path):
+    root = build(tmp_path, 'build', {'a.bin': b'aaaabbbb'})
+    store = RecordingStore(str(tmp_path / 'store'))
+    first = buildManifest.publish(root, store, CHUNK, sync_script=None)
+
+    again = buildManifest.publish(root, store, CHUNK, sync_script=None)
+    write(root, {'a.bin': b'aaaacccc'})
+    changed = buildManifest.publish(root, store, CHUNK, sync_script=None)
+
+    assert again['version'] == first['version']
+    assert (again['uploadedChunks'], again['uploadedBytes']) == (0, 0)
+    assert changed['version'] != first['version']
+    assert (changed['uploadedChunks'], changed['uploadedBytes']) == (1, 4)
+    assert sorted(name for name in store.puts if name.startswith('chunks/')) == sorted(
+        f"chunks/{buildManifest.hashlib.sha256(data).hexdigest()}" for data in (b'aaaa', b'bbbb', b'cccc'))
+
+
+def test_sync_downloads_only_what_changed_since_the_last_sync(tmp_path):
+    root = build(tmp_path, 'build', {'a.bin': b'aaaabbbb', 'gone.bin': b'eeee'})
+    store = buildManifest.LocalStore(str(tmp_path / 'store'))
+    destination = str(tmp_path / 'instance')
+    buildManifest.publish(root, store, CHUNK, sync_script=None)
+    first = buildManifest.sync(store, destination)
+
+    os.remove(os.path.join(root, 'gone.bin'))
+    write(root, {'a.bin': b'aaaacccc'})
+    buildManifest.publish(root, store, CHUNK, sync_script=None)
+    second = buildManifest.sync(store, destination)
+
+    assert (first['downloadedChunks'], first['downloadedBytes']) == (3, 12)
+    assert (second['changedFiles'], second['removedFiles']) == (1, 1)
+    assert (second['downloadedChunks'], second['downloadedBytes']) == (1, 4)
+    with open(os.path.join(destination, 'a.bin'), 'rb') as f:
+        assert f.read() == b'aaaacccc'
+    assert not os.path.exists(os.path.join(destination, 'gone.bin'))
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+import connectionTombstones
+import fakeAws
+
+
+@pytest.fixture
+def tombstones(aws):
+    return aws.dynamodb.Table(connectionTombstones.TOMBSTONE_TABLE)
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    slept = []
+    monkeypatch.setattr(connectionTombstones.time, 'sleep', slept.append)
+    return slept
+
+
+def test_record_writes_an_expiring_tombstone(aws, tombstones):
+    connectionTombstones.record('conn-1', 'Going away')
+
+    item = tombstones.items['conn-1']
+    assert item['Reason'] == 'Going away'
+    assert abs(item['ExpiresAt'] - (time.time() + connectionTombstones.TTL_SECONDS)) < 5
+
+
+def test_lookup_reads_a_hundred_keys_per_call(aws, tombstones):
+    for i in (3, 150):
+        connectionTombstones.record(f"conn-{i:04d}")
+
+    found = connectionTombstones.cancelled([f"conn-{i:04d}" for i in range(250)] + [None, ''])
+
+    assert found == {'conn-0003', 'conn-0150'}
+    assert aws.calls['dynamodb.BatchGetItem'] == 3
+
+
+def test_unprocessed_keys_are_retried(aws, tombstones, monkeypatch, no_backoff):
+    connectionTombstones.record('conn-2')
+    batch_get_item = aws.dynamodb.batch_get_item
+    calls = []
+
+    def throttled_once(RequestItems):
+        calls.append(RequestItems)
+        if len(calls) > 1:
+            return batch_get_item(RequestItems=RequestItems)
+        # the first call only gets to conn-1, conn-2 comes back as unprocessed
+        table = connectionTombstones.TOMBSTONE_TABLE
+        keys = RequestItems[table]['Keys']
+        return {'Responses': {table: []},
+                'UnprocessedKeys': {table: dict(RequestItems[table], Keys=keys[1:])}}
+
+    monkeypatch.setattr(aws.dynamodb, 'batch_get_item', throttled_once)
+
+    assert connectionTombstones.cancelled(['conn-1', 'conn-2']) == {'conn-2'}
+    assert calls[1][connectionTombstones.TOMBSTONE_TABLE]['Keys'] == [{'ConnectionId': 'conn-2'}]
+    assert len(no_backoff) == 1
+
+
+def test_keys_left_unprocessed_count_as_not_cancelled(aws, tombstones, monkeypatch, no_backoff, caplog):
+    connectionTombstones.record('conn-1')
+
+    def always_throttled(RequestItems):
+        return {'Responses': {}, 'UnprocessedKeys': RequestItems}
+
+    monkeypatch.setattr(aws.dynamodb, 'batch_get_item', always_throttled)
+
+    assert connectionTombstones.cancelled(['conn-1']) == set()
+    assert len(no_backoff) == connectionTombstones.MAX_ATTEMPTS
+    assert '1 tombstone lookups were not processed' in caplog.text
+
+
+def test_failed_lookup_cancels_nothing(aws, tombstones, monkeypatch):
+    connectionTombstones.record('conn-1')
+
+    def access_denied(RequestItems):
+        raise fakeAws.client_error('AccessDeniedException', 'BatchGetItem')
+
+    monkeypatch.setattr(aws.dynamodb, 'batch_get_item', access_denied)
+
+    assert connectionTombstones.cancelled(['conn-1']) == set()
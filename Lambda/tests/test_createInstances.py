@@ -0,0 +1,122 @@
+import json
+import os
+import time
+
+import pytest
+
+import createInstances
+import launchLock
+import slotAllocator
+import warmPool
+
+@pytest.fixture
+def config(aws, monkeypatch):
+    aws.ssm.parameters.update({'HealthCoach-ConcurrencyLimit': '10', 'HealthCoach-MatchmakerIP': '127.0.0.1'})
+    monkeypatch.setenv('SubnetIdPublicA', 'subnet-a')
+    # without ALBName no slots are provisioned, the free slots in the table are all there is
+    monkeypatch.delenv('ALBName', raising=False)
+    monkeypatch.setattr(warmPool, 'POOL_SIZE', 5)
+
+
+def free_slots(aws, count):
+    table = aws.dynamodb.Table(os.environ['DynamoDBName'])
+    for i in range(2, count + 2):
+        table.items[f"TG{i:02d}"] = {'TargetGroup': f"TG{i:02d}", 'QueryString': f"session={i:02d}",
+                                     'InstanceID': '', 'FreeSlot': slotAllocator.FREE_MARKER}
+
+
+def parked(aws, count):
+    instance_ids = []
+    for _ in range(count):
+        instance_id = aws.ec2.run_instances(TagSpecifications=[{'ResourceType': 'instance', 'Tags': [
+            {'Key': 'type', 'Value': 'signalling'},
+            {'Key': warmPool.CREATED_TAG, 'Value': str(int(time.time()))},
+            {'Key': warmPool.PARKED_TAG, 'Value': str(int(time.time()))}]}])['Instances'][0]['InstanceId']
+        aws.ec2.set_state([instance_id], 'stopped')
+        instance_ids.append(instance_id)
+    return instance_ids
+
+
+def states(aws, instance_ids):
+    return sorted(aws.ec2.instances[instance_id]['State']['Name'] for instance_id in instance_ids)
+
+
+def test_warm_pool_starts_no_more_instances_than_free_slots(aws, config):
+    free_slots(aws, 1)
+    pool = parked(aws, 2)
+
+    response = createInstances.lambda_handler({'count': 3}, None)
+
+    body = json.loads(response['body'])
+    assert response['statusCode'] == 200
+    assert body['WarmStarts'] == 1 and len(body['InstanceIds']) == 1
+    assert states(aws, pool) == ['pending', 'stopped']
+
+
+def test_warm_pool_is_untouched_without_free_slots(aws, config):
+    pool = parked(aws, 2)
+
+    response = createInstances.lambda_handler({'count': 2}, None)
+
+    assert response['statusCode'] == 400
+    assert states(aws, pool) == ['stopped', 'stopped']
+    assert aws.calls['ec2.StartInstances'] == 0
+
+
+def test_new_instances_launch_after_the_warm_pool(aws, config):
+    free_slots(aws, 3)
+    pool = parked(aws, 1)
+
+    body = json.loads(createInstances.lambda_handler({'count': 3}, None)['body'])
+
+    assert body['WarmStarts'] == 1 and len(body['InstanceIds']) == 3
+    assert body['InstanceIds'][0] == pool[0]
+
+
+def booting(aws, count):
+    # launched and not registered yet, no slot tag
+    return [aws.ec2.run_instances()['Instances'][0]['InstanceId'] for _ in range(count)]
+
+
+def test_booting_instances_are_subtracted_from_the_request(aws, config):
+    free_slots(aws, 6)
+    booting(aws, 2)
+    launches = aws.calls['ec2.RunInstances']
+
+    body = json.loads(createInstances.lambda_handler({'count': 5, 'subtractBooting': True}, None)['body'])
+
+    assert len(body['InstanceIds']) == 3
+    # all of them in one call, EC2 starts as many as it has capacity for
+    assert aws.calls['ec2.RunInstances'] == launches + 1
+    assert len(aws.ec2.reservations[-1][1]) == 3
+
+
+def test_booting_instances_cover_the_request(aws, config):
+    free_slots(aws, 3)
+    booting(aws, 3)
+
+    response = createInstances.lambda_handler({'count': 2, 'subtractBooting': True}, None)
+
+    assert response['statusCode'] == 200 and json.loads(response['body'])['InstanceIds'] == []
+
+
+def test_launch_is_capped_by_the_concurrency_limit(aws, config):
+    free_slots(aws, 10)
+    booting(aws, 8)
+
+    body = json.loads(createInstances.lambda_handler({'count': 5}, None)['body'])
+
+    assert len(body['InstanceIds']) == 2
+
+
+def test_concurrent_scale_out_is_refused_while_the_lock_is_held(aws, config):
+    free_slots(aws, 3)
+    holder = launchLock.LaunchLock()
+    assert holder.acquire()
+
+    response = createInstances.lambda_handler({'count': 1}, None)
+
+    assert response['statusCode'] == 409
+    assert aws.ec2.instances == {}
+    holder.release()
+    assert createInstances.lambda_handler({'count': 1}, None)['statusCode'] == 200
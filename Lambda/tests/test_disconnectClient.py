@@ -0,0 +1,31 @@
+import connectionTombstones
+import disconnectClient
+import fakeAws
+
+
+def disconnect(connection_id, reason='Going away'):
+    return disconnectClient.lambda_handler(
+        {'requestContext': {'routeKey': '$disconnect', 'connectionId': connection_id, 'disconnectReason': reason}},
+        None)
+
+
+def test_disconnect_leaves_a_tombstone(aws):
+    assert disconnect('conn-1')['statusCode'] == 200
+
+    assert connectionTombstones.cancelled(['conn-1', 'conn-2']) == {'conn-1'}
+
+
+def test_event_without_connection_id_is_rejected(aws):
+    assert disconnectClient.lambda_handler({'requestContext': {}}, None)['statusCode'] == 400
+    assert aws.dynamodb.Table(connectionTombstones.TOMBSTONE_TABLE).items == {}
+
+
+def test_failed_write_is_reported_not_raised(aws, monkeypatch):
+    table = aws.dynamodb.Table(connectionTombstones.TOMBSTONE_TABLE)
+
+    def throttled(**kwargs):
+        raise fakeAws.client_error('ProvisionedThroughputExceededException', 'PutItem')
+
+    monkeypatch.setattr(table, 'put_item', throttled)
+
+    assert disconnect('conn-1')['statusCode'] == 500
@@ -0,0 +1,42 @@
+import types
+
+import launchLock
+
+
+def test_only_one_holder_at_a_time(aws):
+    first, second = launchLock.LaunchLock(), launchLock.LaunchLock()
+
+    assert first.acquire()
+    assert not second.acquire()
+    first.release()
+    assert second.acquire()
+
+
+def test_locks_with_other_names_do_not_block_each_other(aws):
+    assert launchLock.LaunchLock('scale-out').acquire()
+    assert launchLock.LaunchLock('slot-provisioner').acquire()
+
+
+def test_expired_lease_is_taken_over_and_not_released_by_its_old_holder(aws, monkeypatch, caplog):
+    now = [1000]
+    monkeypatch.setattr(launchLock, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    crashed, next_planner = launchLock.LaunchLock(lease_seconds=60), launchLock.LaunchLock(lease_seconds=60)
+    assert crashed.acquire()
+
+    now[0] = 1060
+    assert not next_planner.acquire()
+    now[0] = 1061
+    assert next_planner.acquire()
+
+    crashed.release()
+
+    assert 'expired before it was released' in caplog.text
+    assert aws.dynamodb.Table(launchLock.LOCK_TABLE).items['scale-out']['Owner'] == next_planner.owner
+
+
+def test_context_manager_releases(aws):
+    with launchLock.LaunchLock() as acquired:
+        assert acquired
+        assert not launchLock.LaunchLock().acquire()
+
+    assert launchLock.LaunchLock().acquire()
@@ -0,0 +1,103 @@
+import http.client
+import json
+import time
+
+import matchmakerClient
+
+
+class StaleOnce:
+    """A pooled connection the server closed while it was idle: the first request on it fails."""
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def pooled_client(monkeypatch, idle_seconds=0.0):
+    client = matchmakerClient.MatchmakerClient('http://matchmaker.local:90/signallingserver')
+    stale = StaleOnce()
+    client._idle.put((stale, time.monotonic() - idle_seconds))
+    sent = []
+
+    def send(connection, method, path, headers, body):
+        sent.append((connection, method, path))
+        if connection is stale:
+            raise http.client.RemoteDisconnected('Remote end closed connection without response')
+        return 200, json.dumps({'signallingServers': [], 'released': 0}).encode('utf-8')
+
+    monkeypatch.setattr(client, '_send', send)
+    monkeypatch.setattr(client, '_new_connection', StaleOnce)
+    return client, stale, sent
+
+
+def test_get_is_retried_on_a_new_connection(monkeypatch):
+    client, stale, sent = pooled_client(monkeypatch)
+
+    result = client.request('GET', path='/signallingservers/stats')
+
+    assert result.status == 200
+    assert len(sent) == 2 and sent[0][0] is stale and stale.closed
+
+
+def test_reservation_is_not_sent_twice(monkeypatch):
+    client, stale, sent = pooled_client(monkeypatch)
+
+    results = client.reserve(3)
+
+    # the first attempt may have leased servers, the batch fails instead of leasing a second set
+    assert len(sent) == 1
+    assert [result.status for result in results] == [None, None, None]
+    assert 'RemoteDisconnected' in results[0].error
+
+
+def test_allocation_gets_are_not_retried(monkeypatch):
+    client, stale, sent = pooled_client(monkeypatch)
+
+    results = client.request_many(1)
+
+    assert len(sent) == 1 and results[0].status is None
+
+
+def test_reservation_skips_connections_idle_past_the_keep_alive_timeout(monkeypatch):
+    client, stale, sent = pooled_client(monkeypatch, idle_seconds=matchmakerClient.MATCHMAKER_IDLE_REUSE_SECONDS + 1)
+
+    results = client.reserve(2)
+
+    assert len(sent) == 1 and sent[0][0] is not stale and stale.closed
+    assert [result.status for result in results] == [400, 400]
+
+
+def test_release_is_retried(monkeypatch):
+    client, stale, sent = pooled_client(monkeypatch)
+
+    result = client.release(['i-1'], lease_ids=['lease-1'])
+
+    assert result.status == 200 and len(sent) == 2
+
+
+def answering(monkeypatch, status, body):
+    client = matchmakerClient.MatchmakerClient('http://matchmaker.local:90/signallingserver')
+    monkeypatch.setattr(client, '_send', lambda connection, method, path, headers, request_body: (status, body))
+    monkeypatch.setattr(client, '_new_connection', StaleOnce)
+    return client
+
+
+def test_failed_reservation_gives_each_request_its_own_result(monkeypatch):
+    results = answering(monkeypatch, 500, b'Could not reserve signalling servers').reserve(3)
+
+    assert [result.status for result in results] == [500, 500, 500]
+    assert len({id(result) for result in results}) == 3
+    results[0].status = None
+    assert results[1].status == 500
+
+
+def test_malformed_reservation_fails_every_request(monkeypatch):
+    without_query_string = json.dumps({'signallingServers': [{'instanceID': 'i-1'}]}).encode('utf-8')
+    for body in (b'<html>Bad Gateway</html>', b'[]', without_query_string):
+        results = answering(monkeypatch, 200, body).reserve(2)
+
+        assert [result.status for result in results] == [None, None]
+        assert 'Malformed reservation response' in results[0].error
+        assert results[0] is not results[1]
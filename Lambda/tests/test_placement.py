@@ -0,0 +1,113 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import placement
+
+
+@pytest.fixture(autouse=True)
+def history(monkeypatch):
+    # launch outcomes are remembered per container, every test starts without any
+    monkeypatch.setattr(placement, '_history', {})
+
+
+def attempts(aws, fails):
+    # records every run_instances request, fails(request) returns an error code or None
+    tried = []
+
+    def launch_error(request):
+        tried.append((request.get('SubnetId'), request.get('InstanceType'), request['MaxCount']))
+        return fails(request)
+
+    aws.ec2.launch_error = launch_error
+    return tried
+
+
+def test_options_start_with_the_template_then_types_then_templates():
+    options = placement.launch_options('lt-main', ['g5.xlarge'], ['Backup-LT'])
+
+    assert [label for label, _ in options] == ['lt-main', 'lt-main/g5.xlarge', 'Backup-LT']
+    assert options[0][1] == {'LaunchTemplate': {'LaunchTemplateId': 'lt-main', 'Version': '$Latest'}}
+    assert options[1][1]['InstanceType'] == 'g5.xlarge'
+    assert options[2][1] == {'LaunchTemplate': {'LaunchTemplateName': 'Backup-LT', 'Version': '$Latest'}}
+
+
+def test_rank_prefers_emptier_subnets_and_tries_a_failed_one_last():
+    assert placement.rank(['subnet-a', 'subnet-b'], {'subnet-a': 3, 'subnet-b': 1}) == ['subnet-b', 'subnet-a']
+
+    placement.record('subnet-b', False, now=1000.0)
+
+    assert placement.rank(['subnet-a', 'subnet-b'], {'subnet-a': 3, 'subnet-b': 1}, now=1010.0) == \
+        ['subnet-a', 'subnet-b']
+    # after the backoff only the lower success rate keeps it behind
+    assert placement.rank(['subnet-a', 'subnet-b'], {'subnet-b': 1},
+                          now=1000.0 + placement.BACKOFF_SECONDS + 1) == ['subnet-a', 'subnet-b']
+
+
+def test_capacity_error_moves_to_the_next_subnet_then_the_next_option(aws):
+    options = placement.launch_options('main-LT', ['g5.xlarge'], [])
+    # the template's instance type has no capacity anywhere, the fallback type only in subnet-b
+    tried = attempts(aws, lambda request: None if request.get('InstanceType') and request['SubnetId'] == 'subnet-b'
+                     else 'InsufficientInstanceCapacity')
+
+    instance_ids = placement.launch(aws.ec2, 2, ['subnet-a', 'subnet-b'], {}, spread={'subnet-b': 1},
+                                    options=options)
+
+    assert len(instance_ids) == 2
+    assert tried == [('subnet-a', None, 2), ('subnet-b', None, 2), ('subnet-a', 'g5.xlarge', 2),
+                     ('subnet-b', 'g5.xlarge', 2)]
+    assert {aws.ec2.instances[instance_id]['SubnetId'] for instance_id in instance_ids} == {'subnet-b'}
+
+
+def test_failed_subnet_is_tried_last_on_the_next_launch(aws):
+    attempts(aws, lambda request: 'InsufficientInstanceCapacity' if request['SubnetId'] == 'subnet-a' else None)
+    placement.launch(aws.ec2, 1, ['subnet-a', 'subnet-b'], {}, spread={'subnet-b': 5},
+                     options=placement.launch_options('main-LT', [], []))
+
+    tried = attempts(aws, lambda request: None)
+    placement.launch(aws.ec2, 1, ['subnet-a', 'subnet-b'], {}, spread={'subnet-b': 5},
+                     options=placement.launch_options('main-LT', [], []))
+
+    assert tried == [('subnet-b', None, 1)]
+
+
+def test_other_errors_are_raised_at_once(aws):
+    tried = attempts(aws, lambda request: 'UnauthorizedOperation')
+
+    with pytest.raises(ClientError):
+        placement.launch(aws.ec2, 1, ['subnet-a', 'subnet-b'], {}, options=placement.launch_options('main-LT', [], []))
+    assert len(tried) == 1
+
+
+def test_last_capacity_error_is_raised_when_nothing_launched(aws):
+    tried = attempts(aws, lambda request: 'InsufficientInstanceCapacity')
+
+    with pytest.raises(ClientError) as raised:
+        placement.launch(aws.ec2, 1, ['subnet-a', 'subnet-b'], {},
+                         options=placement.launch_options('main-LT', ['g5.xlarge'], []))
+    assert raised.value.response['Error']['Code'] == 'InsufficientInstanceCapacity'
+    assert len(tried) == 4
+
+
+@pytest.mark.parametrize('code', sorted(placement.QUOTA_ERRORS))
+def test_quota_error_moves_to_the_next_option_without_marking_the_subnet(aws, code):
+    options = placement.launch_options('main-LT', ['g5.xlarge'], [])
+    tried = attempts(aws, lambda request: None if request.get('InstanceType') else code)
+
+    instance_ids = placement.launch(aws.ec2, 1, ['subnet-a', 'subnet-b'], {}, spread={'subnet-b': 1},
+                                    options=options)
+
+    # one attempt for the quota, no other subnet with the same option
+    assert len(instance_ids) == 1
+    assert tried == [('subnet-a', None, 1), ('subnet-a', 'g5.xlarge', 1)]
+    assert not placement.backing_off('subnet-a') and placement.success_rate('subnet-a') == 1.0
+
+
+def test_quota_error_is_raised_when_no_option_is_left(aws):
+    tried = attempts(aws, lambda request: 'VcpuLimitExceeded')
+
+    with pytest.raises(ClientError) as raised:
+        placement.launch(aws.ec2, 1, ['subnet-a', 'subnet-b'], {},
+                         options=placement.launch_options('main-LT', ['g5.xlarge'], []))
+    assert raised.value.response['Error']['Code'] == 'VcpuLimitExceeded'
+    assert len(tried) == 2
+    assert placement.rank(['subnet-a', 'subnet-b'], {'subnet-b': 1}) == ['subnet-a', 'subnet-b']
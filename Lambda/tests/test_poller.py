@@ -0,0 +1,228 @@
+import json
+import types
+import urllib.parse
+
+import pytest
+
+import connectionTombstones
+import poller
+from conftest import add_servers, enqueue
+
+
+def payloads(count, start=0):
+    return [{'connectionId': f"conn-{i:04d}", 'requestId': f"req-{i:04d}"} for i in range(start, start + count)]
+
+
+@pytest.fixture
+def without_bulk_api(matchmaker, monkeypatch):
+    # a MatchMaker from before the bulk reservation API, the poller falls back to one GET per session
+    handle = matchmaker.handle
+
+    def old_handle(method, path, headers, body):
+        if path.startswith('/signallingservers/reserve'):
+            return 404, 'Not Found'
+        return handle(method, path, headers, body)
+
+    monkeypatch.setattr(matchmaker, 'handle', old_handle)
+    return matchmaker
+
+
+@pytest.fixture
+def closes_after_keep_alive(aws, monkeypatch):
+    # the browser of conn-0001 goes away between the keep-alive and the session details
+    post = aws.apigateway.post_to_connection
+
+    def post_then_close(ConnectionId, Data):
+        response = post(ConnectionId, Data)
+        if ConnectionId == 'conn-0001':
+            aws.apigateway.closed.add(ConnectionId)
+        return response
+
+    monkeypatch.setattr(aws.apigateway, 'post_to_connection', post_then_close)
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+def test_unused_lease_is_released(aws, matchmaker, closes_after_keep_alive, bulk, request):
+    if not bulk:
+        request.getfixturevalue('without_bulk_api')
+    add_servers(aws, matchmaker, 3)
+
+    outcomes = poller.allocate_batch(payloads(3))
+
+    assert outcomes == [poller.ALLOCATED, poller.DISCARDED, poller.ALLOCATED]
+    assert aws.calls['matchmaker.POST /signallingservers/release'] == 1
+    assert matchmaker.lease_stats()['released'] == 1
+    assert matchmaker.lease_stats()['active'] == 2
+
+
+def test_lease_without_instance_id_is_logged_not_released(aws, matchmaker, without_bulk_api, closes_after_keep_alive,
+                                                           monkeypatch, caplog):
+    handle = without_bulk_api.handle
+
+    def without_instance_id(method, path, headers, body):
+        status, payload = handle(method, path, headers, body)
+        if isinstance(payload, dict):
+            payload.pop('instanceID', None)
+        return status, payload
+
+    monkeypatch.setattr(matchmaker, 'handle', without_instance_id)
+    add_servers(aws, matchmaker, 2)
+
+    outcomes = poller.allocate_batch(payloads(2))
+
+    assert outcomes == [poller.ALLOCATED, poller.DISCARDED]
+    assert aws.calls['matchmaker.POST /signallingservers/release'] == 0
+    assert 'Cannot release 1 unused leases' in caplog.text
+
+
+def test_closed_connections_use_no_server(aws, matchmaker):
+    add_servers(aws, matchmaker, 3)
+    aws.apigateway.closed.add('conn-0000')
+
+    outcomes = poller.allocate_batch(payloads(2))
+
+    assert outcomes == [poller.DISCARDED, poller.ALLOCATED]
+    assert matchmaker.lease_stats()['granted'] == 1
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+def test_signalling_server_url_keeps_the_listener_rule_parameter(aws, matchmaker, bulk, request):
+    if not bulk:
+        request.getfixturevalue('without_bulk_api')
+    add_servers(aws, matchmaker, 1)
+
+    assert poller.allocate_batch(payloads(1)) == [poller.ALLOCATED]
+
+    # the frontend appends the string to the load balancer URL ending in "?", the rules match session=NN
+    signalling_server = aws.apigateway.posted['conn-0000'][-1]['signallingServer']
+    params = dict(urllib.parse.parse_qsl(signalling_server, strict_parsing=True))
+    assert params['session'] == '02'
+    assert matchmaker.client_connected('i-0002', params['lease'])
+    assert matchmaker.lease_stats()['confirmed'] == 1
+
+
+class Context:
+    """A Lambda context whose remaining time drops by step_millis every time it is asked."""
+
+    def __init__(self, remaining_millis, step_millis=0):
+        self.remaining_millis = remaining_millis
+        self.step_millis = step_millis
+
+    def get_remaining_time_in_millis(self):
+        remaining = self.remaining_millis
+        self.remaining_millis -= self.step_millis
+        return remaining
+
+
+def sqs_event(aws, count, malformed=0):
+    records = [{'messageId': f"msg-{i:04d}", 'body': json.dumps(payload)}
+               for i, payload in enumerate(payloads(count))]
+    records += [{'messageId': f"bad-{i}", 'body': '{not json'} for i in range(malformed)]
+    return {'Records': records}
+
+
+def test_sqs_batch_reports_only_requests_without_a_server(aws, matchmaker):
+    add_servers(aws, matchmaker, 2)
+
+    response = poller.lambda_handler(sqs_event(aws, 4, malformed=1), None)
+
+    # the malformed message can never succeed and is dropped, the two without a server are retried
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'msg-0002'}, {'itemIdentifier': 'msg-0003'}]}
+    assert aws.calls['lambda.Invoke'] == 1
+    assert aws.lambda_.pending[-1][1]['count'] == 2
+
+
+def test_sqs_batch_is_returned_when_allocation_raises(aws, matchmaker, monkeypatch):
+    def broken(payloads):
+        raise ValueError('Expecting value: line 1 column 1 (char 0)')
+
+    monkeypatch.setattr(poller, 'allocate_batch', broken)
+
+    response = poller.lambda_handler(sqs_event(aws, 2), None)
+
+    assert [failure['itemIdentifier'] for failure in response['batchItemFailures']] == ['msg-0000', 'msg-0001']
+
+
+def test_drain_stops_at_the_safety_margin(aws, matchmaker):
+    add_servers(aws, matchmaker, 30)
+    enqueue(aws, 25)
+    # enough time for one batch only
+    context = Context(poller.SAFETY_MARGIN_MILLIS + 2000, step_millis=2000)
+
+    assert poller.lambda_handler({}, context)['statusCode'] == 200
+
+    assert aws.calls['sqs.ReceiveMessage'] == 1
+    assert aws.queue('sessions.fifo').counts() == (15, 0)
+
+
+def test_drain_stops_after_max_drain_seconds(aws, matchmaker, monkeypatch):
+    add_servers(aws, matchmaker, 30)
+    enqueue(aws, 25)
+    clock = iter(range(0, 10**6, 100))
+    # only the poller's clock, every read of it is 100 s later
+    monkeypatch.setattr(poller, 'time', types.SimpleNamespace(monotonic=lambda: next(clock)))
+    # the first batch is taken at 100 s and the second at 200 s of a 250 s drain, 300 s is past its end
+    monkeypatch.setattr(poller, 'MAX_DRAIN_SECONDS', 250 + poller.SAFETY_MARGIN_MILLIS // 1000)
+
+    poller.lambda_handler({}, Context(900_000))
+
+    assert aws.calls['sqs.ReceiveMessage'] == 2
+    assert aws.queue('sessions.fifo').counts() == (5, 0)
+
+
+def test_failed_batch_stays_queued_and_the_drain_goes_on(aws, matchmaker, monkeypatch):
+    add_servers(aws, matchmaker, 30)
+    enqueue(aws, 15)
+    allocate = poller.allocate_batch
+    calls = []
+
+    def fails_once(payloads):
+        calls.append(len(payloads))
+        if len(calls) == 1:
+            raise ValueError('Expecting value: line 1 column 1 (char 0)')
+        return allocate(payloads)
+
+    monkeypatch.setattr(poller, 'allocate_batch', fails_once)
+
+    response = poller.lambda_handler({}, Context(900_000))
+
+    assert response['statusCode'] == 200
+    assert calls == [10, 5]
+    # the failed batch is in flight until its visibility timeout, then received again
+    assert aws.queue('sessions.fifo').counts() == (0, 10)
+
+
+def test_tombstoned_requests_get_no_push_and_no_server(aws, matchmaker):
+    add_servers(aws, matchmaker, 3)
+    connectionTombstones.record('conn-0000')
+    connectionTombstones.record('conn-0002')
+
+    outcomes = poller.allocate_batch(payloads(3))
+
+    assert outcomes == [poller.DISCARDED, poller.ALLOCATED, poller.DISCARDED]
+    assert set(aws.apigateway.posted) == {'conn-0001'}
+    assert matchmaker.lease_stats()['granted'] == 1
+    assert aws.calls['dynamodb.BatchGetItem'] == 1
+
+
+def test_tombstoned_requests_need_no_launch(aws, matchmaker):
+    connectionTombstones.record('conn-0001')
+
+    response = poller.lambda_handler(sqs_event(aws, 3), None)
+
+    # the two live requests wait for a server, the closed one is gone from the queue
+    assert [failure['itemIdentifier'] for failure in response['batchItemFailures']] == ['msg-0000', 'msg-0002']
+    assert aws.lambda_.pending[-1][1]['count'] == 2
+    assert 'conn-0001' not in aws.apigateway.posted
+
+
+def test_drain_requests_one_scale_out_for_every_waiting_request(aws, matchmaker):
+    enqueue(aws, 15)
+
+    poller.lambda_handler({}, Context(900_000))
+
+    # the batch of 10 without a server plus the 5 still queued, in a single createInstances request
+    assert aws.calls['lambda.Invoke'] == 1
+    request = aws.lambda_.pending[-1][1]
+    assert request['count'] == 15 and request['subtractBooting'] is True
+    assert len(request['correlationIds']) == 10
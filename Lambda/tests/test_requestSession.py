@@ -0,0 +1,106 @@
+import json
+import re
+
+import pytest
+
+import requestSession
+import runtime
+from conftest import enqueue
+
+SECRET = 'bearer-secret'
+
+
+@pytest.fixture
+def config(aws, monkeypatch):
+    monkeypatch.setenv('clientSecret', SECRET)
+    monkeypatch.setattr(requestSession, 'MAX_QUEUE_DEPTH', 5)
+
+
+def request(connection_id, request_id, at=1_700_000_000_000, body=None):
+    return requestSession.lambda_handler({
+        'requestContext': {'requestId': request_id, 'connectionId': connection_id, 'requestTimeEpoch': at},
+        'body': json.dumps(body or {'bearer': SECRET})
+    }, None)
+
+
+def test_short_deduplication_id_is_kept_readable():
+    assert requestSession.deduplication_id('conn-1', 'req-1') == 'conn-1:req-1'
+
+
+def test_long_deduplication_id_is_hashed_to_fit_sqs():
+    connection_id, request_id = 'c' * 100, 'r' * 40
+
+    dedup_id = requestSession.deduplication_id(connection_id, request_id)
+
+    assert re.fullmatch('[0-9a-f]{64}', dedup_id)
+    assert dedup_id == requestSession.deduplication_id(connection_id, request_id)
+    assert dedup_id != requestSession.deduplication_id(connection_id, 'r' * 39 + 's')
+
+
+def test_requests_in_the_same_millisecond_are_all_queued(aws, config):
+    # two users, and one user asking twice, all within one millisecond
+    for connection_id, request_id in [('conn-1', 'req-1'), ('conn-2', 'req-2'), ('conn-1', 'req-3')]:
+        assert request(connection_id, request_id)['statusCode'] == 200
+
+    queue = aws.queue('sessions.fifo')
+    assert queue.duplicates_dropped == 0 and queue.counts() == (3, 0)
+
+
+def test_retried_delivery_of_the_same_request_is_deduplicated(aws, config):
+    request('conn-1', 'req-1')
+    request('conn-1', 'req-1')
+
+    assert aws.queue('sessions.fifo').counts() == (1, 0)
+
+
+def test_full_backlog_is_rejected_with_retry_after(aws, config):
+    enqueue(aws, 5)
+
+    response = request('conn-9', 'req-9')
+
+    assert response['statusCode'] == 429
+    assert response['headers'] == {'Retry-After': str(requestSession.RETRY_AFTER_SECONDS)}
+    assert json.loads(response['body'])['retryAfter'] == requestSession.RETRY_AFTER_SECONDS
+    assert aws.queue('sessions.fifo').counts() == (5, 0)
+
+
+def test_backlog_is_read_once_per_cache_period(aws, config, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(runtime.time, 'monotonic', lambda: now[0])
+    enqueue(aws, 4)
+
+    # the cached depth of 4 admits both, although the second one fills the queue beyond the cap
+    assert request('conn-1', 'req-1')['statusCode'] == 200
+    assert request('conn-2', 'req-2')['statusCode'] == 200
+    assert aws.calls['sqs.GetQueueAttributes'] == 1
+
+    now[0] += requestSession.QUEUE_DEPTH_TTL_SECONDS + 1
+    assert request('conn-3', 'req-3')['statusCode'] == 429
+    assert aws.calls['sqs.GetQueueAttributes'] == 2
+
+
+def test_admission_control_can_be_disabled(aws, config, monkeypatch):
+    monkeypatch.setattr(requestSession, 'MAX_QUEUE_DEPTH', 0)
+    enqueue(aws, 10)
+
+    assert request('conn-1', 'req-1')['statusCode'] == 200
+    assert aws.calls['sqs.GetQueueAttributes'] == 0
+
+
+def test_wrong_bearer_is_refused(aws, config):
+    assert request('conn-1', 'req-1', body={'bearer': 'guess'})['statusCode'] == 403
+
+
+def test_priority_lane_needs_the_signed_claim(aws, config, monkeypatch):
+    monkeypatch.setenv('PriorityLanes', 'priority:sessions-priority.fifo:4,standard:sessions.fifo:1')
+    body = {'bearer': SECRET, 'priority': 'priority'}
+
+    request('conn-1', 'req-1', body=body)
+    requestSession.lambda_handler({
+        'requestContext': {'requestId': 'req-2', 'connectionId': 'conn-2', 'requestTimeEpoch': 1_700_000_000_000,
+                           'authorizer': {'sub': 'alice', 'priority': 'priority'}},
+        'body': json.dumps({'bearer': SECRET})
+    }, None)
+
+    assert [json.loads(m.body)['connectionId'] for m in aws.queue('sessions.fifo').messages] == ['conn-1']
+    assert [json.loads(m.body)['connectionId'] for m in aws.queue('sessions-priority.fifo').messages] == ['conn-2']
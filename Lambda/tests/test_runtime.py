@@ -0,0 +1,87 @@
+import runtime
+from conftest import add_servers, enqueue
+
+
+def records(aws, count, start):
+    # the event the SQS event source mapping hands to the poller
+    enqueue(aws, count, start)
+    messages = aws.queue('sessions.fifo').receive(count)
+    return {'Records': [{'messageId': m.message_id, 'body': m.body} for m in messages]}
+
+
+def control_plane_calls(aws):
+    return {op: n for op, n in aws.calls.items() if op.startswith(('ssm.', 'lambda.GetFunction'))}
+
+
+def test_cached_value_is_loaded_once_until_invalidated(aws):
+    loads = []
+    load = lambda: loads.append(1) or len(loads)
+
+    assert runtime.cached('key', load) == 1
+    assert runtime.cached('key', load) == 1
+    runtime.invalidate('key')
+    assert runtime.cached('key', load) == 2
+    assert len(loads) == 2
+
+
+def test_cached_value_expires_after_ttl(aws, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(runtime.time, 'monotonic', lambda: now[0])
+    loads = []
+    load = lambda: loads.append(1) or len(loads)
+
+    assert runtime.cached('key', load, ttl=60) == 1
+    now[0] += 59
+    assert runtime.cached('key', load, ttl=60) == 1
+    now[0] += 2
+    assert runtime.cached('key', load, ttl=60) == 2
+
+
+def test_clients_are_created_once_per_container(aws):
+    assert runtime.client('ssm') is runtime.client('ssm')
+    assert runtime.resource('dynamodb') is runtime.resource('dynamodb')
+    assert aws.created == {'client.ssm': 1, 'resource.dynamodb': 1}
+
+
+def test_warm_poller_invocations_reuse_clients_and_the_secret(aws, matchmaker):
+    import poller
+
+    add_servers(aws, matchmaker, 9)
+    for invocation in range(3):
+        response = poller.lambda_handler(records(aws, 3, invocation * 3), None)
+        assert response == {'batchItemFailures': []}
+
+    # before the runtime module every invocation read the secret from SSM and created its clients again
+    assert control_plane_calls(aws) == {'ssm.GetParameter': 1}
+    assert all(count == 1 for count in aws.created.values())
+    # one bulk reservation per batch, a keep-alive and the session details per request
+    assert aws.calls['matchmaker.POST /signallingservers/reserve'] == 3
+    assert aws.calls['apigatewaymanagementapi.PostToConnection'] == 18
+
+
+def test_create_instances_arn_is_resolved_once_without_the_environment(aws, matchmaker, monkeypatch):
+    import poller
+
+    monkeypatch.delenv('CreateInstancesArn')
+    # no servers, every invocation asks createInstances for more
+    for invocation in range(3):
+        response = poller.lambda_handler(records(aws, 2, invocation * 2), None)
+        assert len(response['batchItemFailures']) == 2
+
+    assert control_plane_calls(aws) == {'ssm.GetParameter': 1, 'lambda.GetFunction': 1}
+    assert aws.calls['lambda.Invoke'] == 3
+    assert [event['count'] for _, event in aws.lambda_.pending] == [2, 2, 2]
+
+
+def test_rejected_secret_is_fetched_again(aws, matchmaker):
+    import poller
+
+    add_servers(aws, matchmaker, 2)
+    aws.ssm.parameters['HealthCoach-ClientSecret'] = 'rotated-away'
+    response = poller.lambda_handler(records(aws, 1, 0), None)
+    assert len(response['batchItemFailures']) == 1
+
+    aws.ssm.parameters['HealthCoach-ClientSecret'] = matchmaker.secret
+    assert poller.lambda_handler(records(aws, 1, 1), None) == {'batchItemFailures': []}
+    assert aws.calls['ssm.GetParameter'] == 2
+    assert 'signallingServer' in aws.apigateway.posted['conn-0001'][-1]
@@ -0,0 +1,50 @@
+import pytest
+
+from scalingPolicy import WarmPoolPolicy
+
+
+@pytest.fixture
+def policy():
+    return WarmPoolPolicy(warm_spares=1, max_instances=10, boot_minutes=2.0, smoothing=0.5, scale_in_buffer=1)
+
+
+def test_forecast_smooths_but_follows_a_ramp(policy):
+    assert policy.forecast_rate([]) == 0.0
+    # 4 -> 0.5 * 0 + 0.5 * 4 = 2, the falling demand is smoothed
+    assert policy.forecast_rate([4, 0]) == 2.0
+    # 0 -> 2, but never below the newest minute while demand grows
+    assert policy.forecast_rate([0, 4]) == 4.0
+
+
+def test_launches_for_queue_forecast_and_spares(policy):
+    decision = policy.decide(queue_depth=2, pool_size=3, idle=1, booting=1, arrivals_per_minute=[1, 1])
+
+    # 2 queued + ceil(1/min * 2 min) + 1 spare = 5 wanted, 2 free
+    assert (decision.wanted_free, decision.launch, decision.release) == (5, 3, 0)
+
+
+def test_launch_is_capped_by_the_instance_limit(policy):
+    decision = policy.decide(queue_depth=20, pool_size=8, idle=0, booting=0, arrivals_per_minute=[])
+
+    assert decision.launch == 2
+    assert 'capped by limit 10' in decision.reason
+
+
+def test_releases_only_idle_servers_beyond_the_buffer(policy):
+    decision = policy.decide(queue_depth=0, pool_size=6, idle=6, booting=0, arrivals_per_minute=[0, 0])
+
+    # 1 spare wanted, 1 more tolerated
+    assert (decision.wanted_free, decision.release, decision.launch) == (1, 4, 0)
+
+
+def test_does_not_release_while_requests_wait(policy):
+    decision = policy.decide(queue_depth=1, pool_size=6, idle=6, booting=0, arrivals_per_minute=[0])
+
+    assert (decision.launch, decision.release) == (0, 0)
+
+
+def test_steady_pool_is_left_alone(policy):
+    decision = policy.decide(queue_depth=0, pool_size=3, idle=2, booting=0, arrivals_per_minute=[0])
+
+    assert (decision.launch, decision.release) == (0, 0)
+    assert decision.to_dict()['reason'] == 'pool matches demand'
@@ -0,0 +1,95 @@
+from collections import Counter
+
+import pytest
+
+import sessionLanes
+from sessionLanes import Lane, LaneScheduler
+
+
+@pytest.fixture
+def configured():
+    return sessionLanes.lanes('priority:sessions-priority.fifo:3,standard:sessions.fifo:1')
+
+
+def serve(scheduler, candidates, batches, backlog=None, batch_size=1, start=0.0):
+    served = Counter()
+    for i in range(batches):
+        lane = scheduler.next_lane(candidates, backlog)
+        scheduler.granted(lane, batch_size, now=start + i)
+        served[lane.name] += batch_size
+    return served
+
+
+def test_lanes_are_parsed_highest_priority_first(configured, monkeypatch):
+    assert [(lane.name, lane.queue_name, lane.weight) for lane in configured] == [
+        ('priority', 'sessions-priority.fifo', 3), ('standard', 'sessions.fifo', 1)]
+    monkeypatch.setenv('SQSName', 'sessions.fifo')
+    assert [(lane.name, lane.queue_name) for lane in sessionLanes.lanes('')] == [('standard', 'sessions.fifo')]
+
+
+def test_only_the_signed_claim_opens_a_higher_lane(configured):
+    priority, standard = configured
+
+    assert sessionLanes.lane_for({}, {'priority': 'priority'}, configured) is priority
+    # a client cannot ask its way into a better lane
+    assert sessionLanes.lane_for({'priority': 'priority'}, None, configured) is standard
+    assert sessionLanes.lane_for({'priority': 'priority'}, {'sub': 'alice'}, configured) is standard
+    assert sessionLanes.lane_for({'priority': 'priority'}, {'priority': 'vip'}, configured) is standard
+
+
+def test_body_can_only_lower_the_lane(configured):
+    clinician, paid, free = sessionLanes.lanes('clinician:c.fifo:6,paid:p.fifo:3,free:f.fifo:1')
+    lanes = [clinician, paid, free]
+
+    assert sessionLanes.lane_for({'priority': 'free'}, {'priority': 'paid'}, lanes) is free
+    assert sessionLanes.lane_for({'priority': 'clinician'}, {'priority': 'paid'}, lanes) is paid
+    assert sessionLanes.lane_for({'priority': 'unknown'}, {'priority': 'paid'}, lanes) is paid
+
+
+def test_servers_are_shared_by_weight(configured):
+    scheduler = LaneScheduler(configured, starvation_seconds=10**6, now=0.0)
+
+    served = serve(scheduler, configured, 40)
+
+    assert served == {'priority': 30, 'standard': 10}
+
+
+def test_ties_go_to_the_higher_priority_lane(configured):
+    scheduler = LaneScheduler(configured, starvation_seconds=10**6, now=0.0)
+
+    assert scheduler.next_lane(configured).name == 'priority'
+    assert scheduler.next_lane([]) is None
+
+
+def test_idle_lane_does_not_bank_its_share(configured):
+    priority, standard = configured
+    scheduler = LaneScheduler(configured, starvation_seconds=10**6, now=0.0)
+    # the standard lane is empty while the priority lane gets 20 servers
+    for i in range(20):
+        lane = scheduler.next_lane(configured)
+        if lane is standard:
+            scheduler.skip(standard, configured)
+            lane = scheduler.next_lane(configured)
+        assert lane is priority
+        scheduler.granted(priority, 1, now=float(i))
+
+    served = serve(scheduler, configured, 8, start=20.0)
+
+    # back to the 3:1 split instead of the standard lane taking every server to catch up
+    assert served['standard'] <= 3
+
+
+def test_starving_lane_with_a_backlog_is_served_first():
+    heavy, light = Lane('heavy', 'q1', 100), Lane('light', 'q2', 1)
+    scheduler = LaneScheduler([heavy, light], starvation_seconds=30, now=0.0)
+    scheduler.granted(light, 1, now=0.0)
+    for now in range(1, 30):
+        scheduler.granted(heavy, 1, now=float(now))
+    assert scheduler.next_lane([heavy, light], {'light': 5}) is heavy
+
+    scheduler.granted(heavy, 1, now=30.0)
+
+    assert scheduler.passed_over(light) == 30.0
+    assert scheduler.next_lane([heavy, light], {'light': 5}) is light
+    # without waiting messages the light lane is not starving
+    assert scheduler.next_lane([heavy, light], {}) is heavy
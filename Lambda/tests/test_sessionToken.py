@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+import sessionToken
+
+KEYS = {'2024-01': b'old secret', '2024-06': b'new secret'}
+NOW = 1_700_000_000
+
+
+def token(**claims):
+    return sessionToken.sign({'sub': 'alice', 'exp': NOW + 60, **claims}, keys=KEYS)
+
+
+def test_valid_token_returns_its_claims():
+    assert sessionToken.verify(token(priority='priority'), now=NOW, keys=KEYS) == {
+        'sub': 'alice', 'exp': NOW + 60, 'priority': 'priority'}
+
+
+def test_token_is_signed_with_the_newest_key_and_the_old_one_still_verifies():
+    new = token()
+    old = sessionToken.sign({'sub': 'alice', 'exp': NOW + 60}, kid='2024-01', keys=KEYS)
+
+    assert sessionToken.verify(new, now=NOW, keys={'2024-06': KEYS['2024-06']})
+    assert sessionToken.verify(old, now=NOW, keys=KEYS)
+    assert sessionToken.verify(old, now=NOW, keys={'2024-06': KEYS['2024-06']}) is None
+
+
+@pytest.mark.parametrize('offset, valid', [
+    (0, True),
+    (60 + sessionToken.LEEWAY_SECONDS, True),
+    (61 + sessionToken.LEEWAY_SECONDS, False),
+])
+def test_expiry_allows_the_leeway(offset, valid):
+    assert (sessionToken.verify(token(), now=NOW + offset, keys=KEYS) is not None) == valid
+
+
+def test_token_without_expiry_is_rejected():
+    assert sessionToken.verify(sessionToken.sign({'sub': 'alice'}, keys=KEYS), now=NOW, keys=KEYS) is None
+
+
+def test_token_not_yet_valid_is_rejected():
+    assert sessionToken.verify(token(nbf=NOW + 300, exp=NOW + 600), now=NOW, keys=KEYS) is None
+    assert sessionToken.verify(token(nbf=NOW + 300, exp=NOW + 600), now=NOW + 300, keys=KEYS)
+
+
+def test_tampered_claims_are_rejected():
+    header, claims, signature = token().split('.')
+    forged = sessionToken._b64encode(b'{"sub":"mallory","exp":9999999999}')
+
+    assert sessionToken.verify(f"{header}.{forged}.{signature}", now=NOW, keys=KEYS) is None
+
+
+def test_unsigned_and_malformed_tokens_are_rejected():
+    none_header = sessionToken._b64encode(b'{"alg":"none","kid":"2024-06"}')
+    claims = token().split('.')[1]
+
+    for candidate in ['', 'abcd', f"{none_header}.{claims}.", 'a.b.c', 'x' * (sessionToken.MAX_TOKEN_LENGTH + 1)]:
+        assert sessionToken.verify(candidate, now=NOW, keys=KEYS) is None
+
+
+def test_keys_are_read_from_ssm_once(aws):
+    aws.ssm.parameters[sessionToken.KEY_PARAMETER] = '{"2024-06": "new secret"}'
+
+    for _ in range(3):
+        assert sessionToken.verify(token(), now=NOW) is not None
+
+    assert aws.calls['ssm.GetParameter'] == 1
+
+
+@pytest.mark.parametrize('kid', [['2024-06'], {'kid': '2024-06'}, 7, None])
+def test_key_id_that_is_not_a_string_is_rejected(kid):
+    header = sessionToken._b64encode(('{"alg":"HS256","kid":%s}' % json.dumps(kid)).encode('utf-8'))
+    _, claims, signature = token().split('.')
+
+    assert sessionToken.verify(f"{header}.{claims}.{signature}", now=NOW, keys=KEYS) is None
+
+
+@pytest.mark.parametrize('exp', ['9999999999', True, float('inf'), float('nan'), None])
+def test_expiry_that_is_not_a_finite_number_is_rejected(exp):
+    # json.dumps writes Infinity and NaN, which json.loads reads back as floats
+    assert sessionToken.verify(token(exp=exp), now=NOW, keys=KEYS) is None
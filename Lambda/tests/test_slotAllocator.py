@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import Counter
+
+import slotAllocator
+
+
+def free_table(aws, count):
+    table = aws.dynamodb.Table('instanceMapping')
+    for i in range(2, count + 2):
+        table.items[f"TG{i:02d}"] = {'TargetGroup': f"TG{i:02d}", 'QueryString': f"session={i:02d}",
+                                     'InstanceID': '', 'FreeSlot': slotAllocator.FREE_MARKER}
+    return table
+
+
+def claim_concurrently(table, instance_ids):
+    # every claimer starts at the same moment, as instances booting together would
+    start = threading.Barrier(len(instance_ids))
+    claimed = {}
+
+    def claim(instance_id):
+        start.wait()
+        claimed[instance_id] = slotAllocator.claim_slot(table, instance_id)
+
+    threads = [threading.Thread(target=claim, args=(instance_id,)) for instance_id in instance_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return claimed
+
+
+def test_concurrent_claims_never_share_a_slot(aws, monkeypatch):
+    table = free_table(aws, 20)
+    query = table.query
+
+    def slow_query(**kwargs):
+        # the round trip of a real index query, long enough for the claimers to read the same candidates
+        response = query(**kwargs)
+        time.sleep(0.01)
+        return response
+
+    monkeypatch.setattr(table, 'query', slow_query)
+
+    claimed = claim_concurrently(table, [f"i-{i:04d}" for i in range(30)])
+
+    slots = [item['TargetGroup'] for item in claimed.values() if item]
+    assert len(slots) == 20
+    assert len(set(slots)) == 20
+    holders = Counter(item['InstanceID'] for item in table.items.values())
+    assert all(count == 1 for count in holders.values())
+    for instance_id, item in claimed.items():
+        if item:
+            assert table.items[item['TargetGroup']]['InstanceID'] == instance_id
+            assert 'FreeSlot' not in table.items[item['TargetGroup']]
+    assert slotAllocator.count_free_slots(table) == 0
+
+
+def test_claim_returns_none_without_free_slots(aws):
+    table = free_table(aws, 1)
+
+    assert slotAllocator.claim_slot(table, 'i-1')['TargetGroup'] == 'TG02'
+    assert slotAllocator.claim_slot(table, 'i-2') is None
+
+
+def test_release_only_by_the_holder(aws):
+    table = free_table(aws, 1)
+    slotAllocator.claim_slot(table, 'i-1')
+
+    assert slotAllocator.release_slot(table, 'TG02', instance_id='i-2') is False
+    assert table.items['TG02']['InstanceID'] == 'i-1'
+    assert slotAllocator.release_slot(table, 'TG02', instance_id='i-1') is True
+    assert slotAllocator.claim_slot(table, 'i-2')['TargetGroup'] == 'TG02'
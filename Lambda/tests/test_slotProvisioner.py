@@ -0,0 +1,178 @@
+import pytest
+
+import fakeAws
+import launchLock
+import slotAllocator
+import slotProvisioner
+
+
+@pytest.fixture
+def table(aws, monkeypatch):
+    monkeypatch.setenv('ALBName', 'signalling')
+    return aws.dynamodb.Table('instanceMapping')
+
+
+def stack_slot(aws, table, number, priority):
+    # a slot the stack created: its rule, target group and item, not managed by slotProvisioner
+    target_group = aws.elbv2.create_target_group(Name=f"SignallingTargetGroup{number:02d}")['TargetGroups'][0]
+    aws.elbv2.create_rule(
+        ListenerArn=aws.elbv2.listener['ListenerArn'], Priority=priority,
+        Conditions=[{'Field': 'query-string',
+                     'QueryStringConfig': {'Values': [{'Key': 'session', 'Value': f"{number:02d}"}]}}],
+        Actions=[{'Type': 'forward', 'TargetGroupArn': target_group['TargetGroupArn']}])
+    table.items[f"TG{number:02d}"] = {'TargetGroup': f"TG{number:02d}", 'ARN': target_group['TargetGroupArn'],
+                                      'QueryString': f"session={number:02d}", 'InstanceID': '',
+                                      'FreeSlot': slotAllocator.FREE_MARKER}
+
+
+def recorded(calls, name, call):
+    def record(**kwargs):
+        calls.append(name)
+        return call(**kwargs)
+    return record
+
+
+def managed_slots(aws, table, count):
+    return slotProvisioner.create_slots(table, aws.elbv2, 'signalling', count, slotProvisioner.current_slots(table))
+
+
+@pytest.mark.parametrize('total, free, limit, wanted, max_slots, expected', [
+    # fill up to the wanted free slots
+    (5, 0, 10, 3, 99, (3, 0)),
+    # never more slots than concurrencyLimit, or MaxSlots when that is lower
+    (9, 0, 10, 3, 99, (1, 0)),
+    (5, 0, 100, 10, 8, (3, 0)),
+    (10, 0, 10, 3, 99, (0, 0)),
+    # MinFreeSlots 1 plus a surplus of 2 free slots are kept
+    (6, 3, 10, 0, 99, (0, 0)),
+    (6, 4, 10, 0, 99, (0, 1)),
+    # above concurrencyLimit the extra slots go, but only free ones
+    (12, 3, 10, 0, 99, (0, 2)),
+    (12, 1, 10, 0, 99, (0, 1)),
+])
+def test_plan_boundaries(total, free, limit, wanted, max_slots, expected):
+    assert slotProvisioner.plan(total, free, limit, wanted_free=wanted, min_free=1, surplus=2,
+                                max_slots=max_slots) == expected
+
+
+def test_new_slots_take_free_numbers_and_priorities(aws, table):
+    stack_slot(aws, table, 2, priority=1)
+    stack_slot(aws, table, 3, priority=3)
+    # a slot whose rule is missing still reserves its number
+    table.items['TG05'] = {'TargetGroup': 'TG05', 'QueryString': 'session=05', 'InstanceID': 'i-1'}
+
+    items = managed_slots(aws, table, 2)
+
+    assert [item['QueryString'] for item in items] == ['session=04', 'session=06']
+    priorities = {rule['RuleArn']: rule['Priority'] for rule in aws.elbv2.rules.values()}
+    assert [priorities[item['RuleArn']] for item in items] == ['2', '4']
+    assert table.items['TG04'] == items[0] and table.items['TG04']['ManagedBy'] == slotProvisioner.MANAGED_BY
+    assert slotAllocator.claim_slot(table, 'i-2') is not None
+
+
+def test_slots_created_before_an_error_are_still_written(aws, table, monkeypatch):
+    create_rule = aws.elbv2.create_rule
+    created = []
+
+    def rule_quota(**kwargs):
+        if created:
+            raise fakeAws.client_error('TooManyRules', 'CreateRule')
+        created.append(create_rule(**kwargs))
+        return created[-1]
+
+    monkeypatch.setattr(aws.elbv2, 'create_rule', rule_quota)
+
+    items = managed_slots(aws, table, 3)
+
+    assert [item['TargetGroup'] for item in items] == ['TG02']
+    assert set(table.items) == {'TG02'}
+
+
+def test_retire_deletes_rule_then_target_group_and_batches_the_table_deletes(aws, table, monkeypatch):
+    stack_slot(aws, table, 2, priority=1)
+    managed_slots(aws, table, 3)
+    deleted = []
+    for name in ('delete_rule', 'delete_target_group'):
+        monkeypatch.setattr(aws.elbv2, name, recorded(deleted, name, getattr(aws.elbv2, name)))
+    writes = aws.calls['dynamodb.BatchWriteItem']
+
+    retired = slotProvisioner.retire_slots(table, aws.elbv2, 5, slotProvisioner.current_slots(table))
+
+    # newest first, the stack's own slot stays
+    assert [item['TargetGroup'] for item in retired] == ['TG05', 'TG04', 'TG03']
+    assert deleted == ['delete_rule', 'delete_target_group'] * 3
+    assert set(table.items) == {'TG02'} and len(aws.elbv2.rules) == 1
+    assert aws.calls['dynamodb.TransactWriteItems'] == 1
+    assert aws.calls['dynamodb.BatchWriteItem'] == writes + 1
+
+
+def test_slot_claimed_during_retirement_is_kept(aws, table):
+    managed_slots(aws, table, 3)
+    current = slotProvisioner.current_slots(table)
+    # an instance claims TG03 after the read, the transaction is cancelled and the slots are withdrawn one by one
+    table.items['TG03']['InstanceID'] = 'i-late'
+    del table.items['TG03']['FreeSlot']
+
+    retired = slotProvisioner.retire_slots(table, aws.elbv2, 3, current)
+
+    assert [item['TargetGroup'] for item in retired] == ['TG04', 'TG02']
+    assert set(table.items) == {'TG03'} and table.items['TG03']['InstanceID'] == 'i-late'
+    assert len(aws.elbv2.rules) == 1
+
+
+def test_failed_delete_leaves_a_withdrawn_item_that_ensure_cleans_up(aws, table, monkeypatch):
+    managed_slots(aws, table, 2)
+    delete_rule = aws.elbv2.delete_rule
+
+    def throttled(RuleArn):
+        raise fakeAws.client_error('Throttling', 'DeleteRule')
+
+    monkeypatch.setattr(aws.elbv2, 'delete_rule', throttled)
+
+    assert slotProvisioner.retire_slots(table, aws.elbv2, 1, slotProvisioner.current_slots(table)) == []
+    stale = table.items['TG03']
+    assert 'FreeSlot' not in stale and not stale['InstanceID']
+
+    monkeypatch.setattr(aws.elbv2, 'delete_rule', delete_rule)
+    report = slotProvisioner.ensure(table, concurrency_limit=2, wanted_free=1)
+
+    assert 'TG03' not in table.items and stale['RuleArn'] not in aws.elbv2.rules
+    assert stale['ARN'] not in aws.elbv2.target_groups
+    assert report['slots'] == 1 and report['free'] == 1
+
+
+def test_stale_item_whose_rule_is_already_gone_is_removed(aws, table):
+    managed_slots(aws, table, 2)
+    stale = table.items['TG03']
+    del stale['FreeSlot']
+    aws.elbv2.delete_rule(RuleArn=stale['RuleArn'])
+
+    slotProvisioner.ensure(table, concurrency_limit=2, wanted_free=1)
+
+    assert 'TG03' not in table.items and stale['ARN'] not in aws.elbv2.target_groups
+
+
+def test_ensure_creates_up_to_the_wanted_free_slots(aws, table):
+    stack_slot(aws, table, 2, priority=1)
+
+    report = slotProvisioner.ensure(table, concurrency_limit=10, wanted_free=3)
+
+    assert report == {'slots': 3, 'free': 3, 'created': 2, 'retired': 0}
+    assert slotAllocator.count_free_slots(table) == 3
+
+
+def test_ensure_returns_none_while_another_caller_holds_the_lock(aws, table):
+    holder = launchLock.LaunchLock('slot-provisioner')
+    assert holder.acquire()
+
+    assert slotProvisioner.ensure(table, concurrency_limit=10, wanted_free=3) is None
+    assert table.items == {} and aws.calls['elbv2.CreateTargetGroup'] == 0
+
+    holder.release()
+    assert slotProvisioner.ensure(table, concurrency_limit=10, wanted_free=3)['created'] == 3
+
+
+def test_ensure_without_alb_name_does_nothing(aws, table, monkeypatch):
+    monkeypatch.delenv('ALBName')
+
+    assert slotProvisioner.ensure(table, concurrency_limit=10, wanted_free=3) is None
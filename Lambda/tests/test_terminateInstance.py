@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+import fakeAws
+import slotAllocator
+import terminateInstance
+import warmPool
+
+
+def signalling_instance(aws, target_group):
+    # a stopped signalling instance registered in the target group of its slot, as registerInstances leaves it
+    instance_id = aws.ec2.run_instances(TagSpecifications=[{'ResourceType': 'instance', 'Tags': [
+        {'Key': 'type', 'Value': 'signalling'},
+        {'Key': slotAllocator.SLOT_TAG, 'Value': target_group},
+        {'Key': warmPool.CREATED_TAG, 'Value': str(int(time.time()))}]}])['Instances'][0]['InstanceId']
+    aws.ec2.set_state([instance_id], 'stopped')
+    arn = f"arn:tg/{target_group}"
+    aws.dynamodb.Table('instanceMapping').items[target_group] = {
+        'TargetGroup': target_group, 'ARN': arn, 'QueryString': 'session=02', 'InstanceID': instance_id}
+    aws.elbv2.register_targets(TargetGroupArn=arn, Targets=[{'Id': instance_id}])
+    return instance_id
+
+
+@pytest.fixture
+def access_denied(aws, monkeypatch):
+    def deregister_targets(TargetGroupArn, Targets):
+        raise fakeAws.client_error('AccessDenied', 'DeregisterTargets')
+
+    monkeypatch.setattr(aws.elbv2, 'deregister_targets', deregister_targets)
+
+
+def state(aws, instance_id):
+    return aws.ec2.instances[instance_id]['State']['Name']
+
+
+def stopped_event(instance_id):
+    return {'detail': {'instance-id': instance_id, 'state': 'stopped'}}
+
+
+def test_stopped_instance_is_deregistered_before_its_slot_is_released(aws):
+    instance_id = signalling_instance(aws, 'TG02')
+
+    terminateInstance.lambda_handler(stopped_event(instance_id), None)
+
+    assert state(aws, instance_id) == 'terminated'
+    assert aws.elbv2.targets['arn:tg/TG02'] == set()
+    slot = aws.dynamodb.Table('instanceMapping').items['TG02']
+    assert slot['InstanceID'] == '' and slot['FreeSlot'] == slotAllocator.FREE_MARKER
+
+
+def test_failed_deregistration_still_terminates_and_frees_the_slot(aws, access_denied, monkeypatch):
+    # even with room in the warm pool, an instance still in its target group is not parked
+    monkeypatch.setattr(warmPool, 'POOL_SIZE', 5)
+    instance_id = signalling_instance(aws, 'TG02')
+
+    terminateInstance.lambda_handler(stopped_event(instance_id), None)
+
+    assert state(aws, instance_id) == 'terminated'
+    assert aws.dynamodb.Table('instanceMapping').items['TG02']['InstanceID'] == ''
+
+
+def test_deregistered_instance_is_parked(aws, monkeypatch):
+    monkeypatch.setattr(warmPool, 'POOL_SIZE', 5)
+    instance_id = signalling_instance(aws, 'TG02')
+
+    terminateInstance.lambda_handler(stopped_event(instance_id), None)
+
+    assert state(aws, instance_id) == 'stopped'
+    tags = {tag['Key'] for tag in aws.ec2.instances[instance_id]['Tags']}
+    assert warmPool.PARKED_TAG in tags and slotAllocator.SLOT_TAG not in tags
+    assert aws.dynamodb.Table('instanceMapping').items['TG02']['InstanceID'] == ''
+
+
+def test_bulk_teardown_terminates_everything_when_deregistration_fails(aws, access_denied):
+    instance_ids = [signalling_instance(aws, f"TG{i:02d}") for i in range(2, 6)]
+
+    terminateInstance.lambda_handler({'stopAllServers': True}, None)
+
+    assert [state(aws, instance_id) for instance_id in instance_ids] == ['terminated'] * 4
+    assert all(item['InstanceID'] == '' for item in aws.dynamodb.Table('instanceMapping').items.values())
@@ -0,0 +1,43 @@
+import json
+import random
+
+import tracing
+
+
+def emf_lines(capsys, stage, durations, **properties):
+    for duration in durations:
+        tracing.emit(stage, f"req-{duration}", duration, **properties)
+    return capsys.readouterr().out.splitlines()
+
+
+def test_nearest_rank_percentile():
+    values = [float(v) for v in range(1, 11)]
+
+    assert tracing.percentile([], 50) == 0.0
+    assert tracing.percentile([7.0], 99) == 7.0
+    assert tracing.percentile(values, 0) == 1.0
+    assert tracing.percentile(values, 25) == 3.0
+    assert tracing.percentile(values, 50) == 5.0
+    assert tracing.percentile(values, 95) == 10.0
+    assert tracing.percentile(values, 100) == 10.0
+
+
+def test_aggregate_reports_percentiles_per_stage(capsys):
+    push = list(range(1, 101))
+    queue_wait = [10 * v for v in range(1, 201)]
+    random.Random(7).shuffle(push)
+    random.Random(7).shuffle(queue_wait)
+    lines = emf_lines(capsys, 'push', push) + emf_lines(capsys, 'queueWait', queue_wait, Lane='high')
+    # the same records as CloudWatch Logs shows them, next to lines that are not measurements
+    lines = [f"2026-01-01T00:00:00.000Z\tabc-123\tINFO\t{line}" if i % 2 else line for i, line in enumerate(lines)]
+    lines += ["START RequestId: abc-123", '{"_aws": not json', json.dumps({"Stage": "push", "DurationMs": 5000}),
+              json.dumps(tracing.emit_counts('placement', {'Launched': 1}))]
+
+    report = tracing.aggregate(lines)
+
+    assert report == {
+        'push': {'count': 100, 'p50': 50.0, 'p95': 95.0, 'p99': 99.0, 'max': 100.0},
+        'queueWait': {'count': 200, 'p50': 1000.0, 'p95': 1900.0, 'p99': 1980.0, 'max': 2000.0}
+    }
+    assert tracing.format_report(report).splitlines()[1].split() == ['queueWait', '200', '1000.0', '1900.0',
+                                                                     '1980.0', '2000.0']
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import slotAllocator
+import uploadToDDB
+
+
+def add_rule(aws, number):
+    target_group = aws.elbv2.create_target_group(Name=f"SignallingTargetGroup{number:02d}")['TargetGroups'][0]
+    aws.elbv2.create_rule(
+        ListenerArn=aws.elbv2.listener['ListenerArn'], Priority=number,
+        Conditions=[{'Field': 'query-string',
+                     'QueryStringConfig': {'Values': [{'Key': 'session', 'Value': f"{number:02d}"}]}}],
+        Actions=[{'Type': 'forward', 'TargetGroupArn': target_group['TargetGroupArn']}])
+    return target_group['TargetGroupArn']
+
+
+def free_slot(table, target_group, arn='arn:tg/gone'):
+    table.items[target_group] = {'TargetGroup': target_group, 'ARN': arn, 'QueryString': 'session=99',
+                                 'InstanceID': '', 'FreeSlot': slotAllocator.FREE_MARKER}
+
+
+@pytest.fixture
+def table(aws, monkeypatch):
+    monkeypatch.setenv('ALBName', 'signalling')
+    return aws.dynamodb.Table('instanceMapping')
+
+
+def sync(event=None):
+    response = uploadToDDB.lambda_handler(event or {}, None)
+    assert response['statusCode'] == 200, response
+    return json.loads(response['body'])['changes']
+
+
+def test_sync_adds_new_rules_and_removes_stale_free_slots(aws, table):
+    arn = add_rule(aws, 2)
+    free_slot(table, 'TG09')
+
+    report = sync()
+
+    assert report['added'] == ['TG02'] and report['removed'] == ['TG09']
+    assert table.items['TG02'] == {'TargetGroup': 'TG02', 'ARN': arn, 'QueryString': 'session=02',
+                                   'InstanceID': '', 'FreeSlot': slotAllocator.FREE_MARKER}
+    assert 'TG09' not in table.items
+    assert sync()['unchanged'] == 1
+
+
+def test_stale_slot_claimed_after_the_read_is_kept(aws, table, monkeypatch):
+    add_rule(aws, 2)
+    free_slot(table, 'TG09')
+    read = uploadToDDB.current_slots
+
+    def read_then_claim(table):
+        # an instance boots between the sync's read of the table and its delete
+        current = read(table)
+        assert slotAllocator.claim_slot(table, 'i-late')['TargetGroup'] == 'TG09'
+        return current
+
+    monkeypatch.setattr(uploadToDDB, 'current_slots', read_then_claim)
+
+    report = sync()
+
+    assert report['removed'] == [] and report['inUse'] == ['TG09']
+    assert table.items['TG09']['InstanceID'] == 'i-late'
+
+
+def test_dry_run_changes_nothing(aws, table):
+    add_rule(aws, 2)
+    free_slot(table, 'TG09')
+
+    report = sync({'dryRun': True})
+
+    assert report['added'] == ['TG02'] and report['removed'] == ['TG09']
+    assert set(table.items) == {'TG09'}
+
+
+def test_clearing_the_table_batches_the_deletes(aws, table, monkeypatch):
+    monkeypatch.setenv('CLEAR_TABLE_ON_START', 'true')
+    for number in range(60):
+        free_slot(table, f"TG{number + 100}")
+    arn = add_rule(aws, 2)
+
+    report = sync()
+
+    assert report['added'] == ['TG02'] and report['removed'] == []
+    assert set(table.items) == {'TG02'} and table.items['TG02']['ARN'] == arn
+    assert aws.calls['dynamodb.BatchWriteItem'] == 3
+    assert aws.calls['dynamodb.DeleteItem'] == 0 and aws.calls['dynamodb.PutItem'] == 1
@@ -0,0 +1,140 @@
+# this module records how long a session request spends in each stage of the pipeline (requestSession, SQS, poller,
+# MatchMaker, web socket push). The API Gateway requestId is the correlation ID: it is carried in the SQS payload and
+# every downstream invoke. Each measurement is printed as a CloudWatch Embedded Metric Format record, so CloudWatch
+# turns it into a DurationMs metric per Stage with p50/p95/p99 statistics while the correlation ID stays searchable in
+# the logs. Run this file on captured log lines to get the same breakdown locally:
+#   python tracing.py poller.log requestSession.log
+import json
+import math
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get("TracingNamespace", "HealthCoach/SessionAllocation")
+
+# stages in pipeline order, used to sort the local report
+STAGES = ['ingest', 'queueWait', 'matchmaker', 'push', 'launch', 'endToEnd']
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def correlation_id(payload):
+    return payload.get("correlationId") or payload.get("requestId") or 'unknown'
+
+
+def emit(stage, correlation, duration_ms, dimensions=(), **properties):
+    # correlation is a single ID or a list of IDs when one measurement covers several requests. dimensions names
+    # properties that split the stage further, e.g. Lane; the metric per Stage alone is published as well
+    record = {
+        "_aws": {
+            "Timestamp": now_ms(),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [["Stage"]] + ([["Stage"] + list(dimensions)] if dimensions else []),
+                "Metrics": [{"Name": "DurationMs", "Unit": "Milliseconds"}]
+            }]
+        },
+        "Stage": stage,
+        "DurationMs": round(duration_ms, 3),
+        "CorrelationId": correlation
+    }
+    record.update(properties)
+    print(json.dumps(record), flush=True)
+    return record
+
+
+@contextmanager
+def stage_timer(stage, correlation, **properties):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        emit(stage, correlation, (time.monotonic() - started) * 1000, **properties)
+
+
+def since(stage, correlation, started_ms, **properties):
+    # emits the time elapsed since an epoch timestamp carried in the payload, e.g. enqueuedAt
+    if started_ms:
+        emit(stage, correlation, now_ms() - int(started_ms), **properties)
+
+
+def emit_counts(group, counts, units=None, dimensions=(), **properties):
+    # one EMF record with a metric per entry of counts under the dimension Group, e.g. the MatchMaker's lease counters.
+    # Metrics are Counts unless units says otherwise. Cumulative counters are published as they are, RATE() in
+    # CloudWatch metric math turns them into rates. dimensions names properties that split the metrics further, e.g.
+    # Subnet
+    record = {
+        "_aws": {
+            "Timestamp": now_ms(),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [["Group"] + list(dimensions)],
+                "Metrics": [{"Name": name, "Unit": (units or {}).get(name, "Count")} for name in counts]
+            }]
+        },
+        "Group": group
+    }
+    record.update(counts)
+    record.update(properties)
+    print(json.dumps(record), flush=True)
+    return record
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def parse_records(lines):
+    # yields the EMF records found in log lines, with or without a CloudWatch/Lambda prefix before the JSON
+    for line in lines:
+        start = line.find('{')
+        if start < 0 or '"_aws"' not in line:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if 'Stage' in record and 'DurationMs' in record:
+            yield record
+
+
+def aggregate(lines):
+    """Returns {stage: {'count', 'p50', 'p95', 'p99', 'max'}} for the EMF records in lines."""
+    durations = {}
+    for record in parse_records(lines):
+        durations.setdefault(record['Stage'], []).append(float(record['DurationMs']))
+    report = {}
+    for stage, values in durations.items():
+        values.sort()
+        report[stage] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'max': values[-1]
+        }
+    return report
+
+
+def format_report(report):
+    order = {stage: i for i, stage in enumerate(STAGES)}
+    rows = [f"{'stage':<12}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}{'max ms':>12}"]
+    for stage in sorted(report, key=lambda s: (order.get(s, len(STAGES)), s)):
+        r = report[stage]
+        rows.append(f"{stage:<12}{r['count']:>8}{r['p50']:>12.1f}{r['p95']:>12.1f}{r['p99']:>12.1f}{r['max']:>12.1f}")
+    return "\n".join(rows)
+
+
+if __name__ == '__main__':
+    lines = []
+    for path in sys.argv[1:] or ['-']:
+        with (sys.stdin if path == '-' else open(path)) as f:
+            lines.extend(f.readlines())
+    print(format_report(aggregate(lines)))
@@ -1,20 +1,160 @@
 import json
-import boto3
 import os
 import traceback
 
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import runtime
+import slotAllocator
+
+# This function mirrors the query string rules of the Signalling ALB into the instanceMapping table. It reads every
+# listener and rule, diffs them against one full read of the table and only writes what changed, so it is cheap
+# enough to run on every deploy or on a schedule. Pass {"dryRun": true} to only get the change report.
+
+
+def paged(call, result_key, **params):
+    # elbv2 describe_* calls page with Marker/NextMarker
+    while True:
+        response = call(**params)
+        yield from response.get(result_key, [])
+        if not response.get('NextMarker'):
+            return
+        params['Marker'] = response['NextMarker']
+
+
+def desired_slots(client, alb_name):
+    """Returns {TargetGroup: {'ARN': ..., 'QueryString': ...}} for every query string rule of the ALB."""
+    response = client.describe_load_balancers(Names=[alb_name])
+    loadbalancerarn = response['LoadBalancers'][0]['LoadBalancerArn']
+    print(f"Found LoadBalancer ARN: {loadbalancerarn}")
+
+    slots = {}
+    for listener in paged(client.describe_listeners, 'Listeners', LoadBalancerArn=loadbalancerarn):
+        rules = list(paged(client.describe_rules, 'Rules', ListenerArn=listener['ListenerArn']))
+        print(f"Listener {listener['ListenerArn']} has {len(rules)} rules")
+        for rule in rules:
+            if rule.get('IsDefault') or rule['Priority'] == 'default':
+                continue
+            query_conditions = [c for c in rule['Conditions'] if 'QueryStringConfig' in c]
+            forwards = [a for a in rule['Actions'] if a.get('TargetGroupArn')]
+            if not query_conditions or not forwards:
+                print(f"⚠️ Skipping rule without query string forward: {rule['RuleArn']}")
+                continue
+            qs_key = query_conditions[0]['QueryStringConfig']['Values'][0]['Key']
+            qs_value = query_conditions[0]['QueryStringConfig']['Values'][0]['Value']
+            slots[f"TG{qs_value}"] = {'ARN': forwards[0]['TargetGroupArn'], 'QueryString': f"{qs_key}={qs_value}"}
+    return slots
+
+
+def current_slots(table):
+    # one paginated read of the whole mapping table
+    items = {}
+    params = {}
+    while True:
+        response = table.scan(**params)
+        for item in response['Items']:
+            items[item['TargetGroup']] = item
+        if 'LastEvaluatedKey' not in response:
+            return items
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def diff_slots(desired, current):
+    added = sorted(tg for tg in desired if tg not in current)
+    updated = sorted(tg for tg in desired if tg in current and
+                     (current[tg].get('ARN'), current[tg].get('QueryString')) !=
+                     (desired[tg]['ARN'], desired[tg]['QueryString']))
+    removed = sorted(tg for tg in current if tg not in desired)
+    return added, updated, removed
+
+
+def _conditional_failure(err):
+    return err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def apply_changes(table, desired, current, added, updated, removed):
+    report = {'added': [], 'updated': [], 'removed': [], 'conflicts': [], 'inUse': []}
+    # every write below is conditional, instances claim slots while the sync runs. BatchWriteItem takes no conditions,
+    # so only clear_table batches its deletes, the changes are written one item at a time
+
+    # new slots are created free, a conditional put never overwrites a slot another writer created meanwhile
+    for tg in added:
+        try:
+            table.put_item(
+                Item={
+                    'TargetGroup': tg,
+                    'ARN': desired[tg]['ARN'],
+                    'InstanceID': '',
+                    'FreeSlot': slotAllocator.FREE_MARKER,
+                    'QueryString': desired[tg]['QueryString']
+                },
+                ConditionExpression=Attr('TargetGroup').not_exists()
+            )
+            report['added'].append(tg)
+        except ClientError as err:
+            if not _conditional_failure(err):
+                raise
+            report['conflicts'].append(tg)
+
+    # changed rules keep the instance assignment of the slot
+    for tg in updated:
+        try:
+            table.update_item(
+                Key={'TargetGroup': tg},
+                UpdateExpression="SET ARN = :arn, QueryString = :qs",
+                ConditionExpression=Attr('ARN').eq(current[tg].get('ARN')) & Attr('QueryString').eq(current[tg].get('QueryString')),
+                ExpressionAttributeValues={':arn': desired[tg]['ARN'], ':qs': desired[tg]['QueryString']}
+            )
+            report['updated'].append(tg)
+        except ClientError as err:
+            if not _conditional_failure(err):
+                raise
+            report['conflicts'].append(tg)
+
+    # slots whose rule is gone are deleted unless an instance holds them. The delete is conditional on the slot still
+    # being unclaimed, an instance that claimed it after the read keeps it and the slot is reported as in use
+    for tg in removed:
+        if current[tg].get('InstanceID'):
+            report['inUse'].append(tg)
+            continue
+        try:
+            table.delete_item(Key={'TargetGroup': tg}, ConditionExpression=Attr('InstanceID').eq(''))
+            report['removed'].append(tg)
+        except ClientError as err:
+            if not _conditional_failure(err):
+                raise
+            report['inUse'].append(tg)
+    return report
+
+
+def clear_table(table):
+    params = {'ProjectionExpression': 'TargetGroup'}
+    cleared = 0
+    with table.batch_writer() as batch:
+        while True:
+            scan = table.scan(**params)
+            for item in scan.get('Items', []):
+                batch.delete_item(Key={'TargetGroup': item['TargetGroup']})
+                cleared += 1
+            if 'LastEvaluatedKey' not in scan:
+                return cleared
+            params['ExclusiveStartKey'] = scan['LastEvaluatedKey']
+
+
 def lambda_handler(event, context):
     print("=== HealthCoach PopulateDynamoDB Lambda STARTED ===")
 
     try:
         # === Step 1: Initialize AWS clients ===
-        client = boto3.client('elbv2')
-        dynamodb = boto3.resource('dynamodb')
+        client = runtime.client('elbv2')
+        dynamodb = runtime.resource('dynamodb')
 
         # === Step 2: Load environment variables ===
         alb_name = os.environ.get("ALBName")
         table_name = os.environ.get("DynamoDBName")
-        clear_table = os.environ.get("CLEAR_TABLE_ON_START", "False").lower() == "true"
+        clear_table_on_start = os.environ.get("CLEAR_TABLE_ON_START", "False").lower() == "true"
+        dry_run = bool((event or {}).get("dryRun", False))
 
         if not alb_name or not table_name:
             raise ValueError("Missing required environment variables: ALBName or DynamoDBName")
@@ -22,86 +162,38 @@ def lambda_handler(event, context):
         table = dynamodb.Table(table_name)
         print(f"Using ALB: {alb_name}")
         print(f"Using DynamoDB table: {table_name}")
-        print(f"Auto-clear table on start: {clear_table}")
+        print(f"Auto-clear table on start: {clear_table_on_start}, dry run: {dry_run}")
 
         # === Step 3: Optionally clear DynamoDB table ===
-        if clear_table:
+        if clear_table_on_start and not dry_run:
             print("Clearing all items from table before repopulating...")
-            scan = table.scan(ProjectionExpression='TargetGroup')
-            with table.batch_writer() as batch:
-                for item in scan.get('Items', []):
-                    batch.delete_item(Key={'TargetGroup': item['TargetGroup']})
-            print("✅ Table cleared successfully.")
-
-        # === Step 4: Fetch Load Balancer ARN ===
-        print("Fetching LoadBalancer ARN...")
-        response = client.describe_load_balancers(Names=[alb_name])
-        loadbalancerarn = response['LoadBalancers'][0]['LoadBalancerArn']
-        print(f"Found LoadBalancer ARN: {loadbalancerarn}")
-
-        # === Step 5: Fetch Listener ARN ===
-        print("Fetching Listener ARN...")
-        response = client.describe_listeners(LoadBalancerArn=loadbalancerarn)
-        listenerarn = response['Listeners'][0]['ListenerArn']
-        print(f"Found Listener ARN: {listenerarn}")
-
-        # === Step 6: Fetch Listener Rules ===
-        print("Fetching listener rules...")
-        response = client.describe_rules(ListenerArn=listenerarn)
-        rules = response.get('Rules', [])
-        print(f"Found {len(rules)} listener rules")
-
-        added_count = 0
-        skipped_count = 0
-
-        # === Step 7: Iterate and populate DynamoDB ===
-        for rule in rules:
-            if rule['Priority'] == 'default':
-                print("Skipping default rule...")
-                continue
-
-            try:
-                qs_key = rule['Conditions'][0]['QueryStringConfig']['Values'][0]['Key']
-                qs_value = rule['Conditions'][0]['QueryStringConfig']['Values'][0]['Value']
-                qs = f"{qs_key}={qs_value}"
-                target_group = f"TG{qs_value}"
-                arn = rule['Actions'][0]['TargetGroupArn']
-
-                print(f"Processing rule: TargetGroup={target_group}, ARN={arn}, QueryString={qs}")
-
-                # Check for existing item (avoid duplicates)
-                existing = table.get_item(Key={'TargetGroup': target_group})
-                if 'Item' in existing:
-                    print(f"⚠️ Skipping duplicate TargetGroup: {target_group}")
-                    skipped_count += 1
-                    continue
-
-                # Insert new record
-                table.put_item(
-                    Item={
-                        'TargetGroup': target_group,
-                        'ARN': arn,
-                        'InstanceID': '',
-                        'QueryString': qs
-                    }
-                )
-                print(f"✅ Added TargetGroup {target_group} to DynamoDB.")
-                added_count += 1
-
-            except Exception as inner_e:
-                print(f"❌ Error processing rule: {str(inner_e)}")
-                traceback.print_exc()
-
-        print(f"=== Population Complete ===")
-        print(f"Records added: {added_count}")
-        print(f"Records skipped (duplicates): {skipped_count}")
+            print(f"✅ Table cleared successfully, {clear_table(table)} items deleted.")
+
+        # === Step 4: Read every listener rule and the whole table ===
+        desired = desired_slots(client, alb_name)
+        current = current_slots(table)
+        print(f"ALB defines {len(desired)} slots, table holds {len(current)}")
+
+        # === Step 5: Apply only the differences ===
+        added, updated, removed = diff_slots(desired, current)
+        if dry_run:
+            report = {'added': added, 'updated': updated, 'removed': removed, 'conflicts': [], 'inUse': []}
+        else:
+            report = apply_changes(table, desired, current, added, updated, removed)
+            # free slots written before the FreeSlotIndex existed are not visible to the slot allocator
+            report['indexed'] = slotAllocator.backfill_free_index(table)
+        report['unchanged'] = len(desired) - len(added) - len(updated)
+
+        print(f"=== Sync Complete ===")
+        print(json.dumps(report))
 
         return {
             'statusCode': 200,
             'body': json.dumps({
-                'message': 'DynamoDB population complete',
-                'added': added_count,
-                'skipped': skipped_count
+                'message': 'DynamoDB sync complete' if not dry_run else 'DynamoDB sync dry run',
+                'added': len(report['added']),
+                'skipped': report['unchanged'],
+                'changes': report
             })
         }
 
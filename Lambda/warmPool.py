@@ -0,0 +1,133 @@
+# this module keeps a bounded pool of stopped Signalling instances that can be started again instead of launching new
+# ones. Starting a stopped instance skips run_instances and the first boot of a fresh volume, so it is much faster than
+# a launch. terminateInstance parks an instance that stopped, createInstances takes parked instances before it
+# launches new ones, and both retire what the policy no longer wants: instances older than WarmPoolMaxAgeHours (they
+# run an old build and accumulate state) and the oldest ones beyond WarmPoolSize. WarmPoolSize 0, the default, turns
+# the pool off and every stopped instance is terminated as before
+import os
+import time
+import logging
+
+from botocore.exceptions import ClientError
+
+import slotAllocator
+import tracing
+
+logger = logging.getLogger()
+
+POOL_SIZE = int(os.environ.get("WarmPoolSize", "0"))
+MAX_AGE_SECONDS = float(os.environ.get("WarmPoolMaxAgeHours", "24")) * 3600
+# epoch seconds of the first launch, the instance's LaunchTime changes with every start
+CREATED_TAG = 'CreatedAt'
+# epoch seconds of the moment the instance was parked
+PARKED_TAG = 'ParkedAt'
+
+
+def enabled():
+    return POOL_SIZE > 0
+
+
+def _tags(instance):
+    return {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+
+
+def created_at(instance):
+    # instances launched before the tag existed fall back to their last start
+    tags = _tags(instance)
+    if CREATED_TAG in tags:
+        return float(tags[CREATED_TAG])
+    if 'LaunchTime' in instance:
+        return instance['LaunchTime'].timestamp()
+    return None
+
+
+def parked_instances(ec2):
+    # stopped signalling instances that terminateInstance has parked, youngest first. A stopped instance without the
+    # parked tag may still hold its slot and is left alone
+    instances = []
+    paginator = ec2.get_paginator('describe_instances')
+    for page in paginator.paginate(Filters=[
+            {'Name': 'tag:type', 'Values': ['signalling']},
+            {'Name': 'instance-state-name', 'Values': ['stopped']}]):
+        for reservation in page['Reservations']:
+            instances.extend(i for i in reservation['Instances'] if PARKED_TAG in _tags(i))
+    return sorted(instances, key=lambda instance: -(created_at(instance) or 0))
+
+
+def plan(instances, now, pool_size=None, max_age_seconds=None):
+    """Splits parked instances, youngest first, into (keep, retire)."""
+    pool_size = POOL_SIZE if pool_size is None else pool_size
+    max_age_seconds = MAX_AGE_SECONDS if max_age_seconds is None else max_age_seconds
+    keep = []
+    retire = []
+    for instance in instances:
+        created = created_at(instance)
+        if created is None or now - created > max_age_seconds or len(keep) >= pool_size:
+            retire.append(instance['InstanceId'])
+        else:
+            keep.append(instance['InstanceId'])
+    return keep, retire
+
+
+def retire(ec2, instance_ids):
+    # parked instances hold no slot, terminating them is all there is to do
+    if instance_ids:
+        ec2.terminate_instances(InstanceIds=instance_ids)
+        logger.info(f"Retired {len(instance_ids)} parked instances: {instance_ids}")
+        tracing.emit_counts('warmPool', {'Retired': len(instance_ids)})
+
+
+def park(ec2, instance, now=None):
+    """Keeps a stopped instance that left its target group in the pool, returns False when it should be terminated."""
+    if not enabled():
+        return False
+    now = time.time() if now is None else now
+    instance_id = instance['InstanceId']
+    # the stop event can arrive before describe_instances reports the instance as stopped
+    instances = parked_instances(ec2)
+    if instance_id not in [i['InstanceId'] for i in instances]:
+        instances = sorted(instances + [instance], key=lambda i: -(created_at(i) or 0))
+    keep, retired = plan(instances, now)
+    if instance_id not in keep:
+        retire(ec2, [i for i in retired if i != instance_id])
+        return False
+    # the slot tag is dropped so that the restarted instance counts as booting and claims a fresh slot
+    ec2.delete_tags(Resources=[instance_id], Tags=[{'Key': slotAllocator.SLOT_TAG}])
+    tags = [{'Key': PARKED_TAG, 'Value': str(int(now))}]
+    if CREATED_TAG not in _tags(instance) and created_at(instance) is not None:
+        tags.append({'Key': CREATED_TAG, 'Value': str(int(created_at(instance)))})
+    ec2.create_tags(Resources=[instance_id], Tags=tags)
+    retire(ec2, retired)
+    logger.info(f"Parked {instance_id} in the warm pool ({len(keep)}/{POOL_SIZE})")
+    tracing.emit_counts('warmPool', {'Parked': 1, 'PoolSize': len(keep)})
+    return True
+
+
+def take(ec2, count, now=None):
+    """Starts up to count parked instances and returns their IDs. Callers hold the launch lock."""
+    if not enabled() or count <= 0:
+        return []
+    now = time.time() if now is None else now
+    keep, retired = plan(parked_instances(ec2), now)
+    retire(ec2, retired)
+    candidates = keep[:count]
+    if not candidates:
+        return []
+    try:
+        ec2.start_instances(InstanceIds=candidates)
+        started = candidates
+    except ClientError as err:
+        # one instance without capacity, or one that is still stopping, fails the whole call, so the candidates are
+        # tried one by one and the ones that fail stay in the pool
+        logger.warning(f"Starting {len(candidates)} parked instances failed, starting them one by one: {err}")
+        started = []
+        for instance_id in candidates:
+            try:
+                ec2.start_instances(InstanceIds=[instance_id])
+                started.append(instance_id)
+            except ClientError as single_err:
+                logger.warning(f"Could not start parked instance {instance_id}: {single_err}")
+    if started:
+        ec2.delete_tags(Resources=started, Tags=[{'Key': PARKED_TAG}])
+    logger.info(f"Started {len(started)} parked instances: {started}")
+    return started
@@ -0,0 +1,118 @@
+// Copyright Epic Games, Inc. All Rights Reserved.
+
+//Start : AWS - allocation throughput of several matchmaker processes sharing one pool state
+// Starts the local pool state stand-in (modules/poolState.js) and, for each process count, forks that many matchmaker
+// processes against it. Every process runs --concurrency allocation cycles at a time, as the poller and browsers
+// would: reserve a server, clientConnected, clientDisconnected. A clientConnected that finds a client already on the
+// server means two processes were handed the same server, these are reported as double allocations.
+//
+// The stand-in delays each reply by --store-latency-ms, the round trip to Redis or DynamoDB. Each allocation request
+// also occupies its process's event loop for --handler-ms (express routing, the secret check, JSON), modelled as a
+// per-process queue rather than burnt CPU so that the result does not depend on the cores of the machine it runs on.
+//
+//   node benchmarks/poolBenchmark.js --nodes 1,2,4,8 --duration 5 --concurrency 8 --servers 1000
+const { fork } = require('child_process');
+const poolState = require('../modules/poolState.js');
+
+function option(name, defaultValue) {
+	var index = process.argv.indexOf(`--${name}`);
+	return index >= 0 ? process.argv[index + 1] : defaultValue;
+}
+
+function percentile(sorted, p) {
+	return sorted.length ? sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))] : 0;
+}
+
+async function worker() {
+	var state = poolState.create('local', { LocalAddress: option('address') });
+	var handlerMs = parseFloat(option('handler-ms', '0.5'));
+	var concurrency = parseInt(option('concurrency', '8'));
+	var deadline = Date.now() + parseFloat(option('duration', '5')) * 1000;
+	var stats = { allocations: 0, empty: 0, doubleAllocations: 0, reserveMs: [] };
+
+	// the single event loop of a matchmaker handles one request at a time
+	var eventLoop = Promise.resolve();
+	var handle = () => {
+		eventLoop = eventLoop.then(() => new Promise(resolve => setTimeout(resolve, handlerMs)));
+		return eventLoop;
+	};
+
+	var cycle = async () => {
+		while (Date.now() < deadline) {
+			var started = process.hrtime.bigint();
+			await handle();
+			var server = (await state.reserve(1))[0];
+			stats.reserveMs.push(Number(process.hrtime.bigint() - started) / 1e6);
+			if (server == undefined) {
+				stats.empty++;
+				continue;
+			}
+			stats.allocations++;
+			if (await state.clientConnected(server.instanceID, server.leaseID) !== 1)
+				stats.doubleAllocations++;
+			await state.clientDisconnected(server.instanceID);
+		}
+	};
+	await Promise.all(Array.from({ length: concurrency }, cycle));
+	await state.close();
+	process.send(stats);
+}
+
+async function run(nodes, options) {
+	var store = await poolState.serve(0, {}, options.storeLatencyMs);
+	var address = `127.0.0.1:${store.address().port}`;
+	for (var i = 0; i < options.servers; i++) {
+		await store.state.register({ instanceID: `i-${i}`, address: `10.0.0.${i}`, port: 80, ready: true,
+			numConnectedClients: 0 }, 'benchmark');
+	}
+
+	var started = Date.now();
+	var results = await Promise.all(Array.from({ length: nodes }, () => new Promise((resolve, reject) => {
+		var child = fork(__filename, ['--worker', '--address', address, '--duration', String(options.duration),
+			'--concurrency', String(options.concurrency), '--handler-ms', String(options.handlerMs)]);
+		child.on('message', resolve);
+		child.on('error', reject);
+	})));
+	var seconds = (Date.now() - started) / 1000;
+	store.close();
+
+	var reserveMs = [].concat(...results.map(result => result.reserveMs)).sort((a, b) => a - b);
+	return {
+		nodes: nodes,
+		allocations: results.reduce((sum, result) => sum + result.allocations, 0),
+		perSecond: results.reduce((sum, result) => sum + result.allocations, 0) / seconds,
+		empty: results.reduce((sum, result) => sum + result.empty, 0),
+		doubleAllocations: results.reduce((sum, result) => sum + result.doubleAllocations, 0),
+		p50: percentile(reserveMs, 0.5),
+		p95: percentile(reserveMs, 0.95)
+	};
+}
+
+async function main() {
+	var options = {
+		duration: parseFloat(option('duration', '5')),
+		concurrency: parseInt(option('concurrency', '8')),
+		servers: parseInt(option('servers', '1000')),
+		handlerMs: parseFloat(option('handler-ms', '0.5')),
+		storeLatencyMs: parseFloat(option('store-latency-ms', '1'))
+	};
+	console.log(`concurrency ${options.concurrency} per process, ${options.servers} servers, handler ` +
+		`${options.handlerMs} ms, store latency ${options.storeLatencyMs} ms`);
+	console.log('processes  allocations  per second  speedup  reserve p50 ms  reserve p95 ms  empty  double');
+	var baseline;
+	for (const nodes of option('nodes', '1,2,4,8').split(',').map(Number)) {
+		var result = await run(nodes, options);
+		baseline = baseline || result.perSecond;
+		console.log(`${String(result.nodes).padStart(9)}  ${String(result.allocations).padStart(11)}  ` +
+			`${result.perSecond.toFixed(0).padStart(10)}  ${(result.perSecond / baseline).toFixed(2).padStart(7)}  ` +
+			`${result.p50.toFixed(2).padStart(14)}  ${result.p95.toFixed(2).padStart(14)}  ` +
+			`${String(result.empty).padStart(5)}  ${String(result.doubleAllocations).padStart(6)}`);
+	}
+}
+
+if (process.argv.includes('--worker')) {
+	worker();
+} else {
+	main();
+}
+//End : AWS - allocation throughput of several matchmaker processes sharing one pool state
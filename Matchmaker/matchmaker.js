@@ -13,7 +13,29 @@ const defaultConfig = {
 	MatchmakerPort: 9999,
 
 	// Log to file
-	LogToFile: true
+	LogToFile: true,
+
+	//Start : AWS - allocation caches
+	// How long the client secret from the parameter store is trusted before it is read again
+	SecretCacheSeconds: 300,
+	// How often the instanceID -> QueryString cache is reloaded from DynamoDB in the background
+	QueryStringRefreshSeconds: 60,
+	//End : AWS - allocation caches
+
+	//Start : AWS - shared pool state
+	// Where the pool of Cirrus servers is kept so several matchmakers can share it: memory (this process only), local
+	// (the stand-in served by modules/poolState.js), redis or dynamodb
+	PoolStateBackend: "memory",
+	// Address of the local stand-in, URL of the Redis server and DynamoDB table, used by the matching backend
+	PoolStateAddress: "127.0.0.1:6390",
+	PoolStateRedisUrl: "redis://127.0.0.1:6379",
+	PoolStateTable: "matchmakerPool",
+	//End : AWS - shared pool state
+
+	//Start : AWS - reservation leases
+	// How long a handed out server waits for its user to connect before it goes back to the pool
+	LeaseSeconds: 60
+	//End : AWS - reservation leases
 };
 
 // Similar to the Signaling Server (SS) code, load in a config.json file for the MM parameters
@@ -48,6 +70,18 @@ if (config.LogToFile) {
 // A list of all the Cirrus server which are connected to the Matchmaker.
 var cirrusServers = new Map();
 var theSSMSecret=''
+//Start : AWS - pool state, shared with the other matchmaker processes unless PoolStateBackend is memory
+// cirrusServers only holds the servers connected to this process, their readiness, client count and reservation lease
+// are kept in poolState under the instance ID so that every matchmaker can hand them out
+// identifies this process in the shared pool state, a server is only removed by the process it is connected to
+const matchmakerNode = `${require('os').hostname()}:${process.pid}`;
+const poolState = require('./modules/poolState.js').create(config.PoolStateBackend, {
+	LeaseMs: config.LeaseSeconds * 1000,
+	LocalAddress: config.PoolStateAddress,
+	RedisUrl: config.PoolStateRedisUrl,
+	TableName: config.PoolStateTable
+});
+//End : AWS - pool state, shared with the other matchmaker processes unless PoolStateBackend is memory
 //
 // Parse command line.
 //
@@ -118,75 +152,158 @@ function sendRetryResponse(res) {
 }
 
 // Get a Cirrus server if there is one available which has no clients connected.
-function getAvailableCirrusServer() {
-	for (cirrusServer of cirrusServers.values()) {
-		if (cirrusServer.numConnectedClients === 0 && cirrusServer.ready === true) {
-
-			// Check if we had at least 10 seconds since the last redirect, avoiding the 
-			// chance of redirecting 2+ users to the same SS before they click Play.
-			// In other words, give the user 10 seconds to click play button the claim the server.
-			if( cirrusServer.hasOwnProperty('lastRedirect')) {
-				if( ((Date.now() - cirrusServer.lastRedirect) / 1000) < 10 )
-					continue;
-			}
-			cirrusServer.lastRedirect = Date.now();
-
-			return cirrusServer;
-		}
-	}
+async function getAvailableCirrusServer() {
+	//Start : AWS - reserve the server in the pool state, atomically across matchmakers
+	// The server is leased to the user for LeaseSeconds. The lease ends when the user connects to
+	// it or the lease expires, avoiding the chance of redirecting 2+ users to the same SS.
+	var cirrusServer = (await poolState.reserve(1))[0];
+	if (cirrusServer != undefined)
+		return cirrusServer;
+	//End : AWS - reserve the server in the pool state, atomically across matchmakers
 	
 	console.log('WARNING: No empty Cirrus servers are available');
 	return undefined;
 }
+
+//Start : AWS - reserve several Cirrus servers in one call for the session poller
+// Returns up to count available Cirrus servers, each one leased so it is not handed out twice
+async function getAvailableCirrusServers(count) {
+	return poolState.reserve(count);
+}
+
+// Makes reserved servers that will not be used immediately available again. With leaseIds only those leases end,
+// a server that was leased to someone else in the meantime keeps its new lease
+async function releaseCirrusServers(instanceIds, leaseIds) {
+	return poolState.release(instanceIds, leaseIds);
+}
+
+// The lease ID travels to the browser in the signalling server URL, Cirrus sends it back in clientConnected. The
+// load balancer rules only look at their own query string parameter. QueryString is stored without the leading "?"
+// (session=02), the frontend appends it to the load balancer URL that ends in "?"
+function withLease(qs, leaseId) {
+	return `${qs}${qs && !/[?&]$/.test(qs) ? '&' : ''}lease=${leaseId}`;
+}
+//End : AWS - reserve several Cirrus servers in one call for the session poller
 //Start : AWS - get client secret for validation from parameter store
-const getParameterInfo = async () => { 
-	const client = new SSMClient({ region: "ap-south-1" });
-	const input = { // GetParameterRequest
-		Name: "matchmakerclientsecret" // required
-	};
-	const paramSSMcommand = new GetParameterCommand(input);
-	const paramSSMresponse= await client.send(paramSSMcommand);
-	theSSMSecret=paramSSMresponse.Parameter.Value
+// The secret is cached for SecretCacheSeconds and concurrent requests share one parameter store call
+const ssmClient = new SSMClient({ region: "ap-south-1" });
+var secretFetchedAt = 0;
+var secretRequest = null;
+
+const getParameterInfo = async (forceRefresh) => {
+	if (!forceRefresh && theSSMSecret && (Date.now() - secretFetchedAt) < config.SecretCacheSeconds * 1000)
+		return;
+	if (!secretRequest) {
+		const input = { // GetParameterRequest
+			Name: "matchmakerclientsecret" // required
+		};
+		secretRequest = ssmClient.send(new GetParameterCommand(input)).then((paramSSMresponse) => {
+			theSSMSecret = paramSSMresponse.Parameter.Value;
+			secretFetchedAt = Date.now();
+		}).finally(() => {
+			secretRequest = null;
+		});
+	}
+	await secretRequest;
+}
+
+// Checks the clientsecret header. A mismatch re-reads a secret older than a minute once, so a rotated secret is
+// picked up without letting bad requests trigger a parameter store call each
+const isValidClientSecret = async (req) => {
+	await getParameterInfo();
+	var secret = req.header("clientsecret");
+	if (secret == undefined)
+		return false;
+	if (secret != theSSMSecret && (Date.now() - secretFetchedAt) > 60 * 1000)
+		await getParameterInfo(true);
+	return secret == theSSMSecret;
 }
 //End : AWS - get client secret for validation from parameter store
 
-//Start : AWS -  Get Query String from DynamoDB for Signalling Instance
-const getQueryStringFromDDB = async (instanceId) => {     
-    	var qs=''
-    	console.log(instanceId)
-        var params = {
-        	FilterExpression: "InstanceID = :t",
-			ExpressionAttributeValues: {
-    			":t": {S: instanceId}
-			},
-			ProjectionExpression: "QueryString",
-            TableName: "instanceMapping"
-        };
-        
-        const data =await ddb.scan(params).promise()
-    	qs=data.Items[0].QueryString.S
-		console.log("Success", qs);
-		return qs
+//Start : AWS - instanceID -> QueryString cache of the instanceMapping table
+// The whole mapping is small (one row per target group slot), so it is loaded with one paginated scan, reloaded every
+// QueryStringRefreshSeconds and whenever a server shows up that is not in it. Allocations read it from memory
+var queryStringCache = new Map();
+var queryStringRequest = null;
+
+const refreshQueryStrings = async () => {
+	if (!queryStringRequest) {
+		queryStringRequest = (async () => {
+			var queryStrings = new Map();
+			var params = {
+				FilterExpression: "InstanceID <> :empty",
+				ExpressionAttributeValues: { ":empty": {S: ""} },
+				ProjectionExpression: "InstanceID, QueryString",
+				TableName: "instanceMapping"
+			};
+			do {
+				const data = await ddb.scan(params).promise();
+				for (const item of data.Items) {
+					queryStrings.set(item.InstanceID.S, item.QueryString.S);
+				}
+				params.ExclusiveStartKey = data.LastEvaluatedKey;
+			} while (params.ExclusiveStartKey);
+			queryStringCache = queryStrings;
+			console.log(`Loaded ${queryStrings.size} signalling server query strings`);
+		})().finally(() => {
+			queryStringRequest = null;
+		});
+	}
+	await queryStringRequest;
+}
+
+// Returns {instanceID: QueryString} for the given instances, DynamoDB is read only when one of them is not cached
+const getQueryStrings = async (instanceIds) => {
+	if (instanceIds.some(instanceId => !queryStringCache.has(instanceId)))
+		await refreshQueryStrings();
+	var queryStrings = {};
+	for (const instanceId of instanceIds) {
+		if (queryStringCache.has(instanceId))
+			queryStrings[instanceId] = queryStringCache.get(instanceId);
+	}
+	return queryStrings;
+}
+
+const getQueryString = async (instanceId) => {
+	return (await getQueryStrings([instanceId]))[instanceId];
 }
-//End : AWS -  Get Query String from DynamoDB for Signalling Instance
+
+function cacheQueryString(cirrusServer) {
+	// a server that registered after the last load triggers a reload in the background
+	if (cirrusServer.instanceID && !queryStringCache.has(cirrusServer.instanceID)) {
+		refreshQueryStrings().catch(err => console.log(`ERROR reading query strings: ${err}`));
+	}
+}
+
+refreshQueryStrings().catch(err => console.log(`ERROR reading query strings: ${err}`));
+setInterval(() => {
+	refreshQueryStrings().catch(err => console.log(`ERROR reading query strings: ${err}`));
+}, config.QueryStringRefreshSeconds * 1000);
+//End : AWS - instanceID -> QueryString cache of the instanceMapping table
 
 if(enableRESTAPI) {
 	// Handle REST signalling server only request.
 	app.options('/signallingserver', cors())
 	app.get('/signallingserver', cors(),  async(req, res) => {
 		//Start : AWS - check if a valid secret was provided in header to authenticate calls
-		console.log(config.AWSRegion)
-		await getParameterInfo()
-		if(req.header("clientsecret") != undefined && req.header("clientsecret")==theSSMSecret)
+		if(await isValidClientSecret(req))
 		{
-			cirrusServer = getAvailableCirrusServer();
+			var cirrusServer = await getAvailableCirrusServer();
 			if (cirrusServer != undefined) {
-				var qs=await getQueryStringFromDDB(cirrusServer.instanceID);
+				var qs=await getQueryString(cirrusServer.instanceID);
+				if (qs == undefined) {
+					// not registered behind the load balancer yet, leave it for a later request
+					await releaseCirrusServers([cirrusServer.instanceID], [cirrusServer.leaseID]);
+					res.status(400).send('No signalling servers available');
+					return;
+				}
 				console.log("Received", qs);
 				// The original function used to send the instance ip/port to allow connection to Signalling
 				// We have modified the logic to send a query string which allows to connect to Signalling
 				// via an external load balancer. The query string is in dynamoDB
-				res.json({ signallingServer: qs});
+				// instanceID lets the session poller release the lease when the browser is gone
+				res.json({ signallingServer: withLease(qs, cirrusServer.leaseID), instanceID: cirrusServer.instanceID,
+					leaseID: cirrusServer.leaseID, leaseExpiresAt: cirrusServer.leaseExpiresAt });
 				console.log(`Returning ${cirrusServer.address}:${cirrusServer.port}`);
 			} else {
 				res.status(400).send('No signalling servers available');
@@ -197,12 +314,97 @@ if(enableRESTAPI) {
 		}
 		//End : AWS - check if a valid secret was provided in header to authenticate calls
 	});
+
+	//Start : AWS - bulk reservation used by the session poller to match a whole SQS batch in one round trip
+	// POST /signallingservers/reserve?count=N reserves up to N servers, N between 1 and 100
+	app.post('/signallingservers/reserve', cors(), async(req, res) => {
+		if(!(await isValidClientSecret(req))) {
+			res.status(401).send('Unauthorized');
+			return;
+		}
+		var count = Math.max(1, Math.min(parseInt(req.query.count) || 1, 100));
+		try {
+			var servers = await getAvailableCirrusServers(count);
+		} catch (err) {
+			console.log(`ERROR reserving Cirrus servers: ${err}`);
+			res.status(500).send('Could not reserve signalling servers');
+			return;
+		}
+		try {
+			var queryStrings = await getQueryStrings(servers.map(server => server.instanceID));
+		} catch (err) {
+			console.log(`ERROR reading query strings: ${err}`);
+			await releaseCirrusServers(servers.map(server => server.instanceID), servers.map(server => server.leaseID));
+			res.status(500).send('Could not read signalling server mapping');
+			return;
+		}
+		var reserved = [];
+		var unmapped = [];
+		for (const server of servers) {
+			if (queryStrings[server.instanceID] != undefined) {
+				reserved.push({
+					instanceID: server.instanceID,
+					signallingServer: withLease(queryStrings[server.instanceID], server.leaseID),
+					leaseID: server.leaseID,
+					leaseExpiresAt: server.leaseExpiresAt
+				});
+			} else {
+				// not registered behind the load balancer yet, leave it for a later request
+				unmapped.push(server);
+			}
+		}
+		if (unmapped.length > 0)
+			await releaseCirrusServers(unmapped.map(server => server.instanceID), unmapped.map(server => server.leaseID));
+		console.log(`Reserved ${reserved.length} of ${count} requested Cirrus servers`);
+		res.json({ signallingServers: reserved });
+	});
+
+	// GET /signallingservers/stats summarises the pool for the warm-pool autoscaler, with the lease counters
+	app.get('/signallingservers/stats', cors(), async(req, res) => {
+		if(!(await isValidClientSecret(req))) {
+			res.status(401).send('Unauthorized');
+			return;
+		}
+		var now = Date.now();
+		var stats = { total: 0, ready: 0, busy: 0, reserved: 0, idle: 0 };
+		for (const cirrusServer of await poolState.list()) {
+			stats.total++;
+			if (cirrusServer.ready === true)
+				stats.ready++;
+			if (cirrusServer.numConnectedClients > 0) {
+				stats.busy++;
+			} else if (cirrusServer.ready === true) {
+				// servers with a running lease are waiting for their user
+				if (cirrusServer.leaseID && cirrusServer.leaseExpiresAt >= now)
+					stats.reserved++;
+				else
+					stats.idle++;
+			}
+		}
+		stats.leases = await poolState.leaseStats();
+		res.json(stats);
+	});
+
+	// POST /signallingservers/release with {"instanceIDs": [...], "leaseIDs": [...]} returns unused reservations to the
+	// pool. leaseIDs is optional and parallel to instanceIDs
+	app.post('/signallingservers/release', cors(), express.json(), async(req, res) => {
+		if(!(await isValidClientSecret(req))) {
+			res.status(401).send('Unauthorized');
+			return;
+		}
+		var instanceIds = (req.body && Array.isArray(req.body.instanceIDs)) ? req.body.instanceIDs : [];
+		var leaseIds = (req.body && Array.isArray(req.body.leaseIDs)) ? req.body.leaseIDs : undefined;
+		var released = await releaseCirrusServers(instanceIds, leaseIds);
+		console.log(`Released ${released} reserved Cirrus servers`);
+		res.json({ released: released });
+	});
+	//End : AWS - bulk reservation used by the session poller to match a whole SQS batch in one round trip
 }
 
 if(enableRedirectionLinks) {
 	// Handle standard URL.
-	app.get('/', (req, res) => {
-		cirrusServer = getAvailableCirrusServer();
+	app.get('/', async (req, res) => {
+		var cirrusServer = await getAvailableCirrusServer();
 		if (cirrusServer != undefined) {
 			res.redirect(`http://${cirrusServer.address}:${cirrusServer.port}/`);
 			//console.log(req);
@@ -213,8 +415,8 @@ if(enableRedirectionLinks) {
 	});
 
 	// Handle URL with custom HTML.
-	app.get('/custom_html/:htmlFilename', (req, res) => {
-		cirrusServer = getAvailableCirrusServer();
+	app.get('/custom_html/:htmlFilename', async (req, res) => {
+		var cirrusServer = await getAvailableCirrusServer();
 		if (cirrusServer != undefined) {
 			res.redirect(`http://${cirrusServer.address}:${cirrusServer.port}/custom_html/${req.params.htmlFilename}`);
 			console.log(`Redirect to ${cirrusServer.address}:${cirrusServer.port}`);
@@ -235,7 +437,113 @@ function disconnect(connection) {
 	connection.end();
 }
 
+//Start : AWS - messages from a Cirrus server update the pool state, in the order they were received
+async function onCirrusMessage(connection, message) {
+	var cirrusServer;
+	if (message.type === 'connect') {
+		// A Cirrus server connects to this Matchmaker server.
+		cirrusServer = {
+			address: message.address,
+			port: message.port,
+			numConnectedClients: 0,
+			lastPingReceived: Date.now(),
+			instanceID:message.instanceId
+		};
+		cirrusServer.ready = message.ready === true;
+
+		// Handles disconnects between MM and SS to not add dupes with numConnectedClients = 0 and redirect users to same SS
+		// Check if player is connected and doing a reconnect. message.playerConnected is a new variable sent from the SS to
+		// help track whether or not a player is already connected when a 'connect' message is sent (i.e., reconnect).
+		if(message.playerConnected == true) {
+			cirrusServer.numConnectedClients = 1;
+		}
+
+		// Find if we already have a ciruss server address connected to (possibly a reconnect happening)
+		let server = [...cirrusServers.entries()].find(([key, val]) => val.address === cirrusServer.address && val.port === cirrusServer.port);
+
+		// if a duplicate server with the same address isn't found -- add it to the map as an available server to send users to.
+		if (!server || server.size <= 0) {
+			console.log(`Adding connection for ${cirrusServer.address.split(".")[0]} with playerConnected: ${message.playerConnected}`)
+			cirrusServers.set(connection, cirrusServer);
+		} else {
+			console.log(`RECONNECT: cirrus server address ${cirrusServer.address.split(".")[0]} already found--replacing. playerConnected: ${message.playerConnected}`)
+			var foundServer = cirrusServers.get(server[0]);
+			
+			// Make sure to retain the numConnectedClients from the last one before the reconnect to MM
+			if (foundServer) {					
+				cirrusServers.set(connection, cirrusServer);
+				console.log(`Replacing server with original with numConn: ${cirrusServer.numConnectedClients}`);
+				cirrusServers.delete(server[0]);
+			} else {
+				cirrusServers.set(connection, cirrusServer);
+				console.log("Connection not found in Map() -- adding a new one");
+			}
+		}
+		// the pool state entry is replaced as a whole, also when the server was connected to another matchmaker before
+		await poolState.register(cirrusServer, matchmakerNode);
+		// an instance restarted from the warm pool keeps its instanceID but holds another slot, so the query string
+		// cached for its previous life is dropped and read again
+		queryStringCache.delete(cirrusServer.instanceID);
+		cacheQueryString(cirrusServer);
+	} else if (message.type === 'streamerConnected') {
+		// The stream connects to a Cirrus server and so is ready to be used
+		cirrusServer = cirrusServers.get(connection);
+		if(cirrusServer) {
+			cirrusServer.ready = true;
+			await poolState.setReady(cirrusServer.instanceID, true);
+			cacheQueryString(cirrusServer);
+			console.log(`Cirrus server ${cirrusServer.address}:${cirrusServer.port} ready for use`);
+		} else {
+			disconnect(connection);
+		}
+	} else if (message.type === 'streamerDisconnected') {
+		// The stream connects to a Cirrus server and so is ready to be used
+		cirrusServer = cirrusServers.get(connection);
+		if(cirrusServer) {
+			cirrusServer.ready = false;
+			await poolState.setReady(cirrusServer.instanceID, false);
+			console.log(`Cirrus server ${cirrusServer.address}:${cirrusServer.port} no longer ready for use`);
+		} else {
+			disconnect(connection);
+		}
+	} else if (message.type === 'clientConnected') {
+		// A client connects to a Cirrus server.
+		cirrusServer = cirrusServers.get(connection);
+		if(cirrusServer) {
+			// confirms the lease the user was given, Cirrus passes it on from the player's URL
+			cirrusServer.numConnectedClients = await poolState.clientConnected(cirrusServer.instanceID, message.leaseId);
+			console.log(`Client connected to Cirrus server ${cirrusServer.address}:${cirrusServer.port}`);
+		} else {
+			disconnect(connection);
+		}
+	} else if (message.type === 'clientDisconnected') {
+		// A client disconnects from a Cirrus server, at 0 clients it is immediately available for a new client
+		cirrusServer = cirrusServers.get(connection);
+		if(cirrusServer) {
+			cirrusServer.numConnectedClients = await poolState.clientDisconnected(cirrusServer.instanceID);
+			console.log(`Client disconnected from Cirrus server ${cirrusServer.address}:${cirrusServer.port}`);
+		} else {				
+			disconnect(connection);
+		}
+	} else if (message.type === 'ping') {
+		cirrusServer = cirrusServers.get(connection);
+		if(cirrusServer) {
+			cirrusServer.lastPingReceived = Date.now();
+			await poolState.touch(cirrusServer.instanceID);
+		} else {				
+			disconnect(connection);
+		}
+	} else {
+		console.log('ERROR: Unknown data: ' + JSON.stringify(message));
+		disconnect(connection);
+	}
+}
+//End : AWS - messages from a Cirrus server update the pool state, in the order they were received
+
 const matchmaker = net.createServer((connection) => {
+	//Start : AWS - messages from a Cirrus server update the pool state, in the order they were received
+	connection.pending = Promise.resolve();
+	//End : AWS - messages from a Cirrus server update the pool state, in the order they were received
 	connection.on('data', (data) => {
 		try {
 			message = JSON.parse(data);
@@ -247,96 +555,12 @@ const matchmaker = net.createServer((connection) => {
 			disconnect(connection);
 			return;
 		}
-		if (message.type === 'connect') {
-			// A Cirrus server connects to this Matchmaker server.
-			cirrusServer = {
-				address: message.address,
-				port: message.port,
-				numConnectedClients: 0,
-				lastPingReceived: Date.now(),
-				instanceID:message.instanceId
-			};
-			cirrusServer.ready = message.ready === true;
-
-			// Handles disconnects between MM and SS to not add dupes with numConnectedClients = 0 and redirect users to same SS
-			// Check if player is connected and doing a reconnect. message.playerConnected is a new variable sent from the SS to
-			// help track whether or not a player is already connected when a 'connect' message is sent (i.e., reconnect).
-			if(message.playerConnected == true) {
-				cirrusServer.numConnectedClients = 1;
-			}
-
-			// Find if we already have a ciruss server address connected to (possibly a reconnect happening)
-			let server = [...cirrusServers.entries()].find(([key, val]) => val.address === cirrusServer.address && val.port === cirrusServer.port);
-
-			// if a duplicate server with the same address isn't found -- add it to the map as an available server to send users to.
-			if (!server || server.size <= 0) {
-				console.log(`Adding connection for ${cirrusServer.address.split(".")[0]} with playerConnected: ${message.playerConnected}`)
-				cirrusServers.set(connection, cirrusServer);
-            } else {
-				console.log(`RECONNECT: cirrus server address ${cirrusServer.address.split(".")[0]} already found--replacing. playerConnected: ${message.playerConnected}`)
-				var foundServer = cirrusServers.get(server[0]);
-				
-				// Make sure to retain the numConnectedClients from the last one before the reconnect to MM
-				if (foundServer) {					
-					cirrusServers.set(connection, cirrusServer);
-					console.log(`Replacing server with original with numConn: ${cirrusServer.numConnectedClients}`);
-					cirrusServers.delete(server[0]);
-				} else {
-					cirrusServers.set(connection, cirrusServer);
-					console.log("Connection not found in Map() -- adding a new one");
-				}
-			}
-		} else if (message.type === 'streamerConnected') {
-			// The stream connects to a Cirrus server and so is ready to be used
-			cirrusServer = cirrusServers.get(connection);
-			if(cirrusServer) {
-				cirrusServer.ready = true;
-				console.log(`Cirrus server ${cirrusServer.address}:${cirrusServer.port} ready for use`);
-			} else {
-				disconnect(connection);
-			}
-		} else if (message.type === 'streamerDisconnected') {
-			// The stream connects to a Cirrus server and so is ready to be used
-			cirrusServer = cirrusServers.get(connection);
-			if(cirrusServer) {
-				cirrusServer.ready = false;
-				console.log(`Cirrus server ${cirrusServer.address}:${cirrusServer.port} no longer ready for use`);
-			} else {
-				disconnect(connection);
-			}
-		} else if (message.type === 'clientConnected') {
-			// A client connects to a Cirrus server.
-			cirrusServer = cirrusServers.get(connection);
-			if(cirrusServer) {
-				cirrusServer.numConnectedClients++;
-				console.log(`Client connected to Cirrus server ${cirrusServer.address}:${cirrusServer.port}`);
-			} else {
-				disconnect(connection);
-			}
-		} else if (message.type === 'clientDisconnected') {
-			// A client disconnects from a Cirrus server.
-			cirrusServer = cirrusServers.get(connection);
-			if(cirrusServer) {
-				cirrusServer.numConnectedClients--;
-				console.log(`Client disconnected from Cirrus server ${cirrusServer.address}:${cirrusServer.port}`);
-				if(cirrusServer.numConnectedClients === 0) {
-					// this make this server immediately available for a new client
-					cirrusServer.lastRedirect = 0;
-				}
-			} else {				
-				disconnect(connection);
-			}
-		} else if (message.type === 'ping') {
-			cirrusServer = cirrusServers.get(connection);
-			if(cirrusServer) {
-				cirrusServer.lastPingReceived = Date.now();
-			} else {				
-				disconnect(connection);
-			}
-		} else {
-			console.log('ERROR: Unknown data: ' + JSON.stringify(message));
-			disconnect(connection);
-		}
+		//Start : AWS - messages from a Cirrus server update the pool state, in the order they were received
+		const received = message;
+		connection.pending = connection.pending.then(() => onCirrusMessage(connection, received)).catch((err) => {
+			console.log(`ERROR updating pool state for ${received.type}: ${err}`);
+		});
+		//End : AWS - messages from a Cirrus server update the pool state, in the order they were received
 	});
 
 	// A Cirrus server disconnects from this Matchmaker server.
@@ -344,6 +568,12 @@ const matchmaker = net.createServer((connection) => {
 		cirrusServer = cirrusServers.get(connection);
 		if(cirrusServer) {
 			cirrusServers.delete(connection);
+			//Start : AWS - remove the server from the pool state unless it reconnected to another matchmaker
+			const instanceID = cirrusServer.instanceID;
+			connection.pending = connection.pending.then(() => poolState.remove(instanceID, matchmakerNode)).catch((err) => {
+				console.log(`ERROR removing ${instanceID} from the pool state: ${err}`);
+			});
+			//End : AWS - remove the server from the pool state unless it reconnected to another matchmaker
 			console.log(`Cirrus server ${cirrusServer.address}:${cirrusServer.port} disconnected from Matchmaker`);
 		} else {
 			console.log(`Disconnected machine that wasn't a registered cirrus server, remote address: ${connection.remoteAddress}`);
@@ -0,0 +1,916 @@
+// Copyright Epic Games, Inc. All Rights Reserved.
+
+//Start : AWS - pool state shared between matchmaker processes
+// The readiness, client count and reservation lease of every Cirrus server live behind one of these backends, keyed by
+// the instance ID of the signalling server rather than by its TCP connection. Every operation is atomic in the backend,
+// so several matchmaker processes can register servers and hand them out without giving the same server to two users.
+//
+//   memory   - in this process only, the original single matchmaker behaviour (default)
+//   local    - a shared in-memory stand-in served by `node modules/poolState.js --serve 6390`, for tests and benchmarks
+//   redis    - a Redis server, allocations run as Lua scripts (needs `npm install redis`)
+//   dynamodb - a DynamoDB table with conditional writes, see MatchmakerPoolTable in infra/create.yaml
+//
+// Handing out a server grants a lease: a random lease ID that expires after LeaseMs. The lease ID travels to the
+// browser in the signalling server URL and back with Cirrus' clientConnected message, which confirms the lease. A lease
+// that is not confirmed in time expires and the server is free again; that time is capacity lost to an abandoned
+// reservation and is counted in leaseStats().
+//
+// Every backend implements the same async functions:
+//   register(server, node)               add or replace {instanceID, address, port, ready, numConnectedClients}
+//   setReady(instanceID, ready)          the streamer (dis)connected
+//   clientConnected(instanceID, leaseID) confirms the lease, returns the number of clients after the increment
+//   clientDisconnected(instanceID)       returns the number of clients after the decrement, the server is free at 0
+//   touch(instanceID)                    a ping was received from the server
+//   remove(instanceID, node)             the connection to the server was lost, ignored if it moved to another node
+//   reserve(count)                       atomically leases up to count free servers, each with its leaseID
+//   release(instanceIDs, leaseIDs)       ends unconfirmed leases early (only the given lease when leaseIDs are passed)
+//   list()                               all servers, for the stats endpoint
+//   leaseStats()                         lease counters, see LEASE_COUNTERS
+// Servers that did not ping for StaleMs are not handed out, their matchmaker process may be gone.
+
+const crypto = require('crypto');
+const net = require('net');
+
+const DEFAULT_OPTIONS = {
+	// how long a handed out server waits for its user before it is given to someone else
+	LeaseMs: 60 * 1000,
+	// Cirrus pings every 30 seconds, a server that missed several pings is not handed out
+	StaleMs: 120 * 1000,
+	LocalAddress: '127.0.0.1:6390',
+	RedisUrl: 'redis://127.0.0.1:6379',
+	RedisPrefix: 'matchmaker:',
+	TableName: 'matchmakerPool'
+};
+
+// granted     leases handed out
+// confirmed   confirmed by the user's clientConnected before they expired
+// released    handed back unused, e.g. when the browser's web socket was gone
+// expired     ran out unconfirmed, the server was blocked for the whole lease for nobody
+// late        the user arrived after the lease expired
+// mismatched  a clientConnected carried another lease ID than the server's lease, a double booking
+// abandonedServerSeconds  server time blocked by expired leases
+const LEASE_COUNTERS = ['granted', 'confirmed', 'released', 'expired', 'late', 'mismatched', 'abandonedServerSeconds'];
+
+function newLeaseID() {
+	return crypto.randomBytes(8).toString('hex');
+}
+
+function emptyLeaseStats() {
+	var stats = {};
+	LEASE_COUNTERS.forEach(counter => stats[counter] = 0);
+	return stats;
+}
+
+// what a clientConnected does to the lease the server has, the same for every backend
+function confirmOutcome(leaseID, leaseExpiresAt, presentedLeaseID, now) {
+	if (!leaseID)
+		return presentedLeaseID ? 'late' : undefined;
+	if (presentedLeaseID && presentedLeaseID !== leaseID)
+		return 'mismatched';
+	return leaseExpiresAt >= now ? 'confirmed' : 'late';
+}
+
+function serverInfo(server) {
+	return {
+		instanceID: server.instanceID,
+		address: server.address,
+		port: server.port,
+		ready: server.ready === true,
+		numConnectedClients: server.numConnectedClients,
+		leaseID: server.leaseID || '',
+		leaseExpiresAt: server.leaseExpiresAt || 0,
+		lastPingReceived: server.lastPingReceived
+	};
+}
+
+// --- memory -----------------------------------------------------------------------------------------------------------
+
+class MemoryPoolState {
+	constructor(options) {
+		this.options = Object.assign({}, DEFAULT_OPTIONS, options);
+		this.servers = new Map();
+		// the servers that are ready, have no client and no running lease, so reserve() does not scan every server
+		this.free = new Set();
+		this.leaseTimers = new Map();
+		this.stats = emptyLeaseStats();
+	}
+
+	leased(server) {
+		return server.leaseID && !server.leaseExpired;
+	}
+
+	index(server) {
+		if (server.ready === true && server.numConnectedClients <= 0 && !this.leased(server)) {
+			this.free.add(server);
+		} else {
+			this.free.delete(server);
+		}
+	}
+
+	clearLease(server) {
+		clearTimeout(this.leaseTimers.get(server.instanceID));
+		this.leaseTimers.delete(server.instanceID);
+		server.leaseID = '';
+		server.leaseExpiresAt = 0;
+		server.leaseExpired = false;
+	}
+
+	grantLease(server) {
+		this.clearLease(server);
+		server.leaseID = newLeaseID();
+		server.leaseExpiresAt = Date.now() + this.options.LeaseMs;
+		this.free.delete(server);
+		var timer = setTimeout(() => this.expireLease(server, server.leaseID), this.options.LeaseMs);
+		if (timer.unref)
+			timer.unref();
+		this.leaseTimers.set(server.instanceID, timer);
+		this.stats.granted++;
+	}
+
+	expireLease(server, leaseID) {
+		this.leaseTimers.delete(server.instanceID);
+		if (this.servers.get(server.instanceID) !== server || server.leaseID !== leaseID)
+			return;
+		// the lease ID is kept so that a user arriving late is still recognised
+		server.leaseExpired = true;
+		this.stats.expired++;
+		this.stats.abandonedServerSeconds += this.options.LeaseMs / 1000;
+		this.index(server);
+	}
+
+	async register(server, node) {
+		var previous = this.servers.get(server.instanceID);
+		var entry = serverInfo(server);
+		entry.node = node;
+		entry.lastPingReceived = Date.now();
+		if (previous) {
+			this.free.delete(previous);
+			// a running lease survives a reconnect of its server, its user is still on the way
+			if (this.leased(previous) && entry.numConnectedClients === 0) {
+				entry.leaseID = previous.leaseID;
+				entry.leaseExpiresAt = previous.leaseExpiresAt;
+				var timer = setTimeout(() => this.expireLease(entry, entry.leaseID), entry.leaseExpiresAt - Date.now());
+				if (timer.unref)
+					timer.unref();
+				clearTimeout(this.leaseTimers.get(entry.instanceID));
+				this.leaseTimers.set(entry.instanceID, timer);
+			} else {
+				this.clearLease(previous);
+			}
+		}
+		this.servers.set(entry.instanceID, entry);
+		this.index(entry);
+	}
+
+	async setReady(instanceID, ready) {
+		var server = this.servers.get(instanceID);
+		if (server) {
+			server.ready = ready;
+			this.index(server);
+		}
+	}
+
+	async clientConnected(instanceID, leaseID) {
+		var server = this.servers.get(instanceID);
+		if (!server)
+			return undefined;
+		var outcome = confirmOutcome(server.leaseID, server.leaseExpired ? 0 : server.leaseExpiresAt, leaseID, Date.now());
+		if (outcome)
+			this.stats[outcome]++;
+		this.clearLease(server);
+		server.numConnectedClients++;
+		this.index(server);
+		return server.numConnectedClients;
+	}
+
+	async clientDisconnected(instanceID) {
+		var server = this.servers.get(instanceID);
+		if (!server)
+			return undefined;
+		// at 0 clients the server is immediately available for a new client
+		server.numConnectedClients = Math.max(server.numConnectedClients - 1, 0);
+		this.index(server);
+		return server.numConnectedClients;
+	}
+
+	async touch(instanceID) {
+		var server = this.servers.get(instanceID);
+		if (server)
+			server.lastPingReceived = Date.now();
+	}
+
+	async remove(instanceID, node) {
+		var server = this.servers.get(instanceID);
+		if (server && (node === undefined || server.node === node)) {
+			this.clearLease(server);
+			this.servers.delete(instanceID);
+			this.free.delete(server);
+		}
+	}
+
+	async reserve(count) {
+		var alive = Date.now() - this.options.StaleMs;
+		var reserved = [];
+		for (const server of this.free) {
+			if (reserved.length >= count)
+				break;
+			if (server.lastPingReceived < alive)
+				continue;
+			this.grantLease(server);
+			reserved.push(serverInfo(server));
+		}
+		return reserved;
+	}
+
+	async release(instanceIDs, leaseIDs) {
+		var released = 0;
+		instanceIDs.forEach((instanceID, i) => {
+			var server = this.servers.get(instanceID);
+			var leaseID = leaseIDs && leaseIDs[i];
+			if (server && server.numConnectedClients === 0 && this.leased(server) && (!leaseID || leaseID === server.leaseID)) {
+				this.clearLease(server);
+				this.index(server);
+				released++;
+			}
+		});
+		this.stats.released += released;
+		return released;
+	}
+
+	async list() {
+		return [...this.servers.values()].map(server => {
+			var info = serverInfo(server);
+			if (server.leaseExpired)
+				info.leaseExpiresAt = Math.min(info.leaseExpiresAt, Date.now() - 1);
+			return info;
+		});
+	}
+
+	async leaseStats() {
+		var stats = Object.assign({}, this.stats);
+		stats.active = [...this.servers.values()].filter(server => this.leased(server)).length;
+		return stats;
+	}
+
+	async close() {
+		this.leaseTimers.forEach(timer => clearTimeout(timer));
+		this.leaseTimers.clear();
+	}
+}
+
+// the backends that find expired leases when they next touch the server add the ones nobody touched yet
+function withPendingExpiries(stats, servers, leaseMs) {
+	var now = Date.now();
+	stats.active = 0;
+	for (const server of servers) {
+		if (server.leaseID && server.leaseExpiresAt >= now) {
+			stats.active++;
+		} else if (server.leaseID) {
+			stats.expired++;
+			stats.abandonedServerSeconds += leaseMs / 1000;
+		}
+	}
+	return stats;
+}
+
+// --- local stand-in ---------------------------------------------------------------------------------------------------
+
+const OPERATIONS = ['register', 'setReady', 'clientConnected', 'clientDisconnected', 'touch', 'remove', 'reserve',
+	'release', 'list', 'leaseStats'];
+
+// Serves a MemoryPoolState to other processes over newline separated JSON: {id, op, args} -> {id, result} or
+// {id, error}. Requests are handled one at a time by a single event loop, which makes every operation atomic as it is
+// in Redis. latencyMs delays each reply to stand in for the network round trip to a real store.
+function serve(port, options, latencyMs) {
+	var state = new MemoryPoolState(options);
+	var server = net.createServer((connection) => {
+		connection.setNoDelay(true);
+		var buffered = '';
+		connection.on('data', (data) => {
+			buffered += data.toString();
+			var lines = buffered.split('\n');
+			buffered = lines.pop();
+			for (const line of lines) {
+				if (!line)
+					continue;
+				const request = JSON.parse(line);
+				const reply = (response) => {
+					const send = () => connection.writable && connection.write(JSON.stringify(response) + '\n');
+					latencyMs ? setTimeout(send, latencyMs) : send();
+				};
+				if (!OPERATIONS.includes(request.op)) {
+					reply({ id: request.id, error: `Unknown operation ${request.op}` });
+					continue;
+				}
+				state[request.op](...request.args).then(
+					result => reply({ id: request.id, result: result }),
+					err => reply({ id: request.id, error: err.toString() }));
+			}
+		});
+		connection.on('error', () => {});
+	});
+	server.state = state;
+	return new Promise((resolve) => server.listen(port, () => resolve(server)));
+}
+
+class LocalPoolState {
+	constructor(options) {
+		this.options = Object.assign({}, DEFAULT_OPTIONS, options);
+		this.nextId = 0;
+		this.pending = new Map();
+		this.buffered = '';
+		this.connection = null;
+	}
+
+	connect() {
+		if (!this.connection) {
+			var [host, port] = this.options.LocalAddress.split(':');
+			this.connection = net.createConnection(parseInt(port), host);
+			this.connection.setNoDelay(true);
+			this.connection.on('data', (data) => {
+				this.buffered += data.toString();
+				var lines = this.buffered.split('\n');
+				this.buffered = lines.pop();
+				for (const line of lines) {
+					const response = JSON.parse(line);
+					const pending = this.pending.get(response.id);
+					this.pending.delete(response.id);
+					if (response.error !== undefined)
+						pending.reject(new Error(response.error));
+					else
+						pending.resolve(response.result);
+				}
+			});
+			var fail = (err) => {
+				this.pending.forEach(pending => pending.reject(err || new Error('Pool state connection closed')));
+				this.pending.clear();
+				this.connection = null;
+			};
+			this.connection.on('error', fail);
+			this.connection.on('close', () => fail());
+		}
+		return this.connection;
+	}
+
+	call(op, ...args) {
+		var connection = this.connect();
+		var id = this.nextId++;
+		return new Promise((resolve, reject) => {
+			this.pending.set(id, { resolve, reject });
+			connection.write(JSON.stringify({ id: id, op: op, args: args }) + '\n');
+		});
+	}
+
+	register(server, node) { return this.call('register', serverInfo(server), node); }
+	setReady(instanceID, ready) { return this.call('setReady', instanceID, ready); }
+	clientConnected(instanceID, leaseID) { return this.call('clientConnected', instanceID, leaseID); }
+	clientDisconnected(instanceID) { return this.call('clientDisconnected', instanceID); }
+	touch(instanceID) { return this.call('touch', instanceID); }
+	remove(instanceID, node) { return this.call('remove', instanceID, node); }
+	reserve(count) { return this.call('reserve', count); }
+	release(instanceIDs, leaseIDs) { return this.call('release', instanceIDs, leaseIDs); }
+	list() { return this.call('list'); }
+	leaseStats() { return this.call('leaseStats'); }
+
+	async close() {
+		if (this.connection)
+			this.connection.end();
+	}
+}
+
+// --- redis ------------------------------------------------------------------------------------------------------------
+
+// The free set holds the ready, client-less servers scored by the time they can be handed out: 0, or the expiry of
+// their lease. An expired lease is only noticed when the server is leased again or its user arrives, then it is counted.
+
+// KEYS[1] server hash, KEYS[2] free set, ARGV: instance ID, address, port, ready, clients, now, node
+const REGISTER_SCRIPT = `
+local lease = redis.call('HMGET', KEYS[1], 'leaseID', 'leaseExpiresAt')
+redis.call('HSET', KEYS[1], 'instanceID', ARGV[1], 'address', ARGV[2], 'port', ARGV[3], 'ready', ARGV[4],
+	'numConnectedClients', ARGV[5], 'lastPingReceived', ARGV[6], 'node', ARGV[7])
+if ARGV[4] == 'true' and tonumber(ARGV[5]) == 0 then
+	-- a running lease survives a reconnect of its server, its user is still on the way
+	local score = 0
+	if lease[1] and lease[1] ~= '' then score = tonumber(lease[2]) end
+	redis.call('ZADD', KEYS[2], score, ARGV[1])
+else
+	if tonumber(ARGV[5]) > 0 then redis.call('HSET', KEYS[1], 'leaseID', '', 'leaseExpiresAt', 0) end
+	redis.call('ZREM', KEYS[2], ARGV[1])
+end
+return 1`;
+
+// KEYS[1] free set, KEYS[2] lease counters, ARGV: now, lease expiry, count, alive since, server key prefix, lease
+// seconds, new lease IDs...
+const RESERVE_SCRIPT = `
+local count = tonumber(ARGV[3])
+local reserved = {}
+local granted = 0
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, count * 4)
+for _, id in ipairs(ids) do
+	if granted >= count then break end
+	local key = ARGV[5] .. id
+	local server = redis.call('HMGET', key, 'address', 'port', 'lastPingReceived', 'leaseID')
+	if server[3] and tonumber(server[3]) >= tonumber(ARGV[4]) then
+		if server[4] and server[4] ~= '' then
+			redis.call('HINCRBY', KEYS[2], 'expired', 1)
+			redis.call('HINCRBYFLOAT', KEYS[2], 'abandonedServerSeconds', ARGV[6])
+		end
+		granted = granted + 1
+		local leaseID = ARGV[6 + granted]
+		redis.call('ZADD', KEYS[1], ARGV[2], id)
+		redis.call('HSET', key, 'leaseID', leaseID, 'leaseExpiresAt', ARGV[2])
+		table.insert(reserved, id)
+		table.insert(reserved, server[1])
+		table.insert(reserved, server[2])
+		table.insert(reserved, leaseID)
+	end
+end
+if granted > 0 then redis.call('HINCRBY', KEYS[2], 'granted', granted) end
+return reserved`;
+
+// KEYS[1] server hash, KEYS[2] free set, KEYS[3] lease counters, ARGV: instance ID, presented lease ID, now,
+// lease seconds
+const CONNECT_SCRIPT = `
+if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end
+local lease = redis.call('HMGET', KEYS[1], 'leaseID', 'leaseExpiresAt')
+local outcome = nil
+if lease[1] and lease[1] ~= '' then
+	local expired = tonumber(lease[2]) < tonumber(ARGV[3])
+	if expired then
+		redis.call('HINCRBY', KEYS[3], 'expired', 1)
+		redis.call('HINCRBYFLOAT', KEYS[3], 'abandonedServerSeconds', ARGV[4])
+	end
+	if ARGV[2] ~= '' and ARGV[2] ~= lease[1] then outcome = 'mismatched'
+	elseif expired then outcome = 'late'
+	else outcome = 'confirmed' end
+elseif ARGV[2] ~= '' then
+	outcome = 'late'
+end
+if outcome then redis.call('HINCRBY', KEYS[3], outcome, 1) end
+redis.call('HSET', KEYS[1], 'leaseID', '', 'leaseExpiresAt', 0)
+redis.call('ZREM', KEYS[2], ARGV[1])
+return redis.call('HINCRBY', KEYS[1], 'numConnectedClients', 1)`;
+
+// KEYS[1] server hash, KEYS[2] free set, ARGV: instance ID
+const DISCONNECT_SCRIPT = `
+if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end
+local clients = redis.call('HINCRBY', KEYS[1], 'numConnectedClients', -1)
+if clients < 0 then
+	clients = 0
+	redis.call('HSET', KEYS[1], 'numConnectedClients', 0)
+end
+if clients == 0 and redis.call('HGET', KEYS[1], 'ready') == 'true' then
+	redis.call('ZADD', KEYS[2], 0, ARGV[1])
+end
+return clients`;
+
+// KEYS[1] server hash, KEYS[2] free set, ARGV: instance ID, ready
+const READY_SCRIPT = `
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('HSET', KEYS[1], 'ready', ARGV[2])
+local server = redis.call('HMGET', KEYS[1], 'numConnectedClients', 'leaseID', 'leaseExpiresAt')
+if ARGV[2] == 'true' and tonumber(server[1]) == 0 then
+	local score = 0
+	if server[2] and server[2] ~= '' then score = tonumber(server[3]) end
+	redis.call('ZADD', KEYS[2], score, ARGV[1])
+else
+	redis.call('ZREM', KEYS[2], ARGV[1])
+end
+return 1`;
+
+// KEYS[1] server hash, KEYS[2] free set, ARGV: instance ID, node (empty for any node)
+const REMOVE_SCRIPT = `
+if ARGV[2] ~= '' and redis.call('HGET', KEYS[1], 'node') ~= ARGV[2] then return 0 end
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return 1`;
+
+// KEYS[1] free set, KEYS[2] lease counters, ARGV: server key prefix, now, then instance ID and lease ID pairs
+const RELEASE_SCRIPT = `
+local released = 0
+for i = 3, #ARGV, 2 do
+	local key = ARGV[1] .. ARGV[i]
+	local server = redis.call('HMGET', key, 'numConnectedClients', 'leaseID', 'leaseExpiresAt', 'ready')
+	if server[1] and tonumber(server[1]) == 0 and server[2] and server[2] ~= '' and
+			tonumber(server[3]) >= tonumber(ARGV[2]) and (ARGV[i + 1] == '' or ARGV[i + 1] == server[2]) then
+		redis.call('HSET', key, 'leaseID', '', 'leaseExpiresAt', 0)
+		if server[4] == 'true' then redis.call('ZADD', KEYS[1], 0, ARGV[i]) end
+		released = released + 1
+	end
+end
+if released > 0 then redis.call('HINCRBY', KEYS[2], 'released', released) end
+return released`;
+
+class RedisPoolState {
+	constructor(options) {
+		this.options = Object.assign({}, DEFAULT_OPTIONS, options);
+		var redis;
+		try {
+			redis = require('redis');
+		} catch (e) {
+			throw new Error('PoolStateBackend "redis" needs the redis package, run npm install redis');
+		}
+		this.client = redis.createClient({ url: this.options.RedisUrl });
+		this.client.on('error', err => console.log(`ERROR pool state redis: ${err}`));
+		this.connected = this.client.connect();
+		this.freeKey = this.options.RedisPrefix + 'free';
+		this.leaseKey = this.options.RedisPrefix + 'leases';
+		this.serverPrefix = this.options.RedisPrefix + 'server:';
+	}
+
+	async eval(script, keys, args) {
+		await this.connected;
+		return this.client.eval(script, { keys: keys, arguments: args.map(String) });
+	}
+
+	async register(server, node) {
+		var entry = serverInfo(server);
+		await this.eval(REGISTER_SCRIPT, [this.serverPrefix + entry.instanceID, this.freeKey], [entry.instanceID,
+			entry.address, entry.port, entry.ready, entry.numConnectedClients, Date.now(), node]);
+	}
+
+	async setReady(instanceID, ready) {
+		await this.eval(READY_SCRIPT, [this.serverPrefix + instanceID, this.freeKey], [instanceID, ready === true]);
+	}
+
+	async clientConnected(instanceID, leaseID) {
+		var clients = await this.eval(CONNECT_SCRIPT, [this.serverPrefix + instanceID, this.freeKey, this.leaseKey],
+			[instanceID, leaseID || '', Date.now(), this.options.LeaseMs / 1000]);
+		return clients < 0 ? undefined : clients;
+	}
+
+	async clientDisconnected(instanceID) {
+		var clients = await this.eval(DISCONNECT_SCRIPT, [this.serverPrefix + instanceID, this.freeKey], [instanceID]);
+		return clients < 0 ? undefined : clients;
+	}
+
+	async touch(instanceID) {
+		await this.connected;
+		await this.client.hSet(this.serverPrefix + instanceID, 'lastPingReceived', String(Date.now()));
+	}
+
+	async remove(instanceID, node) {
+		await this.eval(REMOVE_SCRIPT, [this.serverPrefix + instanceID, this.freeKey], [instanceID, node || '']);
+	}
+
+	async reserve(count) {
+		var now = Date.now();
+		var expiresAt = now + this.options.LeaseMs;
+		var leaseIDs = Array.from({ length: count }, newLeaseID);
+		var flat = await this.eval(RESERVE_SCRIPT, [this.freeKey, this.leaseKey], [now, expiresAt, count,
+			now - this.options.StaleMs, this.serverPrefix, this.options.LeaseMs / 1000, ...leaseIDs]);
+		var reserved = [];
+		for (var i = 0; i < flat.length; i += 4) {
+			reserved.push({ instanceID: flat[i], address: flat[i + 1], port: parseInt(flat[i + 2]), ready: true,
+				numConnectedClients: 0, leaseID: flat[i + 3], leaseExpiresAt: expiresAt });
+		}
+		return reserved;
+	}
+
+	async release(instanceIDs, leaseIDs) {
+		if (instanceIDs.length == 0)
+			return 0;
+		var pairs = [];
+		instanceIDs.forEach((instanceID, i) => pairs.push(instanceID, (leaseIDs && leaseIDs[i]) || ''));
+		return this.eval(RELEASE_SCRIPT, [this.freeKey, this.leaseKey], [this.serverPrefix, Date.now(), ...pairs]);
+	}
+
+	async list() {
+		await this.connected;
+		var servers = [];
+		for await (const key of this.client.scanIterator({ MATCH: this.serverPrefix + '*', COUNT: 100 })) {
+			var server = await this.client.hGetAll(key);
+			if (server.instanceID) {
+				servers.push({
+					instanceID: server.instanceID,
+					address: server.address,
+					port: parseInt(server.port),
+					ready: server.ready === 'true',
+					numConnectedClients: parseInt(server.numConnectedClients),
+					leaseID: server.leaseID || '',
+					leaseExpiresAt: parseInt(server.leaseExpiresAt || '0'),
+					lastPingReceived: parseInt(server.lastPingReceived)
+				});
+			}
+		}
+		return servers;
+	}
+
+	async leaseStats() {
+		await this.connected;
+		var counters = await this.client.hGetAll(this.leaseKey);
+		var stats = emptyLeaseStats();
+		LEASE_COUNTERS.forEach(counter => stats[counter] = parseFloat(counters[counter] || '0'));
+		return withPendingExpiries(stats, await this.list(), this.options.LeaseMs);
+	}
+
+	async close() {
+		await this.connected;
+		await this.client.quit();
+	}
+}
+
+// --- dynamodb ---------------------------------------------------------------------------------------------------------
+
+// One item per server keyed by InstanceID. Ready, client-less servers also carry FreeSlot='free' and FreeAt, the time they
+// can be handed out (0, or the expiry of their LeaseID), which puts them in the sparse FreeIndex (FreeSlot, FreeAt).
+// Reserving queries that index and claims each candidate with a conditional update on the FreeAt value it read, so two
+// matchmakers never claim the same server. The lease counters are kept in the item with InstanceID LEASE_STATS_KEY.
+const LEASE_STATS_KEY = '#leases';
+
+class DynamoDBPoolState {
+	constructor(options, ddb) {
+		this.options = Object.assign({}, DEFAULT_OPTIONS, options);
+		if (!ddb) {
+			var AWS = require('aws-sdk');
+			ddb = new AWS.DynamoDB({ apiVersion: "2012-08-10" });
+		}
+		this.ddb = ddb;
+	}
+
+	static isConditionFailure(err) {
+		return err.code === 'ConditionalCheckFailedException';
+	}
+
+	async conditionalUpdate(params) {
+		try {
+			return await this.ddb.updateItem(Object.assign({ TableName: this.options.TableName }, params)).promise();
+		} catch (err) {
+			if (DynamoDBPoolState.isConditionFailure(err))
+				return undefined;
+			throw err;
+		}
+	}
+
+	async count(counters) {
+		var names = Object.keys(counters).filter(counter => counters[counter]);
+		if (names.length == 0)
+			return;
+		var values = {};
+		names.forEach(counter => values[`:${counter}`] = { N: String(counters[counter]) });
+		await this.ddb.updateItem({
+			TableName: this.options.TableName,
+			Key: { InstanceID: { S: LEASE_STATS_KEY } },
+			UpdateExpression: "ADD " + names.map(counter => `${counter} :${counter}`).join(', '),
+			ExpressionAttributeValues: values
+		}).promise();
+	}
+
+	// puts the server back into the free index if it is ready and has no client, a running lease keeps its expiry
+	async markFree(instanceID) {
+		return this.conditionalUpdate({
+			Key: { InstanceID: { S: instanceID } },
+			UpdateExpression: "SET FreeSlot = :free, FreeAt = if_not_exists(FreeAt, :zero)",
+			ConditionExpression: "IsReady = :true AND ClientCount = :zero",
+			ExpressionAttributeValues: { ":free": { S: "free" }, ":true": { BOOL: true }, ":zero": { N: "0" } }
+		});
+	}
+
+	async register(server, node) {
+		var entry = serverInfo(server);
+		var free = entry.ready && entry.numConnectedClients === 0;
+		var values = {
+			":address": { S: entry.address },
+			":port": { N: String(entry.port) },
+			":ready": { BOOL: entry.ready },
+			":clients": { N: String(entry.numConnectedClients) },
+			":now": { N: String(Date.now()) },
+			":node": { S: node }
+		};
+		var update = "SET Address = :address, Port = :port, IsReady = :ready, ClientCount = :clients, LastPing = :now, " +
+			"Matchmaker = :node";
+		if (free) {
+			// a running lease survives a reconnect of its server, its user is still on the way
+			update += ", FreeSlot = :free, FreeAt = if_not_exists(FreeAt, :zero)";
+			values[":free"] = { S: "free" };
+			values[":zero"] = { N: "0" };
+		} else {
+			update += entry.numConnectedClients > 0 ? " REMOVE FreeSlot, FreeAt, LeaseID" : " REMOVE FreeSlot";
+		}
+		await this.ddb.updateItem({
+			TableName: this.options.TableName,
+			Key: { InstanceID: { S: entry.instanceID } },
+			UpdateExpression: update,
+			ExpressionAttributeValues: values
+		}).promise();
+	}
+
+	async setReady(instanceID, ready) {
+		await this.conditionalUpdate({
+			Key: { InstanceID: { S: instanceID } },
+			UpdateExpression: ready ? "SET IsReady = :ready" : "SET IsReady = :ready REMOVE FreeSlot",
+			ConditionExpression: "attribute_exists(InstanceID)",
+			ExpressionAttributeValues: { ":ready": { BOOL: ready === true } }
+		});
+		if (ready)
+			await this.markFree(instanceID);
+	}
+
+	async clientConnected(instanceID, leaseID) {
+		var data = await this.conditionalUpdate({
+			Key: { InstanceID: { S: instanceID } },
+			UpdateExpression: "ADD ClientCount :one REMOVE FreeSlot, FreeAt, LeaseID",
+			ConditionExpression: "attribute_exists(InstanceID)",
+			ExpressionAttributeValues: { ":one": { N: "1" } },
+			ReturnValues: "ALL_OLD"
+		});
+		if (!data)
+			return undefined;
+		var old = data.Attributes;
+		var currentLease = old.LeaseID ? old.LeaseID.S : '';
+		var expiresAt = old.FreeAt ? parseInt(old.FreeAt.N) : 0;
+		var now = Date.now();
+		var counters = {};
+		var outcome = confirmOutcome(currentLease, expiresAt, leaseID, now);
+		if (outcome)
+			counters[outcome] = 1;
+		if (currentLease && expiresAt < now) {
+			counters.expired = 1;
+			counters.abandonedServerSeconds = this.options.LeaseMs / 1000;
+		}
+		await this.count(counters);
+		return parseInt(old.ClientCount.N) + 1;
+	}
+
+	async clientDisconnected(instanceID) {
+		var data = await this.conditionalUpdate({
+			Key: { InstanceID: { S: instanceID } },
+			UpdateExpression: "ADD ClientCount :minus",
+			ConditionExpression: "ClientCount > :zero",
+			ExpressionAttributeValues: { ":minus": { N: "-1" }, ":zero": { N: "0" } },
+			ReturnValues: "UPDATED_NEW"
+		});
+		var clients = data ? parseInt(data.Attributes.ClientCount.N) : 0;
+		if (clients === 0) {
+			// this make this server immediately available for a new client
+			await this.markFree(instanceID);
+		}
+		return clients;
+	}
+
+	async touch(instanceID) {
+		await this.conditionalUpdate({
+			Key: { InstanceID: { S: instanceID } },
+			UpdateExpression: "SET LastPing = :now",
+			ConditionExpression: "attribute_exists(InstanceID)",
+			ExpressionAttributeValues: { ":now": { N: String(Date.now()) } }
+		});
+	}
+
+	async remove(instanceID, node) {
+		var params = { TableName: this.options.TableName, Key: { InstanceID: { S: instanceID } } };
+		if (node !== undefined) {
+			params.ConditionExpression = "Matchmaker = :node";
+			params.ExpressionAttributeValues = { ":node": { S: node } };
+		}
+		try {
+			await this.ddb.deleteItem(params).promise();
+		} catch (err) {
+			if (!DynamoDBPoolState.isConditionFailure(err))
+				throw err;
+		}
+	}
+
+	async reserve(count) {
+		var now = Date.now();
+		var expiresAt = now + this.options.LeaseMs;
+		var reserved = [];
+		var expired = 0;
+		var params = {
+			TableName: this.options.TableName,
+			IndexName: "FreeIndex",
+			KeyConditionExpression: "FreeSlot = :free AND FreeAt <= :now",
+			FilterExpression: "LastPing >= :alive",
+			ExpressionAttributeValues: { ":free": { S: "free" }, ":now": { N: String(now) },
+				":alive": { N: String(now - this.options.StaleMs) } },
+			// a few extra candidates, some may be claimed by another matchmaker in the meantime
+			Limit: count * 2
+		};
+		do {
+			var data = await this.ddb.query(params).promise();
+			var claims = data.Items.slice(0, count - reserved.length).map((item) => {
+				var leaseID = newLeaseID();
+				return this.conditionalUpdate({
+					Key: { InstanceID: item.InstanceID },
+					UpdateExpression: "SET FreeAt = :expires, LeaseID = :lease",
+					ConditionExpression: "FreeAt = :seen",
+					ExpressionAttributeValues: { ":expires": { N: String(expiresAt) }, ":lease": { S: leaseID },
+						":seen": item.FreeAt },
+					ReturnValues: "UPDATED_OLD"
+				}).then((claimed) => {
+					if (!claimed)
+						return;
+					// the server still had a lease, it ran out without its user
+					if (claimed.Attributes && claimed.Attributes.LeaseID)
+						expired++;
+					reserved.push({
+						instanceID: item.InstanceID.S,
+						address: item.Address.S,
+						port: parseInt(item.Port.N),
+						ready: true,
+						numConnectedClients: 0,
+						leaseID: leaseID,
+						leaseExpiresAt: expiresAt
+					});
+				});
+			});
+			await Promise.all(claims);
+			params.ExclusiveStartKey = data.LastEvaluatedKey;
+		} while (params.ExclusiveStartKey && reserved.length < count);
+		await this.count({ granted: reserved.length, expired: expired,
+			abandonedServerSeconds: expired * this.options.LeaseMs / 1000 });
+		return reserved;
+	}
+
+	async release(instanceIDs, leaseIDs) {
+		var now = String(Date.now());
+		var released = await Promise.all(instanceIDs.map((instanceID, i) => {
+			var leaseID = leaseIDs && leaseIDs[i];
+			var values = { ":zero": { N: "0" }, ":now": { N: now } };
+			var condition = "ClientCount = :zero AND attribute_exists(LeaseID) AND FreeAt >= :now";
+			if (leaseID) {
+				condition += " AND LeaseID = :lease";
+				values[":lease"] = { S: leaseID };
+			}
+			return this.conditionalUpdate({
+				Key: { InstanceID: { S: instanceID } },
+				UpdateExpression: "SET FreeAt = :zero REMOVE LeaseID",
+				ConditionExpression: condition,
+				ExpressionAttributeValues: values
+			});
+		}));
+		var count = released.filter(data => data !== undefined).length;
+		await this.count({ released: count });
+		return count;
+	}
+
+	async list() {
+		var servers = [];
+		var params = { TableName: this.options.TableName };
+		do {
+			var data = await this.ddb.scan(params).promise();
+			for (const item of data.Items) {
+				if (item.InstanceID.S === LEASE_STATS_KEY)
+					continue;
+				servers.push({
+					instanceID: item.InstanceID.S,
+					address: item.Address.S,
+					port: parseInt(item.Port.N),
+					ready: item.IsReady.BOOL,
+					numConnectedClients: parseInt(item.ClientCount.N),
+					leaseID: item.LeaseID ? item.LeaseID.S : '',
+					leaseExpiresAt: item.LeaseID && item.FreeAt ? parseInt(item.FreeAt.N) : 0,
+					lastPingReceived: parseInt(item.LastPing.N)
+				});
+			}
+			params.ExclusiveStartKey = data.LastEvaluatedKey;
+		} while (params.ExclusiveStartKey);
+		return servers;
+	}
+
+	async leaseStats() {
+		var data = await this.ddb.getItem({ TableName: this.options.TableName,
+			Key: { InstanceID: { S: LEASE_STATS_KEY } } }).promise();
+		var stats = emptyLeaseStats();
+		LEASE_COUNTERS.forEach((counter) => {
+			if (data.Item && data.Item[counter])
+				stats[counter] = parseFloat(data.Item[counter].N);
+		});
+		return withPendingExpiries(stats, await this.list(), this.options.LeaseMs);
+	}
+
+	async close() {}
+}
+
+const BACKENDS = {
+	memory: MemoryPoolState,
+	local: LocalPoolState,
+	redis: RedisPoolState,
+	dynamodb: DynamoDBPoolState
+};
+
+function create(backend, options) {
+	var PoolState = BACKENDS[backend || 'memory'];
+	if (!PoolState)
+		throw new Error(`Unknown PoolStateBackend ${backend}, expected one of ${Object.keys(BACKENDS).join(', ')}`);
+	return new PoolState(options);
+}
+
+module.exports = {
+	create,
+	serve,
+	LEASE_COUNTERS,
+	MemoryPoolState,
+	LocalPoolState,
+	RedisPoolState,
+	DynamoDBPoolState
+};
+
+// node modules/poolState.js --serve 6390 [--latency 1] runs the shared local stand-in
+if (require.main === module) {
+	var args = process.argv.slice(2);
+	var port = parseInt(args[args.indexOf('--serve') + 1]) || 6390;
+	var latency = args.includes('--latency') ? parseFloat(args[args.indexOf('--latency') + 1]) : 0;
+	serve(port, {}, latency).then(() => console.log(`Pool state stand-in listening on *:${port}`));
+}
+//End : AWS - pool state shared between matchmaker processes
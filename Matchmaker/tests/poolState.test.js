@@ -0,0 +1,115 @@
+// Copyright Epic Games, Inc. All Rights Reserved.
+
+//Start : AWS - pool state leases and concurrent reservations, run with `npm test`
+const test = require('node:test');
+const assert = require('node:assert');
+const poolState = require('../modules/poolState.js');
+
+const LEASE_MS = 50;
+
+function sleep(ms) {
+	return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+async function registerServers(state, count) {
+	for (var i = 0; i < count; i++) {
+		await state.register({ instanceID: `i-${i}`, address: `10.0.0.${i}`, port: 80, ready: true,
+			numConnectedClients: 0 }, 'test');
+	}
+}
+
+for (const backend of ['memory', 'local']) {
+	test(`${backend}: an unconfirmed lease expires and the server is handed out again`, async (t) => {
+		var { state, close } = await open(backend);
+		t.after(close);
+		await registerServers(state, 1);
+
+		var first = (await state.reserve(1))[0];
+		assert.strictEqual((await state.reserve(1)).length, 0);
+		await sleep(LEASE_MS * 2);
+		var second = (await state.reserve(1))[0];
+
+		assert.strictEqual(second.instanceID, first.instanceID);
+		assert.notStrictEqual(second.leaseID, first.leaseID);
+		var stats = await state.leaseStats();
+		assert.strictEqual(stats.granted, 2);
+		assert.strictEqual(stats.expired, 1);
+		assert.strictEqual(stats.abandonedServerSeconds, LEASE_MS / 1000);
+	});
+
+	test(`${backend}: a user arriving after the lease expired is counted late`, async (t) => {
+		var { state, close } = await open(backend);
+		t.after(close);
+		await registerServers(state, 2);
+
+		var [onTime, tooLate] = await state.reserve(2);
+		assert.strictEqual(await state.clientConnected(onTime.instanceID, onTime.leaseID), 1);
+		await sleep(LEASE_MS * 2);
+		assert.strictEqual(await state.clientConnected(tooLate.instanceID, tooLate.leaseID), 1);
+
+		var stats = await state.leaseStats();
+		assert.strictEqual(stats.confirmed, 1);
+		assert.strictEqual(stats.late, 1);
+		assert.strictEqual(stats.active, 0);
+	});
+
+	test(`${backend}: release ends only the given lease`, async (t) => {
+		var { state, close } = await open(backend);
+		t.after(close);
+		await registerServers(state, 1);
+
+		var server = (await state.reserve(1))[0];
+		assert.strictEqual(await state.release([server.instanceID], ['another lease']), 0);
+		assert.strictEqual((await state.reserve(1)).length, 0);
+		assert.strictEqual(await state.release([server.instanceID], [server.leaseID]), 1);
+		assert.strictEqual((await state.reserve(1))[0].instanceID, server.instanceID);
+	});
+}
+
+// several matchmaker processes, each its own connection to the shared state, reserve and confirm at the same time as
+// in poolBenchmark.js: every server may be handed out once, a clientConnected that finds a client already there is a
+// double allocation
+test('local: concurrent reservations from several processes never share a server', async (t) => {
+	var store = await poolState.serve(0, { LeaseMs: 60 * 1000 }, 1);
+	var address = `127.0.0.1:${store.address().port}`;
+	var processes = Array.from({ length: 4 }, () => poolState.create('local', { LocalAddress: address }));
+	t.after(async () => {
+		await Promise.all(processes.map(state => state.close()));
+		store.close();
+	});
+	await registerServers(store.state, 40);
+
+	var reservations = await Promise.all(processes.flatMap(state => Array.from({ length: 8 }, async () => {
+		var reserved = await state.reserve(2);
+		return Promise.all(reserved.map(async server => ({
+			instanceID: server.instanceID,
+			clients: await state.clientConnected(server.instanceID, server.leaseID)
+		})));
+	})));
+
+	var allocated = reservations.flat();
+	assert.strictEqual(allocated.length, 40);
+	assert.strictEqual(new Set(allocated.map(server => server.instanceID)).size, 40);
+	assert.deepStrictEqual(allocated.filter(server => server.clients !== 1), []);
+	var stats = await processes[0].leaseStats();
+	assert.strictEqual(stats.confirmed, 40);
+	assert.strictEqual(stats.mismatched, 0);
+});
+
+async function open(backend) {
+	if (backend === 'memory') {
+		var state = poolState.create('memory', { LeaseMs: LEASE_MS });
+		return { state: state, close: () => state.close() };
+	}
+	var store = await poolState.serve(0, { LeaseMs: LEASE_MS });
+	var client = poolState.create('local', { LocalAddress: `127.0.0.1:${store.address().port}` });
+	return {
+		state: client,
+		close: async () => {
+			await client.close();
+			await store.state.close();
+			store.close();
+		}
+	};
+}
+//End : AWS - pool state leases and concurrent reservations, run with `npm test`
@@ -786,7 +786,9 @@ playerServer.on('connection', function (ws, req) {
 	});
 
 	sendPlayerConnectedToFrontend();
-	sendPlayerConnectedToMatchmaker();
+	// Start : AWS - the lease the Matchmaker granted for this server is confirmed with the player's connection
+	sendPlayerConnectedToMatchmaker(urlParams.get('lease'));
+	// End : AWS - the lease the Matchmaker granted for this server is confirmed with the player's connection
 	player.ws.send(JSON.stringify(clientConfig));
 	sendPlayersCount();
 });
@@ -1066,13 +1068,18 @@ function sendStreamerDisconnectedToMatchmaker() {
 
 // The Matchmaker will not re-direct clients to this Cirrus server if any client
 // is connected.
-function sendPlayerConnectedToMatchmaker() {
+function sendPlayerConnectedToMatchmaker(leaseId) {
 	if (!config.UseMatchmaker)
 		return;
 	try {
 		message = {
 			type: 'clientConnected'
 		};
+		// Start : AWS - lease ID from the signalling server URL the Matchmaker handed out
+		if (leaseId) {
+			message.leaseId = leaseId;
+		}
+		// End : AWS - lease ID from the signalling server URL the Matchmaker handed out
 		matchmaker.write(JSON.stringify(message));
 	} catch (err) {
 		console.logColor(logging.Red, `ERROR sending clientConnected: ${err.message}`);
@@ -0,0 +1,337 @@
+# this tool publishes the packaged Signalling server build as content-addressed chunks, so that an instance only
+# downloads what changed since the copy already on its volume or AMI. Every file is cut into fixed-size chunks that are
+# stored once under chunks/<sha256>, whatever file or version they belong to. A manifest lists each file with its size,
+# hash and chunk hashes; it is stored as manifests/<version>.json, where the version is derived from its content, and
+# latest.json points to the current one. syncBuild.ps1, uploaded next to them, is what the instance user data runs at
+# boot; the sync command below is the same algorithm for Linux hosts and for checking a build locally. Examples:
+#   python buildManifest.py publish C:\builds\HealthCoach s3://healthcoach-deployment/HealthCoach-Build
+#   python buildManifest.py sync s3://healthcoach-deployment/HealthCoach-Build /opt/healthcoach
+#   python buildManifest.py diff old-manifest.json new-manifest.json
+# A store is an s3://bucket/prefix URL or a local directory
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FORMAT = 1
+DEFAULT_CHUNK_MB = 8
+# kept in the destination, records what the last sync wrote so that unchanged files are recognised without reading them
+STATE_DIR = '.healthcoach-build'
+SYNC_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'syncBuild.ps1')
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# stores
+# ---------------------------------------------------------------------------------------------------------------------
+
+class S3Store:
+    def __init__(self, url):
+        import boto3
+        bucket, _, prefix = url[len('s3://'):].partition('/')
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client('s3')
+
+    def _key(self, name):
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def get(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(name))['Body'].read()
+
+    def put(self, name, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(name), Body=data)
+
+    def list(self, directory):
+        start = len(self._key(directory)) + 1
+        names = set()
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket,
+                                                                          Prefix=self._key(directory) + '/'):
+            names.update(item['Key'][start:] for item in page.get('Contents', []))
+        return names
+
+
+class LocalStore:
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, name):
+        with open(os.path.join(self.path, name), 'rb') as f:
+            return f.read()
+
+    def put(self, name, data):
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def list(self, directory):
+        path = os.path.join(self.path, directory)
+        return set(os.listdir(path)) if os.path.isdir(path) else set()
+
+
+def open_store(url):
+    return S3Store(url) if url.startswith('s3://') else LocalStore(url)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# manifests
+# ---------------------------------------------------------------------------------------------------------------------
+
+def hash_file(path, chunk_size):
+    """Returns (sha256 of the file, [sha256 of each chunk])."""
+    whole = hashlib.sha256()
+    chunks = []
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            whole.update(data)
+            chunks.append(hashlib.sha256(data).hexdigest())
+    return whole.hexdigest(), chunks
+
+
+def walk(root):
+    # relative paths with forward slashes, in a stable order
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(d for d in subdirectories if d != STATE_DIR)
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            yield os.path.relpath(path, root).replace(os.sep, '/'), path
+
+
+def build_manifest(root, chunk_size):
+    files = []
+    for relative, path in walk(root):
+        sha256, chunks = hash_file(path, chunk_size)
+        files.append({'path': relative, 'size': os.path.getsize(path), 'sha256': sha256, 'chunks': chunks})
+    # the version only depends on the content, publishing the same build twice gives the same version
+    version = hashlib.sha256(json.dumps([chunk_size, files], sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return {
+        'format': FORMAT,
+        'version': version,
+        'createdAt': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'chunkSize': chunk_size,
+        'files': files
+    }
+
+
+def chunk_locations(manifest, root):
+    # {chunk hash: (path, offset, length)} of the first occurrence of each chunk under root
+    locations = {}
+    chunk_size = manifest['chunkSize']
+    for entry in manifest['files']:
+        path = os.path.join(root, *entry['path'].split('/'))
+        for index, chunk in enumerate(entry['chunks']):
+            offset = index * chunk_size
+            locations.setdefault(chunk, (path, offset, min(chunk_size, entry['size'] - offset)))
+    return locations
+
+
+def read_range(path, offset, length):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def diff(old, new):
+    """Summarises what an instance holding old has to download to get new."""
+    old_chunks = {chunk for entry in old['files'] for chunk in entry['chunks']} \
+        if old.get('chunkSize') == new['chunkSize'] else set()
+    old_files = {entry['path']: entry['sha256'] for entry in old['files']}
+    changed = [entry for entry in new['files'] if old_files.get(entry['path']) != entry['sha256']]
+    sizes = {}
+    for entry in new['files']:
+        for index, chunk in enumerate(entry['chunks']):
+            sizes.setdefault(chunk, min(new['chunkSize'], entry['size'] - index * new['chunkSize']))
+    download = {chunk for entry in changed for chunk in entry['chunks'] if chunk not in old_chunks}
+    return {
+        'files': len(new['files']),
+        'changedFiles': len(changed),
+        'removedFiles': len(set(old_files) - {entry['path'] for entry in new['files']}),
+        'buildBytes': sum(entry['size'] for entry in new['files']),
+        'downloadChunks': len(download),
+        'downloadBytes': sum(sizes[chunk] for chunk in download)
+    }
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# publish
+# ---------------------------------------------------------------------------------------------------------------------
+
+def publish(root, store, chunk_size=DEFAULT_CHUNK_MB << 20, workers=16, sync_script=SYNC_SCRIPT):
+    started = time.monotonic()
+    manifest = build_manifest(root, chunk_size)
+    locations = chunk_locations(manifest, root)
+    missing = sorted(set(locations) - store.list('chunks'))
+
+    def upload(chunk):
+        store.put(f"chunks/{chunk}", read_range(*locations[chunk]))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # surfaces the first failed upload
+        list(executor.map(upload, missing))
+
+    manifest_name = f"manifests/{manifest['version']}.json"
+    store.put(manifest_name, json.dumps(manifest, separators=(',', ':')).encode('utf-8'))
+    if sync_script and os.path.exists(sync_script):
+        with open(sync_script, 'rb') as f:
+            store.put('syncBuild.ps1', f.read())
+    # latest.json is written last, an instance never sees a manifest whose chunks are not all uploaded
+    store.put('latest.json', json.dumps({'version': manifest['version'], 'manifest': manifest_name}).encode('utf-8'))
+    return {
+        'version': manifest['version'],
+        'files': len(manifest['files']),
+        'chunks': len(locations),
+        'uploadedChunks': len(missing),
+        'uploadedBytes': sum(locations[chunk][2] for chunk in missing),
+        'seconds': round(time.monotonic() - started, 3)
+    }
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# sync
+# ---------------------------------------------------------------------------------------------------------------------
+
+def _mtime_ms(path):
+    # milliseconds since the epoch, syncBuild.ps1 records the same unit
+    return os.stat(path).st_mtime_ns // 1000000
+
+
+def _local_entry(path, entry, recorded, chunk_size):
+    # the local copy of a file as {'sha256', 'chunks'}, or None. A file written by the last sync and not touched since
+    # is trusted without reading it, anything else of the right size is hashed once, e.g. a build baked into the AMI
+    if not os.path.isfile(path):
+        return None
+    size = os.path.getsize(path)
+    if recorded and recorded['size'] == size and recorded['mtime'] == _mtime_ms(path) \
+            and recorded.get('chunkSize') == chunk_size:
+        return recorded
+    if entry is None or entry['size'] != size:
+        return None
+    sha256, chunks = hash_file(path, chunk_size)
+    return {'sha256': sha256, 'chunks': chunks, 'size': size}
+
+
+def sync(store, destination, workers=16):
+    started = time.monotonic()
+    latest = json.loads(store.get('latest.json'))
+    manifest = json.loads(store.get(latest['manifest']))
+    chunk_size = manifest['chunkSize']
+    state_dir = os.path.join(destination, STATE_DIR)
+    state_path = os.path.join(state_dir, 'state.json')
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = {entry['path']: entry for entry in json.load(f)['files']}
+
+    def local_path(relative):
+        return os.path.join(destination, *relative.split('/'))
+
+    # chunks that can be copied from intact local files, including files the new build no longer has
+    entries = {entry['path']: entry for entry in manifest['files']}
+    local = {}
+    reusable = {}
+    for relative in list(entries) + [p for p in state if p not in entries]:
+        current = _local_entry(local_path(relative), entries.get(relative), state.get(relative), chunk_size)
+        if current is None:
+            continue
+        local[relative] = current
+        for index, chunk in enumerate(current['chunks']):
+            offset = index * chunk_size
+            reusable.setdefault(chunk, (local_path(relative), offset, min(chunk_size, current['size'] - offset)))
+
+    changed = [entry for entry in manifest['files']
+               if local.get(entry['path'], {}).get('sha256') != entry['sha256']]
+    missing = sorted({chunk for entry in changed for chunk in entry['chunks'] if chunk not in reusable})
+    staging = os.path.join(state_dir, 'chunks')
+    os.makedirs(staging, exist_ok=True)
+
+    def download(chunk):
+        data = store.get(f"chunks/{chunk}")
+        with open(os.path.join(staging, chunk), 'wb') as f:
+            f.write(data)
+        return len(data)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        downloaded_bytes = sum(executor.map(download, missing))
+    downloaded = set(missing)
+
+    # every changed file is assembled next to its target first, so that chunks are still read from the old files
+    staged = []
+    for entry in changed:
+        target = local_path(entry['path'])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        whole = hashlib.sha256()
+        with open(target + '.healthcoach-new', 'wb') as out:
+            for chunk in entry['chunks']:
+                if chunk in downloaded:
+                    with open(os.path.join(staging, chunk), 'rb') as f:
+                        data = f.read()
+                else:
+                    data = read_range(*reusable[chunk])
+                whole.update(data)
+                out.write(data)
+        if whole.hexdigest() != entry['sha256']:
+            raise ValueError(f"{entry['path']} does not match the manifest after assembly")
+        staged.append(target)
+    for target in staged:
+        os.replace(target + '.healthcoach-new', target)
+    for chunk in missing:
+        os.remove(os.path.join(staging, chunk))
+    removed = [p for p in state if p not in entries]
+    for relative in removed:
+        if os.path.isfile(local_path(relative)):
+            os.remove(local_path(relative))
+
+    os.makedirs(state_dir, exist_ok=True)
+    with open(state_path, 'w') as f:
+        json.dump({'version': manifest['version'], 'files': [
+            dict(entry, mtime=_mtime_ms(local_path(entry['path'])), chunkSize=chunk_size)
+            for entry in manifest['files']]}, f, separators=(',', ':'))
+    return {
+        'version': manifest['version'],
+        'files': len(manifest['files']),
+        'changedFiles': len(changed),
+        'removedFiles': len(removed),
+        'downloadedChunks': len(missing),
+        'downloadedBytes': downloaded_bytes,
+        'buildBytes': sum(entry['size'] for entry in manifest['files']),
+        'seconds': round(time.monotonic() - started, 3)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish and sync chunked, content-addressed builds")
+    commands = parser.add_subparsers(dest='command', required=True)
+    publish_command = commands.add_parser('publish', help="chunk a packaged build and upload what the store lacks")
+    publish_command.add_argument('root')
+    publish_command.add_argument('store')
+    publish_command.add_argument('--chunk-mb', type=float, default=DEFAULT_CHUNK_MB)
+    publish_command.add_argument('--workers', type=int, default=16)
+    sync_command = commands.add_parser('sync', help="bring a directory to the latest published build")
+    sync_command.add_argument('store')
+    sync_command.add_argument('destination')
+    sync_command.add_argument('--workers', type=int, default=16)
+    diff_command = commands.add_parser('diff', help="what an instance on the old manifest downloads for the new one")
+    diff_command.add_argument('old')
+    diff_command.add_argument('new')
+    args = parser.parse_args(argv)
+
+    if args.command == 'publish':
+        result = publish(args.root, open_store(args.store), int(args.chunk_mb * (1 << 20)), args.workers)
+    elif args.command == 'sync':
+        result = sync(open_store(args.store), args.destination, args.workers)
+    else:
+        with open(args.old) as old, open(args.new) as new:
+            result = diff(json.load(old), json.load(new))
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# this script brings a Signalling server to the latest build published by buildManifest.py. It is uploaded next to the
+# manifests and run by the instance user data at every boot. Only the chunks of changed files that are not already on
+# the volume are downloaded, unchanged files are recognised from the state of the last sync without being read, and a
+# copy baked into the AMI without that state is hashed once. Files of the previous build that the new one no longer
+# has are removed; nothing else on the volume is touched. It exits with 1 when the sync fails, the caller then falls
+# back to a full aws s3 sync.
+#   powershell -ExecutionPolicy Bypass -File syncBuild.ps1 -Store s3://healthcoach-deployment/HealthCoach-Build -Destination C:\
+param(
+    [Parameter(Mandatory = $true)][string]$Store,
+    [string]$Destination = 'C:\',
+    [int]$Parallel = 16
+)
+$ErrorActionPreference = 'Stop'
+$started = Get-Date
+$stateDir = Join-Path $Destination '.healthcoach-build'
+$staging = Join-Path $stateDir 'chunks'
+$statePath = Join-Path $stateDir 'state.json'
+New-Item -ItemType Directory -Force -Path $staging | Out-Null
+# chunks left behind by an interrupted sync
+Get-ChildItem -Path $staging -File | Remove-Item -Force
+$sha = [System.Security.Cryptography.SHA256]::Create()
+
+function Get-StoreObject([string]$name, [string]$path) {
+    aws s3 cp "$Store/$name" $path --only-show-errors
+    if ($LASTEXITCODE -ne 0) { throw "Could not download $Store/$name" }
+}
+
+function ConvertTo-Hex([byte[]]$bytes) {
+    return ([System.BitConverter]::ToString($bytes) -replace '-', '').ToLowerInvariant()
+}
+
+function Get-LocalPath([string]$relative) {
+    return Join-Path $Destination ($relative -replace '/', '\')
+}
+
+function Get-MtimeMs([string]$path) {
+    # milliseconds since the epoch, buildManifest.py records the same unit
+    return ([DateTimeOffset](Get-Item -LiteralPath $path).LastWriteTimeUtc).ToUnixTimeMilliseconds()
+}
+
+function Get-FileChunks([string]$path) {
+    # returns @{sha256; chunks; size} for a file hashed in chunks of the manifest's chunk size
+    $whole = [System.Security.Cryptography.SHA256]::Create()
+    $chunks = New-Object System.Collections.Generic.List[string]
+    $buffer = New-Object byte[] $chunkSize
+    $stream = [System.IO.File]::OpenRead($path)
+    try {
+        while ($true) {
+            $read = 0
+            while ($read -lt $chunkSize) {
+                $n = $stream.Read($buffer, $read, $chunkSize - $read)
+                if ($n -le 0) { break }
+                $read += $n
+            }
+            if ($read -eq 0) { break }
+            [void]$whole.TransformBlock($buffer, 0, $read, $null, 0)
+            $chunks.Add((ConvertTo-Hex $sha.ComputeHash($buffer, 0, $read)))
+            if ($read -lt $chunkSize) { break }
+        }
+        [void]$whole.TransformFinalBlock((New-Object byte[] 0), 0, 0)
+        return @{ sha256 = (ConvertTo-Hex $whole.Hash); chunks = $chunks.ToArray(); size = $stream.Length }
+    } finally {
+        $stream.Dispose()
+    }
+}
+
+function Get-LocalEntry([string]$relative, $entry, $recorded) {
+    # the local copy of a file, trusted without reading it when the last sync wrote it and it was not touched since
+    $path = Get-LocalPath $relative
+    if (-not (Test-Path -LiteralPath $path -PathType Leaf)) { return $null }
+    $size = (Get-Item -LiteralPath $path).Length
+    if ($recorded -and $recorded.size -eq $size -and $recorded.mtime -eq (Get-MtimeMs $path) -and $recorded.chunkSize -eq $chunkSize) {
+        return @{ sha256 = $recorded.sha256; chunks = @($recorded.chunks); size = $size }
+    }
+    if ($entry -eq $null -or $entry.size -ne $size) { return $null }
+    return Get-FileChunks $path
+}
+
+try {
+    Get-StoreObject 'latest.json' (Join-Path $stateDir 'latest.json')
+    $latest = Get-Content (Join-Path $stateDir 'latest.json') -Raw | ConvertFrom-Json
+    Get-StoreObject $latest.manifest (Join-Path $stateDir 'manifest.json')
+    $manifest = Get-Content (Join-Path $stateDir 'manifest.json') -Raw | ConvertFrom-Json
+    $chunkSize = [int]$manifest.chunkSize
+
+    $entries = @{}
+    foreach ($entry in $manifest.files) { $entries[$entry.path] = $entry }
+    $state = @{}
+    if (Test-Path $statePath) {
+        foreach ($recorded in (Get-Content $statePath -Raw | ConvertFrom-Json).files) { $state[$recorded.path] = $recorded }
+    }
+
+    # chunks that can be copied from intact local files, including files the new build no longer has
+    $local = @{}
+    $reusable = @{}
+    foreach ($relative in @($entries.Keys) + @($state.Keys | Where-Object { -not $entries.ContainsKey($_) })) {
+        $current = Get-LocalEntry $relative $entries[$relative] $state[$relative]
+        if ($current -eq $null) { continue }
+        $local[$relative] = $current
+        for ($i = 0; $i -lt $current.chunks.Count; $i++) {
+            $offset = [long]$i * $chunkSize
+            if (-not $reusable.ContainsKey($current.chunks[$i])) {
+                $reusable[$current.chunks[$i]] = @((Get-LocalPath $relative), $offset, [Math]::Min($chunkSize, $current.size - $offset))
+            }
+        }
+    }
+
+    $changed = @($manifest.files | Where-Object { -not $local.ContainsKey($_.path) -or $local[$_.path].sha256 -ne $_.sha256 })
+    $missing = New-Object System.Collections.Generic.HashSet[string]
+    foreach ($entry in $changed) {
+        foreach ($chunk in $entry.chunks) { if (-not $reusable.ContainsKey($chunk)) { [void]$missing.Add($chunk) } }
+    }
+
+    # one aws cp per chunk, Parallel of them at a time
+    $queue = New-Object System.Collections.Generic.Queue[string]
+    foreach ($chunk in $missing) { $queue.Enqueue($chunk) }
+    $running = @()
+    while ($queue.Count -gt 0 -or $running.Count -gt 0) {
+        while ($queue.Count -gt 0 -and $running.Count -lt $Parallel) {
+            $chunk = $queue.Dequeue()
+            $process = Start-Process -FilePath 'aws' -NoNewWindow -PassThru -ArgumentList @(
+                's3', 'cp', "$Store/chunks/$chunk", (Join-Path $staging $chunk), '--only-show-errors')
+            # reading the handle keeps the exit code available after the process is gone
+            [void]$process.Handle
+            $running += $process
+        }
+        $finished = @($running | Where-Object { $_.HasExited })
+        foreach ($process in $finished) {
+            if ($process.ExitCode -ne 0) { throw "Downloading a chunk failed with exit code $($process.ExitCode)" }
+        }
+        $running = @($running | Where-Object { $finished -notcontains $_ })
+        Start-Sleep -Milliseconds 20
+    }
+
+    $downloadedBytes = [long](Get-ChildItem -Path $staging -File | Measure-Object -Property Length -Sum).Sum
+
+    # every changed file is assembled next to its target first, so that chunks are still read from the old files
+    foreach ($entry in $changed) {
+        $target = Get-LocalPath $entry.path
+        New-Item -ItemType Directory -Force -Path (Split-Path $target) | Out-Null
+        $whole = [System.Security.Cryptography.SHA256]::Create()
+        $out = [System.IO.File]::Create("$target.healthcoach-new")
+        try {
+            foreach ($chunk in $entry.chunks) {
+                if ($missing.Contains($chunk)) {
+                    $data = [System.IO.File]::ReadAllBytes((Join-Path $staging $chunk))
+                } else {
+                    $source, $offset, $length = $reusable[$chunk]
+                    $data = New-Object byte[] $length
+                    $in = [System.IO.File]::OpenRead($source)
+                    try {
+                        [void]$in.Seek($offset, [System.IO.SeekOrigin]::Begin)
+                        $read = 0
+                        while ($read -lt $length) {
+                            $n = $in.Read($data, $read, $length - $read)
+                            if ($n -le 0) { throw "$source changed while it was read" }
+                            $read += $n
+                        }
+                    } finally {
+                        $in.Dispose()
+                    }
+                }
+                [void]$whole.TransformBlock($data, 0, $data.Length, $null, 0)
+                $out.Write($data, 0, $data.Length)
+            }
+        } finally {
+            $out.Dispose()
+        }
+        [void]$whole.TransformFinalBlock((New-Object byte[] 0), 0, 0)
+        if ((ConvertTo-Hex $whole.Hash) -ne $entry.sha256) { throw "$($entry.path) does not match the manifest after assembly" }
+    }
+    foreach ($entry in $changed) {
+        $target = Get-LocalPath $entry.path
+        Move-Item -LiteralPath "$target.healthcoach-new" -Destination $target -Force
+    }
+    Get-ChildItem -Path $staging -File | Remove-Item -Force
+    $removed = @($state.Keys | Where-Object { -not $entries.ContainsKey($_) })
+    foreach ($relative in $removed) {
+        $path = Get-LocalPath $relative
+        if (Test-Path -LiteralPath $path -PathType Leaf) { Remove-Item -LiteralPath $path -Force }
+    }
+
+    $files = foreach ($entry in $manifest.files) {
+        [ordered]@{ path = $entry.path; size = $entry.size; sha256 = $entry.sha256; chunks = @($entry.chunks)
+                    mtime = (Get-MtimeMs (Get-LocalPath $entry.path)); chunkSize = $chunkSize }
+    }
+    # written without a byte order mark, buildManifest.py reads the same state
+    [System.IO.File]::WriteAllText($statePath, (@{ version = $manifest.version; files = @($files) } | ConvertTo-Json -Depth 4 -Compress))
+
+    $seconds = [Math]::Round(((Get-Date) - $started).TotalSeconds, 1)
+    Write-Host "Build $($manifest.version): $($changed.Count) of $($manifest.files.Count) files changed, $($removed.Count) removed, $($missing.Count) chunks ($downloadedBytes bytes) downloaded in $seconds s"
+    exit 0
+} catch {
+    Write-Host "Build sync failed: $_"
+    exit 1
+}